@@ -269,10 +269,27 @@ PASSWORD_RESET_CONFIRM_URL = 'https://jornada40.cl/reset-password/{uid}/{token}'
 # ==========================================
 GEMINI_API_KEY     = config('GEMINI_API_KEY',     default=None)
 
+# Procesos para renderizar PDFs en paralelo en descargas masivas (core/pdf_pool.py).
+# 0 = automático (hasta 4 según CPUs); 1 = sin pool, todo en el proceso actual.
+# En los procesos web es 1: cada worker de gunicorn levantaría su propio pool.
+# El worker procesar_trabajos usa PDF_RENDER_WORKERS_TRABAJOS.
+PDF_RENDER_WORKERS = config('PDF_RENDER_WORKERS', default=1, cast=int)
+PDF_RENDER_WORKERS_TRABAJOS = config('PDF_RENDER_WORKERS_TRABAJOS', default=0, cast=int)
+# Días que se guarda el ZIP de una exportación terminada (core/trabajos.py lo borra después).
+EXPORTACIONES_RETENCION_DIAS = config('EXPORTACIONES_RETENCION_DIAS', default=7, cast=int)
+
 B2_KEY_ID          = config('B2_KEY_ID',          default=None)
 B2_APPLICATION_KEY = config('B2_APPLICATION_KEY', default=None)
 B2_BUCKET_NAME     = config('B2_BUCKET_NAME',     default=None)
 B2_ENDPOINT_URL    = config('B2_ENDPOINT_URL',    default=None)
+# Cliente B2 compartido por proceso (core/b2_client.py): conexiones simultáneas
+# por worker, timeouts en segundos y reintentos (modo "standard" de botocore).
+B2_MAX_POOL_CONNECTIONS = config('B2_MAX_POOL_CONNECTIONS', default=10, cast=int)
+B2_CONNECT_TIMEOUT      = config('B2_CONNECT_TIMEOUT',      default=5, cast=int)
+B2_READ_TIMEOUT         = config('B2_READ_TIMEOUT',         default=60, cast=int)
+B2_MAX_REINTENTOS       = config('B2_MAX_REINTENTOS',       default=3, cast=int)
+# Vigencia (segundos) de la URL presignada con que el trabajador abre el PDF a firmar
+FIRMA_DOCUMENTO_URL_TTL = config('FIRMA_DOCUMENTO_URL_TTL', default=900, cast=int)
 
 if IS_DEPLOYED and B2_KEY_ID:
     # Backblaze B2 — S3-compatible object storage (activo cuando las vars están configuradas)
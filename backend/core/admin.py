@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Empresa, Empleado, Contrato, AnexoContrato, Plan, Cliente
+from .models import Empresa, Empleado, Contrato, AnexoContrato, Plan, Cliente, IndicadorEconomico
 
 # ==========================================
 # GESTIÓN DE SUSCRIPCIONES Y CLIENTES
@@ -42,4 +42,11 @@ class ContratoAdmin(admin.ModelAdmin):
 class AnexoContratoAdmin(admin.ModelAdmin):
     list_display = ('titulo', 'contrato', 'fecha_emision', 'creado_en')
     list_filter = ('fecha_emision',)
-    search_fields = ('titulo', 'contrato__empleado__rut', 'contrato__empleado__apellido_paterno')
\ No newline at end of file
+    search_fields = ('titulo', 'contrato__empleado__rut', 'contrato__empleado__apellido_paterno')
+
+
+@admin.register(IndicadorEconomico)
+class IndicadorEconomicoAdmin(admin.ModelAdmin):
+    list_display = ('indicador', 'fecha', 'valor', 'cargado_en')
+    list_filter = ('indicador',)
+    date_hierarchy = 'fecha'
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from .pdf_cache import conectar_invalidaciones
+        from .resumenes import conectar_senales
+        conectar_invalidaciones()
+        conectar_senales()
@@ -4,15 +4,41 @@ Cliente Backblaze B2 para el sistema de firma electrónica.
 Estructura de carpetas en el bucket:
   pendientes/{empresa_id}/{uuid}.pdf          — PDF sin firmas, temporal
   firmados/{empresa_id}/{año}/{mes}/{uuid}_firmado.pdf — PDF firmado, permanente
+
+Todas las operaciones usan un cliente boto3 compartido por proceso, creado la
+primera vez que se necesita y descartado en el hijo tras un fork. Tamaño del
+pool de conexiones, timeouts y reintentos vienen de B2_* en settings.
+Comparación contra un cliente por llamada: manage.py benchmark_b2.
 """
+import os
+import threading
+import time
+
 import boto3
 from botocore.config import Config
 from botocore.exceptions import ClientError
 from django.conf import settings
 
+# Un solo cliente por proceso: crear uno vuelve a leer los modelos de botocore
+# y abre un pool de conexiones nuevo. Los clientes boto3 son thread-safe, así
+# que los hilos del worker web lo comparten; solo su creación va con lock.
+_cliente_cache = None
+_cliente_lock = threading.Lock()
+
+
+def _configuracion():
+    return Config(
+        signature_version='s3v4',
+        max_pool_connections=getattr(settings, 'B2_MAX_POOL_CONNECTIONS', 10),
+        tcp_keepalive=True,
+        connect_timeout=getattr(settings, 'B2_CONNECT_TIMEOUT', 5),
+        read_timeout=getattr(settings, 'B2_READ_TIMEOUT', 60),
+        retries={'max_attempts': getattr(settings, 'B2_MAX_REINTENTOS', 3), 'mode': 'standard'},
+    )
 
-def _cliente():
-    """Crea y retorna un cliente boto3 apuntando a Backblaze B2."""
+
+def _nuevo_cliente():
+    """Crea un cliente boto3 apuntando a Backblaze B2."""
     if not all([settings.B2_KEY_ID, settings.B2_APPLICATION_KEY,
                 settings.B2_BUCKET_NAME, settings.B2_ENDPOINT_URL]):
         raise RuntimeError(
@@ -24,10 +50,47 @@ def _cliente():
         endpoint_url=settings.B2_ENDPOINT_URL,
         aws_access_key_id=settings.B2_KEY_ID,
         aws_secret_access_key=settings.B2_APPLICATION_KEY,
-        config=Config(signature_version='s3v4'),
+        config=_configuracion(),
     )
 
 
+def _cliente():
+    """Retorna el cliente compartido del proceso, creándolo la primera vez."""
+    global _cliente_cache
+    cliente = _cliente_cache
+    if cliente is not None:
+        return cliente
+    with _cliente_lock:
+        if _cliente_cache is None:
+            _cliente_cache = _nuevo_cliente()
+        return _cliente_cache
+
+
+def reiniciar_cliente():
+    """
+    Descarta el cliente compartido; el próximo uso crea uno nuevo (ej: tras
+    cambiar credenciales en tests).
+    """
+    global _cliente_cache
+    with _cliente_lock:
+        _cliente_cache = None
+    with _urls_lock:
+        _urls.clear()
+
+
+def _despues_de_fork():
+    # Un worker de gunicorn (preload) no debe compartir sockets con el master,
+    # y el lock pudo quedar tomado por un hilo que no existe en el hijo.
+    global _cliente_cache, _cliente_lock, _urls_lock
+    _cliente_cache = None
+    _cliente_lock = threading.Lock()
+    _urls_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_despues_de_fork)
+
+
 # ---------------------------------------------------------------------------
 # Helpers de path — toda la lógica de rutas en un solo lugar
 # ---------------------------------------------------------------------------
@@ -60,22 +123,66 @@ def subir_documento(file_bytes: bytes, key: str,
     return key
 
 
-def generar_url_presignada(key: str, ttl_segundos: int = 3600) -> str:
+def generar_url_presignada(key: str, ttl_segundos: int = 3600,
+                           nombre_archivo: str | None = None) -> str:
     """
     Genera una URL de lectura temporal para el key dado.
     Por defecto expira en 1 hora. Usar 300 (5 min) para vistas previas
-    y 3600 para la página de firma.
+    y 3600 para la página de firma. Con nombre_archivo, B2 responde con
+    Content-Disposition inline y ese nombre.
     """
     cliente = _cliente()
-    return cliente.generate_presigned_url(
-        'get_object',
-        Params={'Bucket': settings.B2_BUCKET_NAME, 'Key': key},
-        ExpiresIn=ttl_segundos,
-    )
+    params = {'Bucket': settings.B2_BUCKET_NAME, 'Key': key}
+    if nombre_archivo:
+        params['ResponseContentDisposition'] = f'inline; filename="{nombre_archivo}"'
+    return cliente.generate_presigned_url('get_object', Params=params, ExpiresIn=ttl_segundos)
+
+
+# URLs presignadas ya firmadas: {(key, ttl, nombre): (url, vence_en epoch)}.
+# Se reutilizan hasta MARGEN_URL_SEGUNDOS antes de que venzan, para que quien
+# la reciba siempre tenga al menos ese tiempo para abrirla.
+MARGEN_URL_SEGUNDOS = 60
+MAX_URLS_EN_CACHE = 2048
+_urls = {}
+_urls_lock = threading.Lock()
+
+
+def url_presignada_vigente(key: str, ttl_segundos: int = 900,
+                           nombre_archivo: str | None = None) -> tuple[str, float]:
+    """
+    Como generar_url_presignada, pero reutiliza la URL del mismo key mientras
+    le quede vigencia. Retorna (url, vence_en) con vence_en en epoch.
+    """
+    margen = min(MARGEN_URL_SEGUNDOS, ttl_segundos // 2)
+    clave = (key, ttl_segundos, nombre_archivo)
+    ahora = time.time()
+    with _urls_lock:
+        guardada = _urls.get(clave)
+    if guardada and guardada[1] - margen > ahora:
+        return guardada
+
+    url = generar_url_presignada(key, ttl_segundos=ttl_segundos, nombre_archivo=nombre_archivo)
+    guardada = (url, ahora + ttl_segundos)
+    with _urls_lock:
+        if len(_urls) >= MAX_URLS_EN_CACHE:
+            for vieja in [c for c, (_, vence) in _urls.items() if vence - margen <= ahora]:
+                del _urls[vieja]
+            if len(_urls) >= MAX_URLS_EN_CACHE:
+                _urls.clear()
+        _urls[clave] = guardada
+    return guardada
+
+
+def olvidar_urls(key: str) -> None:
+    """Descarta las URLs guardadas de un key (ej: al borrarlo del bucket)."""
+    with _urls_lock:
+        for clave in [c for c in _urls if c[0] == key]:
+            del _urls[clave]
 
 
 def eliminar_documento(key: str) -> None:
     """Elimina un archivo de B2. No lanza error si el key no existe."""
+    olvidar_urls(key)
     cliente = _cliente()
     try:
         cliente.delete_object(Bucket=settings.B2_BUCKET_NAME, Key=key)
@@ -90,6 +197,51 @@ def descargar_documento(key: str) -> bytes:
     return response['Body'].read()
 
 
+TAMANO_TROZO = 64 * 1024
+
+
+class Trozos:
+    """
+    Iterable con el cuerpo de un objeto B2, de a TAMANO_TROZO bytes.
+    close() devuelve la conexión al pool aunque no se haya leído todo
+    (StreamingHttpResponse lo llama al terminar o si el cliente corta).
+    """
+
+    def __init__(self, cuerpo, tamano=TAMANO_TROZO):
+        self.cuerpo = cuerpo
+        self.tamano = tamano
+
+    def __iter__(self):
+        try:
+            yield from self.cuerpo.iter_chunks(self.tamano)
+        finally:
+            self.close()
+
+    def close(self):
+        self.cuerpo.close()
+
+
+def abrir_documento(key: str, rango: str | None = None) -> dict:
+    """
+    Pide un archivo de B2 sin leerlo: el cuerpo se consume por trozos.
+    rango es un encabezado HTTP Range ('bytes=0-1023') que se pasa tal cual.
+    Retorna {'trozos', 'largo', 'rango', 'content_type'}; 'rango' trae el
+    Content-Range ('bytes 0-1023/5000') solo si la respuesta es parcial.
+    Un rango fuera del archivo lanza ClientError con código InvalidRange.
+    """
+    cliente = _cliente()
+    params = {'Bucket': settings.B2_BUCKET_NAME, 'Key': key}
+    if rango:
+        params['Range'] = rango
+    response = cliente.get_object(**params)
+    return {
+        'trozos': Trozos(response['Body']),
+        'largo': response['ContentLength'],
+        'rango': response.get('ContentRange'),
+        'content_type': response.get('ContentType') or 'application/pdf',
+    }
+
+
 def documento_existe(key: str) -> bool:
     """Verifica si un key existe en B2 sin descargarlo."""
     cliente = _cliente()
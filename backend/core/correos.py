@@ -0,0 +1,195 @@
+"""
+correos.py — Cola de correos salientes (EmailOutbox)
+
+Las vistas no envían correos: llaman a encolar() dentro de la misma
+transacción que guarda el cambio de estado, y el worker `procesar_trabajos`
+los despacha con despachar(). Así la latencia o las caídas del proveedor
+(Resend) no llegan al request, y un correo nunca sale por un cambio que se
+revirtió.
+
+El despacho toma lotes con un solo UPDATE (estado → ENVIANDO, marcado con un
+id de lote, para que varios workers no tomen lo mismo) y los envía por una
+única conexión del backend de email, abierta una vez por lote. Un fallo se
+reintenta con espera exponencial (ESPERA_BASE_SEGUNDOS · 2^(intentos-1),
+hasta ESPERA_MAX_SEGUNDOS); tras MAX_INTENTOS el correo queda FALLIDO.
+
+Lo que no puede esperar al worker (el OTP de firma vence en 10 minutos y el
+worker puede estar ocupado con una exportación larga) usa enviar_al_confirmar():
+se guarda igual en la cola, pero el mismo request lo envía apenas confirma la
+transacción; si el proveedor falla, queda PENDIENTE con su reintento normal.
+
+Uso:
+    from core import correos
+    with transaction.atomic():
+        solicitud.save()
+        correos.encolar(asunto, texto, [email], html=html, categoria='FIRMA_SOLICITUD')
+"""
+import datetime
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from . import b2_client
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 50
+MAX_INTENTOS = 6
+ESPERA_BASE_SEGUNDOS = 30
+ESPERA_MAX_SEGUNDOS = 3600
+# Un lote ENVIANDO que no termina en este tiempo se devuelve a la cola
+MINUTOS_COLGADO = 15
+
+
+def nuevo(asunto, texto, destinatarios, html='', adjuntos=None, categoria='', remitente=None):
+    """EmailOutbox sin guardar; para encolar muchos de una vez con encolar_lote()."""
+    return EmailOutbox(
+        categoria=categoria,
+        asunto=asunto,
+        remitente=remitente or settings.DEFAULT_FROM_EMAIL,
+        destinatarios=list(destinatarios),
+        texto=texto,
+        html=html,
+        adjuntos=adjuntos or [],
+    )
+
+
+def encolar(asunto, texto, destinatarios, html='', adjuntos=None, categoria='', remitente=None):
+    """
+    Guarda un correo para enviarlo después. adjuntos: lista de
+    {'nombre', 'b2_key', 'content_type'} que se descargan de B2 al enviar.
+    """
+    correo = nuevo(asunto, texto, destinatarios, html=html, adjuntos=adjuntos,
+                   categoria=categoria, remitente=remitente)
+    correo.save()
+    return correo
+
+
+def enviar_al_confirmar(asunto, texto, destinatarios, html='', adjuntos=None, categoria='', remitente=None):
+    """
+    Como encolar(), pero el correo se envía desde este mismo proceso cuando la
+    transacción confirma, sin pasar por el worker. Si el envío falla queda en
+    la cola y despachar() lo reintenta.
+    """
+    correo = encolar(asunto, texto, destinatarios, html=html, adjuntos=adjuntos,
+                     categoria=categoria, remitente=remitente)
+    # robust: un error acá no debe convertir en 500 un request que ya confirmó
+    transaction.on_commit(lambda: enviar_lote(_reclamar([correo.pk])), robust=True)
+    return correo
+
+
+def encolar_lote(correos_nuevos):
+    """Guarda varios correos de nuevo() con un solo INSERT por lote."""
+    return EmailOutbox.objects.bulk_create(correos_nuevos, batch_size=500)
+
+
+def espera_reintento(intentos):
+    """Segundos hasta el próximo intento tras `intentos` fallidos."""
+    return min(ESPERA_MAX_SEGUNDOS, ESPERA_BASE_SEGUNDOS * 2 ** max(0, intentos - 1))
+
+
+def _mensaje(correo, conexion):
+    msg = EmailMultiAlternatives(
+        subject=correo.asunto,
+        body=correo.texto,
+        from_email=correo.remitente,
+        to=correo.destinatarios,
+        connection=conexion,
+    )
+    if correo.html:
+        msg.attach_alternative(correo.html, 'text/html')
+    for adjunto in correo.adjuntos:
+        msg.attach(
+            adjunto['nombre'],
+            b2_client.descargar_documento(adjunto['b2_key']),
+            adjunto.get('content_type', 'application/pdf'),
+        )
+    return msg
+
+
+def recuperar_colgados():
+    limite = timezone.now() - datetime.timedelta(minutes=MINUTOS_COLGADO)
+    return EmailOutbox.objects.filter(estado='ENVIANDO', actualizado_en__lt=limite).update(
+        estado='PENDIENTE', lote=None, actualizado_en=timezone.now(),
+    )
+
+
+def reclamar_lote(tamano=TAMANO_LOTE):
+    """Marca hasta `tamano` correos vencidos como ENVIANDO y los retorna."""
+    ahora = timezone.now()
+    ids = list(
+        EmailOutbox.objects.filter(estado='PENDIENTE', proximo_intento__lte=ahora)
+        .order_by('proximo_intento', 'id').values_list('id', flat=True)[:tamano]
+    )
+    return _reclamar(ids) if ids else []
+
+
+def _reclamar(ids):
+    # Solo los que siguen PENDIENTE: otro worker pudo tomarlos entre medio
+    lote = uuid.uuid4()
+    EmailOutbox.objects.filter(id__in=ids, estado='PENDIENTE').update(
+        estado='ENVIANDO', lote=lote, actualizado_en=timezone.now(),
+    )
+    return list(EmailOutbox.objects.filter(lote=lote, estado='ENVIANDO').order_by('proximo_intento', 'id'))
+
+
+def _registrar_fallo(correo, exc):
+    correo.intentos += 1
+    correo.error = str(exc)[:2000]
+    correo.lote = None
+    if correo.intentos >= MAX_INTENTOS:
+        correo.estado = 'FALLIDO'
+        logger.error("Correo %s descartado tras %s intentos: %s", correo.pk, correo.intentos, exc)
+    else:
+        correo.estado = 'PENDIENTE'
+        correo.proximo_intento = timezone.now() + datetime.timedelta(seconds=espera_reintento(correo.intentos))
+    correo.save(update_fields=['estado', 'intentos', 'error', 'lote', 'proximo_intento', 'actualizado_en'])
+
+
+def enviar_lote(correos):
+    """Envía los correos reclamados por una sola conexión. Retorna cuántos salieron."""
+    if not correos:
+        return 0
+    enviados = []
+    conexion = get_connection()
+    try:
+        conexion.open()
+        for correo in correos:
+            try:
+                # send_messages devuelve 0 si el backend descartó el mensaje
+                if not conexion.send_messages([_mensaje(correo, conexion)]):
+                    raise RuntimeError('El backend de email no aceptó el mensaje.')
+            except Exception as exc:
+                logger.warning("Falló el envío del correo %s: %s", correo.pk, exc)
+                _registrar_fallo(correo, exc)
+            else:
+                enviados.append(correo.pk)
+    except Exception as exc:
+        # No se pudo abrir la conexión: todo el lote vuelve a la cola
+        for correo in correos:
+            if correo.estado == 'ENVIANDO' and correo.pk not in enviados:
+                _registrar_fallo(correo, exc)
+    finally:
+        conexion.close()
+        if enviados:
+            EmailOutbox.objects.filter(pk__in=enviados).update(
+                estado='ENVIADO', enviado_en=timezone.now(), lote=None, error='', actualizado_en=timezone.now(),
+            )
+    return len(enviados)
+
+
+def despachar(limite=None, tamano_lote=TAMANO_LOTE) -> int:
+    """Envía correos vencidos por lotes hasta vaciar la cola (o hasta `limite`)."""
+    recuperar_colgados()
+    enviados = 0
+    while limite is None or enviados < limite:
+        lote = reclamar_lote(tamano_lote if limite is None else min(tamano_lote, limite - enviados))
+        if not lote:
+            break
+        enviados += enviar_lote(lote)
+    return enviados
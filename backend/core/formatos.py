@@ -0,0 +1,101 @@
+"""
+formatos.py — Normalización de RUT y fechas
+
+Funciones puras que usan tanto las vistas como la importación masiva
+(importacion.py), separadas de views.py para poder importarlas sin
+arrastrar todo el módulo de vistas.
+"""
+import datetime
+import re
+
+
+# ==========================================
+# UTILIDADES DE RUT (VALIDACIÓN Y FORMATO)
+# ==========================================
+def limpiar_rut(rut):
+    return re.sub(r'[^0-9kK]', '', str(rut)).upper()
+
+def formatear_rut(rut):
+    rut_limpio = limpiar_rut(rut)
+    if len(rut_limpio) < 2:
+        return rut
+    cuerpo = rut_limpio[:-1]
+    dv = rut_limpio[-1]
+    try:
+        cuerpo_con_puntos = "{:,}".format(int(cuerpo)).replace(',', '.')
+    except ValueError:
+        return rut
+    return f"{cuerpo_con_puntos}-{dv}"
+
+def validar_rut(rut):
+    rut_limpio = limpiar_rut(rut)
+    if len(rut_limpio) < 2:
+        return False
+    cuerpo = rut_limpio[:-1]
+    dv_ingresado = rut_limpio[-1]
+
+    try:
+        int(cuerpo)
+    except ValueError:
+        return False
+
+    suma = 0
+    multiplo = 2
+    for d in reversed(cuerpo):
+        suma += int(d) * multiplo
+        multiplo += 1
+        if multiplo == 8:
+            multiplo = 2
+    
+    resto = suma % 11
+    dv_esperado = 11 - resto
+    
+    if dv_esperado == 11:
+        dv_calculado = '0'
+    elif dv_esperado == 10:
+        dv_calculado = 'K'
+    else:
+        dv_calculado = str(dv_esperado)
+        
+    return dv_ingresado == dv_calculado
+
+# ==========================================
+# TRADUCTOR INTELIGENTE DE FECHAS EXCEL
+# ==========================================
+def estandarizar_fecha(fecha_valor):
+    # 1. Manejo de nulos (incluye NaN/NaT, los únicos valores distintos de sí mismos)
+    if not fecha_valor or fecha_valor != fecha_valor:
+        return None
+    
+    # 2. Si la planilla ya lo trae como objeto datetime/date
+    if isinstance(fecha_valor, (datetime.datetime, datetime.date)):
+        return fecha_valor.date() if isinstance(fecha_valor, datetime.datetime) else fecha_valor
+
+    fecha_str = str(fecha_valor).strip()
+    
+    # 3. Si viene como número de serie de Excel
+    try:
+        serial = float(fecha_str)
+        base = datetime.datetime(1899, 12, 30)
+        return (base + datetime.timedelta(days=serial)).date()
+    except ValueError:
+        pass
+
+    # 4. Formatos estrictos chilenos (Día, Mes, Año) + ISO estándar de BD
+    formatos_chilenos = [
+        '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y',
+        '%d-%m-%y', '%d/%m/%y', '%d.%m.%y',
+        '%Y-%m-%d'
+    ]
+    
+    for fmt in formatos_chilenos:
+        try:
+            dt = datetime.datetime.strptime(fecha_str, fmt).date()
+            # Ajuste para años de 2 dígitos (ej: 92 -> 1992 en vez de 2092)
+            if dt.year > datetime.date.today().year + 10:
+                dt = dt.replace(year=dt.year - 100)
+            return dt
+        except ValueError:
+            continue
+
+    return None
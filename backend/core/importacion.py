@@ -0,0 +1,430 @@
+"""
+importacion.py — Importación masiva de trabajadores (carga_masiva)
+
+Antes cada fila del Excel era un save()/create() propio (un INSERT o UPDATE
+por trabajador). Acá las filas se validan y se reparten en dos conjuntos,
+trabajadores nuevos y existentes, que se escriben con bulk_create y
+bulk_update por lotes de TAMANO_LOTE dentro de una sola transacción. El
+número de ficha de los nuevos se asigna en memoria a partir del máximo de la
+empresa (Empleado.save() no se llama en bulk_create).
+
+Antes de escribir, validar_filas() revisa cada bloque de TAMANO_LOTE filas
+por columnas (dígito verificador de los RUT con numpy, sueldos y horas con
+pd.to_numeric, cada fecha distinta una sola vez) y se compara contra los
+trabajadores de la empresa: los que no cambian no se reescriben. Con
+dry_run=True se devuelve ese resumen sin tocar la BD.
+
+El archivo se lee con leer_filas(): openpyxl en modo read_only para .xlsx
+(o el módulo csv para .csv), entregando una fila a la vez como dict con las
+columnas ya normalizadas. Las filas crudas se validan y descartan por
+bloques; lo que sí queda en memoria hasta la transacción final son los
+Empleado a crear o actualizar (a lo más MAX_FILAS en la carga síncrona; en
+segundo plano, FILAS_POR_BLOQUE por transacción).
+
+Los archivos muy grandes se pueden encolar como ImportJob
+(carga_masiva?asincrono=1); procesar_import_job() los importa por bloques
+de FILAS_POR_BLOQUE desde el worker de trabajos.py.
+
+Uso:
+    from core import importacion
+    filas = importacion.leer_filas(archivo)
+    resultado = importacion.importar_empleados(empresa, filas, limite_trabajadores, dry_run=False)
+"""
+import codecs
+import csv
+import datetime
+import io
+import itertools
+import shutil
+import tempfile
+
+import numpy as np
+import openpyxl
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Max
+
+from .formatos import estandarizar_fecha, formatear_rut, limpiar_rut
+from .models import Empleado, ImportJob
+
+MAX_FILAS = 20_000
+# En segundo plano el request no queda abierto: se admiten archivos más grandes
+MAX_FILAS_ASINCRONO = 200_000
+MAX_ARCHIVO_MB = 25
+TAMANO_LOTE = 1_000
+# Filas por bloque en las importaciones en segundo plano (cada bloque = una transacción)
+FILAS_POR_BLOQUE = 500
+
+# Campos que la importación escribe (y que bulk_update actualiza)
+CAMPOS_IMPORTADOS = [
+    'nombres', 'apellido_paterno', 'apellido_materno', 'email', 'sexo', 'nacionalidad',
+    'fecha_nacimiento', 'fecha_ingreso', 'departamento', 'sucursal', 'cargo',
+    'sueldo_base', 'horas_laborales', 'forma_pago', 'banco', 'tipo_cuenta', 'numero_cuenta',
+]
+
+
+class ErrorArchivo(ValueError):
+    """El archivo completo no se puede importar (formato, tamaño, filas)."""
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Lectura del archivo
+# ──────────────────────────────────────────────────────────────────────────────
+def normalizar_columna(nombre):
+    """'Email', ' EMAIL' y 'email' valen lo mismo: minúsculas y sin espacios."""
+    return str(nombre if nombre is not None else '').strip().lower().replace(' ', '_')
+
+
+def _filas_como_dict(filas, max_filas):
+    """
+    filas: iterable de tuplas (la primera es el header). Entrega
+    (fila_num, dict) con la numeración de la planilla (el header es la fila 1),
+    omitiendo filas vacías. Las celdas vacías quedan como ''.
+    """
+    filas = iter(filas)
+    try:
+        columnas = [normalizar_columna(c) for c in next(filas)]
+    except StopIteration:
+        return
+    leidas = 0
+    for fila_num, valores in enumerate(filas, start=2):
+        if not any(v not in (None, '') for v in valores):
+            continue
+        leidas += 1
+        if leidas > max_filas:
+            maximo = f"{max_filas:,}".replace(',', '.')
+            raise ErrorArchivo(f'El archivo no puede tener más de {maximo} filas por importación.')
+        yield fila_num, {
+            col: ('' if valor is None else valor)
+            for col, valor in zip(columnas, valores) if col
+        }
+
+
+def _filas_xlsx(archivo):
+    wb = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def _filas_csv(archivo):
+    muestra = archivo.read(64 * 1024)
+    archivo.seek(0)
+    # UTF-8 (con o sin BOM) si decodifica; si no, Latin-1 (CSV exportado desde Excel en Windows)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(muestra, final=False)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        encoding = 'latin-1'
+    texto = io.TextIOWrapper(archivo, encoding=encoding, newline='')
+    try:
+        dialecto = csv.Sniffer().sniff(muestra.decode(encoding, errors='ignore'), delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    try:
+        yield from csv.reader(texto, dialecto)
+    finally:
+        texto.detach()
+
+
+def es_xlsx(archivo):
+    """Los .xlsx son ZIP: se reconocen por la firma, no por el content-type del navegador."""
+    inicio = archivo.read(4)
+    archivo.seek(0)
+    return inicio == b'PK\x03\x04'
+
+
+def leer_filas(archivo, max_filas=None):
+    """
+    Itera (fila_num, fila) de un .xlsx o .csv, una fila a la vez.
+    Lanza ErrorArchivo si supera max_filas (MAX_FILAS por defecto).
+    """
+    max_filas = max_filas or MAX_FILAS
+    filas = _filas_xlsx(archivo) if es_xlsx(archivo) else _filas_csv(archivo)
+    return _filas_como_dict(filas, max_filas)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Validación (por columnas, todo el archivo de una vez)
+# ──────────────────────────────────────────────────────────────────────────────
+def ruts_validos(ruts):
+    """
+    Dígito verificador de una columna completa de RUTs con numpy (módulo 11).
+    Devuelve un array booleano; un cuerpo no numérico cuenta como inválido.
+    """
+    limpios = [limpiar_rut(r) for r in ruts]
+    cuerpos_txt = np.array([r[:-1] for r in limpios], dtype=str)
+    dv = np.array([r[-1:] for r in limpios], dtype=str)
+    numericos = np.char.isdigit(cuerpos_txt) & (np.char.str_len(cuerpos_txt) <= 10)
+
+    cuerpos = np.where(numericos, cuerpos_txt, '0').astype(np.int64)
+    suma = np.zeros(len(limpios), dtype=np.int64)
+    multiplo = 2
+    for _ in range(10):
+        suma += (cuerpos % 10) * multiplo
+        cuerpos //= 10
+        multiplo = 2 if multiplo == 7 else multiplo + 1
+    esperado = 11 - suma % 11
+    dv_calculado = np.where(esperado == 11, '0', np.where(esperado == 10, 'K', esperado.astype(str)))
+    return numericos & (dv_calculado == dv)
+
+
+def _a_numeros(valores):
+    """Columna → array float; lo que no es número queda NaN."""
+    import pandas as pd  # solo la importación lo necesita; no se carga al levantar el servidor
+    serie = pd.Series(valores, dtype=object).astype(str).str.strip()
+    return pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float)
+
+
+def _texto_cuenta(valor):
+    try:
+        # Si es numérico (ej. 12345.0), lo pasamos a float, luego a entero (quita el .0) y luego a texto
+        return str(int(float(valor)))
+    except (ValueError, TypeError, OverflowError):
+        # Si tiene letras o guiones (ej. "Chequera-123") o está vacío, lo dejamos como texto normal
+        return str(valor).strip()
+
+
+def validar_filas(filas):
+    """
+    Valida un bloque de filas columna por columna (RUT, sueldo, horas,
+    fechas) en vez de fila a fila. Devuelve (validas, errores):
+      validas: [(fila_num, rut_limpio, rut_formateado, datos)]
+      errores: mensajes "Fila N: …" en el orden del archivo.
+    Las filas sin RUT se omiten en silencio. Una fecha_ingreso vacía queda
+    en None (importar_empleados decide: hoy para los nuevos, la guardada
+    para los existentes).
+    """
+    filas = [(n, f) for n, f in filas if str(f.get('rut', '')).strip()]
+    if not filas:
+        return [], []
+    numeros = [n for n, _ in filas]
+    registros = [f for _, f in filas]
+
+    def columna(nombre, defecto=''):
+        return [f.get(nombre, defecto) for f in registros]
+
+    def texto(nombre, defecto=''):
+        return [str(v).strip().upper() for v in columna(nombre, defecto)]
+
+    ruts = [str(v).strip() for v in columna('rut')]
+    rut_ok = ruts_validos(ruts)
+    sueldos = _a_numeros(columna('sueldo_base', 0))
+    horas = _a_numeros(columna('horas_laborales', 44))
+
+    sueldo_nan = np.isnan(sueldos)
+    sueldo_negativo = ~sueldo_nan & (sueldos < 0)
+    horas_nan = np.isnan(horas)
+    horas_enteras = np.where(horas_nan, 0, horas)
+    # Como antes con int(): "44.5" no es un número de horas válido
+    horas_fraccion = horas_enteras % 1 != 0
+    horas_fuera = ~horas_nan & ((horas_enteras <= 0) | (horas_enteras > 168))
+    # Mismo orden de prioridad que antes: sueldo, luego horas
+    motivo = np.select(
+        [~rut_ok, sueldo_nan, sueldo_negativo, horas_nan | horas_fraccion, horas_fuera],
+        ['rut', 'no_numerico', 'negativo', 'no_numerico', 'horas'],
+        default='',
+    )
+    mensajes = {
+        'rut': 'RUT inválido.',
+        'no_numerico': 'sueldo_base u horas_laborales contienen valores no numéricos.',
+        'negativo': 'sueldo_base no puede ser negativo.',
+        'horas': 'horas_laborales debe estar entre 1 y 168.',
+    }
+    errores = [f"Fila {numeros[i]}: {mensajes[m]}" for i, m in enumerate(motivo) if m]
+    ok = np.flatnonzero(motivo == '')
+    if not len(ok):
+        return [], errores
+
+    # Las fechas se repiten mucho (misma fecha de ingreso para media planilla):
+    # se interpreta cada valor distinto una sola vez.
+    def fechas(nombre):
+        valores = columna(nombre, None)
+        unicos = {}
+        for v in valores:
+            clave = (type(v), v)
+            if clave not in unicos:
+                unicos[clave] = estandarizar_fecha(v)
+        return [unicos[(type(v), v)] for v in valores]
+
+    columnas = {
+        'nombres': texto('nombres'),
+        'apellido_paterno': texto('apellido_paterno'),
+        'apellido_materno': texto('apellido_materno'),
+        'email': [str(v).strip().lower() for v in columna('email')],
+        'sexo': [v[:1] for v in texto('sexo', 'M')],
+        'nacionalidad': texto('nacionalidad', 'CHILENA'),
+        'fecha_nacimiento': fechas('fecha_nacimiento'),
+        'fecha_ingreso': fechas('fecha_ingreso'),
+        'departamento': texto('departamento'),
+        'sucursal': texto('sucursal'),
+        'cargo': texto('cargo'),
+        'forma_pago': texto('forma_pago', 'TRANSFERENCIA'),
+        'banco': texto('banco'),
+        'tipo_cuenta': texto('tipo_cuenta'),
+        'numero_cuenta': [_texto_cuenta(v) for v in columna('numero_cuenta')],
+    }
+    validas = []
+    for i in ok:
+        datos = {campo: valores[i] for campo, valores in columnas.items()}
+        datos['sueldo_base'] = int(sueldos[i])
+        datos['horas_laborales'] = int(horas_enteras[i])
+        validas.append((numeros[i], limpiar_rut(ruts[i]), formatear_rut(ruts[i]), datos))
+    return validas, errores
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Comparación con la BD y escritura
+# ──────────────────────────────────────────────────────────────────────────────
+def _cambia(empleado, datos):
+    # Una celda vacía ('') equivale a un campo NULL en la BD
+    return any(
+        getattr(empleado, campo) != valor and not (getattr(empleado, campo) in (None, '') and valor in (None, ''))
+        for campo, valor in datos.items()
+    )
+
+
+def _en_bloques(filas, tamano):
+    filas = iter(filas)
+    while bloque := list(itertools.islice(filas, tamano)):
+        yield bloque
+
+
+def importar_empleados(empresa, filas, limite_trabajadores, dry_run=False, tamano_lote=TAMANO_LOTE):
+    """
+    filas: iterable de (fila_num, row) con las columnas ya normalizadas
+    (ver leer_filas).
+    Crea o actualiza los trabajadores de `empresa` (por RUT) respetando el
+    límite de trabajadores del plan. Los que ya están con los mismos datos
+    no se reescriben. Con dry_run=True solo calcula el resumen, sin tocar la BD.
+    Devuelve: agregados, actualizados, sin_cambios, limite_alcanzado, errores.
+    """
+    existentes_qs = Empleado.objects.filter(empresa=empresa)
+    existentes = {limpiar_rut(emp.rut): emp for emp in existentes_qs}
+    siguiente_ficha = (existentes_qs.aggregate(Max('ficha_numero'))['ficha_numero__max'] or 0) + 1
+    total_actual = len(existentes)
+
+    nuevos = {}
+    actualizados = {}
+    sin_cambios = set()
+    limite_alcanzado = False
+    errores = []
+    hoy = datetime.date.today()
+
+    for bloque in _en_bloques(filas, tamano_lote):
+        validas, errores_bloque = validar_filas(bloque)
+        errores.extend(errores_bloque)
+        for fila_num, rut_limpio, rut_formateado, datos in validas:
+            # Un RUT repetido en el archivo actualiza al mismo trabajador (gana la última fila)
+            empleado = existentes.get(rut_limpio) or nuevos.get(rut_limpio)
+            if empleado is not None:
+                if datos['fecha_ingreso'] is None:
+                    datos['fecha_ingreso'] = empleado.fecha_ingreso
+                if not _cambia(empleado, datos):
+                    sin_cambios.add(rut_limpio)
+                    continue
+                for campo, valor in datos.items():
+                    setattr(empleado, campo, valor)
+                if empleado.pk:
+                    actualizados[rut_limpio] = empleado
+                continue
+
+            # CREAR (Validando límite de plan)
+            if total_actual >= limite_trabajadores:
+                limite_alcanzado = True
+                continue
+            datos['fecha_ingreso'] = datos['fecha_ingreso'] or hoy
+            nuevos[rut_limpio] = Empleado(
+                rut=rut_formateado, empresa=empresa, ficha_numero=siguiente_ficha, **datos,
+            )
+            siguiente_ficha += 1
+            total_actual += 1
+
+    if not dry_run:
+        with transaction.atomic():
+            Empleado.objects.bulk_create(list(nuevos.values()), batch_size=tamano_lote)
+            Empleado.objects.bulk_update(list(actualizados.values()), CAMPOS_IMPORTADOS, batch_size=tamano_lote)
+
+    return {
+        'agregados': len(nuevos),
+        'actualizados': len(actualizados),
+        'sin_cambios': len(sin_cambios - actualizados.keys() - nuevos.keys()),
+        'limite_alcanzado': limite_alcanzado,
+        'errores': errores,
+        'dry_run': dry_run,
+    }
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Importación en segundo plano (ImportJob)
+# ──────────────────────────────────────────────────────────────────────────────
+def limite_trabajadores_de(user):
+    """Máximo de trabajadores que permite el plan del usuario."""
+    cliente = getattr(user, 'perfil_cliente', None)
+    return cliente.plan.limite_trabajadores if (cliente and cliente.plan) else 1000
+
+
+def descartar_archivo(job):
+    """
+    El archivo trae RUT y sueldos: se borra apenas el trabajo termina, bien o
+    mal (trabajos.py lo llama también cuando un ImportJob queda en ERROR).
+    """
+    if job.archivo:
+        job.archivo.delete(save=False)
+        ImportJob.objects.filter(pk=job.pk).update(archivo=None)
+
+
+def procesar_import_job(job, filas_por_bloque=None):
+    """
+    Importa el archivo de un ImportJob reclamado por el worker (core/trabajos.py).
+    Cada bloque de filas se escribe en su propia transacción junto con los
+    contadores del trabajo; si el proceso muere, el reintento salta las
+    `procesados` filas ya confirmadas.
+    """
+    filas_por_bloque = filas_por_bloque or FILAS_POR_BLOQUE
+    limite = limite_trabajadores_de(job.owner)
+
+    # Copia local: openpyxl necesita un archivo con seek y el storage puede ser remoto
+    with tempfile.TemporaryFile() as tmp:
+        with job.archivo.open('rb') as origen:
+            shutil.copyfileobj(origen, tmp)
+
+        if not job.total:
+            tmp.seek(0)
+            try:
+                job.total = sum(1 for _ in leer_filas(tmp, max_filas=MAX_FILAS_ASINCRONO))
+            except ErrorArchivo as e:
+                # No tiene sentido reintentar: el archivo no cambia
+                job.estado, job.error, job.terminado_en = 'ERROR', str(e), timezone.now()
+                job.save()
+                descartar_archivo(job)
+                return
+            job.save(update_fields=['total', 'actualizado_en'])
+
+        tmp.seek(0)
+        filas = itertools.islice(leer_filas(tmp, max_filas=MAX_FILAS_ASINCRONO), job.procesados, None)
+        while True:
+            bloque = list(itertools.islice(filas, filas_por_bloque))
+            if not bloque:
+                break
+            with transaction.atomic():
+                resultado = importar_empleados(job.empresa, bloque, limite)
+                job.procesados += len(bloque)
+                job.agregados += resultado['agregados']
+                job.actualizados += resultado['actualizados']
+                job.sin_cambios += resultado['sin_cambios']
+                job.limite_alcanzado = job.limite_alcanzado or resultado['limite_alcanzado']
+                job.total_errores += len(resultado['errores'])
+                espacio = ImportJob.MAX_ERRORES_GUARDADOS - len(job.errores)
+                job.errores = job.errores + resultado['errores'][:max(0, espacio)]
+                job.save(update_fields=[
+                    'procesados', 'agregados', 'actualizados', 'sin_cambios', 'limite_alcanzado',
+                    'errores', 'total_errores', 'actualizado_en',
+                ])
+
+    job.estado = 'COMPLETADO'
+    job.error = ''
+    job.terminado_en = timezone.now()
+    job.save()
+    descartar_archivo(job)
@@ -1,60 +1,325 @@
 """
 Indicadores económicos de Chile (UF, UTM) e Impuesto Único de Segunda Categoría.
 
-Los valores de UF y UTM se consultan a mindicador.cl (API pública que refleja
-los valores oficiales del Banco Central y del SII) y se cachean para no
-depender de la disponibilidad de la API en cada liquidación.
+Los valores históricos se guardan en la tabla IndicadorEconomico (UF diaria,
+UTM mensual) y se cargan por año completo con cargar_serie_anual(), desde
+mindicador.cl (API pública que refleja los valores oficiales del Banco
+Central y del SII) o desde un JSON local con el mismo formato.
 
-Si la API no responde, se usa un valor de respaldo (FALLBACK) — ojo que estos
-valores quedan desactualizados con el tiempo; conviene revisarlos cada cierto
-tiempo si empiezan a aparecer usados en los logs.
+obtener_uf(fecha) / obtener_utm(mes, anio) resuelven desde un diccionario en
+memoria del proceso armado con esa tabla, así que calcular una liquidación
+no hace llamadas de red y recalcular marzo en octubre usa la UTM de marzo.
+
+Si la tabla no tiene el período pedido se lanza IndicadorNoDisponible (con
+el comando a correr para cargarlo): usar el valor de otro mes daría montos
+equivocados sin que nadie lo note.
+
+El año anterior y el en curso se cargan en cada deploy (`cargar_indicadores` en el paso
+release del Procfile) y el valor del día lo deja en la misma tabla
+refrescar_indicadores(), que el worker procesar_trabajos corre cada hora (o
+un cron con el comando refrescar_indicadores), así que todos los procesos
+web lo ven sin llamar a la API. Servir un valor atrasado o releer la tabla
+deja un warning en el log y suma a los contadores del proceso
+(contadores_indicadores(), visibles con refrescar_indicadores --stats).
 """
+import bisect
+import calendar
+import datetime
+import json
 import logging
+import threading
+import time
+from decimal import Decimal
 
+import numpy as np
 import requests
-from django.core.cache import cache
+from django.db import transaction
+
+from .models import IndicadorEconomico
 
 logger = logging.getLogger(__name__)
 
 MINDICADOR_URL = "https://mindicador.cl/api/{indicador}"
-CACHE_TTL_SEGUNDOS = 6 * 60 * 60  # 6 horas
+MINDICADOR_ANIO_URL = "https://mindicador.cl/api/{indicador}/{anio}"
+
+# Si la UF del día pedido no está cargada, se acepta el último valor conocido
+# siempre que no tenga más de estos días de antigüedad.
+UF_MAX_DIAS_ATRASO = 7
+# Tras un "miss" se vuelve a leer la tabla como máximo cada tantos segundos
+# (otro proceso pudo haber cargado el año mientras tanto).
+RECARGA_MIN_SEGUNDOS = 300
+# El worker trae los valores vigentes como máximo cada tantos segundos
+REFRESCO_SEGUNDOS = 3600
+
+
+# ==========================================
+# SERIES HISTÓRICAS EN MEMORIA
+# ==========================================
+class IndicadorNoDisponible(Exception):
+    """El período pedido no está cargado en IndicadorEconomico."""
+
+
+# {'uf': ([fechas ordenadas], {fecha: valor}), 'utm': (...)}. Nunca se modifica
+# en el lugar: al recargar se arma un dict nuevo y se reemplaza la referencia,
+# así los lectores (sin lock) ven la versión anterior o la nueva, nunca una a medias.
+_series = {}
+_series_cargadas_en = 0.0
+_series_lock = threading.Lock()
+
+# Contadores de este proceso, por indicador (refrescar_indicadores --stats):
+# hit = valor exacto, atrasado = último valor dentro de la tolerancia,
+# miss = sin valor (IndicadorNoDisponible), recarga = relectura forzada de la tabla.
+_contadores = {}
+_contadores_lock = threading.Lock()
+# (indicador, fecha pedida) ya avisados como atrasados, para no repetir el log
+_atrasos_avisados = set()
+
+
+def limpiar_series():
+    """Descarta las series en memoria; la próxima consulta relee la tabla."""
+    global _series, _series_cargadas_en
+    with _series_lock:
+        _series = {}
+        _series_cargadas_en = 0.0
+        _atrasos_avisados.clear()
+
+
+def _cargar_series(forzar=False) -> bool:
+    """Lee la tabla si hace falta; True si efectivamente la leyó."""
+    global _series, _series_cargadas_en
+    with _series_lock:
+        if _series_cargadas_en and not forzar:
+            return False
+        if forzar and time.monotonic() - _series_cargadas_en < RECARGA_MIN_SEGUNDOS:
+            return False
+        nuevas = {}
+        for nombre, fecha, valor in IndicadorEconomico.objects.values_list('indicador', 'fecha', 'valor'):
+            nuevas.setdefault(nombre, {})[fecha] = float(valor)
+        _series = {nombre: (sorted(valores), valores) for nombre, valores in nuevas.items()}
+        # Aunque la tabla esté vacía queda marcada como cargada, para no
+        # consultarla en cada liquidación.
+        _series_cargadas_en = time.monotonic()
+        return True
+
+
+def _contar(nombre, evento):
+    with _contadores_lock:
+        por_evento = _contadores.setdefault(nombre, dict.fromkeys(('hit', 'atrasado', 'miss', 'recarga'), 0))
+        por_evento[evento] += 1
+
+
+def contadores_indicadores() -> dict:
+    """Copia de los contadores hit/atrasado/miss/recarga de este proceso, por indicador."""
+    with _contadores_lock:
+        return {nombre: dict(por_evento) for nombre, por_evento in _contadores.items()}
+
+
+def _valor_en_serie(nombre, fecha, max_dias_atraso=0):
+    """Último valor de la serie con fecha <= fecha pedida (con tolerancia)."""
+    fechas, valores = _series.get(nombre, ([], {}))
+    valor = valores.get(fecha)
+    if valor is not None or not max_dias_atraso:
+        return valor
+    i = bisect.bisect_right(fechas, fecha)
+    if i and (fecha - fechas[i - 1]).days <= max_dias_atraso:
+        return valores[fechas[i - 1]]
+    return None
+
+
+def _resolver(nombre, fecha, max_dias_atraso, periodo):
+    _cargar_series()
+    valor = _valor_en_serie(nombre, fecha)
+    if valor is None and _cargar_series(forzar=True):
+        # El worker o cargar_indicadores pudo haberlo guardado desde otro proceso
+        _contar(nombre, 'recarga')
+        logger.warning("Falta la %s del %s en memoria: se releyó IndicadorEconomico.", nombre.upper(), periodo)
+        valor = _valor_en_serie(nombre, fecha)
+    if valor is not None:
+        _contar(nombre, 'hit')
+        return valor
+
+    # Si sigue faltando se sirve el último valor persistido (dentro de la tolerancia)
+    valor = _valor_en_serie(nombre, fecha, max_dias_atraso)
+    if valor is None:
+        _contar(nombre, 'miss')
+        raise IndicadorNoDisponible(
+            f"No hay valor de la {nombre.upper()} para {periodo}. Cárgalo con "
+            f"'python manage.py cargar_indicadores {fecha.year} --indicador {nombre}'."
+        )
+    _contar(nombre, 'atrasado')
+    if (nombre, fecha) not in _atrasos_avisados:
+        _atrasos_avisados.add((nombre, fecha))
+        logger.warning(
+            "La %s del %s no está cargada; se usa el último valor guardado (%s). "
+            "¿Está corriendo el worker procesar_trabajos?", nombre.upper(), periodo, valor,
+        )
+    return valor
+
+
+def obtener_uf(fecha: datetime.date = None) -> float:
+    """
+    Valor de la UF en la fecha indicada (hoy por defecto), en pesos.
+    Lanza IndicadorNoDisponible si no hay un valor cargado cercano.
+    """
+    fecha = fecha or datetime.date.today()
+    return _resolver('uf', fecha, UF_MAX_DIAS_ATRASO, fecha.strftime('%d/%m/%Y'))
+
+
+def obtener_utm(mes: int = None, anio: int = None) -> float:
+    """
+    Valor de la UTM del mes indicado (el mes actual por defecto), en pesos.
+    Lanza IndicadorNoDisponible si el mes no está cargado.
+    """
+    hoy = datetime.date.today()
+    fecha = datetime.date(anio or hoy.year, mes or hoy.month, 1)
+    return _resolver('utm', fecha, 0, fecha.strftime('%m/%Y'))
+
+
+def fecha_uf_periodo(mes: int, anio: int) -> datetime.date:
+    """
+    Fecha cuya UF se usa para las cotizaciones de un período: el último día
+    del mes, o hoy si el período todavía no termina.
+    """
+    ultimo = datetime.date(anio, mes, calendar.monthrange(anio, mes)[1])
+    return min(ultimo, datetime.date.today())
+
+
+# ==========================================
+# CARGA MASIVA DE SERIES
+# ==========================================
+def _normalizar_serie(nombre, serie):
+    """
+    Convierte la 'serie' de mindicador.cl ([{fecha: ISO, valor}]) en
+    {fecha: Decimal}. La UTM se indexa por el día 1 de su mes.
+    """
+    valores = {}
+    for punto in serie:
+        fecha = datetime.date.fromisoformat(str(punto['fecha'])[:10])
+        if nombre == 'utm':
+            fecha = fecha.replace(day=1)
+        valores[fecha] = Decimal(str(punto['valor'])).quantize(Decimal('0.01'))
+    return valores
+
+
+def guardar_serie(nombre: str, serie) -> int:
+    """
+    Inserta/actualiza de una vez todos los puntos de una serie con formato
+    mindicador.cl. Devuelve cuántos puntos se procesaron.
+    """
+    valores = _normalizar_serie(nombre, serie)
+    if not valores:
+        return 0
+    filas = [IndicadorEconomico(indicador=nombre, fecha=f, valor=v) for f, v in valores.items()]
+    with transaction.atomic():
+        IndicadorEconomico.objects.bulk_create(
+            filas, batch_size=500,
+            update_conflicts=True, unique_fields=['indicador', 'fecha'],
+            update_fields=['valor', 'cargado_en'],
+        )
+    limpiar_series()
+    return len(filas)
+
+
+def cargar_serie_anual(anio: int, indicadores=('uf', 'utm'), archivo=None) -> dict:
+    """
+    Carga el año completo de cada indicador en IndicadorEconomico.
+
+    Sin `archivo`, se descarga de mindicador.cl (/api/{indicador}/{anio}).
+    Con `archivo`, se lee un JSON local {"uf": {"serie": [...]}, "utm": {...}}
+    con el mismo formato que la API (útil en tests o sin red).
+    Devuelve {indicador: cantidad_de_puntos}.
+    """
+    local = None
+    if archivo is not None:
+        with open(archivo, encoding='utf-8') as f:
+            local = json.load(f)
+
+    cargados = {}
+    for nombre in indicadores:
+        if local is not None:
+            serie = local.get(nombre, {}).get('serie', [])
+        else:
+            resp = requests.get(MINDICADOR_ANIO_URL.format(indicador=nombre, anio=anio), timeout=15)
+            resp.raise_for_status()
+            serie = resp.json().get('serie', [])
+        serie = [p for p in serie if str(p.get('fecha', ''))[:4] == str(anio)]
+        cargados[nombre] = guardar_serie(nombre, serie)
+    return cargados
+
+
+# ==========================================
+# VALOR VIGENTE (refresco anticipado)
+# ==========================================
+# Los valores recientes se guardan en IndicadorEconomico, compartida por todos
+# los procesos (una caché en memoria sería una por worker de gunicorn). Las
+# peticiones nunca consultan la API: si el worker todavía no trae el valor del
+# día se sirve el último persistido (hasta UF_MAX_DIAS_ATRASO), y al correr
+# solo desde el worker tampoco hay una estampida de peticiones a mindicador.cl.
+_ultimo_refresco = None
 
-# Valores de respaldo si la API falla. Actualizados por última vez: julio 2026.
-UF_FALLBACK = 40844.79
-UTM_FALLBACK = 71506.0
 
+def _fecha_vigente(nombre, hoy=None):
+    hoy = hoy or datetime.date.today()
+    return hoy.replace(day=1) if nombre == 'utm' else hoy
 
-def _obtener_indicador(nombre: str, fallback: float) -> float:
-    cache_key = f"indicador_{nombre}"
-    valor_cacheado = cache.get(cache_key)
-    if valor_cacheado is not None:
-        return valor_cacheado
 
+def refrescar_indicador(nombre: str) -> bool:
+    """
+    Guarda los últimos valores que publica mindicador.cl (/api/{indicador}
+    trae el último mes de UF y el último año de UTM). False si la API falla.
+    """
     try:
         resp = requests.get(MINDICADOR_URL.format(indicador=nombre), timeout=5)
         resp.raise_for_status()
-        data = resp.json()
-        serie = data.get('serie', [])
-        valor = float(serie[0]['valor']) if serie else float(data.get('valor'))
+        return guardar_serie(nombre, resp.json().get('serie', [])) > 0
     except Exception:
-        logger.warning(
-            "No se pudo obtener el indicador '%s' desde mindicador.cl, usando valor de respaldo (%s).",
-            nombre, fallback,
-        )
-        return fallback
+        logger.warning("No se pudo refrescar el indicador '%s' desde mindicador.cl.", nombre)
+        return False
 
-    cache.set(cache_key, valor, CACHE_TTL_SEGUNDOS)
-    return valor
 
+def refrescar_indicadores(nombres=('uf', 'utm'), forzar=False) -> dict:
+    """
+    Trae los indicadores a los que les falta el valor de hoy (o todos, con
+    forzar=True). Pensado para correr desde un cron/scheduler (comando
+    refrescar_indicadores) antes de que una liquidación lo necesite.
+    Devuelve {nombre: True/False/None} (None = ya estaba cargado, no se tocó).
+    """
+    resultado = {}
+    for nombre in nombres:
+        cargado = IndicadorEconomico.objects.filter(indicador=nombre, fecha=_fecha_vigente(nombre)).exists()
+        resultado[nombre] = None if cargado and not forzar else refrescar_indicador(nombre)
+    return resultado
 
-def obtener_uf() -> float:
-    """Valor de la UF vigente hoy, en pesos."""
-    return _obtener_indicador('uf', UF_FALLBACK)
 
+def refrescar_periodicamente(intervalo=REFRESCO_SEGUNDOS):
+    """
+    refrescar_indicadores() a lo más una vez cada `intervalo` segundos en este
+    proceso; lo llama el loop de procesar_trabajos. Devuelve su resultado, o
+    None si todavía no tocaba.
+    """
+    global _ultimo_refresco
+    ahora = time.monotonic()
+    if _ultimo_refresco is not None and ahora - _ultimo_refresco < intervalo:
+        return None
+    _ultimo_refresco = ahora
+    return refrescar_indicadores()
 
-def obtener_utm() -> float:
-    """Valor de la UTM vigente este mes, en pesos."""
-    return _obtener_indicador('utm', UTM_FALLBACK)
+
+def estadisticas_indicadores(nombres=('uf', 'utm')) -> dict:
+    """
+    Último valor guardado de cada indicador y cuántos días de atraso tiene
+    respecto del vigente (None si el indicador no tiene ningún valor).
+    """
+    stats = {}
+    for nombre in nombres:
+        fila = (
+            IndicadorEconomico.objects.filter(indicador=nombre).order_by('-fecha')
+            .values('fecha', 'valor', 'cargado_en').first()
+        )
+        if fila is not None:
+            fila['dias_atraso'] = max((_fecha_vigente(nombre) - fila['fecha']).days, 0)
+        stats[nombre] = fila
+    return stats
 
 
 # ==========================================
@@ -99,4 +364,33 @@ def calcular_impuesto_unico(base_tributable: float, valor_utm: float) -> int:
             break
 
     impuesto = (base_tributable * tramo_factor) - (tramo_rebaja_utm * valor_utm)
-    return max(0, round(impuesto))
\ No newline at end of file
+    return max(0, round(impuesto))
+
+# Columnas de la tabla para la versión vectorizada (ver calcular_impuesto_unico_vec).
+_IUSC_DESDE_UTM = np.array([t[0] for t in _TRAMOS_IUSC])
+_IUSC_FACTOR = np.array([t[1] for t in _TRAMOS_IUSC])
+_IUSC_REBAJA_UTM = np.array([t[2] for t in _TRAMOS_IUSC])
+
+
+def calcular_impuesto_unico_vec(bases_tributables, valor_utm: float) -> np.ndarray:
+    """
+    Versión vectorizada de calcular_impuesto_unico: recibe un arreglo de bases
+    tributables y devuelve un arreglo int64 con el impuesto de cada una.
+
+    El tramo se ubica con searchsorted sobre los límites de _TRAMOS_IUSC, con
+    el mismo criterio (base_en_utm >= desde_utm) y el mismo redondeo que la
+    versión escalar, de modo que ambas dan resultados idénticos.
+    """
+    bases = np.asarray(bases_tributables, dtype=np.float64)
+    if valor_utm <= 0:
+        return np.zeros(bases.shape, dtype=np.int64)
+
+    base_en_utm = bases / valor_utm
+    tramo = np.searchsorted(_IUSC_DESDE_UTM, base_en_utm, side='right') - 1
+    tramo = np.clip(tramo, 0, len(_TRAMOS_IUSC) - 1)
+
+    impuesto = (bases * _IUSC_FACTOR[tramo]) - (_IUSC_REBAJA_UTM[tramo] * valor_utm)
+    # np.rint redondea al par más cercano, igual que round() de Python
+    impuesto = np.rint(impuesto)
+    impuesto[(bases <= 0) | (impuesto < 0)] = 0
+    return impuesto.astype(np.int64)
@@ -0,0 +1,186 @@
+"""
+libro_excel.py — Excel del Libro de Remuneraciones en modo write-only
+
+Con un Workbook normal, openpyxl mantiene cada celda (y su fuente, relleno,
+borde y alineación) en memoria hasta guardar, así que un libro de miles de
+trabajadores crece en RAM y tiempo fila por fila. Acá el libro se arma con
+Workbook(write_only=True): las filas se escriben al archivo a medida que se
+agregan y los estilos son NamedStyle registrados una sola vez, que cada celda
+referencia por nombre.
+
+No depende de Django (recibe datos planos), así que el benchmark
+(manage.py benchmark_libro) lo puede correr en un proceso limpio.
+
+Uso:
+    from core.libro_excel import escribir_libro
+    escribir_libro(archivo, empresa.nombre_legal, empresa.rut, 'Abril', 2026, filas, totales)
+"""
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.worksheet import Worksheet
+
+COLOR_HEADER = '1E3A5F'
+COLOR_TOTALES = 'F59E0B'
+COLOR_FILA_PAR = 'F1F5F9'
+
+FMT_CLP = '#,##0'
+FMT_TEXT = '@'
+
+# (título, ancho, clave en la fila, formato, alineación)
+COLUMNAS = [
+    ('N°',                    5, 'ficha',         FMT_TEXT, 'center'),
+    ('RUT',                  12, 'rut',           FMT_TEXT, 'left'),
+    ('Apellidos y Nombres',  28, 'nombre',        FMT_TEXT, 'left'),
+    ('Cargo',                16, 'cargo',         FMT_TEXT, 'left'),
+    ('Días\nTrab.',           7, 'dias',          FMT_TEXT, 'center'),
+    ('Sueldo\nBase',         12, 'sueldo_base',   FMT_CLP,  'right'),
+    ('Gratif.',              11, 'gratificacion', FMT_CLP,  'right'),
+    ('Otros Hab.\nImpon.',   12, 'otros_imp',     FMT_CLP,  'right'),
+    ('Total\nImponible',     13, 'total_imp',     FMT_CLP,  'right'),
+    ('Hab. No\nImponibles',  13, 'no_imp',        FMT_CLP,  'right'),
+    ('Total\nHaberes',       12, 'total_hab',     FMT_CLP,  'right'),
+    ('AFP',                   9, 'afp_nombre',    FMT_TEXT, 'center'),
+    ('Cotiz.\nAFP',          11, 'cotiz_afp',     FMT_CLP,  'right'),
+    ('Salud',                 9, 'salud_nombre',  FMT_TEXT, 'center'),
+    ('Cotiz.\nSalud',        11, 'cotiz_salud',   FMT_CLP,  'right'),
+    ('Cesantía',             10, 'cesantia',      FMT_CLP,  'right'),
+    ('Imp.\nÚnico',          10, 'imp_unico',     FMT_CLP,  'right'),
+    ('Anticipo',             10, 'anticipo',      FMT_CLP,  'right'),
+    ('Otros\nDesc.',         10, 'otros_desc',    FMT_CLP,  'right'),
+    ('Total\nDescuentos',    13, 'total_desc',    FMT_CLP,  'right'),
+    ('Alcance\nLíquido',     13, 'sueldo_liq',    FMT_CLP,  'right'),
+]
+
+# Clave de `totales` bajo cada columna de montos de la fila TOTALES
+_TOTALES_POR_COLUMNA = {
+    'sueldo_base': 'sueldo_base', 'gratificacion': 'gratificacion',
+    'otros_imp': 'otros_imp', 'total_imp': 'total_imponible',
+    'no_imp': 'no_imponibles', 'total_hab': 'total_haberes',
+    'cotiz_afp': 'cotiz_afp', 'cotiz_salud': 'cotiz_salud',
+    'cesantia': 'cesantia', 'imp_unico': 'imp_unico', 'anticipo': 'anticipo',
+    'otros_desc': 'otros_desc', 'total_desc': 'total_descuentos',
+    'sueldo_liq': 'sueldo_liquido',
+}
+
+
+def _registrar_estilos(wb):
+    """
+    Registra los NamedStyle del libro y devuelve, por columna, el nombre del
+    estilo para filas impares, filas pares (con relleno) y la fila de totales.
+    """
+    thin = Side(style='thin', color='CBD5E1')
+    borde = Border(left=thin, right=thin, top=thin, bottom=thin)
+    alineaciones = {
+        'center': Alignment(horizontal='center', vertical='center', wrap_text=True),
+        'left': Alignment(horizontal='left', vertical='center'),
+        'right': Alignment(horizontal='right', vertical='center'),
+    }
+    fill_par = PatternFill('solid', fgColor=COLOR_FILA_PAR)
+    fill_total = PatternFill('solid', fgColor=COLOR_TOTALES)
+
+    def registrar(nombre, **atributos):
+        wb.add_named_style(NamedStyle(name=nombre, **atributos))
+        return nombre
+
+    registrar('libro_titulo', font=Font(name='Calibri', bold=True, size=14, color='1E3A5F'),
+              alignment=alineaciones['center'])
+    registrar('libro_subtitulo', font=Font(name='Calibri', bold=True, size=11, color='334155'),
+              alignment=alineaciones['center'])
+    registrar('libro_periodo', font=Font(name='Calibri', size=10, color='475569'),
+              alignment=alineaciones['center'])
+    registrar('libro_header', font=Font(name='Calibri', bold=True, size=9, color='FFFFFF'),
+              fill=PatternFill('solid', fgColor=COLOR_HEADER), alignment=alineaciones['center'], border=borde)
+
+    ft_dato = Font(name='Calibri', size=9)
+    ft_total = Font(name='Calibri', bold=True, size=9)
+    ft_total_liq = Font(name='Calibri', bold=True, size=9, color='7C3AED')
+    for fmt, sufijo in ((FMT_TEXT, 'texto'), (FMT_CLP, 'clp')):
+        for alin in alineaciones:
+            base = dict(number_format=fmt, alignment=alineaciones[alin], border=borde)
+            registrar(f'libro_{sufijo}_{alin}', font=ft_dato, **base)
+            registrar(f'libro_{sufijo}_{alin}_par', font=ft_dato, fill=fill_par, **base)
+            registrar(f'libro_total_{sufijo}_{alin}', font=ft_total, fill=fill_total, **base)
+    registrar('libro_total_liquido', font=ft_total_liq, fill=fill_total, number_format=FMT_CLP,
+              alignment=alineaciones['right'], border=borde)
+
+    impares, pares, totales = [], [], []
+    for i, (_, _, _, fmt, alin) in enumerate(COLUMNAS):
+        sufijo = 'clp' if fmt == FMT_CLP else 'texto'
+        impares.append(f'libro_{sufijo}_{alin}')
+        pares.append(f'libro_{sufijo}_{alin}_par')
+        if i == len(COLUMNAS) - 1:
+            totales.append('libro_total_liquido')
+        elif fmt == FMT_CLP:
+            totales.append('libro_total_clp_right')
+        elif i == 2:
+            totales.append('libro_total_texto_left')
+        else:
+            totales.append('libro_total_texto_center')
+    return impares, pares, totales
+
+
+def escribir_libro(destino, nombre_empresa, rut_empresa, mes_nombre, anio, filas, totales):
+    """
+    Escribe el libro en `destino` (ruta o archivo binario). `filas` puede ser
+    cualquier iterable de dicts con las claves de COLUMNAS; se consume una
+    sola vez, sin guardarlo.
+    """
+    wb = Workbook(write_only=True)
+    estilos_impar, estilos_par, estilos_total = _registrar_estilos(wb)
+    ws = wb.create_sheet(f'Libro {mes_nombre} {anio}')
+    ws.sheet_view.showGridLines = False
+
+    # Todo lo que va en el encabezado de la hoja (anchos, panel fijo,
+    # configuración de impresión) se define antes de la primera fila.
+    for i, (_, ancho, _, _, _) in enumerate(COLUMNAS, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = ancho
+    ws.sheet_format.defaultRowHeight = 15
+    ws.sheet_format.customHeight = True
+    ultima_col = get_column_letter(len(COLUMNAS))
+    for fila, alto in ((1, 22), (2, 18), (3, 16), (4, 6), (5, 36)):
+        ws.row_dimensions[fila].height = alto
+    for fila in (1, 2, 3):
+        ws.merged_cells.add(f'A{fila}:{ultima_col}{fila}')
+    ws.freeze_panes = 'A6'
+    ws.print_title_rows = '1:5'
+    ws.sheet_properties.pageSetUpPr.fitToPage = True
+    ws.page_setup.orientation = 'landscape'
+    ws.page_setup.paperSize = Worksheet.PAPERSIZE_LETTER
+    ws.page_setup.fitToWidth = 1
+    ws.page_setup.fitToHeight = 0
+
+    def celda(valor, estilo):
+        c = WriteOnlyCell(ws, value=valor)
+        c.style = estilo
+        return c
+
+    ws.append([celda(nombre_empresa.upper(), 'libro_titulo')])
+    ws.append([celda('LIBRO DE REMUNERACIONES', 'libro_subtitulo')])
+    ws.append([celda(f'RUT: {rut_empresa}     Período: {mes_nombre} {anio}', 'libro_periodo')])
+    ws.append([])
+    ws.append([celda(titulo, 'libro_header') for titulo, _, _, _, _ in COLUMNAS])
+
+    # append() escribe la fila al archivo en el acto, así que se reutilizan
+    # las mismas celdas (ya con su estilo) cambiando solo el valor: resolver
+    # un NamedStyle por celda es lo más caro de openpyxl en modo write-only.
+    claves = [clave for _, _, clave, _, _ in COLUMNAS]
+    celdas_impar = [celda(None, estilo) for estilo in estilos_impar]
+    celdas_par = [celda(None, estilo) for estilo in estilos_par]
+    fila_idx = 5
+    for fila_idx, f in enumerate(filas, start=6):
+        celdas = celdas_par if fila_idx % 2 == 0 else celdas_impar
+        for c, clave in zip(celdas, claves):
+            c.value = f[clave]
+        ws.append(celdas)
+
+    valores_total = []
+    for i, clave in enumerate(claves):
+        if clave in _TOTALES_POR_COLUMNA:
+            valores_total.append(totales[_TOTALES_POR_COLUMNA[clave]])
+        else:
+            valores_total.append('TOTALES' if i == 2 else '')
+    ws.row_dimensions[fila_idx + 1].height = 18
+    ws.append([celda(valor, estilo) for valor, estilo in zip(valores_total, estilos_total)])
+    wb.save(destino)
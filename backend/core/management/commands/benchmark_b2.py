@@ -0,0 +1,94 @@
+import logging
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from core import b2_client
+
+OPERACIONES = ('subir', 'existe', 'url', 'descargar')
+
+
+def _operaciones(cliente, bucket, key, cuerpo):
+    return {
+        'subir': lambda: cliente.put_object(Bucket=bucket, Key=key, Body=cuerpo, ContentType='application/pdf'),
+        'existe': lambda: cliente.head_object(Bucket=bucket, Key=key),
+        'url': lambda: cliente.generate_presigned_url(
+            'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=3600),
+        'descargar': lambda: cliente.get_object(Bucket=bucket, Key=key)['Body'].read(),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la latencia por operación B2 (subir, existe, url, descargar) creando un cliente "
+        "boto3 por llamada versus el cliente compartido de core/b2_client.py. Usa un servidor S3 "
+        "local: el de moto si está instalado, o el que se indique con --endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=200)
+        parser.add_argument('--kb', type=int, default=64, help='Tamaño del PDF de prueba.')
+        parser.add_argument('--endpoint', help='URL de un S3 local (si no, se levanta moto).')
+        parser.add_argument('--bucket', default='benchmark-b2')
+
+    def handle(self, *args, **options):
+        # En desarrollo el logging raíz está en DEBUG y botocore registra cada request
+        for nombre in ('boto3', 'botocore', 'urllib3', 'moto', 'werkzeug'):
+            logging.getLogger(nombre).setLevel(logging.WARNING)
+        servidor = None
+        endpoint = options['endpoint']
+        if not endpoint:
+            try:
+                from moto.server import ThreadedMotoServer
+            except ImportError:
+                raise CommandError("moto no está instalado: pip install -r requirements-dev.txt o usa --endpoint.")
+            servidor = ThreadedMotoServer(port=0, verbose=False)
+            servidor.start()
+            host, puerto = servidor.get_host_and_port()
+            endpoint = f'http://{host}:{puerto}'
+        try:
+            with override_settings(B2_KEY_ID='benchmark', B2_APPLICATION_KEY='benchmark',
+                                   B2_BUCKET_NAME=options['bucket'], B2_ENDPOINT_URL=endpoint):
+                self._medir(options)
+        finally:
+            b2_client.reiniciar_cliente()
+            if servidor is not None:
+                servidor.stop()
+
+    def _medir(self, options):
+        bucket = options['bucket']
+        cuerpo = b'%PDF-1.4\n' + b'0' * (options['kb'] * 1024)
+        key = f'benchmark/{uuid.uuid4()}.pdf'
+        b2_client.reiniciar_cliente()
+        try:
+            b2_client._cliente().create_bucket(Bucket=bucket)
+        except b2_client.ClientError:
+            pass  # ya existe
+
+        modos = {
+            'cliente por llamada': b2_client._nuevo_cliente,
+            'cliente compartido': b2_client._cliente,
+        }
+        resultados = {}
+        for modo, obtener in modos.items():
+            tiempos = {op: [] for op in OPERACIONES}
+            for _ in range(options['iteraciones']):
+                for op in OPERACIONES:
+                    inicio = time.perf_counter()
+                    _operaciones(obtener(), bucket, key, cuerpo)[op]()
+                    tiempos[op].append((time.perf_counter() - inicio) * 1000)
+            resultados[modo] = tiempos
+
+        self.stdout.write(f"{'operación':<10} {'modo':<20} {'media ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+        for op in OPERACIONES:
+            for modo, tiempos in resultados.items():
+                muestras = sorted(tiempos[op])
+                p95 = muestras[int(len(muestras) * 0.95) - 1] if len(muestras) > 1 else muestras[0]
+                self.stdout.write(
+                    f"{op:<10} {modo:<20} {statistics.mean(muestras):>9.2f} "
+                    f"{statistics.median(muestras):>8.2f} {p95:>8.2f}"
+                )
+        b2_client._cliente().delete_object(Bucket=bucket, Key=key)
@@ -0,0 +1,59 @@
+import multiprocessing
+import resource
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.libro_excel import COLUMNAS, FMT_CLP, _TOTALES_POR_COLUMNA, escribir_libro
+
+
+def _fila(i):
+    fila = {clave: (700_000 + i if fmt == FMT_CLP else f'{clave} {i}') for _, _, clave, fmt, _ in COLUMNAS}
+    fila['dias'] = 30
+    return fila
+
+
+def _rss_peak_kb():
+    # VmHWM es el peak de este proceso; ru_maxrss en Linux arrastra el del padre
+    try:
+        with open('/proc/self/status') as status:
+            for linea in status:
+                if linea.startswith('VmHWM:'):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _medir(cantidad):
+    """Corre en un proceso limpio: (segundos, RSS inicial KB, RSS peak KB, bytes)."""
+    rss_inicial = _rss_peak_kb()
+    totales = {clave: 0 for clave in _TOTALES_POR_COLUMNA.values()}
+    inicio = time.perf_counter()
+    with tempfile.TemporaryFile() as archivo:
+        escribir_libro(archivo, 'Empresa Benchmark SpA', '76.000.000-0', 'Abril', 2026,
+                       (_fila(i) for i in range(cantidad)), totales)
+        tamano = archivo.tell()
+    segundos = time.perf_counter() - inicio
+    return segundos, rss_inicial, _rss_peak_kb(), tamano
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide tiempo y memoria peak (RSS) del Excel del Libro de Remuneraciones para distintas "
+        "cantidades de filas. Cada medición corre en un proceso nuevo para que el peak no se arrastre."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, nargs='+', default=[100, 1_000, 10_000])
+
+    def handle(self, *args, **options):
+        contexto = multiprocessing.get_context('spawn')
+        self.stdout.write(f"{'filas':>8} {'segundos':>9} {'RSS base MB':>12} {'RSS peak MB':>12} {'xlsx KB':>9}")
+        for cantidad in options['filas']:
+            with contexto.Pool(1) as pool:
+                segundos, base, peak, tamano = pool.apply(_medir, (cantidad,))
+            self.stdout.write(
+                f"{cantidad:>8} {segundos:>9.2f} {base / 1024:>12.1f} {peak / 1024:>12.1f} {tamano / 1024:>9.0f}"
+            )
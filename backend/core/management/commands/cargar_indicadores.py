@@ -0,0 +1,31 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.indicadores import cargar_serie_anual
+
+
+class Command(BaseCommand):
+    help = (
+        "Carga en IndicadorEconomico la serie anual de UF y UTM desde mindicador.cl "
+        "(o desde un JSON local con el mismo formato). Sin años, carga el anterior y el "
+        "en curso (lo corre el paso release del deploy; en enero aún se liquida diciembre)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('anios', nargs='*', type=int,
+                            help='Año(s) a cargar, ej: 2025 2026 (por defecto el anterior y el en curso)')
+        parser.add_argument('--indicador', choices=['uf', 'utm'], action='append',
+                            help='Solo este indicador (por defecto ambos).')
+        parser.add_argument('--archivo', help='JSON local {"uf": {"serie": [...]}, "utm": {...}}')
+
+    def handle(self, *args, **options):
+        indicadores = options['indicador'] or ['uf', 'utm']
+        hoy = datetime.date.today()
+        for anio in options['anios'] or [hoy.year - 1, hoy.year]:
+            try:
+                cargados = cargar_serie_anual(anio, indicadores=indicadores, archivo=options['archivo'])
+            except Exception as e:
+                raise CommandError(f"No se pudo cargar {anio}: {e}")
+            resumen = ', '.join(f"{k.upper()}: {v}" for k, v in cargados.items())
+            self.stdout.write(self.style.SUCCESS(f"{anio} → {resumen}"))
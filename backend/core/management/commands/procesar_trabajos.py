@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import correos, pdf_pool
+from core.indicadores import refrescar_periodicamente
+from core.trabajos import ejecutar_pendientes
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de trabajos en segundo plano (exportaciones ZIP, importaciones, firmas, correos, etc.). Consulta la "
+        "BD cada --intervalo segundos; correr como proceso aparte del servidor web. En modo continuo "
+        "también guarda la UF/UTM vigentes una vez por hora."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=5.0,
+                            help='Segundos de espera cuando no hay trabajos pendientes.')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesa lo pendiente y termina (útil en cron o tests).')
+
+    def handle(self, *args, **options):
+        # Solo este proceso usa el pool de PDFs en paralelo; los web no
+        pdf_pool.configurar_workers(settings.PDF_RENDER_WORKERS_TRABAJOS)
+        try:
+            self._procesar(options)
+        finally:
+            pdf_pool.configurar_workers(None)
+
+    def _procesar(self, options):
+        while True:
+            close_old_connections()
+            hechos = ejecutar_pendientes()
+            if hechos:
+                self.stdout.write(f"{hechos} trabajo(s) procesado(s)")
+            # Después de los trabajos, que pueden encolar correos (ej: firma completada)
+            enviados = correos.despachar()
+            if enviados:
+                self.stdout.write(f"{enviados} correo(s) enviado(s)")
+            hechos += enviados
+            if options['una_vez']:
+                return
+            refrescados = [nombre.upper() for nombre, ok in (refrescar_periodicamente() or {}).items() if ok]
+            if refrescados:
+                self.stdout.write(f"Indicadores refrescados: {', '.join(refrescados)}")
+            if not hechos:
+                time.sleep(options['intervalo'])
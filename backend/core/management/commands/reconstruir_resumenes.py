@@ -0,0 +1,27 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.resumenes import reconstruir
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye la tabla ResumenMensual desde las liquidaciones (todas, o solo las de un "
+        "usuario / año). Útil después de cargas directas a la BD o si se sospecha un descuadre."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', help='username del dueño de las empresas.')
+        parser.add_argument('--anio', type=int, help='Solo este año.')
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['usuario']:
+            try:
+                owner = User.objects.get(username=options['usuario'])
+            except User.DoesNotExist:
+                raise CommandError(f"No existe el usuario '{options['usuario']}'.")
+        with transaction.atomic():
+            cantidad = reconstruir(owner=owner, anio=options['anio'])
+        self.stdout.write(f"{cantidad} resumen(es) mensual(es) reconstruido(s)")
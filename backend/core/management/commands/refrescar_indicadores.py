@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from core.indicadores import (
+    IndicadorNoDisponible, contadores_indicadores, estadisticas_indicadores, obtener_uf, obtener_utm,
+    refrescar_indicadores,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Guarda en IndicadorEconomico la UF y UTM vigentes si todavía no están. El worker "
+        "procesar_trabajos ya lo hace cada hora; sirve para forzarlo o para un cron sin worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forzar', action='store_true',
+                            help='Consulta mindicador.cl aunque el valor de hoy ya esté guardado.')
+        parser.add_argument('--stats', action='store_true',
+                            help='Muestra el último valor guardado de cada indicador, su atraso y cómo '
+                                 'se resuelve hoy (hit/atrasado/miss).')
+
+    def handle(self, *args, **options):
+        for nombre, ok in refrescar_indicadores(forzar=options['forzar']).items():
+            if ok is None:
+                self.stdout.write(f"{nombre.upper()}: ya cargado, no se refrescó")
+            elif ok:
+                self.stdout.write(self.style.SUCCESS(f"{nombre.upper()}: refrescado"))
+            else:
+                self.stdout.write(self.style.WARNING(f"{nombre.upper()}: no se pudo refrescar"))
+
+        if options['stats']:
+            for nombre, fila in estadisticas_indicadores().items():
+                if fila is None:
+                    self.stdout.write(self.style.WARNING(f"{nombre.upper()}: sin valores cargados"))
+                    continue
+                self.stdout.write(
+                    f"{nombre.upper()}: {fila['valor']} al {fila['fecha']} "
+                    f"({fila['dias_atraso']} día(s) de atraso, guardado {fila['cargado_en']:%Y-%m-%d %H:%M})"
+                )
+            # Resolver el valor de hoy como lo haría una liquidación: los
+            # contadores dicen si se sirve exacto, atrasado o si falla
+            for obtener in (obtener_uf, obtener_utm):
+                try:
+                    obtener()
+                except IndicadorNoDisponible:
+                    pass
+            for nombre, por_evento in sorted(contadores_indicadores().items()):
+                detalle = ', '.join(f"{evento}={cantidad}" for evento, cantidad in por_evento.items())
+                self.stdout.write(f"{nombre.upper()} en este proceso: {detalle}")
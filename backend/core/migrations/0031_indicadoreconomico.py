@@ -0,0 +1,27 @@
+# Generated by Django 5.2.13 on 2026-10-17 17:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_alter_solicitudfirma_estado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndicadorEconomico',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('indicador', models.CharField(choices=[('uf', 'Unidad de Fomento'), ('utm', 'Unidad Tributaria Mensual')], max_length=10)),
+                ('fecha', models.DateField()),
+                ('valor', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('cargado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['indicador', 'fecha'],
+                'unique_together': {('indicador', 'fecha')},
+            },
+        ),
+    ]
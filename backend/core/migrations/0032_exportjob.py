@@ -0,0 +1,40 @@
+# Generated by Django 5.2.13 on 2026-10-17 17:24
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_indicadoreconomico'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('EXPEDIENTES', 'Expedientes de trabajadores (ZIP)')], default='EXPEDIENTES', max_length=20)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'En cola'), ('PROCESANDO', 'Procesando'), ('COMPLETADO', 'Completado'), ('ERROR', 'Error')], default='PENDIENTE', max_length=12)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('procesados', models.PositiveIntegerField(default=0)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('archivo', models.FileField(blank=True, null=True, upload_to='exports/')),
+                ('error', models.TextField(blank=True, default='')),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_en', models.DateTimeField(blank=True, null=True)),
+                ('terminado_en', models.DateTimeField(blank=True, null=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='core.empresa')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-creado_en'],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.13 on 2026-10-17 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='liquidacion',
+            name='total_horas_extras',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='liquidacion',
+            name='total_ley',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='liquidacion',
+            name='total_no_imponibles',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='liquidacion',
+            name='total_otros_descuentos',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='liquidacion',
+            name='total_otros_imponibles',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+CAMPOS = [
+    'total_otros_imponibles', 'total_horas_extras', 'total_no_imponibles',
+    'total_otros_descuentos', 'total_ley',
+]
+
+
+def _suma(items):
+    if not isinstance(items, list):
+        return 0
+    return sum(int(i.get('valor', 0)) for i in items if isinstance(i, dict))
+
+
+def rellenar_subtotales(apps, schema_editor):
+    """Calcula los subtotales de las liquidaciones existentes, por lotes."""
+    Liquidacion = apps.get_model('core', 'Liquidacion')
+    lote = []
+    for liq in Liquidacion.objects.only(
+        'id', 'detalle_haberes_imponibles', 'detalle_horas_extras',
+        'detalle_haberes_no_imponibles', 'detalle_otros_descuentos',
+        'afp_monto', 'salud_monto', 'seguro_cesantia', 'impuesto_unico',
+    ).iterator(chunk_size=1000):
+        liq.total_otros_imponibles = _suma(liq.detalle_haberes_imponibles)
+        liq.total_horas_extras = _suma(liq.detalle_horas_extras)
+        liq.total_no_imponibles = _suma(liq.detalle_haberes_no_imponibles)
+        liq.total_otros_descuentos = _suma(liq.detalle_otros_descuentos)
+        liq.total_ley = (
+            (liq.afp_monto or 0) + (liq.salud_monto or 0)
+            + (liq.seguro_cesantia or 0) + (liq.impuesto_unico or 0)
+        )
+        lote.append(liq)
+        if len(lote) >= 1000:
+            Liquidacion.objects.bulk_update(lote, CAMPOS)
+            lote = []
+    if lote:
+        Liquidacion.objects.bulk_update(lote, CAMPOS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0034_liquidacion_subtotales'),
+    ]
+
+    operations = [
+        migrations.RunPython(rellenar_subtotales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.13 on 2026-10-17 17:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Floor
+
+# Tasas de core/previred.py al momento de crear la tabla
+_TASA_BASE = 0.0149 + 0.0093
+_TASA_INDEFINIDO = _TASA_BASE + 0.024
+_TASA_PLAZO = _TASA_BASE + 0.030
+
+
+def llenar_resumenes(apps, schema_editor):
+    """Arma los resúmenes de las liquidaciones existentes (como resumenes.reconstruir)."""
+    Liquidacion = apps.get_model('core', 'Liquidacion')
+    ResumenMensual = apps.get_model('core', 'ResumenMensual')
+    tasa = Case(
+        When(empleado__contrato_activo__isnull=True, then=Value(_TASA_INDEFINIDO)),
+        When(empleado__contrato_activo__tipo_contrato='INDEFINIDO', then=Value(_TASA_INDEFINIDO)),
+        default=Value(_TASA_PLAZO),
+        output_field=FloatField(),
+    )
+    agregados = {
+        'trabajadores': Count('id'),
+        'masa_salarial': Sum('total_haberes'),
+        'liquido_total': Sum('sueldo_liquido'),
+        'costo_empleador': Sum(Floor(F('total_imponible') * tasa)),
+        'total_imponible': Sum('total_imponible'),
+        'afp': Sum('afp_monto'),
+        'salud': Sum('salud_monto'),
+        'seguro_cesantia': Sum('seguro_cesantia'),
+        'impuesto_unico': Sum('impuesto_unico'),
+        'anticipos': Sum('anticipo_quincena'),
+        'otros_descuentos': Sum('total_otros_descuentos'),
+        'total_descuentos': Sum('total_descuentos'),
+    }
+    filas = (
+        Liquidacion.objects
+        .values('empleado__empresa_id', 'empleado__empresa__owner_id', 'anio', 'mes')
+        .annotate(**agregados)
+        .order_by()
+    )
+    ResumenMensual.objects.bulk_create([
+        ResumenMensual(
+            owner_id=fila['empleado__empresa__owner_id'], empresa_id=fila['empleado__empresa_id'],
+            anio=fila['anio'], mes=fila['mes'],
+            **{campo: int(fila[campo] or 0) for campo in agregados},
+        )
+        for fila in filas
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_backfill_subtotales_liquidacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('anio', models.IntegerField()),
+                ('mes', models.IntegerField()),
+                ('trabajadores', models.IntegerField(default=0)),
+                ('masa_salarial', models.BigIntegerField(default=0)),
+                ('liquido_total', models.BigIntegerField(default=0)),
+                ('costo_empleador', models.BigIntegerField(default=0)),
+                ('total_imponible', models.BigIntegerField(default=0)),
+                ('afp', models.BigIntegerField(default=0)),
+                ('salud', models.BigIntegerField(default=0)),
+                ('seguro_cesantia', models.BigIntegerField(default=0)),
+                ('impuesto_unico', models.BigIntegerField(default=0)),
+                ('anticipos', models.BigIntegerField(default=0)),
+                ('otros_descuentos', models.BigIntegerField(default=0)),
+                ('total_descuentos', models.BigIntegerField(default=0)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_mensuales', to='core.empresa')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_mensuales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'anio', 'mes'], name='core_resume_owner_i_c43bf9_idx')],
+                'unique_together': {('empresa', 'anio', 'mes')},
+            },
+        ),
+        migrations.RunPython(llenar_resumenes, migrations.RunPython.noop),
+    ]
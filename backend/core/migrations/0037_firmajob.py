@@ -0,0 +1,34 @@
+# Generated by Django 5.2.13 on 2026-10-17 18:11
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_resumenmensual'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FirmaJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'En cola'), ('PROCESANDO', 'Procesando'), ('COMPLETADO', 'Completado'), ('ERROR', 'Error')], default='PENDIENTE', max_length=12)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('firmado_en', models.DateTimeField()),
+                ('ip_firmante', models.GenericIPAddressField(blank=True, null=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_en', models.DateTimeField(blank=True, null=True)),
+                ('terminado_en', models.DateTimeField(blank=True, null=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('solicitud', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='firma_job', to='core.solicitudfirma')),
+            ],
+            options={
+                'ordering': ['-creado_en'],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.13 on 2026-10-17 18:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0037_firmajob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('categoria', models.CharField(blank=True, default='', max_length=30)),
+                ('asunto', models.CharField(max_length=255)),
+                ('remitente', models.CharField(max_length=255)),
+                ('destinatarios', models.JSONField(default=list)),
+                ('texto', models.TextField()),
+                ('html', models.TextField(blank=True, default='')),
+                ('adjuntos', models.JSONField(blank=True, default=list)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'En cola'), ('ENVIANDO', 'Enviando'), ('ENVIADO', 'Enviado'), ('FALLIDO', 'Fallido (sin más reintentos)')], default='PENDIENTE', max_length=10)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lote', models.UUIDField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('enviado_en', models.DateTimeField(blank=True, null=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['creado_en'],
+                'indexes': [models.Index(fields=['estado', 'proximo_intento'], name='core_emailo_estado_78b521_idx')],
+            },
+        ),
+    ]
@@ -325,6 +325,13 @@ class Liquidacion(models.Model):
     total_haberes = models.IntegerField(default=0)
     total_descuentos = models.IntegerField(default=0)
     sueldo_liquido = models.IntegerField(default=0)
+
+    # --- SUBTOTALES (suma de cada detalle JSON, para agregar con SUM en SQL) ---
+    total_otros_imponibles = models.IntegerField(default=0)
+    total_horas_extras = models.IntegerField(default=0)
+    total_no_imponibles = models.IntegerField(default=0)
+    total_otros_descuentos = models.IntegerField(default=0)
+    total_ley = models.IntegerField(default=0)  # AFP + salud + cesantía + impuesto único
     
     archivo_pdf = models.FileField(upload_to='liquidaciones/', null=True, blank=True)
 
@@ -336,6 +343,29 @@ class Liquidacion(models.Model):
     def __str__(self):
         return f"Liquidación {self.mes}/{self.anio} - {self.empleado.rut}"
 
+    @staticmethod
+    def _suma_detalle(items):
+        if not isinstance(items, list):
+            return 0
+        return sum(int(i.get('valor', 0)) for i in items if isinstance(i, dict))
+
+    def actualizar_subtotales(self):
+        """Recalcula los subtotales persistidos desde los detalles y montos legales."""
+        self.total_otros_imponibles = self._suma_detalle(self.detalle_haberes_imponibles)
+        self.total_horas_extras = self._suma_detalle(self.detalle_horas_extras)
+        self.total_no_imponibles = self._suma_detalle(self.detalle_haberes_no_imponibles)
+        self.total_otros_descuentos = self._suma_detalle(self.detalle_otros_descuentos)
+        self.total_ley = (
+            (self.afp_monto or 0) + (self.salud_monto or 0)
+            + (self.seguro_cesantia or 0) + (self.impuesto_unico or 0)
+        )
+
+    def save(self, *args, **kwargs):
+        # bulk_create/bulk_update no pasan por acá: ahí los subtotales vienen
+        # ya calculados por motor_liquidaciones.
+        self.actualizar_subtotales()
+        super().save(*args, **kwargs)
+
 # ==========================================
 # 6. FINIQUITO
 # ==========================================
@@ -539,4 +569,284 @@ class OTPFirma(models.Model):
         )
 
     def __str__(self):
-        return f"OTP {self.solicitud_id} — {'✓' if self.verificado else '⏳'}"
\ No newline at end of file
+        return f"OTP {self.solicitud_id} — {'✓' if self.verificado else '⏳'}"
+
+# ==========================================
+# 9. INDICADORES ECONÓMICOS (UF / UTM históricos)
+# ==========================================
+class IndicadorEconomico(models.Model):
+    """
+    Valor histórico de un indicador. La UF es diaria (fecha = día exacto);
+    la UTM es mensual (fecha = día 1 del mes al que corresponde).
+    """
+    INDICADOR_CHOICES = [
+        ('uf',  'Unidad de Fomento'),
+        ('utm', 'Unidad Tributaria Mensual'),
+    ]
+
+    indicador = models.CharField(max_length=10, choices=INDICADOR_CHOICES)
+    fecha     = models.DateField()
+    valor     = models.DecimalField(max_digits=12, decimal_places=2)
+    cargado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('indicador', 'fecha')
+        ordering = ['indicador', 'fecha']
+
+    def __str__(self):
+        return f"{self.indicador.upper()} {self.fecha}: {self.valor}"
+
+
+# ==========================================
+# 10. TRABAJOS EN SEGUNDO PLANO
+# ==========================================
+class ExportJob(models.Model):
+    """
+    Exportación pesada (ej: expedientes ZIP de toda una empresa) que se arma
+    fuera del request. La procesa el comando `procesar_trabajos`, que lee los
+    trabajos PENDIENTE desde la BD (no requiere broker externo).
+    """
+    ESTADOS = [
+        ('PENDIENTE',  'En cola'),
+        ('PROCESANDO', 'Procesando'),
+        ('COMPLETADO', 'Completado'),
+        ('ERROR',      'Error'),
+    ]
+    TIPOS = [
+        ('EXPEDIENTES', 'Expedientes de trabajadores (ZIP)'),
+    ]
+
+    id           = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner        = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    empresa      = models.ForeignKey('Empresa', on_delete=models.CASCADE, related_name='export_jobs')
+    tipo         = models.CharField(max_length=20, choices=TIPOS, default='EXPEDIENTES')
+    parametros   = models.JSONField(default=dict, blank=True)
+    estado       = models.CharField(max_length=12, choices=ESTADOS, default='PENDIENTE')
+    total        = models.PositiveIntegerField(default=0)
+    procesados   = models.PositiveIntegerField(default=0)
+    intentos     = models.PositiveSmallIntegerField(default=0)
+    archivo      = models.FileField(upload_to='exports/', null=True, blank=True)
+    error        = models.TextField(blank=True, default='')
+
+    creado_en    = models.DateTimeField(auto_now_add=True)
+    iniciado_en  = models.DateTimeField(null=True, blank=True)
+    terminado_en = models.DateTimeField(null=True, blank=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-creado_en']
+
+    @property
+    def progreso(self):
+        """Porcentaje 0–100 (documentos procesados / total)."""
+        if self.estado == 'COMPLETADO':
+            return 100
+        if not self.total:
+            return 0
+        return min(99, round(self.procesados * 100 / self.total))
+
+    def __str__(self):
+        return f"{self.tipo} {self.empresa_id} [{self.estado}]"
+
+
+class ImportJob(models.Model):
+    """
+    Importación masiva de trabajadores (carga_masiva?asincrono=1) que se
+    procesa fuera del request, por bloques de filas. Cada bloque se escribe en
+    su propia transacción junto con el avance (`procesados`), así que si el
+    worker se cae el trabajo retoma desde el último bloque confirmado.
+    """
+    ESTADOS = ExportJob.ESTADOS
+    # Tope de errores guardados por trabajo (el conteo total va en total_errores)
+    MAX_ERRORES_GUARDADOS = 1000
+
+    id             = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner          = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    empresa        = models.ForeignKey('Empresa', on_delete=models.CASCADE, related_name='import_jobs')
+    archivo        = models.FileField(upload_to='imports/', null=True, blank=True)
+    nombre_archivo = models.CharField(max_length=255, blank=True, default='')
+    estado         = models.CharField(max_length=12, choices=ESTADOS, default='PENDIENTE')
+    total          = models.PositiveIntegerField(default=0)
+    procesados     = models.PositiveIntegerField(default=0)
+    agregados      = models.PositiveIntegerField(default=0)
+    actualizados   = models.PositiveIntegerField(default=0)
+    sin_cambios    = models.PositiveIntegerField(default=0)
+    limite_alcanzado = models.BooleanField(default=False)
+    errores        = models.JSONField(default=list, blank=True)
+    total_errores  = models.PositiveIntegerField(default=0)
+    intentos       = models.PositiveSmallIntegerField(default=0)
+    error          = models.TextField(blank=True, default='')
+
+    creado_en      = models.DateTimeField(auto_now_add=True)
+    iniciado_en    = models.DateTimeField(null=True, blank=True)
+    terminado_en   = models.DateTimeField(null=True, blank=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-creado_en']
+
+    @property
+    def progreso(self):
+        """Porcentaje 0–100 (filas procesadas / total)."""
+        if self.estado == 'COMPLETADO':
+            return 100
+        if not self.total:
+            return 0
+        return min(99, round(self.procesados * 100 / self.total))
+
+    def __str__(self):
+        return f"Importación {self.empresa_id} [{self.estado}]"
+
+
+class FirmaJob(models.Model):
+    """
+    Proceso de una firma ya aceptada por el trabajador: agregar el
+    certificado al PDF, subirlo a B2 y notificar. El endpoint de firma solo
+    crea este trabajo; lo ejecuta `procesar_trabajos`. Hay uno por solicitud
+    (si se reintenta la firma se reutiliza), así que el token no se firma
+    dos veces.
+    """
+    ESTADOS = ExportJob.ESTADOS
+
+    id             = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    solicitud      = models.OneToOneField('SolicitudFirma', on_delete=models.CASCADE, related_name='firma_job')
+    estado         = models.CharField(max_length=12, choices=ESTADOS, default='PENDIENTE')
+    intentos       = models.PositiveSmallIntegerField(default=0)
+    error          = models.TextField(blank=True, default='')
+    # Momento e IP del clic de firma: son los que quedan en el certificado
+    firmado_en     = models.DateTimeField()
+    ip_firmante    = models.GenericIPAddressField(null=True, blank=True)
+
+    creado_en      = models.DateTimeField(auto_now_add=True)
+    iniciado_en    = models.DateTimeField(null=True, blank=True)
+    terminado_en   = models.DateTimeField(null=True, blank=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-creado_en']
+
+    def __str__(self):
+        return f"Firma {self.solicitud_id} [{self.estado}]"
+
+
+class FirmaMasivaJob(models.Model):
+    """
+    Envío a firma de muchos documentos a la vez (ej: el anexo 40 horas a toda
+    una empresa). `items` guarda cada documento pedido con su resultado:
+    {'empleado_id', 'tipo_documento', <ids opcionales>, 'estado': PENDIENTE |
+    ENVIADO | ERROR, 'error', 'solicitud_id'}. Lo procesa `procesar_trabajos`.
+    """
+    ESTADOS = ExportJob.ESTADOS
+
+    id             = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner          = models.ForeignKey(User, on_delete=models.CASCADE, related_name='firma_masiva_jobs')
+    empresa        = models.ForeignKey('Empresa', on_delete=models.CASCADE, related_name='firma_masiva_jobs')
+    items          = models.JSONField(default=list)
+    estado         = models.CharField(max_length=12, choices=ESTADOS, default='PENDIENTE')
+    total          = models.PositiveIntegerField(default=0)
+    procesados     = models.PositiveIntegerField(default=0)
+    intentos       = models.PositiveSmallIntegerField(default=0)
+    error          = models.TextField(blank=True, default='')
+
+    creado_en      = models.DateTimeField(auto_now_add=True)
+    iniciado_en    = models.DateTimeField(null=True, blank=True)
+    terminado_en   = models.DateTimeField(null=True, blank=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-creado_en']
+
+    @property
+    def progreso(self):
+        """Porcentaje 0–100 (documentos procesados / total)."""
+        if self.estado == 'COMPLETADO':
+            return 100
+        if not self.total:
+            return 0
+        return min(99, round(self.procesados * 100 / self.total))
+
+    def __str__(self):
+        return f"Firma masiva {self.empresa_id} [{self.estado}]"
+
+
+# ==========================================
+# 11. RESUMEN MENSUAL DE REMUNERACIONES
+# ==========================================
+class ResumenMensual(models.Model):
+    """
+    Totales de las liquidaciones de una empresa en un mes, para que los
+    reportes (consolidado) lean unas pocas filas en vez de agregar la tabla
+    Liquidacion completa. Se mantiene al guardar/borrar liquidaciones (ver
+    resumenes.py) y se puede reconstruir con `manage.py reconstruir_resumenes`.
+    """
+    owner            = models.ForeignKey(User, on_delete=models.CASCADE, related_name='resumenes_mensuales')
+    empresa          = models.ForeignKey(Empresa, on_delete=models.CASCADE, related_name='resumenes_mensuales')
+    anio             = models.IntegerField()
+    mes              = models.IntegerField()
+
+    trabajadores     = models.IntegerField(default=0)  # liquidaciones del mes (una por trabajador)
+    masa_salarial    = models.BigIntegerField(default=0)  # suma de total_haberes
+    liquido_total    = models.BigIntegerField(default=0)
+    costo_empleador  = models.BigIntegerField(default=0)  # SIS + mutual + AFC empleador
+    total_imponible  = models.BigIntegerField(default=0)
+    afp              = models.BigIntegerField(default=0)
+    salud            = models.BigIntegerField(default=0)
+    seguro_cesantia  = models.BigIntegerField(default=0)
+    impuesto_unico   = models.BigIntegerField(default=0)
+    anticipos        = models.BigIntegerField(default=0)
+    otros_descuentos = models.BigIntegerField(default=0)
+    total_descuentos = models.BigIntegerField(default=0)
+
+    actualizado_en   = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('empresa', 'anio', 'mes')
+        indexes = [models.Index(fields=['owner', 'anio', 'mes'])]
+
+    def __str__(self):
+        return f"Resumen {self.mes}/{self.anio} - {self.empresa_id}"
+
+
+# ==========================================
+# 12. CORREOS SALIENTES (OUTBOX)
+# ==========================================
+class EmailOutbox(models.Model):
+    """
+    Correo por enviar. Se crea en la misma transacción que el cambio de
+    estado que lo motiva (solicitud de firma, OTP, firma, rechazo), así que
+    no se pierde ni se envía por un cambio revertido. Lo despacha
+    `procesar_trabajos` por lotes (ver correos.py); tras MAX_INTENTOS queda
+    FALLIDO para revisarlo a mano.
+    """
+    ESTADOS = [
+        ('PENDIENTE', 'En cola'),
+        ('ENVIANDO',  'Enviando'),
+        ('ENVIADO',   'Enviado'),
+        ('FALLIDO',   'Fallido (sin más reintentos)'),
+    ]
+
+    categoria       = models.CharField(max_length=30, blank=True, default='')
+    asunto          = models.CharField(max_length=255)
+    remitente       = models.CharField(max_length=255)
+    destinatarios   = models.JSONField(default=list)
+    texto           = models.TextField()
+    html            = models.TextField(blank=True, default='')
+    # [{'nombre', 'b2_key', 'content_type'}]: se descargan de B2 al enviar
+    adjuntos        = models.JSONField(default=list, blank=True)
+
+    estado          = models.CharField(max_length=10, choices=ESTADOS, default='PENDIENTE')
+    intentos        = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    lote            = models.UUIDField(null=True, blank=True)
+    error           = models.TextField(blank=True, default='')
+
+    creado_en       = models.DateTimeField(auto_now_add=True)
+    enviado_en      = models.DateTimeField(null=True, blank=True)
+    actualizado_en  = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['creado_en']
+        indexes = [models.Index(fields=['estado', 'proximo_intento'])]
+
+    def __str__(self):
+        return f"{self.asunto} → {', '.join(self.destinatarios)} [{self.estado}]"
@@ -0,0 +1,189 @@
+"""
+motor_liquidaciones.py — Cálculo vectorizado de liquidaciones de sueldo
+
+Calcula gratificación, AFP, salud, seguro de cesantía, Impuesto Único y
+totales para muchas liquidaciones a la vez, operando sobre columnas NumPy
+en vez de fila por fila. Lo usan el proceso masivo de un período y
+_calcular_liquidacion (que es solo un lote de una fila), así que ambos
+caminos dan exactamente los mismos montos.
+
+Uso:
+    from core.motor_liquidaciones import calcular_lote
+    resultados = calcular_lote([(contrato, empleado, data), ...], valor_uf, valor_utm)
+"""
+import numpy as np
+
+from .indicadores import calcular_impuesto_unico_vec
+
+
+TASAS_AFP = {
+    'MODELO': 0.1058, 'HABITAT': 0.1127, 'PROVIDA': 0.1145,
+    'CAPITAL': 0.1144, 'CUPRUM': 0.1144, 'PLANVITAL': 0.1116, 'UNO': 0.1049,
+}
+TASA_AFP_DEFAULT = 0.11
+TOPE_GRATIFICACION = 200000
+TASA_GRATIFICACION = 0.25
+TASA_SALUD_LEGAL = 0.07
+TASA_AFC_TRABAJADOR = 0.006
+
+_DETALLES = (
+    'detalle_haberes_imponibles', 'detalle_horas_extras',
+    'detalle_haberes_no_imponibles', 'detalle_otros_descuentos',
+)
+
+
+def _suma_detalle(items):
+    return sum(int(item.get('valor', 0)) for item in items)
+
+
+def leer_fila(contrato, empleado, data):
+    """
+    Normaliza los datos de entrada de una liquidación (asistencia, arreglos
+    dinámicos y lo que aporta el contrato/ficha). Lanza ValueError/TypeError
+    si algún valor no es numérico, para que el llamador pueda descartar solo
+    esa fila.
+    """
+    fila = {
+        'dias_trabajados': int(data.get('dias_trabajados', 30)),
+        'dias_ausencia': int(data.get('dias_ausencia', 0)),
+        'dias_licencia': int(data.get('dias_licencia', 0)),
+        'dias_no_contratados': int(data.get('dias_no_contratados', 0)),
+    }
+    for campo in _DETALLES:
+        fila[campo] = data.get(campo, [])
+    fila['suma_imponibles'] = _suma_detalle(fila['detalle_haberes_imponibles'])
+    fila['suma_horas_extras'] = _suma_detalle(fila['detalle_horas_extras'])
+    fila['suma_no_imponibles'] = _suma_detalle(fila['detalle_haberes_no_imponibles'])
+    fila['suma_otros_descuentos'] = _suma_detalle(fila['detalle_otros_descuentos'])
+
+    fila['sueldo_base_mensual'] = contrato.sueldo_base
+    fila['gratificacion_mensual'] = contrato.gratificacion_legal == 'MENSUAL'
+    fila['indefinido'] = contrato.tipo_contrato == 'INDEFINIDO'
+    fila['anticipo_quincena'] = (contrato.monto_quincena or 0) if contrato.tiene_quincena else 0
+
+    fila['afp_nombre'] = (empleado.afp or 'MODELO').upper()
+    fila['salud_nombre'] = (empleado.sistema_salud or 'FONASA').upper()
+    fila['plan_isapre_uf'] = empleado.plan_isapre_uf or 0
+    return fila
+
+
+def columnas_desde_filas(filas):
+    """Arma las columnas NumPy que consume calcular_columnas()."""
+    def col(campo, dtype=np.int64):
+        return np.array([f[campo] for f in filas], dtype=dtype)
+
+    plan_uf = col('plan_isapre_uf', np.float64)
+    return {
+        'sueldo_base_mensual': col('sueldo_base_mensual'),
+        'dias_ausencia': col('dias_ausencia'),
+        'dias_licencia': col('dias_licencia'),
+        'dias_no_contratados': col('dias_no_contratados'),
+        'suma_imponibles': col('suma_imponibles'),
+        'suma_horas_extras': col('suma_horas_extras'),
+        'suma_no_imponibles': col('suma_no_imponibles'),
+        'suma_otros_descuentos': col('suma_otros_descuentos'),
+        'gratificacion_mensual': col('gratificacion_mensual', bool),
+        'indefinido': col('indefinido', bool),
+        'anticipo_quincena': col('anticipo_quincena'),
+        'tasa_afp': np.array(
+            [TASAS_AFP.get(f['afp_nombre'], TASA_AFP_DEFAULT) for f in filas], dtype=np.float64
+        ),
+        'es_isapre': np.array([f['salud_nombre'] == 'ISAPRE' for f in filas], dtype=bool) & (plan_uf > 0),
+        'plan_isapre_uf': plan_uf,
+    }
+
+
+def calcular_columnas(cols, valor_uf: float, valor_utm: float):
+    """
+    Calcula todas las columnas derivadas de un lote de liquidaciones.
+
+    cols: diccionario de arreglos (ver columnas_desde_filas). Devuelve otro
+    diccionario de arreglos int64 con sueldo_base, gratificacion, afp_monto,
+    salud_monto, seguro_cesantia, impuesto_unico, los totales y los
+    subtotales que Liquidacion guarda (suma de cada detalle y total_ley).
+    """
+    # Días a pagar = 30 menos ausencias, licencias y días no contratados
+    dias_a_pagar = np.maximum(
+        30 - cols['dias_ausencia'] - cols['dias_licencia'] - cols['dias_no_contratados'], 0
+    )
+    sueldo_base = np.floor((cols['sueldo_base_mensual'] / 30) * dias_a_pagar).astype(np.int64)
+
+    # Gratificación (Art. 50, tope mensual)
+    base_gratificacion = sueldo_base + cols['suma_imponibles'] + cols['suma_horas_extras']
+    gratificacion = np.minimum(
+        np.floor(base_gratificacion * TASA_GRATIFICACION).astype(np.int64), TOPE_GRATIFICACION
+    )
+    gratificacion = np.where(cols['gratificacion_mensual'], gratificacion, 0)
+
+    total_imponible = base_gratificacion + gratificacion
+    total_haberes = total_imponible + cols['suma_no_imponibles']
+
+    afp_monto = np.floor(total_imponible * cols['tasa_afp']).astype(np.int64)
+
+    # Salud: Fonasa 7%, o plan Isapre en UF con el 7% como mínimo legal
+    minimo_legal = np.floor(total_imponible * TASA_SALUD_LEGAL).astype(np.int64)
+    salud_isapre = np.floor(cols['plan_isapre_uf'] * valor_uf).astype(np.int64)
+    salud_monto = np.where(cols['es_isapre'], np.maximum(salud_isapre, minimo_legal), minimo_legal)
+
+    seguro_cesantia = np.where(
+        cols['indefinido'], np.floor(total_imponible * TASA_AFC_TRABAJADOR).astype(np.int64), 0
+    )
+
+    base_tributable = total_imponible - afp_monto - salud_monto - seguro_cesantia
+    impuesto_unico = calcular_impuesto_unico_vec(base_tributable, valor_utm)
+
+    total_descuentos = (
+        afp_monto + salud_monto + seguro_cesantia + impuesto_unico
+        + cols['anticipo_quincena'] + cols['suma_otros_descuentos']
+    )
+    return {
+        'sueldo_base': sueldo_base,
+        'gratificacion': gratificacion,
+        'afp_monto': afp_monto,
+        'salud_monto': salud_monto,
+        'seguro_cesantia': seguro_cesantia,
+        'impuesto_unico': impuesto_unico,
+        'anticipo_quincena': cols['anticipo_quincena'],
+        'total_imponible': total_imponible,
+        'total_haberes': total_haberes,
+        'total_descuentos': total_descuentos,
+        'sueldo_liquido': total_haberes - total_descuentos,
+        'total_otros_imponibles': cols['suma_imponibles'],
+        'total_horas_extras': cols['suma_horas_extras'],
+        'total_no_imponibles': cols['suma_no_imponibles'],
+        'total_otros_descuentos': cols['suma_otros_descuentos'],
+        'total_ley': afp_monto + salud_monto + seguro_cesantia + impuesto_unico,
+    }
+
+
+def calcular_lote(entradas, valor_uf: float, valor_utm: float):
+    """
+    entradas: lista de (contrato, empleado, data).
+    Devuelve una lista de diccionarios con los mismos campos que guarda
+    Liquidacion (ver _calcular_liquidacion en views.py), en el mismo orden.
+    """
+    filas = [leer_fila(contrato, empleado, data) for contrato, empleado, data in entradas]
+    return calcular_filas(filas, valor_uf, valor_utm)
+
+
+def calcular_filas(filas, valor_uf: float, valor_utm: float):
+    """Igual que calcular_lote, pero sobre filas ya normalizadas con leer_fila()."""
+    calculado = calcular_columnas(columnas_desde_filas(filas), valor_uf, valor_utm)
+    montos = {campo: arr.tolist() for campo, arr in calculado.items()}
+
+    resultados = []
+    for i, fila in enumerate(filas):
+        es_isapre = fila['salud_nombre'] == 'ISAPRE' and fila['plan_isapre_uf'] > 0
+        resultado = {
+            'dias_trabajados': fila['dias_trabajados'], 'dias_licencia': fila['dias_licencia'],
+            'dias_ausencia': fila['dias_ausencia'], 'dias_no_contratados': fila['dias_no_contratados'],
+            'afp_nombre': fila['afp_nombre'],
+            'salud_nombre': fila['salud_nombre'],
+            'isapre_cotizacion_uf': fila['plan_isapre_uf'] if es_isapre else 0,
+        }
+        for campo in _DETALLES:
+            resultado[campo] = fila[campo]
+        for campo, valores in montos.items():
+            resultado[campo] = valores[i]
+        resultados.append(resultado)
+    return resultados
@@ -0,0 +1,278 @@
+"""
+pdf_cache.py — Caché de PDFs generados, direccionada por contenido
+
+Convertir HTML a PDF con xhtml2pdf es lo más caro de cada descarga. Acá cada
+PDF se identifica por un hash de (nombre del template, mtime del template,
+contexto normalizado) y se guarda en el storage configurado (B2 en
+producción, MEDIA_ROOT en local). Un documento idéntico se renderiza una sola
+vez; las siguientes veces se lee del storage.
+
+Como el contexto se normaliza con los valores de los campos de los modelos
+(y de sus FK dentro de core), editar un trabajador o una liquidación cambia
+el hash y el PDF se vuelve a generar solo; por eso guardar un modelo no
+invalida nada (las vistas guardan el FileField del documento justo después
+de cachear su PDF, y borrarlo ahí vaciaría la caché en cada primer render).
+Cada documento guarda a lo más un PDF por template: al guardar uno nuevo se
+borran los anteriores del mismo documento y template (los de datos o un
+template que ya cambiaron). conectar_invalidaciones() borra los PDFs
+cacheados de un documento/trabajador/empresa cuando éste se elimina, para no
+dejar archivos huérfanos.
+
+Estructura en el storage:
+  pdf_cache/{empresa_id}/{empleado_id}/{modelo}_{pk}_{template}_{hash}.pdf
+
+Uso:
+    from core.pdf_cache import renderizar_pdf
+    pdf_bytes = renderizar_pdf('liquidacion.html', context, 'Liquidacion_1_2026', documento=liquidacion)
+"""
+import datetime
+import decimal
+import hashlib
+import io
+import json
+import logging
+import os
+import uuid
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models
+from django.db.models.signals import post_delete
+from django.template.loader import get_template
+from xhtml2pdf import pisa
+
+logger = logging.getLogger(__name__)
+
+PREFIJO = 'pdf_cache'
+# Cuántos niveles de FK se siguen al normalizar un modelo (contrato → empleado → empresa)
+PROFUNDIDAD_RELACIONES = 2
+
+
+def html_a_pdf(html_string: str, nombre_doc: str) -> bytes:
+    """Convierte HTML a bytes PDF con xhtml2pdf. Lanza excepción si falla."""
+    resultado = io.BytesIO()
+    status = pisa.pisaDocument(io.BytesIO(html_string.encode("UTF-8")), resultado)
+    if status.err:
+        raise Exception(f"Error generando PDF '{nombre_doc}'.")
+    pdf_bytes = resultado.getvalue()
+    if not pdf_bytes:
+        raise Exception(f"PDF '{nombre_doc}' resultó vacío.")
+    return pdf_bytes
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Clave de caché
+# ──────────────────────────────────────────────────────────────────────────────
+def _normalizar_instancia(obj, profundidad):
+    datos = {'_modelo': obj._meta.label_lower, 'pk': obj.pk}
+    for field in obj._meta.concrete_fields:
+        if isinstance(field, models.FileField):
+            # Son los PDFs generados (salida, no entrada del render): guardarlos
+            # no debe cambiar la clave del documento que los produjo.
+            continue
+        if field.is_relation:
+            # Solo se siguen relaciones a modelos de la app (no a User, cuyo
+            # last_login cambiaría la clave en cada inicio de sesión).
+            if profundidad > 0 and field.related_model._meta.app_label == obj._meta.app_label:
+                datos[field.name] = _normalizar(getattr(obj, field.name), profundidad - 1)
+            else:
+                datos[field.attname] = getattr(obj, field.attname)
+        else:
+            datos[field.attname] = _normalizar(getattr(obj, field.attname), 0)
+    return datos
+
+
+def _normalizar(valor, profundidad=PROFUNDIDAD_RELACIONES):
+    """Convierte el contexto en algo serializable a JSON de forma estable."""
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    if isinstance(valor, models.Model):
+        return _normalizar_instancia(valor, profundidad)
+    if isinstance(valor, dict):
+        return {str(k): _normalizar(v, profundidad) for k, v in sorted(valor.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(valor, (list, tuple, models.QuerySet)):
+        return [_normalizar(v, profundidad) for v in valor]
+    if isinstance(valor, (set, frozenset)):
+        return sorted(json.dumps(_normalizar(v, profundidad), sort_keys=True) for v in valor)
+    if isinstance(valor, (datetime.date, datetime.time)):
+        return valor.isoformat()
+    if isinstance(valor, (decimal.Decimal, uuid.UUID)):
+        return str(valor)
+    return str(valor)
+
+
+def _mtime_template(template):
+    origen = getattr(getattr(template, 'origin', None), 'name', None)
+    try:
+        return os.path.getmtime(origen) if origen else None
+    except OSError:
+        return None
+
+
+def clave_render(template_name: str, context: dict, template=None) -> str:
+    """Hash sha256 de (template, mtime del template, contexto normalizado)."""
+    template = template or get_template(template_name)
+    material = json.dumps(
+        {
+            'template': template_name,
+            'mtime': _mtime_template(template),
+            'contexto': _normalizar(context),
+        },
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Ubicación en el storage
+# ──────────────────────────────────────────────────────────────────────────────
+def _ambito(documento):
+    """(empresa_id, empleado_id) dueños de un documento, para armar la ruta."""
+    nombre = documento._meta.model_name
+    if nombre == 'empresa':
+        return documento.pk, None
+    if nombre == 'empleado':
+        return documento.empresa_id, documento.pk
+    if nombre == 'anexocontrato':
+        empleado = documento.contrato.empleado
+        return empleado.empresa_id, empleado.pk
+    empleado = documento.empleado
+    return empleado.empresa_id, empleado.pk
+
+
+def _directorio(empresa_id, empleado_id=None):
+    if empleado_id is None:
+        return f"{PREFIJO}/{empresa_id}"
+    return f"{PREFIJO}/{empresa_id}/{empleado_id}"
+
+
+def _prefijo_documento(documento):
+    return f"{documento._meta.model_name}_{documento.pk}_"
+
+
+def _ruta(documento, clave, plantilla):
+    # Sin '_' en el nombre del template: así el prefijo hasta el hash identifica
+    # (documento, template) y guardar() puede borrar las versiones anteriores
+    plantilla = os.path.splitext(plantilla)[0].replace('_', '-')
+    empresa_id, empleado_id = _ambito(documento)
+    directorio = _directorio(empresa_id, empleado_id if empleado_id is not None else '_')
+    return f"{directorio}/{_prefijo_documento(documento)}{plantilla}_{clave}.pdf"
+
+
+def _leer(ruta):
+    try:
+        if default_storage.exists(ruta):
+            with default_storage.open(ruta, 'rb') as f:
+                return f.read()
+    except Exception:
+        logger.warning("No se pudo leer '%s' de la caché de PDFs; se vuelve a generar.", ruta)
+    return None
+
+
+def guardar(ruta, pdf_bytes):
+    """
+    Guarda un PDF recién generado en la ruta devuelta por buscar(), y borra
+    las versiones anteriores del mismo documento y template.
+    """
+    try:
+        if not default_storage.exists(ruta):
+            directorio, archivo = ruta.rsplit('/', 1)
+            _borrar_directorio(directorio, archivo.rsplit('_', 1)[0] + '_')
+            default_storage.save(ruta, ContentFile(pdf_bytes))
+    except Exception:
+        logger.warning("No se pudo guardar '%s' en la caché de PDFs.", ruta)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# API
+# ──────────────────────────────────────────────────────────────────────────────
+def buscar(template_name, context, documento):
+    """
+    Calcula la ruta en caché de un render y la lee si existe.
+    Devuelve (ruta, pdf_bytes o None, template) — el template ya cargado
+    sirve para renderizar en caso de miss sin buscarlo de nuevo.
+    """
+    template = get_template(template_name)
+    ruta = _ruta(documento, clave_render(template_name, context, template), template_name)
+    return ruta, _leer(ruta), template
+
+
+def renderizar_pdf(template_name, context, nombre_doc, documento, convertir=html_a_pdf) -> bytes:
+    """
+    Renderiza `template_name` con `context` a PDF, o lo lee de la caché si ya
+    se generó antes con exactamente los mismos datos.
+
+    documento: instancia dueña del PDF (Liquidacion, Contrato, DocumentoLegal,
+               AnexoContrato, VacacionEmpleado, Finiquito, Empleado…); define
+               la ruta y qué se invalida cuando cambia.
+    convertir: función (html, nombre_doc) -> bytes; por defecto html_a_pdf.
+    """
+    ruta, pdf_bytes, template = buscar(template_name, context, documento)
+    if pdf_bytes is not None:
+        return pdf_bytes
+
+    pdf_bytes = convertir(template.render(context), nombre_doc)
+    guardar(ruta, pdf_bytes)
+    return pdf_bytes
+
+
+def pdf_desde_html(html_string, nombre_doc, documento, convertir=html_a_pdf) -> bytes:
+    """Igual que renderizar_pdf, para HTML armado en código (clave = hash del HTML)."""
+    clave = hashlib.sha256(html_string.encode('utf-8')).hexdigest()
+    ruta = _ruta(documento, clave, 'html')
+    pdf_bytes = _leer(ruta)
+    if pdf_bytes is not None:
+        return pdf_bytes
+
+    pdf_bytes = convertir(html_string, nombre_doc)
+    guardar(ruta, pdf_bytes)
+    return pdf_bytes
+
+
+def _borrar_directorio(ruta, prefijo=''):
+    try:
+        directorios, archivos = default_storage.listdir(ruta)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    for archivo in archivos:
+        if archivo.startswith(prefijo):
+            default_storage.delete(f"{ruta}/{archivo}")
+    if not prefijo:
+        for directorio in directorios:
+            _borrar_directorio(f"{ruta}/{directorio}")
+
+
+def invalidar(documento):
+    """
+    Borra los PDFs cacheados que dependen de `documento`: los de ese
+    documento, todos los del trabajador (si es un Empleado) o todos los de
+    la empresa (si es una Empresa).
+    """
+    try:
+        nombre = documento._meta.model_name
+        empresa_id, empleado_id = _ambito(documento)
+        if nombre == 'empresa':
+            _borrar_directorio(_directorio(empresa_id))
+        elif nombre == 'empleado':
+            _borrar_directorio(_directorio(empresa_id, empleado_id))
+        else:
+            _borrar_directorio(_directorio(empresa_id, empleado_id), _prefijo_documento(documento))
+    except Exception:
+        # Puede fallar si se borra en cascada (el padre ya no existe) o si el
+        # storage no responde; la clave por contenido igual evita PDFs viejos.
+        logger.warning("No se pudo invalidar la caché de PDFs de %r.", documento, exc_info=True)
+
+
+def _al_borrar(sender, instance, **kwargs):
+    invalidar(instance)
+
+
+def conectar_invalidaciones():
+    """Conecta invalidar() al post_delete de los modelos con PDFs."""
+    from .models import (
+        AnexoContrato, Contrato, DocumentoLegal, Empleado, Empresa,
+        Finiquito, Liquidacion, VacacionEmpleado,
+    )
+    for modelo in (Empresa, Empleado, Contrato, AnexoContrato, DocumentoLegal,
+                   Liquidacion, VacacionEmpleado, Finiquito):
+        post_delete.connect(_al_borrar, sender=modelo, dispatch_uid=f'pdf_cache_{modelo.__name__}_post_delete')
@@ -0,0 +1,195 @@
+"""
+pdf_pool.py — Render de PDFs en paralelo para generación masiva
+
+xhtml2pdf usa un solo núcleo por documento, así que un ZIP de expedientes
+renderiza todo uno tras otro. Acá los lotes de TrabajoPdf se reparten en un
+pool de procesos y los bytes vuelven en el mismo orden en que se pidieron.
+El pool es del worker procesar_trabajos (PDF_RENDER_WORKERS_TRABAJOS); los
+procesos web quedan con PDF_RENDER_WORKERS = 1 (sin pool), para no levantar
+hasta 4 procesos por cada worker de gunicorn.
+
+Lo que cruza al proceso hijo es solo texto plano: el template se renderiza a
+HTML en el proceso principal (los templates llaman métodos de los modelos,
+como get_tipo_display, que un dict no tendría) y el hijo hace únicamente la
+conversión HTML → PDF, que es lo caro. La caché de pdf_cache.py se consulta
+antes de enviar nada al pool.
+
+Uso:
+    from core.pdf_pool import TrabajoPdf, renderizar_en_orden
+    for nombre, pdf in renderizar_en_orden([(nombre, TrabajoPdf(...)), (nombre, b'%PDF…')]):
+        ...
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from . import pdf_cache
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+# Lo fija procesar_trabajos (PDF_RENDER_WORKERS_TRABAJOS); si es None manda
+# PDF_RENDER_WORKERS, que en los procesos web deja todo sin pool.
+_workers_del_proceso = None
+
+
+class TrabajoPdf:
+    """
+    Un PDF por generar: template + contexto, el documento dueño (para la
+    caché) y opcionalmente qué hacer con los bytes al terminar (ej: guardarlo
+    en el FileField del modelo). al_terminar corre en el proceso principal.
+    """
+
+    def __init__(self, template_name, context, nombre_doc, documento, al_terminar=None):
+        self.template_name = template_name
+        self.context = context
+        self.nombre_doc = nombre_doc
+        self.documento = documento
+        self.al_terminar = al_terminar
+
+    def ejecutar(self, convertir=pdf_cache.html_a_pdf) -> bytes:
+        """Genera este PDF en el proceso actual (sin pool)."""
+        pdf_bytes = pdf_cache.renderizar_pdf(
+            self.template_name, self.context, self.nombre_doc, documento=self.documento, convertir=convertir,
+        )
+        if self.al_terminar:
+            self.al_terminar(pdf_bytes)
+        return pdf_bytes
+
+
+def configurar_workers(cantidad):
+    """Fija los workers de este proceso (None vuelve a PDF_RENDER_WORKERS)."""
+    global _workers_del_proceso
+    _workers_del_proceso = cantidad
+
+
+def cantidad_workers() -> int:
+    """PDF_RENDER_WORKERS (o lo de configurar_workers); 0 = automático (hasta 4 según CPUs), 1 = sin pool."""
+    configurado = _workers_del_proceso
+    if configurado is None:
+        configurado = getattr(settings, 'PDF_RENDER_WORKERS', 1)
+    if configurado:
+        return max(1, configurado)
+    return min(4, os.cpu_count() or 1)
+
+
+def _pool(workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            # spawn: los hijos no heredan conexiones a la BD ni hilos del servidor
+            _executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+            )
+            _executor_workers = workers
+        return _executor
+
+
+def cerrar_pool():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+def convertir_htmls(documentos, workers=None):
+    """
+    Convierte una lista de (html, nombre_doc) a PDF, en paralelo si hay más
+    de un worker. Devuelve, en el mismo orden, los bytes o la excepción de
+    cada uno. No pasa por la caché: es para HTML que ya se armó en el
+    proceso principal (ej: solicitudes de firma masivas).
+    """
+    workers = workers or cantidad_workers()
+    resultados = []
+    if workers > 1 and len(documentos) > 1:
+        pool = _pool(workers)
+        futuros = [pool.submit(pdf_cache.html_a_pdf, html, nombre) for html, nombre in documentos]
+        for futuro in futuros:
+            try:
+                resultados.append(futuro.result())
+            except Exception as e:
+                resultados.append(e)
+    else:
+        for html, nombre in documentos:
+            try:
+                resultados.append(pdf_cache.html_a_pdf(html, nombre))
+            except Exception as e:
+                resultados.append(e)
+    return resultados
+
+
+def renderizar_lote(trabajos, workers=None):
+    """
+    Genera una lista de TrabajoPdf. Devuelve, en el mismo orden, los bytes de
+    cada PDF o la excepción que lo hizo fallar (un documento malo no bota el
+    lote completo).
+    """
+    workers = workers or cantidad_workers()
+    resultados = [None] * len(trabajos)
+    pendientes = []  # (indice, ruta_cache, html)
+
+    for i, trabajo in enumerate(trabajos):
+        try:
+            ruta, cacheado, template = pdf_cache.buscar(trabajo.template_name, trabajo.context, trabajo.documento)
+            if cacheado is not None:
+                resultados[i] = cacheado
+            else:
+                pendientes.append((i, ruta, template.render(trabajo.context)))
+        except Exception as e:
+            resultados[i] = e
+
+    generados = convertir_htmls([(html, trabajos[i].nombre_doc) for _, _, html in pendientes], workers=workers)
+    convertidos = [(i, ruta, pdf_bytes) for (i, ruta, _), pdf_bytes in zip(pendientes, generados)]
+
+    for i, ruta, pdf_bytes in convertidos:
+        resultados[i] = pdf_bytes
+        if isinstance(pdf_bytes, Exception):
+            continue
+        pdf_cache.guardar(ruta, pdf_bytes)
+
+    for trabajo, pdf_bytes in zip(trabajos, resultados):
+        if trabajo.al_terminar and not isinstance(pdf_bytes, Exception):
+            try:
+                trabajo.al_terminar(pdf_bytes)
+            except Exception:
+                logger.warning("No se pudo guardar el PDF '%s' en su modelo.", trabajo.nombre_doc, exc_info=True)
+    return resultados
+
+
+def renderizar_en_orden(entradas, tamano_bloque=None, workers=None):
+    """
+    entradas: iterable de (nombre, bytes | TrabajoPdf), ej: archivos de un ZIP.
+    Entrega (nombre, bytes) en el mismo orden, renderizando por bloques en
+    paralelo; así en memoria hay a lo más un bloque de PDFs a la vez. Los
+    que fallan se omiten (se registra en el log).
+    """
+    workers = workers or cantidad_workers()
+    tamano_bloque = tamano_bloque or workers * 2
+    bloque = []
+
+    def vaciar():
+        trabajos = [contenido for _, contenido in bloque if isinstance(contenido, TrabajoPdf)]
+        generados = iter(renderizar_lote(trabajos, workers=workers)) if trabajos else iter(())
+        for nombre, contenido in bloque:
+            if isinstance(contenido, TrabajoPdf):
+                contenido = next(generados)
+                if isinstance(contenido, Exception):
+                    logger.warning("Se omitió '%s': %s", nombre, contenido)
+                    continue
+            yield nombre, contenido
+        bloque.clear()
+
+    for nombre, contenido in entradas:
+        bloque.append((nombre, contenido))
+        if sum(isinstance(c, TrabajoPdf) for _, c in bloque) >= tamano_bloque:
+            yield from vaciar()
+    yield from vaciar()
@@ -0,0 +1,198 @@
+"""
+previred.py — Formato del archivo de cotizaciones Previred
+
+Arma la línea de 105 campos (separados por ';') de cada liquidación a partir
+de valores planos (un dict de .values(), ver CAMPOS), sin tocar modelos ni
+la BD. Formatear una línea cuesta menos que serializarla para otro proceso,
+así que todo corre en el proceso que atiende la descarga.
+
+Uso:
+    from core import previred
+    filas = Liquidacion.objects.filter(...).values(*previred.CAMPOS)
+    lineas = [previred.linea(f) for f in filas]
+"""
+import datetime
+import math
+
+AFP_CODIGOS = {
+    'CAPITAL': '03', 'CUPRUM': '04', 'HABITAT': '05',
+    'MODELO': '08', 'PLANVITAL': '06', 'PROVIDA': '07', 'UNO': '10', 'IPS': '00',
+}
+
+ISAPRE_CODIGOS = {
+    'BANMEDICA': '01', 'COLMENA': '02', 'CRUZ_BLANCA': '03',
+    'ESENCIAL': '04', 'VIDA_TRES': '05', 'SAN_LORENZO': '06',
+    'NUEVA_MASVIDA': '07', 'CONSALUD': '08',
+}
+
+TIPO_CONTRATO = {
+    'INDEFINIDO': '1', 'PLAZO_FIJO': '2', 'OBRA_FAENA': '3',
+}
+
+TIPO_JORNADA = {
+    'ORDINARIA': '1', 'TURNOS': '1', 'BISMANAL': '1',
+    'ART_22': '2', 'PARCIAL': '2', 'OTRO': '1',
+}
+
+MUTUAL_DEFAULT = '01'  # ISL por defecto
+TASA_MUTUAL_AT = 0.0093  # tasa base AT/EP empleador
+TASA_AFC_EMP_INDEFINIDO = 0.024
+TASA_AFC_EMP_PLAZO = 0.030
+TASA_SIS = 0.0149
+TASA_EXPECTATIVA_VIDA = 0.009  # Reforma 2025
+
+# Columnas de Liquidacion (y sus relaciones) que necesita linea().
+# El contrato llega en None si el trabajador no tiene (LEFT JOIN).
+CAMPOS = (
+    'dias_trabajados', 'afp_nombre', 'afp_monto', 'total_imponible',
+    'salud_nombre', 'salud_monto', 'isapre_cotizacion_uf', 'seguro_cesantia',
+    'empleado__rut', 'empleado__nombres', 'empleado__apellido_paterno',
+    'empleado__apellido_materno', 'empleado__sexo', 'empleado__fecha_nacimiento',
+    'empleado__fecha_ingreso', 'empleado__empresa__rut',
+    'empleado__contrato_activo__tipo_contrato', 'empleado__contrato_activo__tipo_jornada',
+)
+
+
+def rut_partes(rut_str: str):
+    """Devuelve (numero_str, dv_str) desde un RUT como '12.345.678-9'."""
+    limpio = (rut_str or '').replace('.', '').replace(' ', '').upper()
+    if '-' in limpio:
+        num, dv = limpio.rsplit('-', 1)
+    elif len(limpio) > 1:
+        num, dv = limpio[:-1], limpio[-1]
+    else:
+        return '0', '0'
+    return num.lstrip('0') or '0', dv
+
+
+def fmt_fecha(f) -> str:
+    """Convierte fecha a DDMMAAAA o cadena vacía."""
+    if not f:
+        return ''
+    try:
+        if isinstance(f, str):
+            d = datetime.date.fromisoformat(f)
+        else:
+            d = f
+        return d.strftime('%d%m%Y')
+    except Exception:
+        return ''
+
+
+def linea(fila: dict) -> str:
+    """Línea de 105 campos del archivo Previred para una fila de CAMPOS."""
+    tipo_contrato = fila['empleado__contrato_activo__tipo_contrato']
+    tipo_jornada = fila['empleado__contrato_activo__tipo_jornada']
+
+    # ── Identificación trabajador ──────────────────────────────────
+    rut_num, rut_dv = rut_partes(fila['empleado__rut'])
+    apellido_m = fila['empleado__apellido_materno'] or ''
+    sexo_cod = '2' if fila['empleado__sexo'] == 'F' else '1'
+    fecha_nac = fmt_fecha(fila['empleado__fecha_nacimiento'])
+    fecha_ing = fmt_fecha(fila['empleado__fecha_ingreso'])
+    tipo_trab = '01'
+    nac_cod = '152'  # Chile
+
+    # ── Contrato ───────────────────────────────────────────────────
+    dias_trab = str(int(fila['dias_trabajados'] or 30))
+    tipo_ctto = TIPO_CONTRATO.get(tipo_contrato or 'INDEFINIDO', '1')
+    es_indefinido = tipo_contrato == 'INDEFINIDO'
+    movimiento = '0'  # vigente
+    rut_emp_num, rut_emp_dv = rut_partes(fila['empleado__empresa__rut'])
+
+    # ── AFP ────────────────────────────────────────────────────────
+    nombre_afp = (fila['afp_nombre'] or 'MODELO').upper()
+    cod_afp = AFP_CODIGOS.get(nombre_afp, '08')
+    renta_imp = int(fila['total_imponible'] or 0)
+    cotiz_afp = str(int(fila['afp_monto'] or 0))
+    sis = str(math.floor(renta_imp * TASA_SIS))
+
+    # ── Salud ──────────────────────────────────────────────────────
+    sistema = (fila['salud_nombre'] or 'FONASA').upper()
+    if sistema == 'FONASA':
+        cod_salud = '00'
+    else:
+        cod_salud = ISAPRE_CODIGOS.get(sistema, '00')
+    cotiz_salud = str(int(fila['salud_monto'] or 0))
+    uf_isapre = str(float(fila['isapre_cotizacion_uf'] or 0))
+
+    # ── Mutual AT/EP ───────────────────────────────────────────────
+    cotiz_mutual = str(math.floor(renta_imp * TASA_MUTUAL_AT))
+
+    # ── AFC Cesantía ───────────────────────────────────────────────
+    ind_afc = '1' if es_indefinido else '0'
+    cotiz_afc_trab = str(int(fila['seguro_cesantia'] or 0))
+    if es_indefinido:
+        cotiz_afc_emp = str(math.floor(renta_imp * TASA_AFC_EMP_INDEFINIDO))
+    elif tipo_contrato == 'PLAZO_FIJO':
+        cotiz_afc_emp = str(math.floor(renta_imp * TASA_AFC_EMP_PLAZO))
+    else:
+        cotiz_afc_emp = '0'
+    renta_imp_afc = str(renta_imp) if es_indefinido else '0'
+
+    # ── Reforma 2025 ───────────────────────────────────────────────
+    tipo_jornada_code = TIPO_JORNADA.get(tipo_jornada or 'ORDINARIA', '1')
+    cotiz_expectativa = str(math.floor(renta_imp * TASA_EXPECTATIVA_VIDA))
+
+    # ── Construir array de 105 campos (base cero) ──────────────────
+    campos = ['0'] * 105
+
+    # Trabajador / contrato (campos 1-17, índices 0-16)
+    campos[0]  = rut_num
+    campos[1]  = rut_dv
+    campos[2]  = fila['empleado__apellido_paterno']
+    campos[3]  = apellido_m
+    campos[4]  = fila['empleado__nombres']
+    campos[5]  = sexo_cod
+    campos[6]  = fecha_nac
+    campos[7]  = nac_cod
+    campos[8]  = tipo_trab
+    campos[9]  = fecha_ing
+    campos[10] = ''   # fecha término (activo)
+    campos[11] = ''   # causal término
+    campos[12] = dias_trab
+    campos[13] = tipo_ctto
+    campos[14] = movimiento
+    campos[15] = rut_emp_num
+    campos[16] = rut_emp_dv
+    # índices 17-23: padding → '0' (ya inicializados)
+
+    # AFP (campos 25-28, índices 24-27)
+    campos[24] = cod_afp
+    campos[25] = str(renta_imp)
+    campos[26] = cotiz_afp
+    campos[27] = sis
+    # índices 28-43: extras AFP → '0'
+
+    # Salud (campos 45-48, índices 44-47)
+    campos[44] = cod_salud
+    campos[45] = str(renta_imp)
+    campos[46] = cotiz_salud
+    campos[47] = uf_isapre
+    # índices 48-59: extras salud → '0'
+
+    # Mutual AT/EP (campos 61-63, índices 60-62)
+    campos[60] = MUTUAL_DEFAULT
+    campos[61] = str(renta_imp)
+    campos[62] = cotiz_mutual
+    # índices 63-69: extras mutual → '0'
+
+    # AFC (campos 71-74, índices 70-73)
+    campos[70] = ind_afc
+    campos[71] = renta_imp_afc
+    campos[72] = cotiz_afc_trab
+    campos[73] = cotiz_afc_emp
+    # índices 74-84: extras AFC → '0'
+
+    # Reforma 2025 (campos 86-88, índices 85-87)
+    campos[85] = '0'               # RIMA
+    campos[86] = tipo_jornada_code # tipo jornada ley 40h
+    campos[87] = cotiz_expectativa # expectativa de vida 0.9%
+    # índices 88-104: extras → '0'
+
+    return ';'.join(campos)
+
+
+def lineas(filas) -> list:
+    """Formatea un bloque de filas (las de una empresa, por ejemplo)."""
+    return [linea(f) for f in filas]
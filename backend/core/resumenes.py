@@ -0,0 +1,269 @@
+"""
+resumenes.py — Mantención de ResumenMensual (totales por empresa y mes)
+
+Cada vez que se guarda o borra una liquidación se recalcula solo el mes de
+su empresa, con una consulta agregada sobre ese grupo (no se suman deltas:
+así una edición, un cambio de período o un borrado en cascada dejan el
+resumen exacto). Como el tipo de contrato define la tasa AFC del costo
+empleador, cambiar el tipo o borrar un contrato recalcula los meses de ese
+trabajador; mover un trabajador de empresa recalcula los de ambas. Lo que
+escribe con bulk_create/bulk_update (procesar_periodo) no dispara señales y
+llama a recalcular() directamente.
+
+Las señales no recalculan en el momento: anotan el mes y lo recalculan una
+sola vez cuando la transacción confirma (un borrado en cascada de una
+empresa son miles de post_delete, pero unos pocos meses). Un guardado que no
+toca montos ni período no anota nada. recalcular() bloquea la fila del
+resumen antes de agregar, para que dos recálculos simultáneos del mismo mes
+se esperen en vez de pisarse.
+
+Uso:
+    from core import resumenes
+    resumenes.recalcular(empresa_id, anio, mes)
+    resumenes.reconstruir(owner=user)   # o manage.py reconstruir_resumenes
+"""
+import threading
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Floor
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from . import previred
+
+
+def costo_empleador():
+    """
+    Sum() del costo empleador (SIS + mutual + AFC empleador) sobre un
+    queryset de Liquidacion, truncado por liquidación. Sin contrato se asume
+    indefinido.
+    """
+    tasa_base = previred.TASA_SIS + previred.TASA_MUTUAL_AT
+    tasa = Case(
+        When(empleado__contrato_activo__isnull=True, then=Value(tasa_base + previred.TASA_AFC_EMP_INDEFINIDO)),
+        When(empleado__contrato_activo__tipo_contrato='INDEFINIDO',
+             then=Value(tasa_base + previred.TASA_AFC_EMP_INDEFINIDO)),
+        default=Value(tasa_base + previred.TASA_AFC_EMP_PLAZO),
+        output_field=FloatField(),
+    )
+    return Sum(Floor(F('total_imponible') * tasa))
+
+
+def _agregados():
+    return {
+        'trabajadores': Count('id'),
+        'masa_salarial': Sum('total_haberes'),
+        'liquido_total': Sum('sueldo_liquido'),
+        'costo_empleador': costo_empleador(),
+        'total_imponible': Sum('total_imponible'),
+        'afp': Sum('afp_monto'),
+        'salud': Sum('salud_monto'),
+        'seguro_cesantia': Sum('seguro_cesantia'),
+        'impuesto_unico': Sum('impuesto_unico'),
+        'anticipos': Sum('anticipo_quincena'),
+        'otros_descuentos': Sum('total_otros_descuentos'),
+        'total_descuentos': Sum('total_descuentos'),
+    }
+
+
+def _montos(fila):
+    return {campo: int(fila[campo] or 0) for campo in _agregados()}
+
+
+def recalcular(empresa_id, anio, mes):
+    """Recalcula (o borra, si ya no hay liquidaciones) el resumen de un mes."""
+    from .models import Empresa, Liquidacion, ResumenMensual
+
+    with transaction.atomic():
+        owner_id = Empresa.objects.filter(pk=empresa_id).values_list('owner_id', flat=True).first()
+        if owner_id is None:  # la empresa se borró (sus resúmenes se van en cascada)
+            return None
+        # La fila existe y queda bloqueada antes de agregar: otro recálculo del
+        # mismo mes espera a que este confirme y luego ve sus liquidaciones.
+        ResumenMensual.objects.get_or_create(
+            empresa_id=empresa_id, anio=anio, mes=mes, defaults={'owner_id': owner_id},
+        )
+        resumen = ResumenMensual.objects.select_for_update().get(empresa_id=empresa_id, anio=anio, mes=mes)
+        fila = Liquidacion.objects.filter(
+            empleado__empresa_id=empresa_id, anio=anio, mes=mes,
+        ).aggregate(**_agregados())
+        if not fila['trabajadores']:
+            resumen.delete()
+            return None
+        resumen.owner_id = owner_id
+        for campo, valor in _montos(fila).items():
+            setattr(resumen, campo, valor)
+        resumen.save()
+        return resumen
+
+
+def reconstruir(owner=None, anio=None):
+    """
+    Vuelve a armar los resúmenes desde cero con una consulta agrupada.
+    Devuelve cuántos quedaron.
+    """
+    from .models import Liquidacion, ResumenMensual
+
+    liquidaciones = Liquidacion.objects.all()
+    resumenes = ResumenMensual.objects.all()
+    if owner is not None:
+        liquidaciones = liquidaciones.filter(empleado__empresa__owner=owner)
+        resumenes = resumenes.filter(owner=owner)
+    if anio is not None:
+        liquidaciones = liquidaciones.filter(anio=anio)
+        resumenes = resumenes.filter(anio=anio)
+
+    nuevos = [
+        ResumenMensual(
+            owner_id=fila['empleado__empresa__owner_id'], empresa_id=fila['empleado__empresa_id'],
+            anio=fila['anio'], mes=fila['mes'], **_montos(fila),
+        )
+        for fila in liquidaciones
+        .values('empleado__empresa_id', 'empleado__empresa__owner_id', 'anio', 'mes')
+        .annotate(**_agregados())
+        .order_by()
+    ]
+    resumenes.delete()
+    ResumenMensual.objects.bulk_create(nuevos, batch_size=500)
+    return len(nuevos)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Señales
+# ──────────────────────────────────────────────────────────────────────────────
+_estado = threading.local()
+
+# Lo que suma en el resumen: si un guardado no cambia nada de esto, no se recalcula
+_CAMPOS_LIQUIDACION = (
+    'empleado_id', 'anio', 'mes', 'total_haberes', 'sueldo_liquido', 'total_imponible', 'afp_monto',
+    'salud_monto', 'seguro_cesantia', 'impuesto_unico', 'anticipo_quincena', 'total_otros_descuentos',
+    'total_descuentos',
+)
+_CAMPOS_CONTRATO = ('empleado_id', 'tipo_contrato')
+_CAMPOS_EMPLEADO = ('empresa_id',)
+
+
+def _pendientes():
+    if not hasattr(_estado, 'meses'):
+        _estado.meses = set()
+        _estado.empleados_borrados = {}   # empleado_id → empresa_id, durante un borrado en cascada
+    return _estado
+
+
+def programar(empresa_id, anio, mes):
+    """Anota el mes para recalcularlo una vez, cuando la transacción confirme."""
+    if empresa_id is None:
+        return
+    _pendientes().meses.add((empresa_id, int(anio), int(mes)))
+    # Se registra siempre: si la transacción se revierte, el callback se
+    # descarta pero el próximo que confirme recalcula lo que quedó anotado
+    transaction.on_commit(recalcular_pendientes)
+
+
+def recalcular_pendientes():
+    estado = _pendientes()
+    estado.empleados_borrados.clear()
+    while estado.meses:
+        recalcular(*estado.meses.pop())
+
+
+def _valores(instance, campos):
+    valores = {campo: getattr(instance, campo) for campo in campos}
+    for campo in ('anio', 'mes'):
+        if campo in valores:
+            valores[campo] = int(valores[campo])
+    return valores
+
+
+def _tomar_foto(sender, instance, campos, update_fields):
+    """Valores guardados antes de este save (None si la fila es nueva)."""
+    nombres = {campo.removesuffix('_id') for campo in campos} | set(campos)
+    if update_fields is not None and not nombres & set(update_fields):
+        instance._resumen_antes = _valores(instance, campos)   # no toca nada de lo que se suma
+    elif instance.pk:
+        instance._resumen_antes = sender.objects.filter(pk=instance.pk).values(*campos).first()
+    else:
+        instance._resumen_antes = None
+
+
+def _empresa_de(empleado_id):
+    from .models import Empleado
+    borrado = _pendientes().empleados_borrados.get(empleado_id)
+    if borrado is not None:
+        return borrado
+    return Empleado.objects.filter(pk=empleado_id).values_list('empresa_id', flat=True).first()
+
+
+def _programar_meses_de(empleado_id, empresa_ids):
+    from .models import Liquidacion
+    periodos = Liquidacion.objects.filter(empleado_id=empleado_id).values_list('anio', 'mes').distinct()
+    for anio, mes in periodos:
+        for empresa_id in empresa_ids:
+            programar(empresa_id, anio, mes)
+
+
+def _antes_de_guardar_liquidacion(sender, instance, update_fields=None, **kwargs):
+    _tomar_foto(sender, instance, _CAMPOS_LIQUIDACION, update_fields)
+
+
+def _al_guardar_liquidacion(sender, instance, **kwargs):
+    antes = getattr(instance, '_resumen_antes', None)
+    ahora = _valores(instance, _CAMPOS_LIQUIDACION)
+    if antes == ahora:
+        return
+    for valores in filter(None, (ahora, antes)):
+        programar(_empresa_de(valores['empleado_id']), valores['anio'], valores['mes'])
+
+
+def _al_borrar_liquidacion(sender, instance, **kwargs):
+    programar(_empresa_de(instance.empleado_id), instance.anio, instance.mes)
+
+
+def _antes_de_guardar_contrato(sender, instance, update_fields=None, **kwargs):
+    _tomar_foto(sender, instance, _CAMPOS_CONTRATO, update_fields)
+
+
+def _al_guardar_contrato(sender, instance, **kwargs):
+    # El tipo de contrato define la tasa AFC del costo empleador
+    antes = getattr(instance, '_resumen_antes', None)
+    if antes == _valores(instance, _CAMPOS_CONTRATO):
+        return
+    for empleado_id in {instance.empleado_id, antes and antes['empleado_id']} - {None}:
+        _programar_meses_de(empleado_id, [_empresa_de(empleado_id)])
+
+
+def _al_borrar_contrato(sender, instance, **kwargs):
+    if instance.empleado_id in _pendientes().empleados_borrados:
+        return  # se borra con su trabajador: las liquidaciones anotan sus meses
+    _programar_meses_de(instance.empleado_id, [_empresa_de(instance.empleado_id)])
+
+
+def _antes_de_guardar_empleado(sender, instance, update_fields=None, **kwargs):
+    _tomar_foto(sender, instance, _CAMPOS_EMPLEADO, update_fields)
+
+
+def _al_guardar_empleado(sender, instance, **kwargs):
+    # Mover a un trabajador de empresa cambia los totales de las dos
+    antes = getattr(instance, '_resumen_antes', None)
+    if antes is None or antes['empresa_id'] == instance.empresa_id:
+        return
+    _programar_meses_de(instance.pk, [antes['empresa_id'], instance.empresa_id])
+
+
+def _antes_de_borrar_empleado(sender, instance, **kwargs):
+    # pre_delete llega antes que los post_delete de sus liquidaciones: así
+    # no hay que consultar la empresa una vez por liquidación
+    _pendientes().empleados_borrados[instance.pk] = instance.empresa_id
+
+
+def conectar_senales():
+    from .models import Contrato, Empleado, Liquidacion
+    pre_save.connect(_antes_de_guardar_liquidacion, sender=Liquidacion, dispatch_uid='resumenes_pre_save')
+    post_save.connect(_al_guardar_liquidacion, sender=Liquidacion, dispatch_uid='resumenes_post_save')
+    post_delete.connect(_al_borrar_liquidacion, sender=Liquidacion, dispatch_uid='resumenes_post_delete')
+    pre_save.connect(_antes_de_guardar_contrato, sender=Contrato, dispatch_uid='resumenes_contrato_pre_save')
+    post_save.connect(_al_guardar_contrato, sender=Contrato, dispatch_uid='resumenes_contrato_post_save')
+    post_delete.connect(_al_borrar_contrato, sender=Contrato, dispatch_uid='resumenes_contrato_post_delete')
+    pre_save.connect(_antes_de_guardar_empleado, sender=Empleado, dispatch_uid='resumenes_empleado_pre_save')
+    post_save.connect(_al_guardar_empleado, sender=Empleado, dispatch_uid='resumenes_empleado_post_save')
+    pre_delete.connect(_antes_de_borrar_empleado, sender=Empleado, dispatch_uid='resumenes_empleado_pre_delete')
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Empresa, Empleado, Contrato, AnexoContrato, DocumentoLegal, Liquidacion, Plan, SolicitudFirma, VacacionEmpleado, Finiquito
+from .models import Empresa, Empleado, Contrato, AnexoContrato, DocumentoLegal, Liquidacion, Plan, SolicitudFirma, VacacionEmpleado, Finiquito, ExportJob, ImportJob, FirmaMasivaJob
 from dj_rest_auth.serializers import PasswordResetSerializer
 
 class EmpresaSerializer(serializers.ModelSerializer):
@@ -141,11 +141,15 @@ class LiquidacionSerializer(serializers.ModelSerializer):
             'seguro_cesantia', 'impuesto_unico',
             'anticipo_quincena', 'detalle_otros_descuentos',
             'total_imponible', 'total_haberes', 'total_descuentos', 'sueldo_liquido',
+            'total_otros_imponibles', 'total_horas_extras', 'total_no_imponibles',
+            'total_otros_descuentos', 'total_ley',
             'archivo_pdf', 'fecha_emision',
         ]
         read_only_fields = (
             'id',
             'total_imponible', 'total_haberes', 'total_descuentos', 'sueldo_liquido',
+            'total_otros_imponibles', 'total_horas_extras', 'total_no_imponibles',
+            'total_otros_descuentos', 'total_ley',
             'archivo_pdf', 'fecha_emision',
         )
 
@@ -235,3 +239,58 @@ class CustomPasswordResetSerializer(PasswordResetSerializer):
             'html_email_template_name': 'registration/password_reset_email.html',
             'email_template_name': 'registration/password_reset_email.txt',
         }
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    progreso = serializers.IntegerField(read_only=True)
+    url_descarga = serializers.SerializerMethodField()
+
+    def get_url_descarga(self, obj):
+        # En producción el storage es B2 privado: .url es una URL presignada (1 hora)
+        if obj.estado != 'COMPLETADO' or not obj.archivo:
+            return None
+        return obj.archivo.url
+
+    class Meta:
+        model = ExportJob
+        fields = [
+            'id', 'tipo', 'empresa', 'parametros', 'estado',
+            'total', 'procesados', 'progreso', 'url_descarga', 'error',
+            'creado_en', 'iniciado_en', 'terminado_en',
+        ]
+        read_only_fields = fields
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    progreso = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id', 'empresa', 'nombre_archivo', 'estado', 'total', 'procesados', 'progreso',
+            'agregados', 'actualizados', 'sin_cambios', 'limite_alcanzado',
+            'errores', 'total_errores', 'error',
+            'creado_en', 'iniciado_en', 'terminado_en',
+        ]
+        read_only_fields = fields
+
+
+class FirmaMasivaJobSerializer(serializers.ModelSerializer):
+    progreso = serializers.IntegerField(read_only=True)
+    enviados = serializers.SerializerMethodField()
+    errores = serializers.SerializerMethodField()
+
+    def get_enviados(self, obj):
+        return sum(1 for item in obj.items if item.get('estado') == 'ENVIADO')
+
+    def get_errores(self, obj):
+        return sum(1 for item in obj.items if item.get('estado') == 'ERROR')
+
+    class Meta:
+        model = FirmaMasivaJob
+        fields = [
+            'id', 'empresa', 'estado', 'total', 'procesados', 'progreso',
+            'enviados', 'errores', 'items', 'error',
+            'creado_en', 'iniciado_en', 'terminado_en',
+        ]
+        read_only_fields = fields
@@ -5,20 +5,24 @@ Cubre: autenticación, aislamiento de datos, rate limiting, webhook,
 
 Correr con: python manage.py test core
 """
+import datetime
 import io
+import os
 import uuid
+import zipfile
 from unittest.mock import patch
 
 import openpyxl
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.core.files.base import ContentFile
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
 from django.test import override_settings
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from .models import Cliente, Contrato, Empleado, Empresa, Liquidacion, Plan, Suscripcion, SolicitudFirma
+from .models import Cliente, Contrato, Empleado, Empresa, IndicadorEconomico, Liquidacion, Plan, Suscripcion, SolicitudFirma
 from .serializers import ContratoSerializer
 
 
@@ -73,6 +77,27 @@ def crear_empleado(empresa, rut, nombres='Juan', apellido='Pérez', cargo='Anali
     )
 
 
+ARCHIVO_INDICADORES = os.path.join(os.path.dirname(__file__), 'fixtures', 'mindicador_2026.json')
+
+
+def cargar_indicadores_prueba(test):
+    """
+    Carga la UF/UTM 2026 del fixture de mindicador más la UF del cierre de
+    cada mes (y de hoy), para que cualquier período de 2026 tenga indicadores.
+    """
+    import calendar
+    import datetime
+    from core.indicadores import cargar_serie_anual, limpiar_series
+    cargar_serie_anual(2026, archivo=ARCHIVO_INDICADORES)
+    fechas = [datetime.date(2026, m, calendar.monthrange(2026, m)[1]) for m in range(1, 13)]
+    IndicadorEconomico.objects.bulk_create(
+        [IndicadorEconomico(indicador='uf', fecha=f, valor=39825.1) for f in fechas + [datetime.date.today()]],
+        ignore_conflicts=True,
+    )
+    limpiar_series()
+    test.addCleanup(limpiar_series)
+
+
 # ─── A1: Endpoints privados requieren autenticación ───────────────────────────
 
 class AuthRequeridaTests(APITestCase):
@@ -296,35 +321,283 @@ class CargaMasivaLimitesTests(APITestCase):
         self.client.force_authenticate(user=self.user)
         self.url = '/api/empleados/carga_masiva/'
 
-    def test_archivo_mayor_5mb_retorna_400(self):
+    def test_archivo_mayor_al_maximo_retorna_400(self):
         from django.core.files.uploadedfile import SimpleUploadedFile
         contenido = b'0' * (6 * 1024 * 1024)
         archivo = SimpleUploadedFile('grande.xlsx', contenido,
                                      content_type='application/octet-stream')
-        resp = self.client.post(
-            self.url, {'empresa': self.empresa.id, 'file': archivo},
-            format='multipart'
-        )
+        with patch('core.importacion.MAX_ARCHIVO_MB', 5):
+            resp = self.client.post(
+                self.url, {'empresa': self.empresa.id, 'file': archivo},
+                format='multipart'
+            )
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('5 MB', resp.data.get('error', ''))
 
-    def test_mas_de_500_filas_retorna_400(self):
-        excel = crear_excel_bytes(filas=501)
-        resp = self.client.post(
-            self.url, {'empresa': self.empresa.id, 'file': excel},
-            format='multipart'
-        )
+    def test_mas_filas_que_el_maximo_retorna_400(self):
+        excel = crear_excel_bytes(filas=11)
+        with patch('core.importacion.MAX_FILAS', 10):
+            resp = self.client.post(
+                self.url, {'empresa': self.empresa.id, 'file': excel},
+                format='multipart'
+            )
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn('500', resp.data.get('error', ''))
+        self.assertIn('10 filas', resp.data.get('error', ''))
+
+    def test_filas_exactas_al_maximo_no_retorna_400_por_limite(self):
+        excel = crear_excel_bytes(filas=10)
+        with patch('core.importacion.MAX_FILAS', 10):
+            resp = self.client.post(
+                self.url, {'empresa': self.empresa.id, 'file': excel},
+                format='multipart'
+            )
+        # No debe rechazar por límite de filas (puede fallar por RUTs inválidos, pero no por límite)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
 
-    def test_500_filas_exactas_no_retorna_400_por_limite(self):
-        excel = crear_excel_bytes(filas=500)
+    def test_500_filas_ya_no_es_el_limite(self):
+        excel = crear_excel_bytes(filas=501)
         resp = self.client.post(
             self.url, {'empresa': self.empresa.id, 'file': excel},
             format='multipart'
         )
-        # No debe rechazar por límite de filas (puede fallar por RUTs inválidos, pero no por límite)
-        self.assertNotEqual(resp.data.get('error', ''), 'El archivo no puede tener más de 500 filas por importación.')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+
+def rut_con_dv(cuerpo):
+    """RUT válido (con dígito verificador calculado) a partir del cuerpo."""
+    suma, multiplo = 0, 2
+    for d in reversed(str(cuerpo)):
+        suma += int(d) * multiplo
+        multiplo = 2 if multiplo == 7 else multiplo + 1
+    dv = {11: '0', 10: 'K'}.get(11 - suma % 11, str(11 - suma % 11))
+    return f'{cuerpo}-{dv}'
+
+
+def crear_excel_trabajadores(ruts, sueldo=600_000):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['RUT', 'Nombres', 'Apellido Paterno', 'Cargo', 'Fecha Ingreso', 'Sueldo Base', 'Horas Laborales'])
+    for rut in ruts:
+        ws.append([rut, 'Importado', 'Masivo', 'Operario', '01-03-2024', sueldo, 40])
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    buf.name = 'trabajadores.xlsx'
+    return buf
+
+
+class LectorImportacionTests(APITestCase):
+    """El lector de importación entrega filas de a una, con columnas
+    normalizadas, tanto desde .xlsx (openpyxl read_only) como desde CSV."""
+
+    def setUp(self):
+        self.user, self.cliente, self.plan, self.empresa = crear_usuario_completo('lector_user', '55500000-3', '66600001-3')
+        self.client.force_authenticate(user=self.user)
+
+    def test_xlsx_normaliza_header_y_celdas_vacias(self):
+        from core.importacion import leer_filas
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append([' RUT ', 'Apellido Paterno', 'EMAIL', None])
+        ws.append(['11.111.111-1', 'Soto', None, 'ignorada'])
+        ws.append([None, None, None, None])
+        ws.append(['22.222.222-2', 'Rojas', 'a@b.cl', None])
+        buf = io.BytesIO()
+        wb.save(buf)
+        buf.seek(0)
+
+        filas = leer_filas(buf)
+        self.assertFalse(isinstance(filas, list))
+        self.assertEqual(list(filas), [
+            (2, {'rut': '11.111.111-1', 'apellido_paterno': 'Soto', 'email': ''}),
+            (4, {'rut': '22.222.222-2', 'apellido_paterno': 'Rojas', 'email': 'a@b.cl'}),
+        ])
+
+    def test_csv_con_punto_y_coma_y_latin1(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        rut = rut_con_dv(15_000_000)
+        contenido = f'RUT;Nombres;Apellido Paterno;Cargo;Sueldo Base;Horas Laborales\n{rut};José;Muñoz;Operario;650000;40\n'
+        archivo = SimpleUploadedFile('trabajadores.csv', contenido.encode('latin-1'), content_type='application/vnd.ms-excel')
+        resp = self.client.post('/api/empleados/carga_masiva/', {'empresa': self.empresa.id, 'file': archivo}, format='multipart')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['agregados'], 1)
+        emp = Empleado.objects.get(empresa=self.empresa)
+        self.assertEqual((emp.nombres, emp.apellido_paterno, emp.sueldo_base), ('JOSÉ', 'MUÑOZ', 650_000))
+
+    def test_exceso_de_filas_se_detecta_al_leer(self):
+        from core.importacion import ErrorArchivo, leer_filas
+        with self.assertRaises(ErrorArchivo):
+            list(leer_filas(crear_excel_bytes(filas=6), max_filas=5))
+
+
+class CargaMasivaBulkTests(APITestCase):
+    """La importación escribe por lotes (bulk_create/bulk_update): las
+    consultas no crecen con las filas y las fichas siguen siendo correlativas."""
+
+    def setUp(self):
+        self.user, self.cliente, self.plan, self.empresa = crear_usuario_completo('bulk_user', '55500000-2', '66600001-2')
+        self.plan.limite_trabajadores = 5000
+        self.plan.save()
+        self.cliente.plan = self.plan
+        self.cliente.save()
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/empleados/carga_masiva/'
+
+    def _importar(self, ruts, **kwargs):
+        return self.client.post(self.url, {'empresa': self.empresa.id, 'file': crear_excel_trabajadores(ruts, **kwargs)},
+                                format='multipart')
+
+    def test_crea_y_actualiza_por_lotes(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        existente = crear_empleado(self.empresa, rut_con_dv(11_111_111).replace('11111111', '11.111.111'))
+        ruts = [rut_con_dv(11_111_111)] + [rut_con_dv(12_000_000 + i) for i in range(1500)]
+
+        with CaptureQueriesContext(connection) as consultas:
+            resp = self._importar(ruts, sueldo=750_000)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['agregados'], 1500)
+        self.assertEqual(resp.data['actualizados'], 1)
+        # Un INSERT por lote, no por fila (SQLite achica el lote por su límite de parámetros)
+        inserts = [q for q in consultas.captured_queries if q['sql'].startswith('INSERT INTO "core_empleado"')]
+        self.assertLess(len(inserts), 1500 // 10)
+        self.assertLess(len(consultas), 100)
+
+        existente.refresh_from_db()
+        self.assertEqual(existente.sueldo_base, 750_000)
+        self.assertEqual(existente.nombres, 'IMPORTADO')
+        fichas = list(Empleado.objects.filter(empresa=self.empresa).order_by('ficha_numero').values_list('ficha_numero', flat=True))
+        self.assertEqual(fichas, list(range(existente.ficha_numero, existente.ficha_numero + 1501)))
+        nuevo = Empleado.objects.get(empresa=self.empresa, rut=f"12.000.000-{rut_con_dv(12_000_000)[-1]}")
+        self.assertEqual(nuevo.fecha_ingreso.isoformat(), '2024-03-01')
+
+    def test_respeta_limite_del_plan(self):
+        self.plan.limite_trabajadores = 3
+        self.plan.save()
+        resp = self._importar([rut_con_dv(13_000_000 + i) for i in range(5)])
+        self.assertEqual(resp.data['agregados'], 3)
+        self.assertTrue(resp.data['limite_alcanzado'])
+        self.assertEqual(Empleado.objects.filter(empresa=self.empresa).count(), 3)
+
+    def test_rut_repetido_en_el_archivo_no_duplica(self):
+        rut = rut_con_dv(14_000_000)
+        resp = self._importar([rut, rut])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['agregados'], 1)
+        self.assertEqual(Empleado.objects.filter(empresa=self.empresa).count(), 1)
+
+
+class CargaMasivaDryRunTests(APITestCase):
+    """?dry_run=1 valida el archivo completo y devuelve el resumen sin
+    escribir; en la carga real, los trabajadores sin cambios no se reescriben."""
+
+    def setUp(self):
+        self.user, _, _, self.empresa = crear_usuario_completo('dryrun_user', '55500000-4', '66600001-4')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/empleados/carga_masiva/'
+        self.ruts = [rut_con_dv(16_000_000 + i) for i in range(4)]
+
+    def _post(self, excel, dry_run=False):
+        url = f'{self.url}?dry_run=1' if dry_run else self.url
+        return self.client.post(url, {'empresa': self.empresa.id, 'file': excel}, format='multipart')
+
+    def test_ruts_validos_coincide_con_validar_rut(self):
+        from core.formatos import validar_rut
+        from core.importacion import ruts_validos
+        ruts = [rut_con_dv(n) for n in (1_000_000, 9_999_999, 76_543_210, 5_126_663)] + \
+               ['12.345.678-0', '1-9', 'K-1', '', '99999999999-1', '11.111.111-k', 'abc']
+        self.assertEqual(list(ruts_validos(ruts)), [validar_rut(r) for r in ruts])
+
+    def test_dry_run_no_escribe_y_cuenta(self):
+        existente = crear_empleado(self.empresa, self.ruts[0])
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(['rut', 'nombres', 'apellido_paterno', 'cargo', 'sueldo_base', 'horas_laborales'])
+        ws.append([self.ruts[0], 'Nuevo Nombre', 'Pérez', 'Analista', 700_000, 40])
+        ws.append([self.ruts[1], 'Ana', 'Soto', 'Operaria', 600_000, 40])
+        ws.append(['12.345.678-0', 'Rut', 'Malo', 'X', 600_000, 40])
+        ws.append([self.ruts[2], 'Sin', 'Sueldo', 'X', 'mucho', 40])
+        ws.append([self.ruts[3], 'Horas', 'Raras', 'X', 600_000, 200])
+        buf = io.BytesIO()
+        wb.save(buf)
+        buf.seek(0)
+        buf.name = 'dry_run.xlsx'
+
+        resp = self._post(buf, dry_run=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.data['dry_run'])
+        self.assertEqual((resp.data['agregados'], resp.data['actualizados'], resp.data['sin_cambios']), (1, 1, 0))
+        self.assertEqual(resp.data['errores'], [
+            'Fila 4: RUT inválido.',
+            'Fila 5: sueldo_base u horas_laborales contienen valores no numéricos.',
+            'Fila 6: horas_laborales debe estar entre 1 y 168.',
+        ])
+        self.assertEqual(Empleado.objects.filter(empresa=self.empresa).count(), 1)
+        existente.refresh_from_db()
+        self.assertEqual(existente.nombres, 'Juan')
+
+    def test_reimportar_no_reescribe_sin_cambios(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self._post(crear_excel_trabajadores(self.ruts))
+        self.assertEqual(Empleado.objects.filter(empresa=self.empresa).count(), 4)
+
+        with CaptureQueriesContext(connection) as consultas:
+            resp = self._post(crear_excel_trabajadores(self.ruts))
+        self.assertEqual((resp.data['agregados'], resp.data['actualizados'], resp.data['sin_cambios']), (0, 0, 4))
+        self.assertFalse([q for q in consultas.captured_queries if q['sql'].startswith('UPDATE "core_empleado"')])
+
+        resp = self._post(crear_excel_trabajadores(self.ruts, sueldo=900_000))
+        self.assertEqual((resp.data['actualizados'], resp.data['sin_cambios']), (4, 0))
+
+    def _excel(self, *filas):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(['rut', 'nombres', 'apellido_paterno', 'apellido_materno', 'cargo',
+                   'fecha_ingreso', 'sueldo_base', 'horas_laborales'])
+        for fila in filas:
+            ws.append(list(fila))
+        buf = io.BytesIO()
+        wb.save(buf)
+        buf.seek(0)
+        buf.name = 'celdas_vacias.xlsx'
+        return buf
+
+    def test_celdas_vacias_no_cuentan_como_cambio(self):
+        fila = [self.ruts[0], 'Juan', 'Pérez', None, 'Analista', None, 700_000, 40]
+        self.assertEqual(self._post(self._excel(fila)).data['agregados'], 1)
+        existente = Empleado.objects.get(empresa=self.empresa)
+        self.assertEqual(existente.fecha_ingreso, datetime.date.today())
+        Empleado.objects.filter(id=existente.id).update(fecha_ingreso=datetime.date(2024, 1, 1), apellido_materno=None)
+
+        # Sin fecha de ingreso ni apellido materno (NULL en la BD): no hay nada que reescribir
+        resp = self._post(self._excel(fila))
+        self.assertEqual((resp.data['actualizados'], resp.data['sin_cambios']), (0, 1))
+
+        resp = self._post(self._excel([self.ruts[0], 'Juan', 'Pérez', None, 'Analista', None, 750_000, 40]))
+        self.assertEqual(resp.data['actualizados'], 1)
+        existente.refresh_from_db()
+        # La fecha de ingreso guardada no se pisa con la de hoy
+        self.assertEqual(existente.fecha_ingreso, datetime.date(2024, 1, 1))
+
+    def test_horas_con_decimales_se_rechazan(self):
+        resp = self._post(self._excel([self.ruts[1], 'Ana', 'Soto', '', 'X', '2024-01-01', 600_000, '44.5'],
+                                      [self.ruts[2], 'Luis', 'Rojas', '', 'X', '2024-01-01', 600_000, 44.5],
+                                      [self.ruts[3], 'Eva', 'Díaz', '', 'X', '2024-01-01', 600_000, 45.0]))
+        self.assertEqual(resp.data['errores'], [
+            'Fila 2: sueldo_base u horas_laborales contienen valores no numéricos.',
+            'Fila 3: sueldo_base u horas_laborales contienen valores no numéricos.',
+        ])
+        self.assertEqual(resp.data['agregados'], 1)
+
+    def test_valida_por_bloques(self):
+        from core import importacion
+        filas = [(n + 2, {'rut': r, 'nombres': 'X', 'sueldo_base': 1, 'horas_laborales': 40})
+                 for n, r in enumerate(self.ruts)]
+        with patch('core.importacion.validar_filas', wraps=importacion.validar_filas) as validar:
+            resultado = importacion.importar_empleados(self.empresa, iter(filas), 100, dry_run=True, tamano_lote=3)
+        self.assertEqual([len(c.args[0]) for c in validar.call_args_list], [3, 1])
+        self.assertEqual(resultado['agregados'], 4)
 
 
 # ─── A8 / A9: Límites en generación de ZIP ────────────────────────────────────
@@ -467,47 +740,61 @@ class FirmaConcurrenciaTests(APITestCase):
             expira_en=timezone.now() + timezone.timedelta(days=1),
         )
 
-    @patch('core.views.b2_client.eliminar_documento')
-    @patch('core.views.b2_client.subir_documento')
-    @patch('core.pdf_firma.agregar_certificado_firma')
-    @patch('core.views.b2_client.descargar_documento')
-    def test_segunda_peticion_de_firma_es_rechazada(self, mock_descargar, mock_certificado, mock_subir, mock_eliminar):
-        mock_descargar.return_value = b'%PDF-original'
-        mock_certificado.return_value = b'%PDF-firmado'
-
-        payload = {
+    def _firmar(self):
+        return self.client.post(f'/api/firma-publica/{self.solicitud.token}/firmar/', {
             'sesion_token': str(self.sesion_token),
             'firma_trabajador': 'data:image/png;base64,aGVsbG8=',
-        }
-        url = f'/api/firma-publica/{self.solicitud.token}/firmar/'
+        }, format='json')
 
-        resp1 = self.client.post(url, payload, format='json')
-        self.assertEqual(resp1.status_code, 200)
+    def _worker(self):
+        from core.trabajos import ejecutar_pendientes
+        return ejecutar_pendientes()
 
-        # Segunda petición (simula doble clic) sobre la misma solicitud ya FIRMADO
-        resp2 = self.client.post(url, payload, format='json')
+    @patch('core.views.b2_client.subir_documento')
+    @patch('core.views.b2_client.descargar_documento')
+    def test_segunda_peticion_de_firma_es_rechazada(self, mock_descargar, mock_subir):
+        from core.models import FirmaJob
+        resp1 = self._firmar()
+        self.assertEqual(resp1.status_code, 202)
+
+        # Segunda petición (simula doble clic) sobre la misma solicitud ya PROCESANDO
+        resp2 = self._firmar()
         self.assertEqual(resp2.status_code, 400)
 
         self.solicitud.refresh_from_db()
-        self.assertEqual(self.solicitud.estado, 'FIRMADO')
+        self.assertEqual(self.solicitud.estado, 'PROCESANDO')
+        self.assertEqual(FirmaJob.objects.filter(solicitud=self.solicitud).count(), 1)
+        # El request no toca B2: eso lo hace el worker
+        mock_descargar.assert_not_called()
+        mock_subir.assert_not_called()
 
     @patch('core.views.b2_client.subir_documento', side_effect=Exception('B2 caído'))
     @patch('core.pdf_firma.agregar_certificado_firma')
     @patch('core.views.b2_client.descargar_documento')
     def test_falla_en_b2_revierte_a_pendiente(self, mock_descargar, mock_certificado, mock_subir):
+        from core.models import FirmaJob
+        from core.trabajos import MAX_INTENTOS
         mock_descargar.return_value = b'%PDF-original'
         mock_certificado.return_value = b'%PDF-firmado'
 
-        url = f'/api/firma-publica/{self.solicitud.token}/firmar/'
-        resp = self.client.post(url, {
-            'sesion_token': str(self.sesion_token),
-            'firma_trabajador': 'data:image/png;base64,aGVsbG8=',
-        }, format='json')
+        self.assertEqual(self._firmar().status_code, 202)
+        self._worker()
 
-        self.assertEqual(resp.status_code, 500)
+        # Se reintenta hasta MAX_INTENTOS y luego queda disponible para volver
+        # a firmar, no atascada en PROCESANDO
+        self.assertEqual(mock_subir.call_count, MAX_INTENTOS)
+        job = FirmaJob.objects.get(solicitud=self.solicitud)
+        self.assertEqual(job.estado, 'ERROR')
         self.solicitud.refresh_from_db()
-        # Debe quedar disponible para reintentar, no atascada en PROCESANDO
         self.assertEqual(self.solicitud.estado, 'PENDIENTE')
+        estado = self.client.get(f'/api/firma-publica/{self.solicitud.token}/estado/')
+        self.assertEqual(estado.data['estado'], 'PENDIENTE')
+        self.assertIn('error', estado.data)
+
+        # Al volver a firmar se reutiliza el mismo trabajo
+        self.assertEqual(self._firmar().status_code, 202)
+        job.refresh_from_db()
+        self.assertEqual((job.estado, job.intentos), ('PENDIENTE', 0))
 
     def test_rechazar_solicitud_ya_no_pendiente_es_rechazado(self):
         self.solicitud.estado = 'FIRMADO'
@@ -522,6 +809,7 @@ class LiquidacionRecalculoTests(APITestCase):
     en vez de dejarlos congelados con los valores de la creación original."""
 
     def setUp(self):
+        cargar_indicadores_prueba(self)
         self.user, self.cliente, self.plan, self.empresa = crear_usuario_completo(
             'liquidacion_owner', '55.555.555-5', '88.888.888-8'
         )
@@ -567,4 +855,1848 @@ class LiquidacionRecalculoTests(APITestCase):
         self.client.patch(f'/api/liquidaciones/{liquidacion_id}/', {'dias_ausencia': 5}, format='json')
 
         liquidacion.refresh_from_db()
-        self.assertFalse(liquidacion.archivo_pdf)
\ No newline at end of file
+        self.assertFalse(liquidacion.archivo_pdf)
+
+class LiquidacionSubtotalesTests(APITestCase):
+    """Los subtotales de cada detalle (otros imponibles, horas extra, no
+    imponibles, otros descuentos y total ley) se guardan como columnas al
+    calcular la liquidación, por cualquiera de los caminos."""
+
+    DETALLES = {
+        'detalle_haberes_imponibles': [{'nombre': 'Bono', 'valor': 50_000}, {'nombre': 'Comisión', 'valor': 20_000}],
+        'detalle_horas_extras': [{'nombre': 'HE 50%', 'valor': 30_000}],
+        'detalle_haberes_no_imponibles': [{'nombre': 'Colación', 'valor': 40_000}],
+        'detalle_otros_descuentos': [{'nombre': 'Préstamo', 'valor': 15_000}],
+    }
+
+    def setUp(self):
+        cargar_indicadores_prueba(self)
+        self.user, _, _, self.empresa = crear_usuario_completo('subtotales_owner', '15.151.515-1', '51.515.151-5')
+        self.empleado = crear_empleado(self.empresa, '16.161.616-1')
+        Contrato.objects.create(
+            empleado=self.empleado, tipo_contrato='INDEFINIDO', fecha_inicio='2024-01-01',
+            sueldo_base=1_000_000, gratificacion_legal='MENSUAL',
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def _verificar(self, liq):
+        self.assertEqual(liq.total_otros_imponibles, 70_000)
+        self.assertEqual(liq.total_horas_extras, 30_000)
+        self.assertEqual(liq.total_no_imponibles, 40_000)
+        self.assertEqual(liq.total_otros_descuentos, 15_000)
+        self.assertEqual(liq.total_ley, liq.afp_monto + liq.salud_monto + liq.seguro_cesantia + liq.impuesto_unico)
+        self.assertGreater(liq.total_ley, 0)
+
+    def test_creacion_y_edicion_guardan_subtotales(self):
+        resp = self.client.post('/api/liquidaciones/', {
+            'empleado': self.empleado.id, 'mes': 5, 'anio': 2026, **self.DETALLES,
+        }, format='json')
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data['total_no_imponibles'], 40_000)
+        self._verificar(Liquidacion.objects.get(id=resp.data['id']))
+
+        self.client.patch(f"/api/liquidaciones/{resp.data['id']}/", {
+            'detalle_otros_descuentos': [{'nombre': 'Préstamo', 'valor': 5_000}],
+        }, format='json')
+        self.assertEqual(Liquidacion.objects.get(id=resp.data['id']).total_otros_descuentos, 5_000)
+
+    def test_proceso_masivo_guarda_subtotales(self):
+        resp = self.client.post('/api/liquidaciones/procesar_periodo/', {
+            'empresa': self.empresa.id, 'mes': 5, 'anio': 2026,
+            'overrides': {str(self.empleado.id): self.DETALLES},
+        }, format='json')
+        self.assertEqual(resp.status_code, 200)
+        self._verificar(Liquidacion.objects.get(empleado=self.empleado, mes=5, anio=2026))
+
+    def test_migracion_rellena_liquidaciones_existentes(self):
+        import importlib
+        from django.apps import apps
+        migracion = importlib.import_module('core.migrations.0035_backfill_subtotales_liquidacion')
+
+        liq = Liquidacion.objects.create(empleado=self.empleado, mes=5, anio=2026, afp_monto=100,
+                                         salud_monto=70, seguro_cesantia=6, impuesto_unico=1, **self.DETALLES)
+        # Simula una fila anterior a las columnas (y un detalle malformado)
+        Liquidacion.objects.filter(id=liq.id).update(
+            total_otros_imponibles=0, total_horas_extras=0, total_no_imponibles=0,
+            total_otros_descuentos=0, total_ley=0, detalle_horas_extras=[{'nombre': 'HE', 'valor': 30_000}, 'x'],
+        )
+        migracion.rellenar_subtotales(apps, None)
+
+        liq.refresh_from_db()
+        self._verificar(liq)
+        self.assertEqual(liq.total_ley, 177)
+
+
+class ProcesarPeriodoTests(APITestCase):
+    """Verifica el cálculo masivo de liquidaciones de un período completo."""
+
+    def setUp(self):
+        cargar_indicadores_prueba(self)
+        self.user, self.cliente, self.plan, self.empresa = crear_usuario_completo(
+            'periodo_owner', '12.121.212-1', '21.212.121-2'
+        )
+        self.empleados = []
+        for i, rut in enumerate(['11.111.111-1', '22.222.222-2', '33.333.333-3']):
+            emp = crear_empleado(self.empresa, rut, nombres=f'Trabajador{i}')
+            Contrato.objects.create(
+                empleado=emp, tipo_contrato='INDEFINIDO',
+                fecha_inicio='2024-01-01', sueldo_base=800_000 + i * 100_000,
+                gratificacion_legal='MENSUAL',
+            )
+            self.empleados.append(emp)
+        self.sin_contrato = crear_empleado(self.empresa, '44.444.444-4', nombres='SinContrato')
+        self.client.force_authenticate(user=self.user)
+
+    def _procesar(self, **extra):
+        body = {'empresa': self.empresa.id, 'mes': 3, 'anio': 2026}
+        body.update(extra)
+        return self.client.post('/api/liquidaciones/procesar_periodo/', body, format='json')
+
+    def test_crea_liquidaciones_y_omite_sin_contrato(self):
+        resp = self._procesar()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['creadas'], 3)
+        self.assertEqual(resp.data['omitidas'], 1)
+        self.assertEqual(Liquidacion.objects.filter(mes=3, anio=2026).count(), 3)
+        omitida = next(r for r in resp.data['resultados'] if r['empleado'] == self.sin_contrato.id)
+        self.assertEqual(omitida['estado'], 'OMITIDA')
+
+    def test_resultado_coincide_con_creacion_individual(self):
+        emp = self.empleados[0]
+        individual = self.client.post('/api/liquidaciones/', {
+            'empleado': emp.id, 'mes': 4, 'anio': 2026, 'dias_ausencia': 2,
+        }, format='json')
+        Liquidacion.objects.filter(id=individual.data['id']).delete()
+
+        resp = self._procesar(mes=4, overrides={str(emp.id): {'dias_ausencia': 2}})
+        fila = next(r for r in resp.data['resultados'] if r['empleado'] == emp.id)
+        self.assertEqual(fila['sueldo_liquido'], individual.data['sueldo_liquido'])
+
+    def test_reproceso_actualiza_existentes(self):
+        self._procesar()
+        emp = self.empleados[1]
+        antes = Liquidacion.objects.get(empleado=emp, mes=3, anio=2026)
+        antes.archivo_pdf.save('test.pdf', ContentFile(b'%PDF-fake'), save=True)
+        storage, nombre = antes.archivo_pdf.storage, antes.archivo_pdf.name
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            resp = self._procesar(overrides={str(emp.id): {'dias_ausencia': 10}})
+        self.assertEqual(resp.data['creadas'], 0)
+        self.assertEqual(resp.data['actualizadas'], 3)
+        # El PDF viejo se borra recién cuando la transacción confirma
+        self.assertTrue(storage.exists(nombre))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(storage.exists(nombre))
+
+        despues = Liquidacion.objects.get(id=antes.id)
+        self.assertEqual(despues.dias_ausencia, 10)
+        self.assertLess(despues.sueldo_liquido, antes.sueldo_liquido)
+        self.assertFalse(despues.archivo_pdf)
+
+    def test_conflicto_no_borra_pdfs(self):
+        from django.db import IntegrityError
+        self._procesar()
+        liq = Liquidacion.objects.get(empleado=self.empleados[0], mes=3, anio=2026)
+        liq.archivo_pdf.save('conflicto.pdf', ContentFile(b'%PDF-fake'), save=True)
+        with patch('core.views.resumenes.recalcular', side_effect=IntegrityError), \
+                self.captureOnCommitCallbacks(execute=True):
+            resp = self._procesar()
+        self.assertEqual(resp.status_code, 409)
+        liq.refresh_from_db()
+        self.assertTrue(liq.archivo_pdf.storage.exists(liq.archivo_pdf.name))
+        liq.archivo_pdf.delete(save=False)
+
+    def test_empleados_debe_ser_lista_de_ids(self):
+        for valor in ('1,2', [self.empleados[0].id, 'x'], {'id': 1}):
+            resp = self._procesar(empleados=valor)
+            self.assertEqual(resp.status_code, 400, valor)
+        resp = self._procesar(empleados=[self.empleados[0].id])
+        self.assertEqual(resp.data['creadas'], 1)
+
+    def test_plan_semilla_no_accede(self):
+        user, _, _, empresa = crear_usuario_completo(
+            'periodo_semilla', '13.131.313-1', '31.313.131-3', plan_semilla=True
+        )
+        self.client.force_authenticate(user=user)
+        resp = self.client.post('/api/liquidaciones/procesar_periodo/',
+                                {'empresa': empresa.id, 'mes': 3, 'anio': 2026}, format='json')
+        self.assertEqual(resp.status_code, 403)
+
+    def test_empresa_ajena_no_se_procesa(self):
+        otro, _, _, _ = crear_usuario_completo('periodo_otro', '14.141.414-1', '41.414.141-4')
+        self.client.force_authenticate(user=otro)
+        resp = self._procesar()
+        self.assertEqual(resp.status_code, 404)
+
+
+class MotorLiquidacionesParidadTests(APITestCase):
+    """Verifica que el motor vectorizado dé exactamente los mismos montos que
+    el cálculo fila a fila (fórmula original con math.floor) sobre entradas
+    aleatorias, y que calcular_impuesto_unico_vec coincida con la versión escalar."""
+
+    UF = 40844.79
+    UTM = 71506.0
+
+    @staticmethod
+    def _referencia(contrato, empleado, data, valor_uf, valor_utm):
+        # Fórmula escalar previa al motor vectorizado, usada como oráculo.
+        import math
+        from core.indicadores import calcular_impuesto_unico
+        dias_a_pagar = max(30 - int(data.get('dias_ausencia', 0)) - int(data.get('dias_licencia', 0))
+                           - int(data.get('dias_no_contratados', 0)), 0)
+        suma = lambda k: sum(int(i.get('valor', 0)) for i in data.get(k, []))
+        sueldo = math.floor((contrato.sueldo_base / 30) * dias_a_pagar)
+        base_grat = sueldo + suma('detalle_haberes_imponibles') + suma('detalle_horas_extras')
+        grat = min(math.floor(base_grat * 0.25), 200000) if contrato.gratificacion_legal == 'MENSUAL' else 0
+        imponible = base_grat + grat
+        haberes = imponible + suma('detalle_haberes_no_imponibles')
+        tasas = {'MODELO': 0.1058, 'HABITAT': 0.1127, 'PROVIDA': 0.1145,
+                 'CAPITAL': 0.1144, 'CUPRUM': 0.1144, 'PLANVITAL': 0.1116, 'UNO': 0.1049}
+        afp = math.floor(imponible * tasas.get((empleado.afp or 'MODELO').upper(), 0.11))
+        if (empleado.sistema_salud or 'FONASA').upper() == 'ISAPRE' and empleado.plan_isapre_uf > 0:
+            salud = max(math.floor(float(empleado.plan_isapre_uf) * valor_uf), math.floor(imponible * 0.07))
+        else:
+            salud = math.floor(imponible * 0.07)
+        afc = math.floor(imponible * 0.006) if contrato.tipo_contrato == 'INDEFINIDO' else 0
+        impuesto = calcular_impuesto_unico(imponible - afp - salud - afc, valor_utm)
+        quincena = contrato.monto_quincena if contrato.tiene_quincena else 0
+        descuentos = afp + salud + afc + impuesto + quincena + suma('detalle_otros_descuentos')
+        return {
+            'sueldo_base': sueldo, 'gratificacion': grat, 'afp_monto': afp, 'salud_monto': salud,
+            'seguro_cesantia': afc, 'impuesto_unico': impuesto, 'total_imponible': imponible,
+            'total_haberes': haberes, 'total_descuentos': descuentos, 'sueldo_liquido': haberes - descuentos,
+        }
+
+    def _entradas_aleatorias(self, n, seed):
+        import random
+        from decimal import Decimal
+        from types import SimpleNamespace
+        rnd = random.Random(seed)
+        afps = ['MODELO', 'habitat', 'PROVIDA', 'CAPITAL', 'CUPRUM', 'PLANVITAL', 'UNO', 'OTRA', None]
+        entradas = []
+        for _ in range(n):
+            contrato = SimpleNamespace(
+                sueldo_base=rnd.randint(0, 8_000_000),
+                gratificacion_legal=rnd.choice(['MENSUAL', 'ANUAL']),
+                tipo_contrato=rnd.choice(['INDEFINIDO', 'PLAZO_FIJO', 'OBRA_FAENA']),
+                tiene_quincena=rnd.random() < 0.3,
+                monto_quincena=rnd.randint(0, 300_000),
+            )
+            empleado = SimpleNamespace(
+                afp=rnd.choice(afps),
+                sistema_salud=rnd.choice(['FONASA', 'ISAPRE', 'isapre', None]),
+                plan_isapre_uf=Decimal(rnd.randint(0, 1500)) / 100,
+            )
+            item = lambda: {'nombre': 'x', 'valor': rnd.randint(0, 400_000)}
+            data = {
+                'dias_ausencia': rnd.randint(0, 12), 'dias_licencia': rnd.randint(0, 12),
+                'dias_no_contratados': rnd.randint(0, 12),
+                'detalle_haberes_imponibles': [item() for _ in range(rnd.randint(0, 3))],
+                'detalle_horas_extras': [item() for _ in range(rnd.randint(0, 2))],
+                'detalle_haberes_no_imponibles': [item() for _ in range(rnd.randint(0, 3))],
+                'detalle_otros_descuentos': [item() for _ in range(rnd.randint(0, 2))],
+            }
+            entradas.append((contrato, empleado, data))
+        return entradas
+
+    def test_lote_coincide_con_referencia_escalar(self):
+        from core.motor_liquidaciones import calcular_lote
+        for seed in range(5):
+            entradas = self._entradas_aleatorias(400, seed)
+            lote = calcular_lote(entradas, self.UF, self.UTM)
+            for (contrato, empleado, data), calculado in zip(entradas, lote):
+                esperado = self._referencia(contrato, empleado, data, self.UF, self.UTM)
+                for campo, valor in esperado.items():
+                    self.assertEqual(calculado[campo], valor, (seed, campo, contrato, empleado, data))
+
+    def test_wrapper_escalar_coincide_con_lote(self):
+        from core.motor_liquidaciones import calcular_lote
+        from core.views import _calcular_liquidacion
+        entradas = self._entradas_aleatorias(50, 99)
+        lote = calcular_lote(entradas, self.UF, self.UTM)
+        for (contrato, empleado, data), calculado in zip(entradas, lote):
+            individual = _calcular_liquidacion(contrato, empleado, data, valor_uf=self.UF, valor_utm=self.UTM)
+            self.assertEqual(individual, calculado)
+            self.assertIsInstance(individual['sueldo_liquido'], int)
+
+    def test_impuesto_vectorizado_coincide_con_escalar(self):
+        import random
+        from core.indicadores import _TRAMOS_IUSC, calcular_impuesto_unico, calcular_impuesto_unico_vec
+        rnd = random.Random(7)
+        bases = [rnd.randint(-100_000, 40_000_000) for _ in range(5000)]
+        # Bordes exactos de cada tramo, donde un error de comparación se notaría
+        bases += [round(desde * self.UTM) + d for desde, _, _ in _TRAMOS_IUSC for d in (-1, 0, 1)]
+        vec = calcular_impuesto_unico_vec(bases, self.UTM).tolist()
+        self.assertEqual(vec, [calcular_impuesto_unico(b, self.UTM) for b in bases])
+
+
+class IndicadoresHistoricosTests(APITestCase):
+    """Verifica que UF/UTM se resuelvan por período desde IndicadorEconomico,
+    sin llamadas de red, y que la liquidación use la UTM de su propio mes."""
+
+    ARCHIVO = ARCHIVO_INDICADORES
+
+    def setUp(self):
+        from core.indicadores import limpiar_series
+        limpiar_series()
+        self.addCleanup(limpiar_series)
+
+    def _cargar(self):
+        from core.indicadores import cargar_serie_anual
+        return cargar_serie_anual(2026, archivo=self.ARCHIVO)
+
+    def test_carga_anual_desde_json(self):
+        cargados = self._cargar()
+        self.assertEqual(cargados, {'uf': 31, 'utm': 12})
+        self.assertEqual(IndicadorEconomico.objects.filter(indicador='utm').count(), 12)
+        # Recargar el mismo año actualiza en vez de duplicar
+        self._cargar()
+        self.assertEqual(IndicadorEconomico.objects.count(), 43)
+
+    def test_resuelve_por_periodo_sin_red(self):
+        import datetime
+        from core.indicadores import obtener_uf, obtener_utm
+        self._cargar()
+        with patch('core.indicadores.requests.get', side_effect=AssertionError('sin red')):
+            self.assertEqual(obtener_utm(3, 2026), 69751.0)
+            self.assertEqual(obtener_utm(10, 2026), 71086.0)
+            self.assertEqual(obtener_uf(datetime.date(2026, 3, 1)), 39700.0)
+            # Sin el día exacto se usa el último valor conocido reciente
+            self.assertEqual(obtener_uf(datetime.date(2026, 4, 2)), 39825.1)
+
+    def test_periodo_sin_datos_no_usa_otro_valor(self):
+        from core.indicadores import IndicadorNoDisponible, obtener_utm
+        self._cargar()
+        with patch('core.indicadores.requests.get', side_effect=AssertionError('sin red')):
+            with self.assertRaisesMessage(IndicadorNoDisponible, 'cargar_indicadores 2019'):
+                obtener_utm(1, 2019)
+
+        user, _, _, empresa = crear_usuario_completo('indicadores_sin', '17.171.717-1', '71.717.171-7')
+        empleado = crear_empleado(empresa, '18.181.818-1')
+        Contrato.objects.create(empleado=empleado, tipo_contrato='INDEFINIDO', fecha_inicio='2018-01-01',
+                                sueldo_base=800_000)
+        self.client.force_authenticate(user=user)
+        resp = self.client.post('/api/liquidaciones/', {'empleado': empleado.id, 'mes': 1, 'anio': 2019},
+                                format='json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('cargar_indicadores', resp.data['error'])
+        self.assertFalse(Liquidacion.objects.exists())
+
+    def test_recargar_series_no_deja_el_dict_vacio(self):
+        from core import indicadores
+        self._cargar()
+        indicadores.obtener_utm(3, 2026)
+        anterior = indicadores._series
+        indicadores._series_cargadas_en = 0.0
+        indicadores._cargar_series()
+        # El dict que tenía un lector no se vacía: se reemplaza la referencia
+        self.assertIn('utm', anterior)
+        self.assertIsNot(indicadores._series, anterior)
+        self.assertEqual(indicadores._series['utm'][1], anterior['utm'][1])
+
+    def test_liquidacion_usa_utm_de_su_mes(self):
+        from core.views import _calcular_liquidacion
+        self._cargar()
+        user, _, _, empresa = crear_usuario_completo('indicadores_owner', '15.151.515-1', '51.515.151-5')
+        empleado = crear_empleado(empresa, '16.161.616-1')
+        contrato = Contrato.objects.create(
+            empleado=empleado, tipo_contrato='INDEFINIDO', fecha_inicio='2024-01-01',
+            sueldo_base=3_500_000, gratificacion_legal='ANUAL',
+        )
+        esperado = _calcular_liquidacion(contrato, empleado, {}, valor_uf=39825.1, valor_utm=69751.0)
+
+        self.client.force_authenticate(user=user)
+        with patch('core.indicadores.requests.get', side_effect=AssertionError('sin red')):
+            resp = self.client.post('/api/liquidaciones/', {
+                'empleado': empleado.id, 'mes': 3, 'anio': 2026,
+            }, format='json')
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data['impuesto_unico'], esperado['impuesto_unico'])
+
+        # Cambiar el período en la edición recalcula con la UTM del mes nuevo
+        import datetime
+        from core.indicadores import limpiar_series
+        IndicadorEconomico.objects.create(indicador='uf', fecha=datetime.date(2026, 4, 30), valor=39900)
+        limpiar_series()
+        esperado_abr = _calcular_liquidacion(contrato, empleado, {}, valor_uf=39900.0, valor_utm=69889.0)
+        self.assertNotEqual(esperado_abr['impuesto_unico'], esperado['impuesto_unico'])
+        resp = self.client.patch(f"/api/liquidaciones/{resp.data['id']}/", {'mes': 4}, format='json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['impuesto_unico'], esperado_abr['impuesto_unico'])
+
+
+class IndicadoresRefrescoTests(APITestCase):
+    """Verifica el refresco anticipado del valor vigente de UF/UTM: se guarda
+    en IndicadorEconomico (compartida entre procesos), las liquidaciones nunca
+    llaman a la API y, si falta el valor del día, se sirve el último guardado."""
+
+    def setUp(self):
+        from core.indicadores import limpiar_series
+        limpiar_series()
+        self.addCleanup(limpiar_series)
+        self.hoy = datetime.date.today()
+
+    def _respuesta(self, *puntos):
+        from unittest.mock import MagicMock
+        resp = MagicMock()
+        resp.json.return_value = {'serie': [{'fecha': f'{f.isoformat()}T03:00:00.000Z', 'valor': v}
+                                            for f, v in puntos]}
+        return resp
+
+    def test_refresco_guarda_en_la_tabla_y_se_usa_sin_red(self):
+        from core.indicadores import obtener_uf, obtener_utm, refrescar_indicadores
+        with patch('core.indicadores.requests.get', return_value=self._respuesta((self.hoy, 41000.5))):
+            self.assertEqual(refrescar_indicadores(), {'uf': True, 'utm': True})
+        self.assertTrue(IndicadorEconomico.objects.filter(indicador='utm', fecha=self.hoy.replace(day=1)).exists())
+        with patch('core.indicadores.requests.get', side_effect=AssertionError('sin red')):
+            self.assertEqual(obtener_uf(), 41000.5)
+            self.assertEqual(obtener_utm(), 41000.5)
+            # Con el valor de hoy ya guardado no se vuelve a consultar
+            self.assertEqual(refrescar_indicadores(), {'uf': None, 'utm': None})
+
+    def test_api_caida_sirve_el_ultimo_valor_guardado(self):
+        from core.indicadores import obtener_uf, refrescar_indicadores
+        IndicadorEconomico.objects.create(indicador='uf', fecha=self.hoy - datetime.timedelta(days=3), valor=40100)
+        with patch('core.indicadores.requests.get', side_effect=Exception('caída')):
+            self.assertEqual(refrescar_indicadores(('uf',)), {'uf': False})
+            self.assertEqual(obtener_uf(), 40100.0)
+
+    def test_proceso_web_ve_lo_que_guardo_el_cron(self):
+        from core import indicadores
+        IndicadorEconomico.objects.create(indicador='uf', fecha=self.hoy - datetime.timedelta(days=1), valor=40100)
+        self.assertEqual(indicadores.obtener_uf(), 40100.0)
+        # Otro proceso guarda el valor de hoy (sin pasar por limpiar_series de este)
+        IndicadorEconomico.objects.create(indicador='uf', fecha=self.hoy, valor=40110)
+        indicadores._series_cargadas_en -= indicadores.RECARGA_MIN_SEGUNDOS + 1
+        self.assertEqual(indicadores.obtener_uf(), 40110.0)
+
+    def test_estadisticas_muestran_el_atraso(self):
+        from core.indicadores import estadisticas_indicadores
+        IndicadorEconomico.objects.create(indicador='uf', fecha=self.hoy - datetime.timedelta(days=2), valor=40100)
+        stats = estadisticas_indicadores()
+        self.assertEqual(stats['uf']['dias_atraso'], 2)
+        self.assertIsNone(stats['utm'])
+
+    def test_valor_atrasado_se_avisa_y_se_cuenta(self):
+        from core import indicadores
+        antes = indicadores.contadores_indicadores().get('uf', {})
+        IndicadorEconomico.objects.create(indicador='uf', fecha=self.hoy - datetime.timedelta(days=3), valor=40100)
+        with self.assertLogs('core.indicadores', 'WARNING') as logs:
+            self.assertEqual(indicadores.obtener_uf(), 40100.0)
+            self.assertEqual(indicadores.obtener_uf(), 40100.0)
+            with self.assertRaises(indicadores.IndicadorNoDisponible):
+                indicadores.obtener_uf(self.hoy - datetime.timedelta(days=30))
+        self.assertEqual(len([m for m in logs.output if 'último valor guardado' in m]), 1)
+        despues = indicadores.contadores_indicadores()['uf']
+        self.assertEqual(despues['atrasado'] - antes.get('atrasado', 0), 2)
+        self.assertEqual(despues['miss'] - antes.get('miss', 0), 1)
+
+    def test_stats_muestra_como_se_resuelve_hoy(self):
+        from django.core.management import call_command
+        IndicadorEconomico.objects.create(indicador='uf', fecha=self.hoy, valor=40100)
+        salida = io.StringIO()
+        with patch('core.indicadores.requests.get', side_effect=Exception('caída')):
+            call_command('refrescar_indicadores', '--stats', stdout=salida)
+        self.assertIn('UF en este proceso: hit=', salida.getvalue())
+        self.assertIn('UTM en este proceso:', salida.getvalue())
+
+    def test_worker_refresca_a_lo_mas_una_vez_por_intervalo(self):
+        from core import indicadores
+        self.addCleanup(setattr, indicadores, '_ultimo_refresco', indicadores._ultimo_refresco)
+        indicadores._ultimo_refresco = None
+        with patch('core.indicadores.refrescar_indicadores', return_value={'uf': True}) as refrescar:
+            self.assertEqual(indicadores.refrescar_periodicamente(), {'uf': True})
+            self.assertIsNone(indicadores.refrescar_periodicamente())
+            indicadores._ultimo_refresco -= indicadores.REFRESCO_SEGUNDOS + 1
+            indicadores.refrescar_periodicamente()
+        self.assertEqual(refrescar.call_count, 2)
+
+    def test_cargar_indicadores_sin_anio_carga_el_anterior_y_el_actual(self):
+        from django.core.management import call_command
+        with patch('core.management.commands.cargar_indicadores.cargar_serie_anual',
+                   return_value={'uf': 1, 'utm': 1}) as cargar:
+            call_command('cargar_indicadores', stdout=io.StringIO())
+        self.assertEqual([c.args[0] for c in cargar.call_args_list], [self.hoy.year - 1, self.hoy.year])
+
+
+class PdfCacheTests(APITestCase):
+    """Verifica la caché de PDFs por contenido: un documento idéntico se
+    renderiza una vez, un cambio en los datos genera otro PDF que reemplaza
+    al anterior y borrar el modelo elimina lo cacheado."""
+
+    def setUp(self):
+        cargar_indicadores_prueba(self)
+        import shutil
+        import tempfile
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=media)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+        self.user, _, _, self.empresa = crear_usuario_completo('pdfcache_owner', '17.171.717-1', '71.717.171-7')
+        self.empleado = crear_empleado(self.empresa, '18.181.818-1')
+        Contrato.objects.create(
+            empleado=self.empleado, tipo_contrato='INDEFINIDO',
+            fecha_inicio='2024-01-01', sueldo_base=900_000,
+        )
+        self.client.force_authenticate(user=self.user)
+        resp = self.client.post('/api/liquidaciones/', {'empleado': self.empleado.id, 'mes': 5, 'anio': 2026}, format='json')
+        self.liquidacion = Liquidacion.objects.get(id=resp.data['id'])
+        self.renders = 0
+
+    def _convertir(self, html, nombre_doc):
+        self.renders += 1
+        return f'%PDF-{self.renders}'.encode()
+
+    def _render(self):
+        from core.pdf_cache import renderizar_pdf
+        context = {'liquidacion': self.liquidacion, 'empleado': self.empleado, 'empresa': self.empresa}
+        return renderizar_pdf('liquidacion.html', context, 'test', documento=self.liquidacion, convertir=self._convertir)
+
+    def _archivos_cacheados(self):
+        from django.core.files.storage import default_storage
+        ruta = f'pdf_cache/{self.empresa.id}/{self.empleado.id}'
+        return default_storage.listdir(ruta)[1] if default_storage.exists(ruta) else []
+
+    def test_documento_identico_se_renderiza_una_vez(self):
+        primero = self._render()
+        segundo = self._render()
+        self.assertEqual(primero, segundo)
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(len(self._archivos_cacheados()), 1)
+
+    def test_cambio_en_modelo_relacionado_cambia_la_clave(self):
+        self._render()
+        # Cambio directo en la BD (sin señales): la clave por contenido igual lo detecta
+        Empresa.objects.filter(id=self.empresa.id).update(nombre_legal='Otra Razón Social SpA')
+        self.empresa.refresh_from_db()
+        self.empleado.empresa = self.empresa
+        self._render()
+        self.assertEqual(self.renders, 2)
+
+    def test_editar_deja_un_solo_pdf_por_template(self):
+        from core.pdf_cache import pdf_desde_html
+        pdf_desde_html('<p>otro documento</p>', 'test', documento=self.liquidacion, convertir=self._convertir)
+        for sueldo in (1_000_000, 1_100_000, 1_200_000):
+            Liquidacion.objects.filter(id=self.liquidacion.id).update(sueldo_liquido=sueldo)
+            self.liquidacion.refresh_from_db()
+            self._render()
+        self.assertEqual(self.renders, 4)
+        # La versión vigente de liquidacion.html, y el otro template intacto
+        archivos = sorted(self._archivos_cacheados())
+        self.assertEqual(len(archivos), 2)
+        self.assertTrue(archivos[0].startswith(f'liquidacion_{self.liquidacion.id}_html_'))
+        self.assertTrue(archivos[1].startswith(f'liquidacion_{self.liquidacion.id}_liquidacion_'))
+        self.assertEqual(self._render(), b'%PDF-4')
+
+    def test_guardar_no_invalida_y_borrar_si(self):
+        self._render()
+        # Las vistas guardan el FileField justo después de cachear: eso no debe vaciar la caché
+        self.liquidacion.archivo_pdf.save('liq.pdf', ContentFile(b'%PDF-1'), save=True)
+        self.empresa.save()
+        self.assertEqual(len(self._archivos_cacheados()), 1)
+        self._render()
+        self.assertEqual(self.renders, 1)
+
+        self.liquidacion.archivo_pdf.delete(save=False)
+        self.liquidacion.delete()
+        self.assertEqual(self._archivos_cacheados(), [])
+
+    def test_endpoint_generar_pdf_reutiliza_render(self):
+        from xhtml2pdf import pisa
+        with patch('core.pdf_cache.pisa.pisaDocument', wraps=pisa.pisaDocument) as pisa_doc:
+            r1 = self.client.get(f'/api/liquidaciones/{self.liquidacion.id}/generar_pdf/')
+            r2 = self.client.get(f'/api/liquidaciones/{self.liquidacion.id}/generar_pdf/')
+        self.assertEqual(r1.status_code, 200)
+        self.assertEqual(r1.content, r2.content)
+        self.assertEqual(pisa_doc.call_count, 1)
+
+
+class ZipStreamingTests(APITestCase):
+    """Verifica que los ZIP se envíen por partes (StreamingHttpResponse), que
+    el resultado sea un ZIP válido y que los PDF vayan sin recomprimir."""
+
+    def setUp(self):
+        self.user, _, _, self.empresa = crear_usuario_completo('zipstream_owner', '19.191.919-1', '91.919.191-9')
+        self.empleados = [
+            crear_empleado(self.empresa, rut, nombres=f'Zip{i}')
+            for i, rut in enumerate(['20.202.020-2', '21.212.121-2'])
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def _leer_zip(self, resp):
+        import zipfile
+        self.assertTrue(resp.streaming)
+        partes = list(resp.streaming_content)
+        return partes, zipfile.ZipFile(io.BytesIO(b''.join(partes)))
+
+    def test_descarga_masiva_entrega_zip_por_partes(self):
+        import zipfile
+        with patch('core.views.EmpleadoViewSet._obtener_o_generar_documento',
+                   side_effect=lambda emp, tipo, user=None, **kwargs: f'%PDF-{emp.rut}'.encode()):
+            resp = self.client.post('/api/empleados/descarga_masiva/', {
+                'empleados': [e.id for e in self.empleados],
+                'empresa_id': self.empresa.id,
+                'documentos': ['contrato', 'anexo_40h'],
+            }, format='json')
+            self.assertEqual(resp.status_code, 200)
+            partes, archivo = self._leer_zip(resp)
+
+        # Una parte por documento más el directorio central al cerrar
+        self.assertEqual(len([p for p in partes if p]), 5)
+        self.assertIsNone(archivo.testzip())
+        self.assertEqual(len(archivo.namelist()), 4)
+        for info in archivo.infolist():
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+        nombre = next(n for n in archivo.namelist() if n.endswith('Contrato.pdf') and 'Zip0' in n)
+        self.assertEqual(archivo.read(nombre), f'%PDF-{self.empleados[0].rut}'.encode())
+
+    def _expediente(self, cantidad):
+        from core.models import AnexoContrato, DocumentoLegal
+        empleados = []
+        for i in range(cantidad):
+            emp = crear_empleado(self.empresa, f'{30_000_000 + len(Empleado.objects.all())}-{i}', nombres=f'Q{i}')
+            contrato = Contrato.objects.create(empleado=emp, tipo_contrato='INDEFINIDO',
+                                               fecha_inicio='2024-01-01', sueldo_base=700_000)
+            for mes in (1, 2, 3):
+                Liquidacion.objects.create(empleado=emp, mes=mes, anio=2026, sueldo_liquido=600_000)
+            for tipo in ('AMONESTACION', 'CONSTANCIA'):
+                DocumentoLegal.objects.create(empleado=emp, tipo=tipo, fecha_emision='2026-02-01')
+            AnexoContrato.objects.create(contrato=contrato, titulo='Cambio de jornada', fecha_emision='2026-02-01')
+            empleados.append(emp)
+        return empleados
+
+    def _consultas_descarga(self, empleados):
+        """
+        (SELECT, escrituras) de una descarga masiva por el camino real de
+        render (solo se reemplaza la conversión HTML → PDF de xhtml2pdf).
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            resp = self.client.post('/api/empleados/descarga_masiva/', {
+                'empleados': [e.id for e in empleados],
+                'empresa_id': self.empresa.id,
+                'documentos': ['contrato', 'anexo_40h', 'liquidaciones', 'amonestaciones',
+                               'constancias', 'anexos_contrato'],
+                'cantidad_liquidaciones': 2,
+            }, format='json')
+            _, archivo = self._leer_zip(resp)
+        # contrato + anexo 40h + 2 liquidaciones + 2 legales + 1 anexo por trabajador
+        self.assertEqual(len(archivo.namelist()), 7 * len(empleados))
+        sql = [q['sql'].split(' ', 1)[0] for q in consultas.captured_queries]
+        return sql.count('SELECT'), len(sql) - sql.count('SELECT')
+
+    def test_descarga_masiva_consultas_no_crecen_con_trabajadores(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media, PDF_RENDER_WORKERS=1), \
+                patch('core.pdf_cache.html_a_pdf', return_value=b'%PDF-fake'):
+            pocos, muchos = self._expediente(2), self._expediente(6)
+            lecturas_pocos, escrituras_pocos = self._consultas_descarga(pocos)
+            lecturas_muchos, escrituras_muchos = self._consultas_descarga(muchos)
+            # Las lecturas no dependen de la cantidad de trabajadores. Lo que sí
+            # crece es guardar cada PDF nuevo en su FileField (contrato, anexo
+            # 40h y 2 liquidaciones por trabajador): un UPDATE de una columna
+            # cada uno, sin señales ni recálculos.
+            self.assertEqual(lecturas_pocos, lecturas_muchos)
+            self.assertEqual((escrituras_pocos, escrituras_muchos), (4 * 2, 4 * 6))
+            # La segunda vez todo sale de los archivos guardados: cero escrituras
+            self.assertEqual(self._consultas_descarga(muchos), (lecturas_muchos, 0))
+
+    def test_descargar_anexos_zip_en_streaming(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media, PDF_RENDER_WORKERS=1), \
+                patch('core.pdf_cache.html_a_pdf', return_value=b'%PDF-anexo'):
+            resp = self.client.post('/api/empleados/descargar_anexos_zip/',
+                                    {'empleados': [e.id for e in self.empleados]}, format='json')
+            _, archivo = self._leer_zip(resp)
+        self.assertEqual(sorted(archivo.namelist()), sorted(f'Anexo_40h_{e.rut}.pdf' for e in self.empleados))
+
+
+class PdfPoolTests(APITestCase):
+    """Verifica el render en paralelo de pdf_pool: el orden de salida es el
+    de entrada, el resultado es igual al render en serie y un documento que
+    falla se omite sin botar el resto."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from core import pdf_pool
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=media)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.addCleanup(pdf_pool.cerrar_pool)
+
+        self.user, _, _, self.empresa = crear_usuario_completo('pdfpool_owner', '24.242.424-2', '42.424.242-4')
+        self.contratos = []
+        for i, rut in enumerate(['25.252.525-2', '26.262.626-2', '27.272.727-2']):
+            emp = crear_empleado(self.empresa, rut, nombres=f'Pool{i}')
+            self.contratos.append(Contrato.objects.create(
+                empleado=emp, tipo_contrato='INDEFINIDO', fecha_inicio='2024-01-01', sueldo_base=800_000 + i,
+            ))
+
+    def _trabajos(self):
+        from core.pdf_pool import TrabajoPdf
+        return [
+            (f'{c.empleado.rut}.pdf', TrabajoPdf('anexo_40h.html', {'contrato': c, 'empleado': c.empleado, 'empresa': self.empresa},
+                                                 f'Anexo_{c.empleado.rut}', documento=c))
+            for c in self.contratos
+        ]
+
+    def test_pool_respeta_el_orden_y_coincide_con_render_en_serie(self):
+        from core import pdf_cache
+        from core.pdf_pool import renderizar_en_orden
+        entradas = self._trabajos()
+        entradas.insert(1, ('ya_generado.pdf', b'%PDF-existente'))
+        with override_settings(PDF_RENDER_WORKERS=2):
+            resultado = list(renderizar_en_orden(entradas, tamano_bloque=2))
+
+        self.assertEqual([n for n, _ in resultado], [n for n, _ in entradas])
+        self.assertEqual(resultado[1][1], b'%PDF-existente')
+        for (nombre, pdf), contrato in zip([r for r in resultado if r[0] != 'ya_generado.pdf'], self.contratos):
+            self.assertTrue(pdf.startswith(b'%PDF'))
+            html = pdf_cache.get_template('anexo_40h.html').render(
+                {'contrato': contrato, 'empleado': contrato.empleado, 'empresa': self.empresa}
+            )
+            self.assertEqual(len(pdf), len(pdf_cache.html_a_pdf(html, nombre)))
+
+    def test_documento_que_falla_se_omite(self):
+        from core.pdf_pool import renderizar_en_orden
+        entradas = self._trabajos()
+        entradas[0][1].template_name = 'no_existe.html'
+        with override_settings(PDF_RENDER_WORKERS=1):
+            nombres = [n for n, _ in renderizar_en_orden(entradas)]
+        self.assertEqual(nombres, [n for n, _ in entradas[1:]])
+
+    def test_al_terminar_recibe_los_bytes(self):
+        from core.pdf_pool import renderizar_lote
+        guardados = []
+        trabajos = [t for _, t in self._trabajos()]
+        for t in trabajos:
+            t.al_terminar = guardados.append
+        with override_settings(PDF_RENDER_WORKERS=1):
+            resultados = renderizar_lote(trabajos)
+        self.assertEqual(guardados, resultados)
+
+
+class ExportJobTests(APITestCase):
+    """Verifica las exportaciones en segundo plano: el endpoint solo encola,
+    el worker arma el ZIP reportando avance y el estado expone la descarga."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=media, PDF_RENDER_WORKERS_TRABAJOS=1)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+        self.user, _, _, self.empresa = crear_usuario_completo('export_owner', '22.222.333-3', '33.333.222-2')
+        # Más de 50 trabajadores: el límite del ZIP síncrono no aplica acá
+        self.empleados = [crear_empleado(self.empresa, f'{10_000_000 + i}-{i % 10}') for i in range(55)]
+        for emp in self.empleados[:3]:
+            Contrato.objects.create(empleado=emp, tipo_contrato='INDEFINIDO',
+                                    fecha_inicio='2024-01-01', sueldo_base=700_000)
+        self.client.force_authenticate(user=self.user)
+
+    def _encolar(self, **extra):
+        body = {'empresa_id': self.empresa.id, 'documentos': ['contrato']}
+        body.update(extra)
+        return self.client.post('/api/exportaciones/', body, format='json')
+
+    def test_encolar_no_genera_documentos(self):
+        with patch('core.views.EmpleadoViewSet._obtener_o_generar_documento') as generar:
+            resp = self._encolar()
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.data['estado'], 'PENDIENTE')
+        self.assertEqual(resp.data['total'], 3)
+        self.assertEqual(len(resp.data['parametros']['empleados']), 55)
+        generar.assert_not_called()
+
+    def test_worker_completa_y_expone_descarga(self):
+        import zipfile
+        from django.core.management import call_command
+        from core.models import ExportJob
+        job_id = self._encolar().data['id']
+
+        def generar(emp, tipo, user=None, **kwargs):
+            if not Contrato.objects.filter(empleado=emp).exists():
+                raise Exception('sin contrato')
+            return b'%PDF-fake'
+
+        with patch('core.views.EmpleadoViewSet._obtener_o_generar_documento', side_effect=generar):
+            call_command('procesar_trabajos', '--una-vez', stdout=io.StringIO())
+
+        resp = self.client.get(f'/api/exportaciones/{job_id}/')
+        self.assertEqual(resp.data['estado'], 'COMPLETADO')
+        self.assertEqual(resp.data['progreso'], 100)
+        self.assertEqual(resp.data['procesados'], 3)
+        self.assertTrue(resp.data['url_descarga'])
+
+        job = ExportJob.objects.get(id=job_id)
+        with job.archivo.open('rb') as f:
+            self.assertEqual(len(zipfile.ZipFile(f).namelist()), 3)
+
+    def test_error_reintenta_y_luego_marca_error(self):
+        from core.models import ExportJob
+        from core.trabajos import MAX_INTENTOS, ejecutar_pendientes
+        job_id = self._encolar().data['id']
+        with patch('core.views._zip_en_streaming', side_effect=RuntimeError('storage caído')):
+            for _ in range(MAX_INTENTOS):
+                ejecutar_pendientes()
+        job = ExportJob.objects.get(id=job_id)
+        self.assertEqual(job.estado, 'ERROR')
+        self.assertEqual(job.intentos, MAX_INTENTOS)
+        self.assertIn('storage caído', job.error)
+
+    def test_trabajo_colgado_vuelve_a_la_cola(self):
+        import datetime
+        from core.models import ExportJob
+        from core.trabajos import recuperar_colgados
+        job_id = self._encolar().data['id']
+        ExportJob.objects.filter(id=job_id).update(
+            estado='PROCESANDO', intentos=1,
+            actualizado_en=timezone.now() - datetime.timedelta(hours=1),
+        )
+        recuperar_colgados(ExportJob)
+        self.assertEqual(ExportJob.objects.get(id=job_id).estado, 'PENDIENTE')
+
+    def test_zip_vencido_se_borra_del_storage(self):
+        import datetime
+        from core.models import ExportJob
+        from core.trabajos import limpiar_exportaciones
+        viejo, reciente = (ExportJob.objects.get(id=self._encolar().data['id']) for _ in range(2))
+        for job, dias in ((viejo, 30), (reciente, 1)):
+            job.archivo.save(f'export_{dias}.zip', ContentFile(b'PK'), save=False)
+            job.estado, job.terminado_en = 'COMPLETADO', timezone.now() - datetime.timedelta(days=dias)
+            job.save()
+        ruta_vieja = viejo.archivo.name
+        self.addCleanup(reciente.archivo.delete, save=False)
+
+        with override_settings(EXPORTACIONES_RETENCION_DIAS=7):
+            self.assertEqual(limpiar_exportaciones(), 1)
+        viejo.refresh_from_db()
+        self.assertFalse(viejo.archivo)
+        self.assertFalse(reciente.archivo.storage.exists(ruta_vieja))
+        self.assertTrue(ExportJob.objects.get(id=reciente.id).archivo)
+        self.assertIsNone(self.client.get(f'/api/exportaciones/{viejo.id}/').data['url_descarga'])
+
+    def test_un_trabajo_por_cola_en_cada_vuelta(self):
+        from core import trabajos
+        from core.models import ExportJob, ImportJob
+        for _ in range(2):
+            self._encolar()
+        ImportJob.objects.create(owner=self.user, empresa=self.empresa, nombre_archivo='x.csv')
+        orden = []
+        procesadores = [
+            (ExportJob, lambda job: orden.append('export'), None),
+            (ImportJob, lambda job: orden.append('import'), None),
+        ]
+        with patch('core.trabajos._procesadores', return_value=procesadores):
+            self.assertEqual(trabajos.ejecutar_pendientes(), 3)
+        # La importación no espera a que se vacíe la cola de exportaciones
+        self.assertEqual(orden, ['export', 'import', 'export'])
+
+    def test_solo_el_worker_usa_el_pool_de_pdfs(self):
+        from django.core.management import call_command
+        from core import pdf_pool
+        vistos = []
+        with override_settings(PDF_RENDER_WORKERS=1, PDF_RENDER_WORKERS_TRABAJOS=3), \
+                patch('core.management.commands.procesar_trabajos.ejecutar_pendientes',
+                      side_effect=lambda: vistos.append(pdf_pool.cantidad_workers()) or 0):
+            self.assertEqual(pdf_pool.cantidad_workers(), 1)
+            call_command('procesar_trabajos', '--una-vez', stdout=io.StringIO())
+            self.assertEqual(pdf_pool.cantidad_workers(), 1)
+        self.assertEqual(vistos, [3])
+
+    def test_solo_el_dueno_ve_el_trabajo(self):
+        job_id = self._encolar().data['id']
+        otro, _, _, _ = crear_usuario_completo('export_otro', '23.232.323-2', '32.323.232-3')
+        self.client.force_authenticate(user=otro)
+        self.assertEqual(self.client.get(f'/api/exportaciones/{job_id}/').status_code, 404)
+
+
+class ImportJobTests(APITestCase):
+    """Verifica las importaciones en segundo plano: carga_masiva?asincrono=1
+    solo encola, el worker importa por bloques (cada uno confirmado por
+    separado) y un reintento retoma desde el último bloque."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=media)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+        self.user, _, _, self.empresa = crear_usuario_completo('import_owner', '55500000-5', '66600001-5')
+        self.client.force_authenticate(user=self.user)
+        self.ruts = [rut_con_dv(17_000_000 + i) for i in range(7)] + ['12.345.678-0']
+
+    def _encolar(self):
+        return self.client.post('/api/empleados/carga_masiva/?asincrono=1',
+                                {'empresa': self.empresa.id, 'file': crear_excel_trabajadores(self.ruts)},
+                                format='multipart')
+
+    def test_encolar_no_importa(self):
+        resp = self._encolar()
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.data['estado'], 'PENDIENTE')
+        self.assertEqual(resp.data['nombre_archivo'], 'trabajadores.xlsx')
+        self.assertEqual(Empleado.objects.filter(empresa=self.empresa).count(), 0)
+
+    def test_worker_importa_por_bloques(self):
+        from django.core.management import call_command
+        from core import importacion
+        from core.models import ImportJob
+        job_id = self._encolar().data['id']
+        with patch('core.importacion.FILAS_POR_BLOQUE', 3), \
+                patch('core.importacion.importar_empleados', wraps=importacion.importar_empleados) as importar:
+            call_command('procesar_trabajos', '--una-vez', stdout=io.StringIO())
+        self.assertEqual(importar.call_count, 3)
+
+        resp = self.client.get(f'/api/importaciones/{job_id}/')
+        self.assertEqual(resp.data['estado'], 'COMPLETADO')
+        self.assertEqual(resp.data['progreso'], 100)
+        self.assertEqual((resp.data['total'], resp.data['procesados'], resp.data['agregados']), (8, 8, 7))
+        self.assertEqual(resp.data['errores'], ['Fila 9: RUT inválido.'])
+        self.assertEqual(Empleado.objects.filter(empresa=self.empresa).count(), 7)
+        self.assertFalse(ImportJob.objects.get(id=job_id).archivo)
+
+    def test_reintento_retoma_desde_el_ultimo_bloque(self):
+        from core import importacion
+        from core.models import ImportJob
+        from core.trabajos import ejecutar_pendientes
+        job_id = self._encolar().data['id']
+        original = importacion.importar_empleados
+        llamadas = []
+
+        def falla_en_el_segundo_bloque(*args, **kwargs):
+            llamadas.append(1)
+            if len(llamadas) == 2:
+                raise RuntimeError('worker caído')
+            return original(*args, **kwargs)
+
+        with patch('core.importacion.FILAS_POR_BLOQUE', 3), \
+                patch('core.importacion.importar_empleados', side_effect=falla_en_el_segundo_bloque):
+            ejecutar_pendientes(limite=1)
+            job = ImportJob.objects.get(id=job_id)
+            self.assertEqual((job.estado, job.procesados, job.agregados), ('PENDIENTE', 3, 3))
+            ejecutar_pendientes(limite=1)
+
+        job = ImportJob.objects.get(id=job_id)
+        self.assertEqual((job.estado, job.procesados, job.agregados), ('COMPLETADO', 8, 7))
+        self.assertEqual(Empleado.objects.filter(empresa=self.empresa).count(), 7)
+        self.assertEqual(job.total_errores, 1)
+
+    def test_archivo_invalido_se_borra(self):
+        from core.models import ImportJob
+        from core.trabajos import ejecutar_pendientes
+        job_id = self._encolar().data['id']
+        ruta = ImportJob.objects.get(id=job_id).archivo.name
+        with patch('core.importacion.MAX_FILAS_ASINCRONO', 3):
+            ejecutar_pendientes(limite=1)
+        job = ImportJob.objects.get(id=job_id)
+        self.assertEqual(job.estado, 'ERROR')
+        self.assertFalse(job.archivo)
+        self.assertFalse(job.archivo.storage.exists(ruta))
+
+    def test_agotar_los_intentos_borra_el_archivo(self):
+        from core.models import ImportJob
+        from core.trabajos import MAX_INTENTOS, ejecutar_pendientes
+        job_id = self._encolar().data['id']
+        ruta = ImportJob.objects.get(id=job_id).archivo.name
+        with patch('core.importacion.importar_empleados', side_effect=RuntimeError('worker caído')):
+            for _ in range(MAX_INTENTOS):
+                ejecutar_pendientes(limite=1)
+        job = ImportJob.objects.get(id=job_id)
+        self.assertEqual(job.estado, 'ERROR')
+        self.assertFalse(job.archivo)
+        self.assertFalse(job.archivo.storage.exists(ruta))
+
+    def test_colgado_sin_intentos_borra_el_archivo(self):
+        import datetime
+        from core.importacion import descartar_archivo
+        from core.models import ImportJob
+        from core.trabajos import MAX_INTENTOS, recuperar_colgados
+        job_id = self._encolar().data['id']
+        ruta = ImportJob.objects.get(id=job_id).archivo.name
+        ImportJob.objects.filter(id=job_id).update(
+            estado='PROCESANDO', intentos=MAX_INTENTOS,
+            actualizado_en=timezone.now() - datetime.timedelta(hours=1),
+        )
+        self.assertEqual(recuperar_colgados(ImportJob, descartar_archivo), 1)
+        job = ImportJob.objects.get(id=job_id)
+        self.assertEqual(job.estado, 'ERROR')
+        self.assertFalse(job.archivo)
+        self.assertFalse(job.archivo.storage.exists(ruta))
+
+    def test_solo_el_dueno_ve_la_importacion(self):
+        job_id = self._encolar().data['id']
+        otro, _, _, _ = crear_usuario_completo('import_otro', '55500000-6', '66600001-6')
+        self.client.force_authenticate(user=otro)
+        self.assertEqual(self.client.get(f'/api/importaciones/{job_id}/').status_code, 404)
+
+
+class PreviredExportTests(APITestCase):
+    """El archivo Previred se envía por partes y con una cantidad fija de
+    consultas, sin importar cuántas liquidaciones tenga el período."""
+
+    def setUp(self):
+        self.user, _, _, self.empresa = crear_usuario_completo('previred_owner', '55500000-7', '76.543.210-3')
+        self.client.force_authenticate(user=self.user)
+
+    def _crear(self, cantidad, tipo_contrato='INDEFINIDO', empresa=None):
+        for _ in range(cantidad):
+            emp = crear_empleado(empresa or self.empresa, rut_con_dv(18_000_000 + Empleado.objects.count()))
+            Contrato.objects.create(empleado=emp, tipo_contrato=tipo_contrato,
+                                    fecha_inicio='2024-01-01', sueldo_base=800_000)
+            Liquidacion.objects.create(empleado=emp, mes=4, anio=2026, total_imponible=1_000_000,
+                                       afp_nombre='HABITAT', afp_monto=114_400, salud_nombre='FONASA')
+
+    def _exportar(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            resp = self.client.get('/api/liquidaciones/exportar_previred/', {'mes': 4, 'anio': 2026})
+            contenido = b''.join(resp.streaming_content).decode('utf-8')
+        return resp, contenido, len(consultas)
+
+    def test_lineas_y_campos(self):
+        self._crear(2)
+        resp, contenido, _ = self._exportar()
+        self.assertTrue(resp.streaming)
+        self.assertIn('Previred_Abril_2026.txt', resp['Content-Disposition'])
+        lineas = contenido.split('\n')
+        self.assertEqual(len(lineas), 2)
+        campos = lineas[0].split(';')
+        self.assertEqual(len(campos), 105)
+        self.assertEqual(campos[13], '1')        # contrato indefinido
+        self.assertEqual(campos[24], '05')       # Habitat
+        self.assertEqual(campos[70], '1')        # AFC indefinido
+        self.assertEqual(campos[73], '24000')    # 2,4% empleador
+        self.assertEqual((campos[15], campos[16]), ('76543210', '3'))
+
+    def test_consultas_no_crecen_con_liquidaciones(self):
+        self._crear(2)
+        _, _, pocas = self._exportar()
+        self._crear(8)
+        _, contenido, muchas = self._exportar()
+        self.assertEqual(len(contenido.split('\n')), 10)
+        self.assertEqual(pocas, muchas)
+
+    def _exportar_masivo(self, **params):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            resp = self.client.get('/api/liquidaciones/exportar_previred_masivo/', {'mes': 4, 'anio': 2026, **params})
+            archivos = {}
+            if resp.status_code == 200:
+                with zipfile.ZipFile(io.BytesIO(b''.join(resp.streaming_content))) as zf:
+                    archivos = {n: zf.read(n).decode('utf-8') for n in zf.namelist()}
+        return resp, archivos, len(consultas)
+
+    def test_masivo_un_archivo_por_empresa(self):
+        otra = Empresa.objects.create(owner=self.user, nombre_legal='Otra Ltda.', rut='77.777.777-7')
+        ajena, _, _, empresa_ajena = crear_usuario_completo('previred_ajeno', '55600000-3', '76.111.111-6')
+        self._crear(2)
+        self._crear(3, tipo_contrato='PLAZO_FIJO', empresa=otra)
+        self._crear(1, empresa=empresa_ajena)
+
+        resp, archivos, _ = self._exportar_masivo()
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Previred_Abril_2026.zip', resp['Content-Disposition'])
+        self.assertEqual(sorted(archivos), [
+            'Previred_76543210-3_Empresa_Test_SA_Abril_2026.txt',
+            'Previred_77777777-7_Otra_Ltda_Abril_2026.txt',
+        ])
+        lineas_otra = archivos['Previred_77777777-7_Otra_Ltda_Abril_2026.txt'].split('\n')
+        self.assertEqual(len(lineas_otra), 3)
+        self.assertEqual(lineas_otra[0].split(';')[13], '2')   # plazo fijo
+
+        # Mismo contenido que el export de una empresa
+        individual = self.client.get('/api/liquidaciones/exportar_previred/',
+                                     {'mes': 4, 'anio': 2026, 'empresa': self.empresa.id})
+        self.assertEqual(archivos['Previred_76543210-3_Empresa_Test_SA_Abril_2026.txt'],
+                         b''.join(individual.streaming_content).decode('utf-8'))
+
+        _, solo_otra, _ = self._exportar_masivo(empresas=f'{otra.id},{empresa_ajena.id}')
+        self.assertEqual(list(solo_otra), ['Previred_77777777-7_Otra_Ltda_Abril_2026.txt'])
+
+    def test_masivo_consultas_no_crecen_con_empresas(self):
+        self._crear(2)
+        _, _, pocas = self._exportar_masivo()
+        for i in range(3):
+            otra = Empresa.objects.create(owner=self.user, nombre_legal=f'Filial {i}', rut=rut_con_dv(78_000_000 + i))
+            self._crear(2, empresa=otra)
+        _, archivos, muchas = self._exportar_masivo()
+        self.assertEqual(len(archivos), 4)
+        self.assertEqual(pocas, muchas)
+
+    def test_masivo_parametros(self):
+        self.assertEqual(self._exportar_masivo(empresas='x')[0].status_code, 400)
+        self.assertEqual(self._exportar_masivo(mes=13)[0].status_code, 400)
+        self.assertEqual(self._exportar_masivo()[0].status_code, 404)
+
+
+class LibroRemuneracionesExcelTests(APITestCase):
+    """El Excel del Libro de Remuneraciones se arma en modo write-only con
+    estilos con nombre y se envía por partes desde un archivo temporal."""
+
+    def setUp(self):
+        self.user, _, _, self.empresa = crear_usuario_completo('libro_owner', '55700000-K', '76.222.222-1')
+        self.client.force_authenticate(user=self.user)
+        for i in range(3):
+            emp = crear_empleado(self.empresa, rut_con_dv(19_000_000 + i), nombres=f'Libro{i}')
+            Liquidacion.objects.create(
+                empleado=emp, mes=4, anio=2026, sueldo_base=600_000 + i, total_imponible=700_000,
+                total_haberes=750_000, total_descuentos=150_000, sueldo_liquido=600_000,
+                afp_nombre='MODELO', afp_monto=70_000, salud_nombre='FONASA', salud_monto=49_000,
+                detalle_haberes_imponibles=[{'nombre': 'Bono', 'valor': 10_000}],
+            )
+
+    def test_excel_en_streaming_con_estilos(self):
+        resp = self.client.get('/api/liquidaciones/libro_remuneraciones/', {'mes': 4, 'anio': 2026})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        self.assertIn('LibroRemuneraciones_Abril_2026_76.222.222-1.xlsx', resp['Content-Disposition'])
+
+        wb = openpyxl.load_workbook(io.BytesIO(b''.join(resp.streaming_content)))
+        ws = wb.active
+        self.assertEqual(ws.title, 'Libro Abril 2026')
+        self.assertEqual(ws['A1'].value, 'EMPRESA TEST SA')
+        self.assertEqual(ws['A2'].value, 'LIBRO DE REMUNERACIONES')
+        self.assertEqual(ws.freeze_panes, 'A6')
+        self.assertIn('A1:U1', {str(r) for r in ws.merged_cells.ranges})
+        self.assertEqual(ws['F5'].value, 'Sueldo\nBase')
+        self.assertEqual(ws['A5'].style, 'libro_header')
+
+        # 3 trabajadores (filas 6-8) y la fila de totales
+        self.assertEqual([ws.cell(row=r, column=6).value for r in (6, 7, 8)], [600_000, 600_001, 600_002])
+        self.assertEqual(ws['H6'].value, 10_000)
+        self.assertEqual(ws['F6'].number_format, '#,##0')
+        self.assertEqual(ws['F6'].style, 'libro_clp_right_par')
+        self.assertEqual(ws['F7'].style, 'libro_clp_right')
+        self.assertEqual(ws['C9'].value, 'TOTALES')
+        self.assertEqual(ws['F9'].value, 1_800_003)
+        self.assertEqual(ws['U9'].value, 1_800_000)
+        self.assertEqual(ws['U9'].style, 'libro_total_liquido')
+        self.assertEqual(ws.max_row, 9)
+
+
+class ConsolidadoTests(APITestCase):
+    """El consolidado anual sale de los resúmenes mensuales: mismos montos que
+    sumar liquidación por liquidación y una cantidad fija de consultas."""
+
+    def setUp(self):
+        self.user, _, _, self.empresa = crear_usuario_completo('consolidado_owner', '17.171.717-1', '71.717.171-7')
+        self.otra = Empresa.objects.create(owner=self.user, nombre_legal='Filial Norte', rut='72.727.272-7')
+        self.client.force_authenticate(user=self.user)
+
+    def _crear(self, empresa, cantidad, meses, tipo_contrato='INDEFINIDO', imponible=1_000_003):
+        # Los resúmenes se recalculan al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(cantidad):
+                emp = crear_empleado(empresa, rut_con_dv(20_000_000 + Empleado.objects.count()))
+                if tipo_contrato:
+                    Contrato.objects.create(empleado=emp, tipo_contrato=tipo_contrato,
+                                            fecha_inicio='2024-01-01', sueldo_base=800_000)
+                for mes in meses:
+                    Liquidacion.objects.create(empleado=emp, mes=mes, anio=2026, total_imponible=imponible + mes,
+                                               total_haberes=1_100_000 + mes, sueldo_liquido=900_000 + mes)
+
+    @staticmethod
+    def _costo_esperado(liq):
+        from core import previred
+        try:
+            tipo = liq.empleado.contrato_activo.tipo_contrato
+            tasa_afc = previred.TASA_AFC_EMP_INDEFINIDO if tipo == 'INDEFINIDO' else previred.TASA_AFC_EMP_PLAZO
+        except Exception:
+            tasa_afc = previred.TASA_AFC_EMP_INDEFINIDO
+        return int(liq.total_imponible * (previred.TASA_SIS + previred.TASA_MUTUAL_AT + tasa_afc))
+
+    def _consultar(self, **params):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            resp = self.client.get('/api/liquidaciones/consolidado/', {'anio': 2026, **params})
+        return resp, len(consultas)
+
+    def test_montos_iguales_a_suma_por_liquidacion(self):
+        self._crear(self.empresa, 2, [1, 2, 3])
+        self._crear(self.empresa, 1, [2], tipo_contrato='PLAZO_FIJO')
+        self._crear(self.otra, 2, [2, 3], tipo_contrato='OBRA_FAENA')
+        self._crear(self.otra, 1, [3], tipo_contrato=None)
+
+        resp, _ = self._consultar()
+        self.assertEqual(resp.status_code, 200)
+        liqs = list(Liquidacion.objects.select_related('empleado__empresa', 'empleado__contrato_activo'))
+        self.assertEqual(resp.data['kpis'], {
+            'masa_salarial': sum(l.total_haberes for l in liqs),
+            'trabajadores': 6,
+            'costo_empleador': sum(self._costo_esperado(l) for l in liqs),
+            'liquido_total': sum(l.sueldo_liquido for l in liqs),
+        })
+        por_empresa = {e['id']: e for e in resp.data['empresas']}
+        self.assertEqual(por_empresa[self.empresa.id]['trabajadores'], 7)   # liquidaciones del año
+        self.assertEqual(por_empresa[self.otra.id]['costo_empleador'],
+                         sum(self._costo_esperado(l) for l in liqs if l.empleado.empresa_id == self.otra.id))
+        febrero = resp.data['evolucion'][1]
+        self.assertEqual(febrero['trabajadores'], 5)
+        self.assertEqual(febrero['costo_empleador'], sum(self._costo_esperado(l) for l in liqs if l.mes == 2))
+        self.assertEqual(resp.data['evolucion'][5]['masa_salarial'], 0)
+
+        resp_mes, _ = self._consultar(mes=3)
+        self.assertEqual(resp_mes.data['kpis']['trabajadores'], 5)
+        self.assertEqual(resp_mes.data['kpis']['masa_salarial'], sum(l.total_haberes for l in liqs if l.mes == 3))
+        self.assertEqual(len(resp_mes.data['empresas']), 2)
+        for formato in ('excel', 'pdf'):
+            self.assertEqual(self._consultar(formato=formato)[0].status_code, 200)
+
+    def test_consultas_constantes(self):
+        self._crear(self.empresa, 1, [1])
+        _, pocas = self._consultar()
+        self._crear(self.empresa, 5, range(1, 13))
+        self._crear(self.otra, 5, range(1, 13), tipo_contrato='PLAZO_FIJO')
+        resp, muchas = self._consultar()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(pocas, muchas)
+        self.assertEqual(self._consultar(mes=5)[1], muchas - 1)
+
+    def test_periodo_sin_liquidaciones(self):
+        self._crear(self.empresa, 1, [1])
+        self.assertEqual(self._consultar(mes=7)[0].status_code, 404)
+        self.assertEqual(self._consultar(anio=2020)[0].status_code, 404)
+
+
+class ResumenMensualTests(APITestCase):
+    """ResumenMensual queda igual a agregar las liquidaciones desde cero tras
+    crear, editar, mover de período, borrar, procesar un período completo,
+    cambiar el contrato o mover al trabajador de empresa; un guardado sin
+    cambios no recalcula y reconstruir_resumenes lo rehace."""
+
+    def setUp(self):
+        cargar_indicadores_prueba(self)
+        self.user, _, _, self.empresa = crear_usuario_completo('resumen_owner', '18.181.818-1', '81.818.181-8')
+        self.client.force_authenticate(user=self.user)
+        self.empleados = []
+        for i in range(3):
+            emp = crear_empleado(self.empresa, rut_con_dv(21_000_000 + i), nombres=f'Resumen{i}')
+            Contrato.objects.create(empleado=emp, tipo_contrato='INDEFINIDO', fecha_inicio='2024-01-01',
+                                    sueldo_base=900_000 + i * 10_000, gratificacion_legal='MENSUAL')
+            self.empleados.append(emp)
+
+    def _estado(self):
+        from core.models import ResumenMensual
+        return sorted(
+            ResumenMensual.objects.values_list('empresa_id', 'anio', 'mes', 'trabajadores', 'masa_salarial',
+                                               'liquido_total', 'costo_empleador', 'afp', 'total_descuentos')
+        )
+
+    def _verificar_contra_reconstruccion(self):
+        from core.resumenes import reconstruir
+        incremental = self._estado()
+        reconstruir()
+        self.assertEqual(incremental, self._estado())
+        return incremental
+
+    def test_mantencion_incremental(self):
+        # Las señales recalculan al confirmar la transacción
+        confirmar = lambda: self.captureOnCommitCallbacks(execute=True)
+        with confirmar():
+            for emp in self.empleados:
+                resp = self.client.post('/api/liquidaciones/', {'empleado': emp.id, 'mes': 6, 'anio': 2026},
+                                        format='json')
+                self.assertEqual(resp.status_code, 201)
+        estado = self._verificar_contra_reconstruccion()
+        self.assertEqual(len(estado), 1)
+        self.assertEqual(estado[0][3], 3)
+        self.assertEqual(estado[0][4], sum(Liquidacion.objects.values_list('total_haberes', flat=True)))
+
+        liq = Liquidacion.objects.get(empleado=self.empleados[0])
+        with confirmar():
+            self.client.patch(f'/api/liquidaciones/{liq.id}/', {'dias_ausencia': 5}, format='json')
+        self._verificar_contra_reconstruccion()
+
+        liq.refresh_from_db()
+        liq.mes = 7
+        with confirmar():
+            liq.save()
+        estado = self._verificar_contra_reconstruccion()
+        self.assertEqual([(f[2], f[3]) for f in estado], [(6, 2), (7, 1)])
+
+        with confirmar():
+            liq.delete()
+        estado = self._verificar_contra_reconstruccion()
+        self.assertEqual([(f[2], f[3]) for f in estado], [(6, 2)])
+
+        contrato = self.empleados[1].contrato_activo
+        contrato.tipo_contrato = 'PLAZO_FIJO'
+        with confirmar():
+            contrato.save()
+        self._verificar_contra_reconstruccion()
+
+        with confirmar():
+            self.empleados[2].delete()
+        estado = self._verificar_contra_reconstruccion()
+        self.assertEqual([(f[2], f[3]) for f in estado], [(6, 1)])
+
+    def _liquidar(self, empleados, *meses):
+        with self.captureOnCommitCallbacks(execute=True):
+            for emp in empleados:
+                for mes in meses:
+                    Liquidacion.objects.create(empleado=emp, mes=mes, anio=2026, total_haberes=1_000_000,
+                                               total_imponible=1_000_000)
+
+    def test_guardar_sin_cambios_no_recalcula(self):
+        self._liquidar(self.empleados[:1], 6)
+        liq = Liquidacion.objects.get()
+        contrato = self.empleados[0].contrato_activo
+        with patch('core.resumenes.recalcular') as recalcular, self.captureOnCommitCallbacks(execute=True):
+            liq.dias_ausencia = 2          # no cambia montos ni período
+            liq.save()
+            liq.save(update_fields=['archivo_pdf'])
+            contrato.sueldo_base += 1      # la tasa depende solo del tipo de contrato
+            contrato.save()
+            self.empleados[0].nombres = 'Otro nombre'
+            self.empleados[0].save()
+        recalcular.assert_not_called()
+
+    def test_borrado_en_cascada_recalcula_una_vez_por_mes(self):
+        from core import resumenes
+        self._liquidar(self.empleados, 6, 7)
+        with patch('core.resumenes.recalcular', wraps=resumenes.recalcular) as recalcular, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.empresa.delete()
+        self.assertEqual(recalcular.call_count, 2)
+        self.assertEqual(self._estado(), [])
+
+    def test_mover_trabajador_de_empresa(self):
+        from core.models import Empresa
+        otra = Empresa.objects.create(owner=self.user, nombre_legal='Otra SA', rut='76.086.428-5')
+        self._liquidar(self.empleados, 6)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.empleados[0].empresa = otra
+            self.empleados[0].save()
+        estado = self._verificar_contra_reconstruccion()
+        self.assertEqual([(f[0], f[3]) for f in estado], [(self.empresa.id, 2), (otra.id, 1)])
+
+    def test_procesar_periodo_actualiza_resumen(self):
+        resp = self.client.post('/api/liquidaciones/procesar_periodo/',
+                                {'empresa': self.empresa.id, 'mes': 8, 'anio': 2026}, format='json')
+        self.assertEqual(resp.data['creadas'], 3)
+        estado = self._verificar_contra_reconstruccion()
+        self.assertEqual(estado[0][3], 3)
+
+        self.client.post('/api/liquidaciones/procesar_periodo/', {
+            'empresa': self.empresa.id, 'mes': 8, 'anio': 2026,
+            'overrides': {str(self.empleados[0].id): {'dias_ausencia': 10}},
+        }, format='json')
+        self._verificar_contra_reconstruccion()
+
+    def test_comando_reconstruir(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from core.models import ResumenMensual
+        self._liquidar(self.empleados, 9)
+        ResumenMensual.objects.update(masa_salarial=1)   # descuadre simulado
+        salida = StringIO()
+        call_command('reconstruir_resumenes', usuario='resumen_owner', stdout=salida)
+        self.assertIn('1 resumen(es)', salida.getvalue())
+        self.assertEqual(ResumenMensual.objects.get().masa_salarial, 3_000_000)
+
+
+# ─── Cliente B2 compartido ────────────────────────────────────────────────────
+
+B2_PRUEBA = dict(B2_KEY_ID='k', B2_APPLICATION_KEY='s', B2_BUCKET_NAME='bucket',
+                 B2_ENDPOINT_URL='http://b2.local', B2_MAX_POOL_CONNECTIONS=25, B2_MAX_REINTENTOS=4)
+
+
+@override_settings(**B2_PRUEBA)
+class B2ClienteTests(APITestCase):
+    """El cliente boto3 se crea una vez por proceso y se comparte entre hilos."""
+
+    def setUp(self):
+        from core import b2_client
+        self.b2 = b2_client
+        b2_client.reiniciar_cliente()
+        self.addCleanup(b2_client.reiniciar_cliente)
+
+    def test_operaciones_reusan_el_cliente(self):
+        with patch('core.b2_client.boto3.client') as crear:
+            self.b2.subir_documento(b'%PDF', 'pendientes/1/a.pdf')
+            self.b2.generar_url_presignada('pendientes/1/a.pdf')
+            self.b2.descargar_documento('pendientes/1/a.pdf')
+            self.b2.documento_existe('pendientes/1/a.pdf')
+            self.b2.eliminar_documento('pendientes/1/a.pdf')
+        self.assertEqual(crear.call_count, 1)
+        config = crear.call_args.kwargs['config']
+        self.assertEqual(config.max_pool_connections, 25)
+        self.assertEqual(config.retries, {'max_attempts': 4, 'mode': 'standard'})
+        self.assertTrue(config.tcp_keepalive)
+
+    def test_hilos_comparten_un_cliente(self):
+        import threading
+        vistos = []
+        barrera = threading.Barrier(8)
+
+        def usar():
+            barrera.wait()
+            vistos.append(self.b2._cliente())
+
+        with patch('core.b2_client.boto3.client', side_effect=lambda *a, **k: object()) as crear:
+            hilos = [threading.Thread(target=usar) for _ in range(8)]
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+        self.assertEqual(crear.call_count, 1)
+        self.assertEqual(len({id(c) for c in vistos}), 1)
+
+    def test_fork_descarta_el_cliente(self):
+        with patch('core.b2_client.boto3.client', side_effect=lambda *a, **k: object()) as crear:
+            primero = self.b2._cliente()
+            self.b2._despues_de_fork()
+            self.assertIsNot(self.b2._cliente(), primero)
+        self.assertEqual(crear.call_count, 2)
+
+    @override_settings(B2_KEY_ID=None)
+    def test_sin_configuracion_falla(self):
+        with self.assertRaises(RuntimeError):
+            self.b2._cliente()
+
+
+@override_settings(**B2_PRUEBA, FIRMA_DOCUMENTO_URL_TTL=900)
+class FirmaDocumentoUrlTests(APITestCase):
+    """Vista previa del PDF por URL presignada, sin pasar el archivo por Django."""
+
+    def setUp(self):
+        from core import b2_client
+        self.b2 = b2_client
+        b2_client.reiniciar_cliente()
+        self.addCleanup(b2_client.reiniciar_cliente)
+        _, _, _, empresa = crear_usuario_completo('doc_url_owner', '31.111.111-1', '76.111.111-1')
+        self.solicitud = SolicitudFirma.objects.create(
+            empleado=crear_empleado(empresa, '32.222.222-2'), empresa=empresa,
+            tipo_documento='CONTRATO', estado='PENDIENTE', b2_key_temporal='pendientes/1/doc.pdf',
+            expira_en=timezone.now() + timezone.timedelta(days=1),
+        )
+        self.url = f'/api/firma-publica/{self.solicitud.token}/documento/'
+        self.firmadas = 0
+
+        def firmar(operacion, Params, ExpiresIn):
+            self.firmadas += 1
+            return f"https://b2.local/{Params['Key']}?firma={self.firmadas}&ttl={ExpiresIn}"
+
+        parche = patch('core.b2_client.boto3.client')
+        self.addCleanup(parche.stop)
+        self.s3 = parche.start().return_value
+        self.s3.generate_presigned_url.side_effect = firmar
+
+    def test_redirect_a_url_presignada_reutilizada(self):
+        resp = self.client.get(self.url, {'modo': 'redirect'})
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp['Location'], 'https://b2.local/pendientes/1/doc.pdf?firma=1&ttl=900')
+        params = self.s3.generate_presigned_url.call_args.kwargs['Params']
+        self.assertIn('inline; filename="Contrato_Laboral_', params['ResponseContentDisposition'])
+
+        segunda = self.client.get(self.url, {'modo': 'redirect'})
+        self.assertEqual(segunda['Location'], resp['Location'])
+        self.assertEqual(self.firmadas, 1)
+        self.s3.get_object.assert_not_called()
+
+    def test_url_se_renueva_antes_de_vencer(self):
+        import time
+        ahora = time.time()
+        with patch('core.b2_client.time.time', return_value=ahora):
+            primera = self.client.get(self.url, {'modo': 'url'})
+        self.assertEqual(primera.status_code, 200)
+        self.assertIn('expira_en', primera.data)
+        with patch('core.b2_client.time.time', return_value=ahora + 900 - self.b2.MARGEN_URL_SEGUNDOS + 1):
+            segunda = self.client.get(self.url, {'modo': 'url'})
+        self.assertNotEqual(primera.data['url'], segunda.data['url'])
+        self.assertEqual(self.firmadas, 2)
+
+    def test_eliminar_documento_olvida_la_url(self):
+        self.client.get(self.url, {'modo': 'url'})
+        self.b2.eliminar_documento('pendientes/1/doc.pdf')
+        self.client.get(self.url, {'modo': 'url'})
+        self.assertEqual(self.firmadas, 2)
+
+    def test_estados_y_modo_invalido(self):
+        self.assertEqual(self.client.get(self.url, {'modo': 'otro'}).status_code, 400)
+        self.solicitud.estado = 'CANCELADO'
+        self.solicitud.save(update_fields=['estado'])
+        self.assertEqual(self.client.get(self.url, {'modo': 'redirect'}).status_code, 410)
+        self.assertEqual(self.firmadas, 0)
+
+
+@override_settings(**B2_PRUEBA)
+class FirmaDocumentoStreamingTests(APITestCase):
+    """El PDF se reenvía por trozos desde B2 y respeta los rangos del visor."""
+
+    PDF = b'%PDF-1.4\n' + bytes(range(256)) * 1000
+
+    def setUp(self):
+        from core import b2_client
+        b2_client.reiniciar_cliente()
+        self.addCleanup(b2_client.reiniciar_cliente)
+        _, _, _, empresa = crear_usuario_completo('doc_stream_owner', '34.444.444-4', '76.444.444-4')
+        solicitud = SolicitudFirma.objects.create(
+            empleado=crear_empleado(empresa, '35.555.555-5'), empresa=empresa,
+            tipo_documento='CONTRATO', estado='PENDIENTE', b2_key_temporal='pendientes/1/doc.pdf',
+            expira_en=timezone.now() + timezone.timedelta(days=1),
+        )
+        self.url = f'/api/firma-publica/{solicitud.token}/documento/'
+        self.cuerpos = []
+
+        parche = patch('core.b2_client.boto3.client')
+        self.addCleanup(parche.stop)
+        self.s3 = parche.start().return_value
+        self.s3.get_object.side_effect = self._get_object
+
+    def _get_object(self, Bucket, Key, Range=None):
+        from botocore.exceptions import ClientError
+        from botocore.response import StreamingBody
+        datos, extra = self.PDF, {}
+        if Range:
+            inicio, _, fin = Range[len('bytes='):].partition('-')
+            if int(inicio) >= len(self.PDF):
+                raise ClientError({'Error': {'Code': 'InvalidRange'}}, 'GetObject')
+            fin = int(fin) if fin else len(self.PDF) - 1
+            datos = self.PDF[int(inicio):fin + 1]
+            extra['ContentRange'] = f'bytes {inicio}-{fin}/{len(self.PDF)}'
+        cuerpo = StreamingBody(io.BytesIO(datos), len(datos))
+        self.cuerpos.append(cuerpo)
+        return {'Body': cuerpo, 'ContentLength': len(datos), 'ContentType': 'application/pdf', **extra}
+
+    def test_documento_completo_por_trozos(self):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        self.assertEqual(resp['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(resp['Content-Length']), len(self.PDF))
+        self.assertEqual(b''.join(resp.streaming_content), self.PDF)
+        resp.close()
+        self.assertTrue(self.cuerpos[0]._raw_stream.closed)
+
+    def test_rango_parcial(self):
+        resp = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp['Content-Range'], f'bytes 100-199/{len(self.PDF)}')
+        self.assertEqual(b''.join(resp.streaming_content), self.PDF[100:200])
+
+    def test_varios_rangos_devuelven_todo(self):
+        resp = self.client.get(self.url, HTTP_RANGE='bytes=0-9,20-29')
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('Range', self.s3.get_object.call_args.kwargs)
+
+    def test_rango_fuera_del_archivo(self):
+        resp = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.PDF) + 10}-')
+        self.assertEqual(resp.status_code, 416)
+
+
+class FirmaJobTests(APITestCase):
+    """La firma se confirma al instante y el worker arma, sube y notifica una sola vez."""
+
+    def setUp(self):
+        _, _, _, self.empresa = crear_usuario_completo('firma_job_owner', '36.666.666-6', '76.666.666-6')
+        self.sesion_token = uuid.uuid4()
+        self.solicitud = SolicitudFirma.objects.create(
+            empleado=crear_empleado(self.empresa, '37.777.777-7'), empresa=self.empresa,
+            tipo_documento='CONTRATO', estado='PENDIENTE', b2_key_temporal='pendientes/1/doc.pdf',
+            email_firmante='trabajador@example.com', sesion_token_trabajador=self.sesion_token,
+            expira_en=timezone.now() + timezone.timedelta(days=1),
+        )
+        for nombre, valor in (('descargar_documento', b'%PDF-original'), ('subir_documento', None),
+                              ('eliminar_documento', None)):
+            parche = patch(f'core.views.b2_client.{nombre}', return_value=valor)
+            setattr(self, nombre, parche.start())
+            self.addCleanup(parche.stop)
+        parche = patch('core.pdf_firma.agregar_certificado_firma', return_value=b'%PDF-firmado')
+        self.certificado = parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_firma_encolada_y_completada_por_el_worker(self):
+        from core.models import EmailOutbox, FirmaJob
+        from core.trabajos import ejecutar_pendientes
+
+        resp = self.client.post(f'/api/firma-publica/{self.solicitud.token}/firmar/', {
+            'sesion_token': str(self.sesion_token), 'firma_trabajador': 'data:image/png;base64,aGVsbG8=',
+        }, format='json', REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(resp.status_code, 202)
+        estado = self.client.get(f'/api/firma-publica/{self.solicitud.token}/estado/')
+        self.assertEqual(estado.data, {'estado': 'PROCESANDO', 'firmado_en': None})
+
+        self.assertEqual(ejecutar_pendientes(), 1)
+        self.solicitud.refresh_from_db()
+        job = FirmaJob.objects.get()
+        self.assertEqual(self.solicitud.estado, 'FIRMADO')
+        self.assertEqual(self.solicitud.firmado_en, job.firmado_en)
+        self.assertEqual(self.solicitud.ip_firmante, '10.1.2.3')
+        self.assertIsNone(self.solicitud.sesion_token_trabajador)
+        self.assertTrue(self.solicitud.b2_key_firmado.endswith(f'{self.solicitud.token}_firmado.pdf'))
+        self.assertEqual(self.certificado.call_args.kwargs['firmado_en'], job.firmado_en)
+        self.subir_documento.assert_called_once_with(b'%PDF-firmado', self.solicitud.b2_key_firmado)
+        self.eliminar_documento.assert_called_once_with('pendientes/1/doc.pdf')
+        self.assertEqual(job.estado, 'COMPLETADO')
+        encolados = EmailOutbox.objects.filter(categoria='FIRMA_COMPLETADA').count()
+        self.assertGreaterEqual(encolados, 1)
+
+        estado = self.client.get(f'/api/firma-publica/{self.solicitud.token}/estado/')
+        self.assertEqual(estado.data['estado'], 'FIRMADO')
+
+        # Repetir el trabajo (ej: el worker murió antes de marcarlo) no duplica nada
+        from core.views import procesar_firma_job
+        procesar_firma_job(job)
+        self.subir_documento.assert_called_once()
+        self.assertEqual(EmailOutbox.objects.filter(categoria='FIRMA_COMPLETADA').count(), encolados)
+
+    def _firmar(self):
+        from core.models import FirmaJob
+        self.client.post(f'/api/firma-publica/{self.solicitud.token}/firmar/', {
+            'sesion_token': str(self.sesion_token), 'firma_trabajador': 'data:image/png;base64,aGVsbG8=',
+        }, format='json')
+        return FirmaJob.objects.get()
+
+    def test_sin_reintentos_la_solicitud_vuelve_a_pendiente(self):
+        from core.trabajos import MAX_INTENTOS, ejecutar_pendientes
+        job = self._firmar()
+        self.subir_documento.side_effect = ConnectionError('B2 no disponible')
+        for _ in range(MAX_INTENTOS):
+            ejecutar_pendientes(limite=1)
+        job.refresh_from_db()
+        self.solicitud.refresh_from_db()
+        self.assertEqual((job.estado, self.solicitud.estado), ('ERROR', 'PENDIENTE'))
+
+    def test_colgado_sin_reintentos_la_solicitud_vuelve_a_pendiente(self):
+        import datetime
+        from core.models import FirmaJob
+        from core.trabajos import MAX_INTENTOS, ejecutar_pendientes
+        job = self._firmar()
+        FirmaJob.objects.filter(pk=job.pk).update(
+            estado='PROCESANDO', intentos=MAX_INTENTOS,
+            actualizado_en=timezone.now() - datetime.timedelta(hours=1),
+        )
+        self.assertEqual(ejecutar_pendientes(), 0)
+        job.refresh_from_db()
+        self.solicitud.refresh_from_db()
+        self.assertEqual((job.estado, self.solicitud.estado), ('ERROR', 'PENDIENTE'))
+
+    def test_estado_token_inexistente(self):
+        resp = self.client.get(f'/api/firma-publica/{uuid.uuid4()}/estado/')
+        self.assertEqual(resp.status_code, 404)
+
+
+class BackendQueFalla(LocmemEmailBackend):
+    """Backend locmem que rechaza a los destinatarios @falla.cl y cuenta conexiones."""
+    conexiones = 0
+
+    def open(self):
+        BackendQueFalla.conexiones += 1
+        return True
+
+    def send_messages(self, messages):
+        if any(d.endswith('@falla.cl') for m in messages for d in m.to):
+            raise ConnectionError('Resend no disponible')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='core.tests.BackendQueFalla')
+class EmailOutboxTests(APITestCase):
+    """Los correos se guardan con el cambio de estado y el worker los envía por lotes."""
+
+    def setUp(self):
+        BackendQueFalla.conexiones = 0
+        _, _, _, self.empresa = crear_usuario_completo('outbox_owner', '38.888.888-8', '76.888.888-8')
+        self.sesion_token = uuid.uuid4()
+        self.solicitud = SolicitudFirma.objects.create(
+            empleado=crear_empleado(self.empresa, '39.999.999-9'), empresa=self.empresa,
+            tipo_documento='CONTRATO', estado='PENDIENTE', b2_key_temporal='pendientes/1/doc.pdf',
+            email_firmante='trabajador@example.com', sesion_token_trabajador=self.sesion_token,
+            expira_en=timezone.now() + timezone.timedelta(days=1),
+        )
+
+    def test_otp_se_envia_al_confirmar_sin_esperar_al_worker(self):
+        from django.core import mail
+        from core.models import EmailOutbox
+        with self.captureOnCommitCallbacks() as callbacks:
+            resp = self.client.post(f'/api/firma-publica/{self.solicitud.token}/solicitar-otp/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)   # nada sale antes de confirmar
+        for callback in callbacks:
+            callback()
+        self.assertEqual(mail.outbox[0].to, ['trabajador@example.com'])
+        correo = EmailOutbox.objects.get()
+        self.assertEqual((correo.categoria, correo.estado), ('OTP', 'ENVIADO'))
+
+    def test_otp_queda_en_la_cola_si_el_envio_falla(self):
+        from django.core import mail
+        from core.models import EmailOutbox
+        SolicitudFirma.objects.filter(pk=self.solicitud.pk).update(email_firmante='trabajador@falla.cl')
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(f'/api/firma-publica/{self.solicitud.token}/solicitar-otp/')
+        self.assertEqual(resp.status_code, 200)
+        correo = EmailOutbox.objects.get()
+        # Queda para el worker, con el reintento de cualquier correo
+        self.assertEqual((correo.categoria, correo.estado, correo.intentos), ('OTP', 'PENDIENTE', 1))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_rechazo_revertido_no_encola(self):
+        from core.models import EmailOutbox
+        with patch('core.views.correos.encolar', side_effect=Exception('BD caída')):
+            with self.assertRaises(Exception):
+                self.client.post(f'/api/firma-publica/{self.solicitud.token}/rechazar/',
+                                 {'sesion_token': str(self.sesion_token)}, format='json')
+        self.solicitud.refresh_from_db()
+        self.assertEqual(self.solicitud.estado, 'PENDIENTE')
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_lote_por_una_conexion(self):
+        from django.core import mail
+        from core import correos
+        from core.models import EmailOutbox
+        for i in range(7):
+            correos.encolar(f'Asunto {i}', 'texto', [f'persona{i}@example.com'], html='<p>hola</p>')
+        self.assertEqual(correos.despachar(tamano_lote=5), 7)
+        self.assertEqual(len(mail.outbox), 7)
+        self.assertEqual(BackendQueFalla.conexiones, 2)   # un lote de 5 y uno de 2
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertEqual(EmailOutbox.objects.filter(estado='ENVIADO').count(), 7)
+        self.assertEqual(correos.despachar(), 0)
+
+    @patch('core.correos.b2_client.descargar_documento', return_value=b'%PDF-firmado')
+    def test_adjunto_se_descarga_al_enviar(self, descargar):
+        from django.core import mail
+        from core import correos
+        correos.encolar('Firmado', 'texto', ['a@example.com'],
+                        adjuntos=[{'nombre': 'doc.pdf', 'b2_key': 'firmados/1/doc.pdf'}])
+        descargar.assert_not_called()
+        correos.despachar()
+        descargar.assert_called_once_with('firmados/1/doc.pdf')
+        self.assertEqual(mail.outbox[0].attachments[0][:2], ('doc.pdf', b'%PDF-firmado'))
+
+    def test_reintentos_con_espera_y_fallido(self):
+        import datetime
+        from django.core import mail
+        from core import correos
+        from core.models import EmailOutbox
+        malo = correos.encolar('A', 'texto', ['nadie@falla.cl'])
+        correos.encolar('B', 'texto', ['ok@example.com'])
+
+        self.assertEqual(correos.despachar(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        malo.refresh_from_db()
+        self.assertEqual((malo.estado, malo.intentos), ('PENDIENTE', 1))
+        self.assertIn('Resend no disponible', malo.error)
+        self.assertGreater(malo.proximo_intento, timezone.now())
+        self.assertEqual(correos.despachar(), 0)  # todavía no le toca
+
+        self.assertEqual([correos.espera_reintento(n) for n in (1, 2, 3)], [30, 60, 120])
+        self.assertEqual(correos.espera_reintento(20), correos.ESPERA_MAX_SEGUNDOS)
+
+        for _ in range(correos.MAX_INTENTOS - 1):
+            EmailOutbox.objects.filter(pk=malo.pk).update(proximo_intento=timezone.now() - datetime.timedelta(seconds=1))
+            correos.despachar()
+        malo.refresh_from_db()
+        self.assertEqual((malo.estado, malo.intentos), ('FALLIDO', correos.MAX_INTENTOS))
+
+
+@override_settings(PDF_RENDER_WORKERS=1)
+class FirmaMasivaTests(APITestCase):
+    """Envío a firma de muchos documentos: el endpoint encola y el worker crea todo por bloques."""
+
+    def setUp(self):
+        self.user, _, _, self.empresa = crear_usuario_completo('masiva_owner', '40.000.000-0', '76.000.000-1')
+        self.empresa.firma_imagen = 'data:image/png;base64,aGVsbG8='
+        self.empresa.save(update_fields=['firma_imagen'])
+        self.empleados = []
+        for i in range(4):
+            emp = crear_empleado(self.empresa, f'{20_000_000 + i}-{i}')
+            emp.email = f'trabajador{i}@example.com'
+            emp.save(update_fields=['email'])
+            Contrato.objects.create(empleado=emp, tipo_contrato='INDEFINIDO',
+                                    fecha_inicio='2024-01-01', sueldo_base=700_000)
+            self.empleados.append(emp)
+        self.client.force_authenticate(user=self.user)
+        for objetivo, valor in (('core.pdf_cache.html_a_pdf', b'%PDF-masivo'),
+                                ('core.views.b2_client.subir_documento', None)):
+            parche = patch(objetivo, return_value=valor)
+            self.addCleanup(parche.stop)
+            setattr(self, objetivo.rsplit('.', 1)[1], parche.start())
+
+    def _items(self, empleados=None):
+        return [{'empleado_id': e.id, 'tipo_documento': 'ANEXO_40H'} for e in (empleados or self.empleados)]
+
+    def _encolar(self, items):
+        return self.client.post('/api/firmas/solicitar_masivo/',
+                                {'empresa_id': self.empresa.id, 'items': items}, format='json')
+
+    def test_encola_y_worker_crea_solicitudes_en_bloque(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from core.models import EmailOutbox
+        from core.trabajos import ejecutar_pendientes
+
+        self.empleados[3].email = ''
+        self.empleados[3].save(update_fields=['email'])
+        resp = self._encolar(self._items())
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual((resp.data['estado'], resp.data['total']), ('PENDIENTE', 4))
+        self.assertFalse(SolicitudFirma.objects.exists())
+        self.html_a_pdf.assert_not_called()
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(ejecutar_pendientes(), 1)
+        inserts = [q['sql'] for q in consultas.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(sum('"core_solicitudfirma"' in q for q in inserts), 1)
+        self.assertEqual(sum('"core_emailoutbox"' in q for q in inserts), 1)
+
+        self.assertEqual(self.html_a_pdf.call_count, 3)
+        self.assertEqual(self.subir_documento.call_count, 3)
+        self.assertEqual(SolicitudFirma.objects.filter(estado='PENDIENTE', tipo_documento='ANEXO_40H').count(), 3)
+        self.assertEqual(EmailOutbox.objects.filter(categoria='FIRMA_SOLICITUD').count(), 3)
+
+        estado = self.client.get(f"/api/firmas/solicitar_masivo/{resp.data['id']}/")
+        self.assertEqual(estado.status_code, 200)
+        self.assertEqual((estado.data['estado'], estado.data['progreso']), ('COMPLETADO', 100))
+        self.assertEqual((estado.data['enviados'], estado.data['errores']), (3, 1))
+        items = estado.data['items']
+        self.assertEqual(items[3]['estado'], 'ERROR')
+        self.assertIn('email', items[3]['error'])
+        ids = {i['solicitud_id'] for i in items[:3]}
+        self.assertEqual(ids, set(SolicitudFirma.objects.values_list('id', flat=True)))
+
+    def test_falla_de_subida_solo_afecta_su_item(self):
+        from core.trabajos import ejecutar_pendientes
+        self.subir_documento.side_effect = [None, Exception('B2 caído'), None, None]
+        job_id = self._encolar(self._items()).data['id']
+        ejecutar_pendientes()
+        estados = [i['estado'] for i in self.client.get(f'/api/firmas/solicitar_masivo/{job_id}/').data['items']]
+        self.assertEqual(estados.count('ENVIADO'), 3)
+        self.assertEqual(estados.count('ERROR'), 1)
+        self.assertEqual(SolicitudFirma.objects.count(), 3)
+
+    def test_validaciones(self):
+        otro, _, _, empresa_ajena = crear_usuario_completo('masiva_otro', '41.000.000-0', '76.000.000-2')
+        ajeno = crear_empleado(empresa_ajena, '42.000.000-0')
+        resp = self._encolar(self._items() + [{'empleado_id': ajeno.id, 'tipo_documento': 'ANEXO_40H'}])
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.data['detalle'], [{'indice': 4, 'error': 'Trabajador no encontrado.'}])
+        self.assertEqual(self._encolar([{'empleado_id': self.empleados[0].id, 'tipo_documento': 'X'}]).status_code, 400)
+        self.assertEqual(self._encolar([]).status_code, 400)
+
+        job_id = self._encolar(self._items()).data['id']
+        self.client.force_authenticate(user=otro)
+        self.assertEqual(self.client.get(f'/api/firmas/solicitar_masivo/{job_id}/').status_code, 404)
+
+        self.empresa.firma_imagen = ''
+        self.empresa.save(update_fields=['firma_imagen'])
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self._encolar(self._items()).status_code, 400)
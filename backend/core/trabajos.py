@@ -0,0 +1,148 @@
+"""
+trabajos.py — Trabajos en segundo plano sin broker externo
+
+Los trabajos pesados (ExportJob, ImportJob, FirmaJob, FirmaMasivaJob, …) se guardan en la BD en estado PENDIENTE y
+los procesa el comando `python manage.py procesar_trabajos`, que consulta la
+tabla cada pocos segundos. Un trabajo se "reclama" con un UPDATE condicional
+(estado PENDIENTE → PROCESANDO), así que pueden correr varios workers a la
+vez sin procesar dos veces lo mismo.
+
+Si un worker muere a mitad de camino, el trabajo queda PROCESANDO sin
+actualizarse; recuperar_colgados() lo devuelve a la cola (o lo marca ERROR
+tras MAX_INTENTOS). Cada tipo puede declarar una función al_fallar, que corre
+siempre que un trabajo queda en ERROR por cualquiera de los dos caminos.
+
+Los ZIP de exportaciones terminadas se borran del storage pasados
+EXPORTACIONES_RETENCION_DIAS (limpiar_exportaciones()).
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ExportJob, FirmaJob, FirmaMasivaJob, ImportJob
+
+logger = logging.getLogger(__name__)
+
+MAX_INTENTOS = 3
+# Un trabajo PROCESANDO que no reporta avance en este tiempo se considera colgado
+MINUTOS_COLGADO = 15
+
+
+def _procesadores():
+    """
+    (modelo, función que procesa una instancia reclamada, al_fallar o None)
+    por tipo de trabajo.
+    """
+    from .importacion import descartar_archivo, procesar_import_job
+    from .views import firma_job_fallido, procesar_export_job, procesar_firma_job, procesar_firma_masiva_job
+    return [
+        # Las firmas primero: el trabajador espera en la página
+        (FirmaJob, procesar_firma_job, firma_job_fallido),
+        (FirmaMasivaJob, procesar_firma_masiva_job, None),
+        (ExportJob, procesar_export_job, None),
+        (ImportJob, procesar_import_job, descartar_archivo),
+    ]
+
+
+def reclamar(modelo):
+    """Toma el trabajo PENDIENTE más antiguo del modelo, o None si no hay."""
+    candidatos = modelo.objects.filter(estado='PENDIENTE').order_by('creado_en').values_list('pk', flat=True)[:20]
+    for pk in candidatos:
+        tomado = modelo.objects.filter(pk=pk, estado='PENDIENTE').update(
+            estado='PROCESANDO', iniciado_en=timezone.now(), actualizado_en=timezone.now(),
+            intentos=F('intentos') + 1,
+        )
+        if tomado:
+            return modelo.objects.get(pk=pk)
+    return None
+
+
+def reportar_avance(trabajo, procesados):
+    """Guarda el avance (y de paso marca que el worker sigue vivo)."""
+    trabajo.procesados = procesados
+    type(trabajo).objects.filter(pk=trabajo.pk).update(procesados=procesados, actualizado_en=timezone.now())
+
+
+def _avisar_fallo(trabajo, al_fallar):
+    if al_fallar is None:
+        return
+    try:
+        al_fallar(trabajo)
+    except Exception:
+        logger.exception("Falló la limpieza del trabajo %s (%s)", trabajo.pk, type(trabajo).__name__)
+
+
+def recuperar_colgados(modelo, al_fallar=None):
+    limite = timezone.now() - datetime.timedelta(minutes=MINUTOS_COLGADO)
+    colgados = modelo.objects.filter(estado='PROCESANDO', actualizado_en__lt=limite)
+    reintentar = colgados.filter(intentos__lt=MAX_INTENTOS).update(estado='PENDIENTE', actualizado_en=timezone.now())
+    ids = list(colgados.values_list('pk', flat=True))
+    fallidos = modelo.objects.filter(pk__in=ids, estado='PROCESANDO').update(
+        estado='ERROR', error='El trabajo se interrumpió demasiadas veces.', terminado_en=timezone.now(),
+    )
+    if fallidos and al_fallar is not None:
+        for trabajo in modelo.objects.filter(pk__in=ids, estado='ERROR'):
+            _avisar_fallo(trabajo, al_fallar)
+    return reintentar + fallidos
+
+
+def ejecutar(trabajo, procesador, al_fallar=None):
+    try:
+        procesador(trabajo)
+    except Exception as e:
+        logger.exception("Falló el trabajo %s (%s)", trabajo.pk, type(trabajo).__name__)
+        trabajo.estado = 'PENDIENTE' if trabajo.intentos < MAX_INTENTOS else 'ERROR'
+        trabajo.error = str(e)[:2000]
+        if trabajo.estado == 'ERROR':
+            trabajo.terminado_en = timezone.now()
+        trabajo.save(update_fields=['estado', 'error', 'terminado_en', 'actualizado_en'])
+        if trabajo.estado == 'ERROR':
+            _avisar_fallo(trabajo, al_fallar)
+        return False
+    return True
+
+
+def limpiar_exportaciones(dias=None) -> int:
+    """Borra los ZIP de exportaciones terminadas hace más de `dias`. Retorna cuántos."""
+    dias = settings.EXPORTACIONES_RETENCION_DIAS if dias is None else dias
+    limite = timezone.now() - datetime.timedelta(days=dias)
+    vencidos = ExportJob.objects.filter(terminado_en__lt=limite).exclude(archivo='').exclude(archivo__isnull=True)
+    borrados = 0
+    for job in vencidos.only('pk', 'archivo').iterator():
+        try:
+            job.archivo.delete(save=False)
+        except Exception:
+            logger.warning("No se pudo borrar el ZIP de la exportación %s.", job.pk, exc_info=True)
+            continue
+        ExportJob.objects.filter(pk=job.pk).update(archivo=None)
+        borrados += 1
+    return borrados
+
+
+def ejecutar_pendientes(limite=None) -> int:
+    """
+    Procesa trabajos pendientes hasta vaciar las colas (o hasta `limite`).
+    Cada vuelta toma a lo más uno de cada tipo, así una exportación larga no
+    deja esperando a las firmas o importaciones que llegaron después.
+    """
+    procesadores = _procesadores()
+    for modelo, _, al_fallar in procesadores:
+        recuperar_colgados(modelo, al_fallar)
+    limpiar_exportaciones()
+    hechos = 0
+    while True:
+        en_la_vuelta = 0
+        for modelo, procesador, al_fallar in procesadores:
+            if limite is not None and hechos >= limite:
+                return hechos
+            trabajo = reclamar(modelo)
+            if trabajo is None:
+                continue
+            ejecutar(trabajo, procesador, al_fallar)
+            hechos += 1
+            en_la_vuelta += 1
+        if not en_la_vuelta:
+            return hechos
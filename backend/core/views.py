@@ -44,9 +44,9 @@ class PasswordResetAccountRateThrottle(AnonRateThrottle):
 
 from django.contrib.auth.models import User
 from django.db import transaction, IntegrityError
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.template.loader import render_to_string, get_template
-from .models import Plan, Suscripcion, Cliente, Empresa, Empleado, Contrato, AnexoContrato, DocumentoLegal, Liquidacion, SolicitudFirma, OTPFirma, VacacionEmpleado, Finiquito
+from .models import Plan, Suscripcion, Cliente, Empresa, Empleado, Contrato, AnexoContrato, DocumentoLegal, Liquidacion, SolicitudFirma, OTPFirma, VacacionEmpleado, Finiquito, ExportJob, ImportJob, FirmaJob, FirmaMasivaJob, ResumenMensual
 from .serializers import PlanSerializer
 from django.contrib.auth.forms import PasswordResetForm
 from xhtml2pdf import pisa
@@ -55,9 +55,13 @@ from django.utils import timezone
 import datetime
 import io
 import zipfile
+import tempfile
 import re
 import math
-from .indicadores import obtener_uf, obtener_utm, calcular_impuesto_unico
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from .indicadores import IndicadorNoDisponible, obtener_uf, obtener_utm, fecha_uf_periodo
+from .motor_liquidaciones import calcular_lote, calcular_filas, leer_fila
 import random
 import string
 from num2words import num2words
@@ -67,112 +71,29 @@ import logging
 from html import escape as _esc
 
 logger = logging.getLogger(__name__)
-import pandas as pd
 import urllib.parse
-from django.db.models import Max, Sum, Exists, OuterRef
+from django.db.models import Sum, Exists, OuterRef, Count, Prefetch, F
+from django.core.files import File
 from django.core.files.base import ContentFile
 import openpyxl
+from botocore.exceptions import ClientError
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter
 
 
-from .serializers import EmpresaSerializer, EmpleadoSerializer, ContratoSerializer, AnexoContratoSerializer, DocumentoLegalSerializer, LiquidacionSerializer, SolicitudFirmaSerializer, FiniquitoSerializer
+from .serializers import EmpresaSerializer, EmpleadoSerializer, ContratoSerializer, AnexoContratoSerializer, DocumentoLegalSerializer, LiquidacionSerializer, SolicitudFirmaSerializer, FiniquitoSerializer, ExportJobSerializer, ImportJobSerializer, FirmaMasivaJobSerializer
 from . import b2_client
-from django.core.mail import EmailMultiAlternatives
+from . import correos
+from .trabajos import reportar_avance
+from .pdf_cache import renderizar_pdf, pdf_desde_html, html_a_pdf as _html_a_pdf_bytes
+from .pdf_pool import TrabajoPdf, renderizar_en_orden
+from .formatos import formatear_rut, validar_rut
+from . import importacion
+from . import previred
+from . import resumenes
+from .libro_excel import escribir_libro
 import uuid as uuid_mod
 
-# ==========================================
-# UTILIDADES DE RUT (VALIDACIÓN Y FORMATO)
-# ==========================================
-def limpiar_rut(rut):
-    return re.sub(r'[^0-9kK]', '', str(rut)).upper()
-
-def formatear_rut(rut):
-    rut_limpio = limpiar_rut(rut)
-    if len(rut_limpio) < 2:
-        return rut
-    cuerpo = rut_limpio[:-1]
-    dv = rut_limpio[-1]
-    try:
-        cuerpo_con_puntos = "{:,}".format(int(cuerpo)).replace(',', '.')
-    except ValueError:
-        return rut
-    return f"{cuerpo_con_puntos}-{dv}"
-
-def validar_rut(rut):
-    rut_limpio = limpiar_rut(rut)
-    if len(rut_limpio) < 2:
-        return False
-    cuerpo = rut_limpio[:-1]
-    dv_ingresado = rut_limpio[-1]
-
-    try:
-        int(cuerpo)
-    except ValueError:
-        return False
-
-    suma = 0
-    multiplo = 2
-    for d in reversed(cuerpo):
-        suma += int(d) * multiplo
-        multiplo += 1
-        if multiplo == 8:
-            multiplo = 2
-    
-    resto = suma % 11
-    dv_esperado = 11 - resto
-    
-    if dv_esperado == 11:
-        dv_calculado = '0'
-    elif dv_esperado == 10:
-        dv_calculado = 'K'
-    else:
-        dv_calculado = str(dv_esperado)
-        
-    return dv_ingresado == dv_calculado
-
-# ==========================================
-# TRADUCTOR INTELIGENTE DE FECHAS EXCEL
-# ==========================================
-def estandarizar_fecha(fecha_valor):
-    # 1. Manejo de nulos (incluyendo nulos de Pandas)
-    if not fecha_valor or pd.isna(fecha_valor):
-        return None
-    
-    # 2. Si Pandas ya lo parseó correctamente como objeto datetime/date
-    if isinstance(fecha_valor, (datetime.datetime, datetime.date)):
-        return fecha_valor.date() if isinstance(fecha_valor, datetime.datetime) else fecha_valor
-
-    fecha_str = str(fecha_valor).strip()
-    
-    # 3. Si viene como número de serie de Excel
-    try:
-        serial = float(fecha_str)
-        base = datetime.datetime(1899, 12, 30)
-        return (base + datetime.timedelta(days=serial)).date()
-    except ValueError:
-        pass
-
-    # 4. Formatos estrictos chilenos (Día, Mes, Año) + ISO estándar de BD
-    formatos_chilenos = [
-        '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y',
-        '%d-%m-%y', '%d/%m/%y', '%d.%m.%y',
-        '%Y-%m-%d'
-    ]
-    
-    for fmt in formatos_chilenos:
-        try:
-            dt = datetime.datetime.strptime(fecha_str, fmt).date()
-            # Ajuste para años de 2 dígitos (ej: 92 -> 1992 en vez de 2092)
-            if dt.year > datetime.date.today().year + 10:
-                dt = dt.replace(year=dt.year - 100)
-            return dt
-        except ValueError:
-            continue
-
-    return None
-
-
 def _plan_activo(user):
     """Devuelve el objeto Plan activo del usuario, o None si no tiene plan."""
     cliente = getattr(user, 'perfil_cliente', None)
@@ -206,16 +127,46 @@ def _es_plan_semilla(user) -> bool:
     return _nivel_plan(user) == 1
 
 
-def _html_a_pdf_bytes(html_string: str, nombre_doc: str) -> bytes:
-    """Convierte HTML a bytes PDF con xhtml2pdf. Lanza excepción si falla."""
-    resultado = io.BytesIO()
-    status = pisa.pisaDocument(io.BytesIO(html_string.encode("UTF-8")), resultado)
-    if status.err:
-        raise Exception(f"Error generando PDF '{nombre_doc}'.")
-    pdf_bytes = resultado.getvalue()
-    if not pdf_bytes:
-        raise Exception(f"PDF '{nombre_doc}' resultó vacío.")
-    return pdf_bytes
+class _SalidaZip(io.RawIOBase):
+    """
+    Destino de escritura para zipfile que no guarda el archivo completo:
+    acumula solo lo escrito desde la última vez que se vació. Como no es
+    "seekable", zipfile escribe cada entrada con data descriptor y nunca
+    vuelve atrás.
+    """
+    def __init__(self):
+        super().__init__()
+        self._pendiente = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._pendiente.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self) -> bytes:
+        datos = b''.join(self._pendiente)
+        self._pendiente.clear()
+        return datos
+
+
+def _zip_en_streaming(entradas):
+    """
+    Arma un ZIP a partir de (nombre, contenido) y lo va entregando por
+    partes, para usar con StreamingHttpResponse: en memoria queda a lo más
+    un documento a la vez, sin importar el tamaño total del ZIP.
+
+    Los PDF ya vienen comprimidos, así que se guardan con ZIP_STORED en vez
+    de volver a pasarlos por deflate; el resto se comprime.
+    """
+    salida = _SalidaZip()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for nombre, contenido in entradas:
+            compresion = zipfile.ZIP_STORED if nombre.lower().endswith('.pdf') else zipfile.ZIP_DEFLATED
+            zip_file.writestr(nombre, contenido, compress_type=compresion)
+            yield salida.vaciar()
+    yield salida.vaciar()
 
 
 _MESES = ["enero","febrero","marzo","abril","mayo","junio","julio","agosto",
@@ -226,6 +177,25 @@ _DIAS_NOMBRES = {
 }
 
 
+def _contrato_de(empleado):
+    """Contrato del trabajador (usa el select_related si ya viene cargado), o None."""
+    try:
+        return empleado.contrato_activo
+    except Contrato.DoesNotExist:
+        return None
+
+
+def _guardar_pdf_generado(campo, nombre, pdf_bytes):
+    """
+    Guarda un PDF recién generado en su FileField con un UPDATE de esa sola
+    columna: un save() completo reescribe todo el modelo y dispara sus señales
+    (ej: recalcular resúmenes por un contrato) por algo que no cambió datos.
+    """
+    campo.save(nombre, ContentFile(pdf_bytes), save=False)
+    instancia = campo.instance
+    type(instancia).objects.filter(pk=instancia.pk).update(**{campo.field.attname: campo.name})
+
+
 def _ctx_contrato(contrato, es_plan_semilla: bool) -> dict:
     """Construye el contexto completo para el template contrato_trabajo.html."""
     empleado = contrato.empleado
@@ -584,17 +554,14 @@ class VacacionViewSet(viewsets.ModelViewSet):
                 'es_plan_semilla': es_semilla,
             }
 
-            template = get_template('comprobante_vacaciones.html')
-            html = template.render(context)
-
-            response = HttpResponse(content_type='application/pdf')
             nombre = f'vacacion_{empleado.rut}_{vacacion.fecha_inicio}.pdf'
-            response['Content-Disposition'] = f'attachment; filename="{nombre}"'
-
-            pisa_status = pisa.CreatePDF(html, dest=response)
-            if pisa_status.err:
+            try:
+                pdf_bytes = renderizar_pdf('comprobante_vacaciones.html', context, nombre, documento=vacacion)
+            except Exception:
                 return HttpResponse('Error al generar el PDF.', status=500)
 
+            response = HttpResponse(pdf_bytes, content_type='application/pdf')
+            response['Content-Disposition'] = f'attachment; filename="{nombre}"'
             return response
 
         except Exception as e:
@@ -769,137 +736,45 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
             if not archivo_excel or not empresa_id:
                 return Response({'error': 'Falta el archivo o la empresa.'}, status=400)
 
-            MAX_EXCEL_MB = 5
-            if hasattr(archivo_excel, 'size') and archivo_excel.size > MAX_EXCEL_MB * 1024 * 1024:
-                return Response({'error': f'El archivo no puede superar {MAX_EXCEL_MB} MB.'}, status=400)
+            if hasattr(archivo_excel, 'size') and archivo_excel.size > importacion.MAX_ARCHIVO_MB * 1024 * 1024:
+                return Response({'error': f'El archivo no puede superar {importacion.MAX_ARCHIVO_MB} MB.'}, status=400)
 
-            MIME_EXCEL = {
+            # Windows suele mandar los .csv como application/vnd.ms-excel; el
+            # formato real se decide por el contenido en importacion.leer_filas
+            MIME_PERMITIDOS = {
                 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
                 'application/vnd.ms-excel',
+                'text/csv', 'application/csv', 'text/plain',
             }
-            if hasattr(archivo_excel, 'content_type') and archivo_excel.content_type not in MIME_EXCEL:
-                return Response({'error': 'Solo se aceptan archivos Excel (.xlsx o .xls).'}, status=400)
+            if hasattr(archivo_excel, 'content_type') and archivo_excel.content_type not in MIME_PERMITIDOS:
+                return Response({'error': 'Solo se aceptan archivos Excel (.xlsx) o CSV.'}, status=400)
 
             empresa = Empresa.objects.get(id=empresa_id, owner=request.user)
-            cliente = getattr(request.user, 'perfil_cliente', None)
-            limite_trabajadores = cliente.plan.limite_trabajadores if (cliente and cliente.plan) else 1000
-
-            # Leemos el Excel
-            df = pd.read_excel(archivo_excel).fillna('')
-            registros = df.to_dict('records')
-
-            MAX_FILAS = 500
-            if len(registros) > MAX_FILAS:
-                return Response({'error': f'El archivo no puede tener más de {MAX_FILAS} filas por importación.'}, status=400)
-            
-            empleados_creados = 0
-            empleados_actualizados = 0
-            limite_alcanzado = False
-            errores = []
-            
-            # Preparamos el mapa de empleados actuales para evitar duplicados
-            empleados_bd = Empleado.objects.filter(empresa=empresa)
-            mapa_empleados = { limpiar_rut(emp.rut): emp for emp in empleados_bd }
-            
-            siguiente_ficha = (empleados_bd.aggregate(Max('ficha_numero'))['ficha_numero__max'] or 0) + 1
-
-            with transaction.atomic():
-                total_actual = empleados_bd.count()
-
-                for fila_num, row in enumerate(registros, start=2):  # start=2 porque fila 1 es el header del Excel
-                    # --- NORMALIZADOR DE COLUMNAS ---
-                    # Creamos un nuevo diccionario con todas las llaves en minúsculas y sin espacios
-                    # Así row.get('email') funcionará aunque el Excel diga "Email", " EMAIL" o "email"
-                    row_norm = { str(k).strip().lower().replace(' ', '_'): v for k, v in row.items() }
-                    
-                    rut_raw = str(row_norm.get('rut', '')).strip()
-                    if not rut_raw: continue
-                    
-                    if not validar_rut(rut_raw):
-                        continue # Saltamos RUTs inválidos
-
-                    rut_limpio = limpiar_rut(rut_raw)
-                    rut_formateado = formatear_rut(rut_raw)
-
-                    # Extraer datos usando las llaves normalizadas
-                    nombres = str(row_norm.get('nombres', '')).strip().upper()
-                    ap_paterno = str(row_norm.get('apellido_paterno', '')).strip().upper()
-                    email_dato = str(row_norm.get('email', '')).strip().lower() # <--- AQUÍ SE CORRIGE EL EMAIL
-
-                    # Lógica de tipos de datos
-                    try:
-                        sueldo = int(float(row_norm.get('sueldo_base', 0)))
-                        if sueldo < 0:
-                            errores.append(f"Fila {fila_num}: sueldo_base no puede ser negativo.")
-                            continue
-                        horas_raw = row_norm.get('horas_laborales', 44)
-                        horas = int(horas_raw)
-                        if horas <= 0 or horas > 168:
-                            errores.append(f"Fila {fila_num}: horas_laborales debe estar entre 1 y 168.")
-                            continue
-                    except (ValueError, TypeError):
-                        errores.append(f"Fila {fila_num}: sueldo_base u horas_laborales contienen valores no numéricos.")
-                        continue
+            limite_trabajadores = importacion.limite_trabajadores_de(request.user)
+
+            # ?dry_run=1: valida y compara contra la BD sin escribir nada
+            dry_run = request.query_params.get('dry_run', '').lower() in ('1', 'true')
+            # ?asincrono=1: encola un ImportJob y responde 202 (estado en /api/importaciones/<id>/)
+            if not dry_run and request.query_params.get('asincrono', '').lower() in ('1', 'true'):
+                activos = ImportJob.objects.filter(owner=request.user, estado__in=['PENDIENTE', 'PROCESANDO']).count()
+                if activos >= ImportJobViewSet.MAX_TRABAJOS_ACTIVOS:
+                    return Response(
+                        {'error': f'Ya tienes {activos} importaciones en curso. Espera a que terminen.'},
+                        status=status.HTTP_429_TOO_MANY_REQUESTS,
+                    )
+                nombre = getattr(archivo_excel, 'name', '') or 'importacion'
+                job = ImportJob(owner=request.user, empresa=empresa, nombre_archivo=nombre[:255])
+                job.archivo.save(nombre, archivo_excel, save=False)
+                job.save()
+                return Response(ImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
-                    raw_cuenta = row_norm.get('numero_cuenta', '')
-                    try:
-                        # Si es numérico (ej. 12345.0), lo pasamos a float, luego a entero (quita el .0) y luego a texto
-                        num_cuenta = str(int(float(raw_cuenta)))
-                    except (ValueError, TypeError):
-                        # Si tiene letras o guiones (ej. "Chequera-123") o está vacío, lo dejamos como texto normal
-                        num_cuenta = str(raw_cuenta).strip()
-
-                    # AQUÍ SE ASIGNAN TODOS LOS CAMPOS QUE ESTABAN EN NULL
-                    nuevos_datos = {
-                        'nombres': nombres,
-                        'apellido_paterno': ap_paterno,
-                        'apellido_materno': str(row_norm.get('apellido_materno', '')).strip().upper(),
-                        'email': email_dato,
-                        'sexo': str(row_norm.get('sexo', 'M')).strip().upper()[:1],
-                        'nacionalidad': str(row_norm.get('nacionalidad', 'CHILENA')).strip().upper(),
-                        'fecha_nacimiento': estandarizar_fecha(row_norm.get('fecha_nacimiento')),
-                        'fecha_ingreso': estandarizar_fecha(row_norm.get('fecha_ingreso')) or datetime.date.today(),
-                        'departamento': str(row_norm.get('departamento', '')).strip().upper(),
-                        'sucursal': str(row_norm.get('sucursal', '')).strip().upper(),
-                        'cargo': str(row_norm.get('cargo', '')).strip().upper(),
-                        'sueldo_base': sueldo,
-                        'horas_laborales': horas,
-                        'forma_pago': str(row_norm.get('forma_pago', 'TRANSFERENCIA')).strip().upper(),
-                        'banco': str(row_norm.get('banco', '')).strip().upper(),
-                        'tipo_cuenta': str(row_norm.get('tipo_cuenta', '')).strip().upper(),
-                        'numero_cuenta': num_cuenta
-                    }
-
-                    empleado_existente = mapa_empleados.get(rut_limpio)
-
-                    if empleado_existente:
-                        # ACTUALIZAR
-                        for key, value in nuevos_datos.items():
-                            setattr(empleado_existente, key, value)
-                        empleado_existente.save()
-                        empleados_actualizados += 1
-                    else:
-                        # CREAR (Validando límite de plan)
-                        if total_actual >= limite_trabajadores:
-                            limite_alcanzado = True
-                            continue
-                        
-                        Empleado.objects.create(
-                            rut=rut_formateado,
-                            empresa=empresa,
-                            ficha_numero=siguiente_ficha,
-                            **nuevos_datos
-                        )
-                        siguiente_ficha += 1
-                        empleados_creados += 1
-                        total_actual += 1
-
-            return Response({
-                'agregados': empleados_creados,
-                'actualizados': empleados_actualizados,
-                'limite_alcanzado': limite_alcanzado,
-                'errores': errores,
-            }, status=200)
+            try:
+                resultado = importacion.importar_empleados(
+                    empresa, importacion.leer_filas(archivo_excel), limite_trabajadores, dry_run=dry_run,
+                )
+            except importacion.ErrorArchivo as e:
+                return Response({'error': str(e)}, status=400)
+            return Response(resultado, status=200)
 
         except Exception:
             return Response({'error': 'Error procesando el archivo. Revisa el formato e inténtalo de nuevo.'}, status=500)
@@ -988,17 +863,31 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
             )
         return pdf_bytes
 
-    def _obtener_o_generar_documento(self, empleado, tipo_documento, user=None):
-        """Revisa si el PDF ya existe en la BD. Si no, lo genera usando los templates HTML reales."""
+    def _pdf_o_trabajo(self, template_name, context, nombre_doc, documento, campo=None, diferido=False):
+        """
+        Genera el PDF (guardándolo en `campo` si se indica), o con diferido=True
+        devuelve el TrabajoPdf equivalente para renderizarlo en lote con pdf_pool.
+        """
+        al_terminar = (lambda pdf: _guardar_pdf_generado(campo, f"{nombre_doc}.pdf", pdf)) if campo is not None else None
+        trabajo = TrabajoPdf(template_name, context, nombre_doc, documento, al_terminar=al_terminar)
+        return trabajo if diferido else trabajo.ejecutar(convertir=self._html_a_pdf)
+
+    def _obtener_o_generar_documento(self, empleado, tipo_documento, user=None, diferido=False,
+                                     contrato=None, liquidacion=None):
+        """
+        Revisa si el PDF ya existe en la BD. Si no, lo genera usando los templates HTML reales.
+        Con diferido=True, en vez de generarlo devuelve un TrabajoPdf (ver pdf_pool.py).
+        contrato/liquidacion: instancias ya cargadas (ej: prefetch del expediente)
+        para no volver a buscarlas.
+        """
 
         empresa = empleado.empresa
         es_plan_semilla = _es_plan_semilla(user) if user else False
 
         # --- LÓGICA PARA CONTRATOS ---
         if tipo_documento == 'contrato':
-            try:
-                contrato = Contrato.objects.get(empleado=empleado)
-            except Contrato.DoesNotExist:
+            contrato = contrato or _contrato_de(empleado)
+            if contrato is None:
                 raise Exception(f"El trabajador {empleado.nombres} no tiene contrato registrado.")
             if contrato.archivo_contrato:
                 try:
@@ -1007,16 +896,13 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
                     pass
 
             context = _ctx_contrato(contrato, es_plan_semilla)
-            html_string = render_to_string('contrato_trabajo.html', context)
-            pdf_bytes = self._html_a_pdf(html_string, f'Contrato_{empleado.rut}')
-            contrato.archivo_contrato.save(f"Contrato_{empleado.rut}.pdf", ContentFile(pdf_bytes))
-            return pdf_bytes
+            return self._pdf_o_trabajo('contrato_trabajo.html', context, f'Contrato_{empleado.rut}',
+                                       contrato, contrato.archivo_contrato, diferido)
 
         # --- LÓGICA PARA ANEXOS 40 HORAS ---
         elif tipo_documento == 'anexo_40h':
-            try:
-                contrato = Contrato.objects.get(empleado=empleado)
-            except Contrato.DoesNotExist:
+            contrato = contrato or _contrato_de(empleado)
+            if contrato is None:
                 raise Exception(f"El trabajador {empleado.nombres} no tiene contrato registrado.")
             if contrato.archivo_anexo_40h:
                 try:
@@ -1025,10 +911,8 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
                     pass
 
             context = _ctx_contrato(contrato, es_plan_semilla)
-            html_string = render_to_string('anexo_40h.html', context)
-            pdf_bytes = self._html_a_pdf(html_string, f'Anexo_40h_{empleado.rut}')
-            contrato.archivo_anexo_40h.save(f"Anexo_40h_{empleado.rut}.pdf", ContentFile(pdf_bytes))
-            return pdf_bytes
+            return self._pdf_o_trabajo('anexo_40h.html', context, f'Anexo_40h_{empleado.rut}',
+                                       contrato, contrato.archivo_anexo_40h, diferido)
 
         # --- LÓGICA PARA LIQUIDACIONES (MES ACTUAL) ---
         elif tipo_documento == 'liquidacion_actual':
@@ -1047,38 +931,31 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
                 liquido_palabras = num2words(liquidacion.sueldo_liquido, lang='es')
             except Exception:
                 liquido_palabras = str(liquidacion.sueldo_liquido)
-            contrato_liq = Contrato.objects.filter(empleado=empleado).first()
+            contrato_liq = contrato or _contrato_de(empleado)
             meses_liq = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
-            det_no_imp = liquidacion.detalle_haberes_no_imponibles
-            if not isinstance(det_no_imp, list): det_no_imp = []
-            det_otros = liquidacion.detalle_otros_descuentos
-            if not isinstance(det_otros, list): det_otros = []
             context = {
                 'empleado': empleado, 'empresa': empresa,
                 'liquidacion': liquidacion, 'contrato': contrato_liq,
                 'mes_nombre': meses_liq[liquidacion.mes - 1].upper(),
                 'liquido_palabras': liquido_palabras,
-                'total_no_imponible': sum(int(i.get('valor', 0)) for i in det_no_imp if isinstance(i, dict)),
-                'total_ley': (liquidacion.afp_monto or 0) + (liquidacion.salud_monto or 0) + (liquidacion.seguro_cesantia or 0) + (liquidacion.impuesto_unico or 0),
-                'total_otros_dsctos': (liquidacion.anticipo_quincena or 0) + sum(int(i.get('valor', 0)) for i in det_otros if isinstance(i, dict)),
+                'total_no_imponible': liquidacion.total_no_imponibles,
+                'total_ley': liquidacion.total_ley,
+                'total_otros_dsctos': (liquidacion.anticipo_quincena or 0) + liquidacion.total_otros_descuentos,
                 'es_plan_semilla': es_plan_semilla,
             }
-            html_string = render_to_string('liquidacion.html', context)
-            pdf_bytes = self._html_a_pdf(html_string, f'Liquidacion_{hoy.month}_{hoy.year}_{empleado.rut}')
-            liquidacion.archivo_pdf.save(
-                f"Liquidacion_{hoy.month}_{hoy.year}_{empleado.rut}.pdf", ContentFile(pdf_bytes)
-            )
-            return pdf_bytes
+            return self._pdf_o_trabajo('liquidacion.html', context, f'Liquidacion_{hoy.month}_{hoy.year}_{empleado.rut}',
+                                       liquidacion, liquidacion.archivo_pdf, diferido)
 
         # --- LÓGICA PARA LIQUIDACIONES HISTÓRICAS ---
         elif tipo_documento.startswith('liquidacion_historica_'):
             _, _, mes_str, anio_str = tipo_documento.split('_')
             mes_hist, anio_hist = int(mes_str), int(anio_str)
 
-            try:
-                liquidacion = Liquidacion.objects.get(empleado=empleado, mes=mes_hist, anio=anio_hist)
-            except Liquidacion.DoesNotExist:
-                raise Exception(f"No existe liquidación {mes_hist}/{anio_hist} para {empleado.nombres}.")
+            if liquidacion is None:
+                try:
+                    liquidacion = Liquidacion.objects.get(empleado=empleado, mes=mes_hist, anio=anio_hist)
+                except Liquidacion.DoesNotExist:
+                    raise Exception(f"No existe liquidación {mes_hist}/{anio_hist} para {empleado.nombres}.")
             if liquidacion.archivo_pdf:
                 try:
                     return liquidacion.archivo_pdf.read()
@@ -1089,28 +966,20 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
                 liquido_palabras = num2words(liquidacion.sueldo_liquido, lang='es')
             except Exception:
                 liquido_palabras = str(liquidacion.sueldo_liquido)
-            contrato_liq = Contrato.objects.filter(empleado=empleado).first()
+            contrato_liq = contrato or _contrato_de(empleado)
             meses_liq = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
-            det_no_imp = liquidacion.detalle_haberes_no_imponibles
-            if not isinstance(det_no_imp, list): det_no_imp = []
-            det_otros = liquidacion.detalle_otros_descuentos
-            if not isinstance(det_otros, list): det_otros = []
             context = {
                 'empleado': empleado, 'empresa': empresa,
                 'liquidacion': liquidacion, 'contrato': contrato_liq,
                 'mes_nombre': meses_liq[liquidacion.mes - 1].upper(),
                 'liquido_palabras': liquido_palabras,
-                'total_no_imponible': sum(int(i.get('valor', 0)) for i in det_no_imp if isinstance(i, dict)),
-                'total_ley': (liquidacion.afp_monto or 0) + (liquidacion.salud_monto or 0) + (liquidacion.seguro_cesantia or 0) + (liquidacion.impuesto_unico or 0),
-                'total_otros_dsctos': (liquidacion.anticipo_quincena or 0) + sum(int(i.get('valor', 0)) for i in det_otros if isinstance(i, dict)),
+                'total_no_imponible': liquidacion.total_no_imponibles,
+                'total_ley': liquidacion.total_ley,
+                'total_otros_dsctos': (liquidacion.anticipo_quincena or 0) + liquidacion.total_otros_descuentos,
                 'es_plan_semilla': es_plan_semilla,
             }
-            html_string = render_to_string('liquidacion.html', context)
-            pdf_bytes = self._html_a_pdf(html_string, f'Liquidacion_{mes_hist}_{anio_hist}_{empleado.rut}')
-            liquidacion.archivo_pdf.save(
-                f"Liquidacion_{mes_hist}_{anio_hist}_{empleado.rut}.pdf", ContentFile(pdf_bytes)
-            )
-            return pdf_bytes
+            return self._pdf_o_trabajo('liquidacion.html', context, f'Liquidacion_{mes_hist}_{anio_hist}_{empleado.rut}',
+                                       liquidacion, liquidacion.archivo_pdf, diferido)
 
         # --- LÓGICA PARA CARTAS DE AMONESTACIÓN ---
         elif tipo_documento == 'amonestacion':
@@ -1125,8 +994,14 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
                 except Exception:
                     pass
 
+            def guardar(pdf_bytes):
+                _guardar_pdf_generado(doc_legal.archivo_pdf, f"Amonestacion_{empleado.rut}.pdf", pdf_bytes)
+            if diferido:
+                trabajo = self._pdf_para_documento_legal(doc_legal, es_plan_semilla, diferido=True)
+                trabajo.al_terminar = guardar
+                return trabajo
             pdf_bytes = self._pdf_para_documento_legal(doc_legal, es_plan_semilla)
-            doc_legal.archivo_pdf.save(f"Amonestacion_{empleado.rut}.pdf", ContentFile(pdf_bytes))
+            guardar(pdf_bytes)
             return pdf_bytes
 
         raise Exception(f"Tipo de documento no soportado: '{tipo_documento}'")
@@ -1134,7 +1009,7 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
     # ====================================================
     # HELPERS PDF PARA DOCUMENTOS LEGALES Y ANEXOS
     # ====================================================
-    def _pdf_para_documento_legal(self, doc, es_plan_semilla):
+    def _pdf_para_documento_legal(self, doc, es_plan_semilla, diferido=False):
         empleado = doc.empleado
         empresa = empleado.empresa
         meses = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
@@ -1148,7 +1023,7 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
         }
         if doc.tipo == 'DESPIDO':
             codigo = doc.causal_articulo or ''
-            causal_label, causal_descripcion, requiere_indemnizacion = self._CAUSAL_INFO.get(
+            causal_label, causal_descripcion, requiere_indemnizacion = DocumentoLegalViewSet._CAUSAL_INFO.get(
                 codigo, (doc.causal_legal or '—', '', False)
             )
             def _fmt(v):
@@ -1157,10 +1032,8 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
             if doc.fecha_ultimo_dia:
                 f = doc.fecha_ultimo_dia
                 fecha_ult = f"{f.day:02d} de {meses[f.month - 1]} de {f.year}"
-            try:
-                contrato_cargo = doc.empleado.contrato.cargo
-            except Exception:
-                contrato_cargo = None
+            contrato_doc = _contrato_de(empleado)
+            contrato_cargo = contrato_doc.cargo if contrato_doc else None
             context.update({
                 'causal_label': causal_label,
                 'causal_descripcion': causal_descripcion,
@@ -1171,12 +1044,13 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
                 'fecha_ultimo_dia_texto': fecha_ult,
                 'contrato_cargo': contrato_cargo,
             })
-            html = render_to_string('carta_despido.html', context)
+            template_name = 'carta_despido.html'
         else:
-            html = render_to_string('documento_legal.html', context)
-        return self._html_a_pdf(html, f'{doc.tipo}_{empleado.rut}_{doc.fecha_emision}')
+            template_name = 'documento_legal.html'
+        return self._pdf_o_trabajo(template_name, context, f'{doc.tipo}_{empleado.rut}_{doc.fecha_emision}',
+                                   doc, diferido=diferido)
 
-    def _pdf_para_anexo_contrato(self, anexo, es_plan_semilla):
+    def _pdf_para_anexo_contrato(self, anexo, es_plan_semilla, diferido=False):
         contrato = anexo.contrato
         empleado = contrato.empleado
         empresa = empleado.empresa
@@ -1189,12 +1063,103 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
             'fecha_actual': fecha_espanol, 'ciudad': ciudad,
             'es_plan_semilla': es_plan_semilla,
         }
-        html = render_to_string('anexo_contrato.html', context)
-        return self._html_a_pdf(html, f'AnexoContrato_{empleado.rut}_{hoy}')
+        return self._pdf_o_trabajo('anexo_contrato.html', context, f'AnexoContrato_{empleado.rut}_{hoy}',
+                                   anexo, diferido=diferido)
 
     # ====================================================
     # ENDPOINT: DESCARGA MASIVA Y EXPEDIENTES (ZIP)
     # ====================================================
+    def _entradas_expediente(self, empleados, documentos, cantidad_liquidaciones):
+        """
+        Genera (ruta_en_zip, pdf_bytes | TrabajoPdf) de cada documento del
+        expediente, uno a la vez, para que el ZIP se pueda ir enviando sin
+        tenerlo completo en memoria. Los PDF que faltan salen como TrabajoPdf
+        y se renderizan en paralelo con renderizar_en_orden (pdf_pool.py). Un
+        documento que falla se omite, como antes.
+
+        Contrato, liquidaciones, documentos legales y anexos se cargan de una
+        vez para todos los trabajadores: la cantidad de consultas no crece con
+        el tamaño de la selección.
+        """
+        es_semilla = False  # el plan ya se verificó en descarga_masiva
+        meses_corto = ["Ene","Feb","Mar","Abr","May","Jun","Jul","Ago","Sep","Oct","Nov","Dic"]
+        carpetas_legales = [
+            (tipo, ruta) for clave, tipo, ruta in [
+                ('amonestaciones', 'AMONESTACION', 'Amonestaciones/Amonestacion'),
+                ('despidos', 'DESPIDO', 'Terminos_Contrato/Termino'),
+                ('mutuo_acuerdo', 'MUTUO_ACUERDO', 'Renuncias/Renuncia'),
+                ('constancias', 'CONSTANCIA', 'Constancias/Constancia'),
+            ] if clave in documentos
+        ]
+
+        empleados = empleados.select_related('empresa', 'contrato_activo')
+        if 'liquidaciones' in documentos and cantidad_liquidaciones > 0:
+            empleados = empleados.prefetch_related(Prefetch(
+                'liquidaciones',
+                queryset=Liquidacion.objects.order_by('-anio', '-mes')[:cantidad_liquidaciones],
+                to_attr='liquidaciones_zip',
+            ))
+        if carpetas_legales:
+            empleados = empleados.prefetch_related(Prefetch(
+                'documentos_legales',
+                queryset=DocumentoLegal.objects.filter(tipo__in=[t for t, _ in carpetas_legales]).order_by('fecha_emision'),
+                to_attr='documentos_legales_zip',
+            ))
+        if 'anexos_contrato' in documentos:
+            empleados = empleados.prefetch_related(Prefetch(
+                'contrato_activo__anexos',
+                queryset=AnexoContrato.objects.order_by('fecha_emision'),
+                to_attr='anexos_zip',
+            ))
+
+        for emp in empleados:
+            rut_limpio = emp.rut.replace("-", "").replace(".", "")
+            carpeta = f"{rut_limpio}_{emp.nombres}_{emp.apellido_paterno}".replace(" ", "_")
+            contrato_emp = _contrato_de(emp)
+
+            if 'contrato' in documentos:
+                try:
+                    yield f"{carpeta}/Contrato.pdf", self._obtener_o_generar_documento(
+                        emp, 'contrato', diferido=True, contrato=contrato_emp)
+                except Exception:
+                    pass
+
+            if 'anexo_40h' in documentos:
+                try:
+                    yield f"{carpeta}/Anexo_Ley_40h.pdf", self._obtener_o_generar_documento(
+                        emp, 'anexo_40h', diferido=True, contrato=contrato_emp)
+                except Exception:
+                    pass
+
+            for liq in getattr(emp, 'liquidaciones_zip', []):
+                try:
+                    pdf = self._obtener_o_generar_documento(
+                        emp, f'liquidacion_historica_{liq.mes}_{liq.anio}', diferido=True,
+                        contrato=contrato_emp, liquidacion=liq)
+                except Exception:
+                    continue
+                yield f"{carpeta}/Liquidaciones/Liq_{meses_corto[liq.mes - 1]}_{liq.anio}.pdf", pdf
+
+            legales_por_tipo = {}
+            for doc in getattr(emp, 'documentos_legales_zip', []):
+                legales_por_tipo.setdefault(doc.tipo, []).append(doc)
+            for tipo, ruta in carpetas_legales:
+                for doc in legales_por_tipo.get(tipo, []):
+                    try:
+                        pdf = self._pdf_para_documento_legal(doc, es_semilla, diferido=True)
+                    except Exception:
+                        continue
+                    yield f"{carpeta}/{ruta}_{doc.fecha_emision}.pdf", pdf
+
+            if 'anexos_contrato' in documentos and contrato_emp:
+                for anexo in contrato_emp.anexos_zip:
+                    try:
+                        pdf = self._pdf_para_anexo_contrato(anexo, es_semilla, diferido=True)
+                    except Exception:
+                        continue
+                    titulo_corto = anexo.titulo[:30].replace(" ", "_")
+                    yield f"{carpeta}/Anexos_Contrato/Anexo_{anexo.fecha_emision}_{titulo_corto}.pdf", pdf
+
     @action(detail=False, methods=['post'])
     def descarga_masiva(self, request):
         """
@@ -1233,84 +1198,13 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
             if not empleados.exists():
                 return Response({'error': 'No se encontraron trabajadores válidos'}, status=404)
 
-            es_semilla = False  # ya verificado arriba
-            meses_corto = ["Ene","Feb","Mar","Abr","May","Jun","Jul","Ago","Sep","Oct","Nov","Dic"]
-            zip_buffer = io.BytesIO()
-
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for emp in empleados:
-                    rut_limpio = emp.rut.replace("-", "").replace(".", "")
-                    carpeta = f"{rut_limpio}_{emp.nombres}_{emp.apellido_paterno}".replace(" ", "_")
-
-                    if 'contrato' in documentos:
-                        try:
-                            pdf = self._obtener_o_generar_documento(emp, 'contrato', request.user)
-                            zip_file.writestr(f"{carpeta}/Contrato.pdf", pdf)
-                        except Exception:
-                            pass
-
-                    if 'anexo_40h' in documentos:
-                        try:
-                            pdf = self._obtener_o_generar_documento(emp, 'anexo_40h', request.user)
-                            zip_file.writestr(f"{carpeta}/Anexo_Ley_40h.pdf", pdf)
-                        except Exception:
-                            pass
-
-                    if 'liquidaciones' in documentos and cantidad_liquidaciones > 0:
-                        liq_qs = Liquidacion.objects.filter(empleado=emp).order_by('-anio', '-mes')[:cantidad_liquidaciones]
-                        for liq in liq_qs:
-                            try:
-                                pdf = self._obtener_o_generar_documento(emp, f'liquidacion_historica_{liq.mes}_{liq.anio}', request.user)
-                                zip_file.writestr(f"{carpeta}/Liquidaciones/Liq_{meses_corto[liq.mes - 1]}_{liq.anio}.pdf", pdf)
-                            except Exception:
-                                pass
-
-                    if 'amonestaciones' in documentos:
-                        for doc in DocumentoLegal.objects.filter(empleado=emp, tipo='AMONESTACION').order_by('fecha_emision'):
-                            try:
-                                pdf = self._pdf_para_documento_legal(doc, es_semilla)
-                                zip_file.writestr(f"{carpeta}/Amonestaciones/Amonestacion_{doc.fecha_emision}.pdf", pdf)
-                            except Exception:
-                                pass
-
-                    if 'despidos' in documentos:
-                        for doc in DocumentoLegal.objects.filter(empleado=emp, tipo='DESPIDO').order_by('fecha_emision'):
-                            try:
-                                pdf = self._pdf_para_documento_legal(doc, es_semilla)
-                                zip_file.writestr(f"{carpeta}/Terminos_Contrato/Termino_{doc.fecha_emision}.pdf", pdf)
-                            except Exception:
-                                pass
-
-                    if 'mutuo_acuerdo' in documentos:
-                        for doc in DocumentoLegal.objects.filter(empleado=emp, tipo='MUTUO_ACUERDO').order_by('fecha_emision'):
-                            try:
-                                pdf = self._pdf_para_documento_legal(doc, es_semilla)
-                                zip_file.writestr(f"{carpeta}/Renuncias/Renuncia_{doc.fecha_emision}.pdf", pdf)
-                            except Exception:
-                                pass
-
-                    if 'constancias' in documentos:
-                        for doc in DocumentoLegal.objects.filter(empleado=emp, tipo='CONSTANCIA').order_by('fecha_emision'):
-                            try:
-                                pdf = self._pdf_para_documento_legal(doc, es_semilla)
-                                zip_file.writestr(f"{carpeta}/Constancias/Constancia_{doc.fecha_emision}.pdf", pdf)
-                            except Exception:
-                                pass
-
-                    if 'anexos_contrato' in documentos:
-                        contrato_emp = Contrato.objects.filter(empleado=emp).first()
-                        if contrato_emp:
-                            for anexo in AnexoContrato.objects.filter(contrato=contrato_emp).order_by('fecha_emision'):
-                                try:
-                                    pdf = self._pdf_para_anexo_contrato(anexo, es_semilla)
-                                    titulo_corto = anexo.titulo[:30].replace(" ", "_")
-                                    zip_file.writestr(f"{carpeta}/Anexos_Contrato/Anexo_{anexo.fecha_emision}_{titulo_corto}.pdf", pdf)
-                                except Exception:
-                                    pass
-
-            zip_buffer.seek(0)
             nombre_zip = f"Expedientes_{empresa.nombre_legal.replace(' ', '_')}_{datetime.date.today()}.zip"
-            response = HttpResponse(zip_buffer.getvalue(), content_type='application/zip')
+            response = StreamingHttpResponse(
+                _zip_en_streaming(renderizar_en_orden(
+                    self._entradas_expediente(empleados, documentos, cantidad_liquidaciones)
+                )),
+                content_type='application/zip',
+            )
             response['Content-Disposition'] = f'attachment; filename="{nombre_zip}"'
             response['Access-Control-Expose-Headers'] = 'Content-Disposition'
             return response
@@ -1338,9 +1232,9 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
         if len(empleado_ids) > MAX_EMPLEADOS_ZIP:
             return Response({'error': f'Máximo {MAX_EMPLEADOS_ZIP} trabajadores por descarga. Divide la selección en grupos.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        es_plan_semilla = _es_plan_semilla(request.user)
+
+        def entradas():
             for emp_id in empleado_ids:
                 try:
                     empleado = Empleado.objects.get(id=emp_id, empresa__owner=request.user)
@@ -1382,25 +1276,16 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
                         'empresa': empresa,
                         'fecha_actual': fecha_zip,
                         'ciudad': ciudad_zip,
-                        'es_plan_semilla': _es_plan_semilla(request.user),
+                        'es_plan_semilla': es_plan_semilla,
                     }
 
-                    template = get_template('anexo_40h.html')
-                    html = template.render(context)
-                    
-                    pdf_buffer = io.BytesIO()
-                    pisa_status = pisa.CreatePDF(html, dest=pdf_buffer)
-                    
-                    if not pisa_status.err:
-                        nombre_archivo = f"Anexo_40h_{empleado.rut}.pdf"
-                        zip_file.writestr(nombre_archivo, pdf_buffer.getvalue())
-                        
+                    pdf = TrabajoPdf('anexo_40h.html', context, f"Anexo_40h_{empleado.rut}", documento=empleado)
                 except Exception as e:
                     print(f"Error fatal saltando empleado {emp_id} en ZIP: {e}")
-                    continue 
-        
-        zip_buffer.seek(0)
-        response = HttpResponse(zip_buffer, content_type='application/zip')
+                    continue
+                yield f"Anexo_40h_{empleado.rut}.pdf", pdf
+
+        response = StreamingHttpResponse(_zip_en_streaming(renderizar_en_orden(entradas())), content_type='application/zip')
         response['Content-Disposition'] = 'attachment; filename="Anexos_Masivos_40h.zip"'
         return response
 
@@ -1441,6 +1326,146 @@ class EmpleadoViewSet(viewsets.ModelViewSet):
         return Response(campos)
 
 
+# ==========================================
+# EXPORTACIONES EN SEGUNDO PLANO
+# ==========================================
+_TIPOS_LEGALES_EXPEDIENTE = {
+    'amonestaciones': 'AMONESTACION', 'despidos': 'DESPIDO',
+    'mutuo_acuerdo': 'MUTUO_ACUERDO', 'constancias': 'CONSTANCIA',
+}
+
+
+def _contar_documentos_expediente(empleados_ids, documentos, cantidad_liquidaciones):
+    """Cuántos PDF debería tener el expediente (para el avance del ExportJob)."""
+    total = 0
+    contratos = Contrato.objects.filter(empleado_id__in=empleados_ids)
+    if 'contrato' in documentos:
+        total += contratos.count()
+    if 'anexo_40h' in documentos:
+        total += contratos.count()
+    if 'liquidaciones' in documentos and cantidad_liquidaciones > 0:
+        por_empleado = (
+            Liquidacion.objects.filter(empleado_id__in=empleados_ids)
+            .values('empleado_id').annotate(n=Count('id')).values_list('n', flat=True)
+        )
+        total += sum(min(n, cantidad_liquidaciones) for n in por_empleado)
+    tipos_legales = [t for clave, t in _TIPOS_LEGALES_EXPEDIENTE.items() if clave in documentos]
+    if tipos_legales:
+        total += DocumentoLegal.objects.filter(empleado_id__in=empleados_ids, tipo__in=tipos_legales).count()
+    if 'anexos_contrato' in documentos:
+        total += AnexoContrato.objects.filter(contrato__empleado_id__in=empleados_ids).count()
+    return total
+
+
+def procesar_export_job(job):
+    """
+    Arma el ZIP de un ExportJob reclamado por el worker (core/trabajos.py):
+    genera los PDF uno a uno reportando el avance, escribe el ZIP en un
+    archivo temporal y lo sube al storage configurado.
+    """
+    params = job.parametros
+    empleados = Empleado.objects.filter(
+        id__in=params.get('empleados', []), empresa=job.empresa,
+    ).order_by('ficha_numero', 'apellido_paterno')
+
+    def entradas_con_avance():
+        generador = EmpleadoViewSet()._entradas_expediente(
+            empleados, params.get('documentos', []), params.get('cantidad_liquidaciones', 1),
+        )
+        for i, entrada in enumerate(renderizar_en_orden(generador), 1):
+            yield entrada
+            reportar_avance(job, i)
+
+    with tempfile.TemporaryFile() as tmp:
+        for parte in _zip_en_streaming(entradas_con_avance()):
+            tmp.write(parte)
+        tmp.seek(0)
+        nombre_zip = f"Expedientes_{job.empresa.nombre_legal.replace(' ', '_')}_{datetime.date.today()}.zip"
+        job.archivo.save(nombre_zip, File(tmp), save=False)
+
+    job.estado = 'COMPLETADO'
+    job.total = max(job.total, job.procesados)
+    job.error = ''
+    job.terminado_en = timezone.now()
+    job.save()
+
+
+class ExportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    POST /api/exportaciones/  → encola la exportación y responde 202.
+    GET  /api/exportaciones/<id>/ → estado, progreso y url_descarga al terminar.
+    """
+    serializer_class = ExportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    MAX_TRABAJOS_ACTIVOS = 3
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(owner=self.request.user)
+
+    def create(self, request):
+        if not _plan_permite(request.user, 3):
+            return Response(
+                {'error': 'La descarga masiva de expedientes en ZIP está disponible desde el plan Pyme. Mejora tu suscripción para acceder.'},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        data = request.data
+        documentos = data.get('documentos', [])
+        if not documentos:
+            return Response({'error': 'Debes seleccionar al menos un tipo de documento'}, status=400)
+        try:
+            cantidad_liquidaciones = min(int(data.get('cantidad_liquidaciones', 1)), 12)
+        except (TypeError, ValueError):
+            return Response({'error': 'cantidad_liquidaciones debe ser numérico.'}, status=400)
+
+        try:
+            empresa = Empresa.objects.get(id=data.get('empresa_id'), owner=request.user)
+        except (Empresa.DoesNotExist, ValueError, TypeError):
+            return Response({'error': 'Empresa no encontrada o no autorizada.'}, status=404)
+
+        # Sin lista de trabajadores se exporta la empresa completa
+        empleados = Empleado.objects.filter(empresa=empresa)
+        if data.get('empleados'):
+            empleados = empleados.filter(id__in=data.get('empleados'))
+        else:
+            empleados = empleados.filter(activo=True)
+        empleados_ids = list(empleados.values_list('id', flat=True))
+        if not empleados_ids:
+            return Response({'error': 'No se encontraron trabajadores válidos'}, status=404)
+
+        activos = ExportJob.objects.filter(owner=request.user, estado__in=['PENDIENTE', 'PROCESANDO']).count()
+        if activos >= self.MAX_TRABAJOS_ACTIVOS:
+            return Response(
+                {'error': f'Ya tienes {activos} exportaciones en curso. Espera a que terminen.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+
+        job = ExportJob.objects.create(
+            owner=request.user, empresa=empresa, tipo='EXPEDIENTES',
+            parametros={
+                'empleados': empleados_ids,
+                'documentos': documentos,
+                'cantidad_liquidaciones': cantidad_liquidaciones,
+            },
+            total=_contar_documentos_expediente(empleados_ids, documentos, cantidad_liquidaciones),
+        )
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ImportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    GET /api/importaciones/<id>/ → estado, progreso y resumen de una
+    importación encolada con carga_masiva?asincrono=1.
+    """
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    MAX_TRABAJOS_ACTIVOS = 3
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(owner=self.request.user)
+
+
 class ContratoViewSet(viewsets.ModelViewSet):
     serializer_class = ContratoSerializer
     permission_classes = [IsAuthenticated]
@@ -1693,22 +1718,17 @@ class AnexoContratoViewSet(viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=500)
 
 
-class LiquidacionViewSet(viewsets.ModelViewSet):
-    queryset = Liquidacion.objects.all().order_by('-anio', '-mes')
-    serializer_class = LiquidacionSerializer
-    permission_classes = [IsAuthenticated]
+def _indicadores_periodo(mes, anio):
+    """UF y UTM que corresponden a un período de remuneraciones (mes/año)."""
+    try:
+        mes, anio = int(mes), int(anio)
+        fecha_uf = fecha_uf_periodo(mes, anio)
+    except (TypeError, ValueError):
+        return obtener_uf(), obtener_utm()
+    return obtener_uf(fecha_uf), obtener_utm(mes, anio)
 
-    def get_queryset(self):
-        # Solo liquidaciones de empleados que pertenecen al usuario autenticado
-        queryset = Liquidacion.objects.filter(
-            empleado__empresa__owner=self.request.user
-        ).order_by('-anio', '-mes')
-        empleado_id = self.request.query_params.get('empleado', None)
-        if empleado_id is not None:
-            queryset = queryset.filter(empleado_id=empleado_id)
-        return queryset
 
-    def _calcular_liquidacion(contrato, empleado, data):
+def _calcular_liquidacion(contrato, empleado, data, valor_uf=None, valor_utm=None, mes=None, anio=None):
     """
     Calcula todos los campos derivados de una liquidación (haberes, descuentos
     legales, impuesto único y totales) a partir de los datos de asistencia y
@@ -1717,93 +1737,37 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
     Usada tanto por LiquidacionViewSet.create() como por .update(), para que
     editar una liquidación existente recalcule los totales de la misma forma
     que al crearla (en vez de dejarlos congelados con los valores viejos).
-    """
-    # 1. ASISTENCIA
-    dias_trabajados = int(data.get('dias_trabajados', 30))
-    dias_ausencia = int(data.get('dias_ausencia', 0))
-    dias_licencia = int(data.get('dias_licencia', 0))
-    dias_no_contratados = int(data.get('dias_no_contratados', 0))
-
-    # Los días a pagar de sueldo base son 30 menos las ausencias y licencias
-    dias_a_pagar = 30 - dias_ausencia - dias_licencia - dias_no_contratados
-    if dias_a_pagar < 0: dias_a_pagar = 0
-
-    # 2. ARREGLOS DINÁMICOS (JSON)
-    detalle_imponibles = data.get('detalle_haberes_imponibles', [])
-    detalle_no_imponibles = data.get('detalle_haberes_no_imponibles', [])
-    detalle_horas_extras = data.get('detalle_horas_extras', [])
-    detalle_otros_descuentos = data.get('detalle_otros_descuentos', [])
-
-    # Sumas matemáticas de los arreglos
-    suma_imponibles_extra = sum(int(item.get('valor', 0)) for item in detalle_imponibles)
-    suma_horas_extras = sum(int(item.get('valor', 0)) for item in detalle_horas_extras)
-    suma_no_imponibles = sum(int(item.get('valor', 0)) for item in detalle_no_imponibles)
-    suma_otros_descuentos = sum(int(item.get('valor', 0)) for item in detalle_otros_descuentos)
-
-    # 3. CÁLCULO DE HABERES
-    sueldo_base_mensual = contrato.sueldo_base
-    sueldo_base_proporcional = math.floor((sueldo_base_mensual / 30) * dias_a_pagar)
-
-    # Gratificación
-    tope_gratificacion = 200000
-    base_gratificacion = sueldo_base_proporcional + suma_imponibles_extra + suma_horas_extras
-    gratificacion_calculada = math.floor(base_gratificacion * 0.25)
-    gratificacion_final = min(gratificacion_calculada, tope_gratificacion) if contrato.gratificacion_legal == 'MENSUAL' else 0
-
-    total_imponible = base_gratificacion + gratificacion_final
-    total_haberes = total_imponible + suma_no_imponibles
-
-    # 4. CÁLCULO DE DESCUENTOS LEGALES
-    tasas_afp = {
-        'MODELO': 0.1058, 'HABITAT': 0.1127, 'PROVIDA': 0.1145,
-        'CAPITAL': 0.1144, 'CUPRUM': 0.1144, 'PLANVITAL': 0.1116, 'UNO': 0.1049
-    }
-    nombre_afp = (empleado.afp or 'MODELO').upper()
-    tasa_afp = tasas_afp.get(nombre_afp, 0.11)
-    afp_monto = math.floor(total_imponible * tasa_afp)
-
-    # Salud (Isapre UF vs Fonasa 7%)
-    valor_uf = obtener_uf()
-    salud_nombre = (empleado.sistema_salud or 'FONASA').upper()
-    if salud_nombre == 'ISAPRE' and empleado.plan_isapre_uf > 0:
-        salud_monto = math.floor(float(empleado.plan_isapre_uf) * valor_uf)
-        isapre_uf = empleado.plan_isapre_uf
-        # La ley exige descontar al menos el 7%, si el plan UF es menor, se cobra 7%
-        minimo_legal = math.floor(total_imponible * 0.07)
-        if salud_monto < minimo_legal:
-            salud_monto = minimo_legal
-    else:
-        salud_monto = math.floor(total_imponible * 0.07)
-        isapre_uf = 0
-
-    # Seguro Cesantía
-    seguro_cesantia = math.floor(total_imponible * 0.006) if contrato.tipo_contrato == 'INDEFINIDO' else 0
 
-    # Impuesto Único de Segunda Categoría
-    base_tributable = total_imponible - afp_monto - salud_monto - seguro_cesantia
-    impuesto_unico = calcular_impuesto_unico(base_tributable, obtener_utm())
+    El cálculo en sí vive en motor_liquidaciones.py: esto es un lote de una
+    sola fila, así el proceso masivo y la edición individual no pueden dar
+    montos distintos.
 
-    # Quincena y otros
-    anticipo_quincena = contrato.monto_quincena if contrato.tiene_quincena else 0
-    total_descuentos = afp_monto + salud_monto + seguro_cesantia + impuesto_unico + anticipo_quincena + suma_otros_descuentos
-
-    # 5. SUELDO LÍQUIDO FINAL
-    sueldo_liquido = total_haberes - total_descuentos
-
-    return {
-        'dias_trabajados': dias_trabajados, 'dias_licencia': dias_licencia,
-        'dias_ausencia': dias_ausencia, 'dias_no_contratados': dias_no_contratados,
-        'sueldo_base': sueldo_base_proporcional, 'gratificacion': gratificacion_final,
-        'detalle_haberes_imponibles': detalle_imponibles,
-        'detalle_horas_extras': detalle_horas_extras,
-        'detalle_haberes_no_imponibles': detalle_no_imponibles,
-        'detalle_otros_descuentos': detalle_otros_descuentos,
-        'afp_nombre': nombre_afp, 'afp_monto': afp_monto,
-        'salud_nombre': salud_nombre, 'isapre_cotizacion_uf': isapre_uf, 'salud_monto': salud_monto,
-        'seguro_cesantia': seguro_cesantia, 'impuesto_unico': impuesto_unico, 'anticipo_quincena': anticipo_quincena,
-        'total_imponible': total_imponible, 'total_haberes': total_haberes,
-        'total_descuentos': total_descuentos, 'sueldo_liquido': sueldo_liquido,
-    }
+    valor_uf / valor_utm permiten pasar los indicadores ya resueltos (proceso
+    masivo de un período); si no vienen, se usan los del período mes/anio
+    (o los vigentes hoy si tampoco viene el período).
+    """
+    if valor_uf is None or valor_utm is None:
+        uf_periodo, utm_periodo = _indicadores_periodo(mes, anio)
+        valor_uf = uf_periodo if valor_uf is None else valor_uf
+        valor_utm = utm_periodo if valor_utm is None else valor_utm
+    return calcular_lote([(contrato, empleado, data)], valor_uf, valor_utm)[0]
+
+
+# Campos de entrada que alimentan _calcular_liquidacion (asistencia + detalles).
+_CAMPOS_EDITABLES_LIQUIDACION = [
+    'dias_trabajados', 'dias_ausencia', 'dias_licencia', 'dias_no_contratados',
+    'detalle_haberes_imponibles', 'detalle_horas_extras',
+    'detalle_haberes_no_imponibles', 'detalle_otros_descuentos',
+]
+# Montos que _calcular_liquidacion deriva de los campos anteriores.
+_CAMPOS_CALCULADOS_LIQUIDACION = [
+    'sueldo_base', 'gratificacion', 'afp_nombre', 'afp_monto',
+    'salud_nombre', 'isapre_cotizacion_uf', 'salud_monto',
+    'seguro_cesantia', 'impuesto_unico', 'anticipo_quincena',
+    'total_imponible', 'total_haberes', 'total_descuentos', 'sueldo_liquido',
+    'total_otros_imponibles', 'total_horas_extras', 'total_no_imponibles',
+    'total_otros_descuentos', 'total_ley',
+]
 
 
 class LiquidacionViewSet(viewsets.ModelViewSet):
@@ -1833,7 +1797,9 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
             if not contrato:
                 return Response({'error': 'El trabajador no tiene un contrato activo.'}, status=status.HTTP_400_BAD_REQUEST)
 
-            calculado = _calcular_liquidacion(contrato, empleado, data)
+            calculado = _calcular_liquidacion(
+                contrato, empleado, data, mes=data.get('mes'), anio=data.get('anio'),
+            )
 
             liquidacion = Liquidacion.objects.create(
                 empleado=empleado, mes=data.get('mes'), anio=data.get('anio'),
@@ -1845,6 +1811,8 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
 
         except Empleado.DoesNotExist:
             return Response({'error': 'Trabajador no encontrado o no autorizado.'}, status=status.HTTP_404_NOT_FOUND)
+        except IndicadorNoDisponible as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except IntegrityError:
             return Response(
                 {'error': 'Ya existe una liquidación para este trabajador en el período indicado.'},
@@ -1862,33 +1830,33 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
             return Response({'error': 'El trabajador no tiene un contrato activo.'}, status=status.HTTP_400_BAD_REQUEST)
 
         data = request.data
-        campos_editables = [
-            'dias_trabajados', 'dias_ausencia', 'dias_licencia', 'dias_no_contratados',
-            'detalle_haberes_imponibles', 'detalle_horas_extras',
-            'detalle_haberes_no_imponibles', 'detalle_otros_descuentos',
-        ]
         # Combina lo que venga en el request con lo que ya estaba guardado,
         # así un PATCH parcial recalcula usando el resto de los valores tal
         # como estaban, en vez de perderlos.
         datos_para_calculo = {
-            campo: data.get(campo, getattr(instance, campo)) for campo in campos_editables
+            campo: data.get(campo, getattr(instance, campo)) for campo in _CAMPOS_EDITABLES_LIQUIDACION
         }
 
+        # Si el PATCH cambia el período, se calcula con la UF/UTM del período nuevo
+        instance.mes = data.get('mes', instance.mes)
+        instance.anio = data.get('anio', instance.anio)
+
         try:
-            calculado = _calcular_liquidacion(contrato, empleado, datos_para_calculo)
+            calculado = _calcular_liquidacion(
+                contrato, empleado, datos_para_calculo, mes=instance.mes, anio=instance.anio,
+            )
 
             for campo, valor in calculado.items():
                 setattr(instance, campo, valor)
 
-            instance.mes = data.get('mes', instance.mes)
-            instance.anio = data.get('anio', instance.anio)
-
             # El PDF generado antes de este cambio ya no refleja los montos
             # recalculados — se limpia para forzar que se regenere.
             if instance.archivo_pdf:
                 instance.archivo_pdf.delete(save=False)
 
             instance.save()
+        except IndicadorNoDisponible as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except IntegrityError:
             return Response(
                 {'error': 'Ya existe una liquidación para este trabajador en el período indicado.'},
@@ -1899,7 +1867,155 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
 
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
-        
+
+    @action(detail=False, methods=['post'], url_path='procesar_periodo')
+    def procesar_periodo(self, request):
+        """
+        POST body:
+          empresa: int
+          mes, anio: int
+          empleados: [id, ...] (opcional — por defecto todos los activos)
+          overrides: {"<empleado_id>": {dias_ausencia, detalle_horas_extras, ...}}
+
+        Calcula en una sola pasada las liquidaciones del período para todos
+        los trabajadores de la empresa. Las que ya existen se recalculan
+        (igual que update()) y las nuevas se crean; todo se escribe con
+        bulk_create/bulk_update en vez de una petición por trabajador.
+        """
+        if not _plan_permite(request.user, 3):
+            return Response(
+                {'error': 'El proceso masivo de liquidaciones está disponible desde el plan Pyme. Mejora tu suscripción para acceder.'},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        data = request.data
+        try:
+            mes = int(data.get('mes'))
+            anio = int(data.get('anio'))
+        except (TypeError, ValueError):
+            return Response({'error': 'Se requieren los parámetros mes y anio numéricos.'}, status=400)
+        if not 1 <= mes <= 12:
+            return Response({'error': 'El mes debe estar entre 1 y 12.'}, status=400)
+
+        overrides = data.get('overrides') or {}
+        if not isinstance(overrides, dict):
+            return Response({'error': 'overrides debe ser un objeto {empleado_id: datos}.'}, status=400)
+        overrides = {str(k): v for k, v in overrides.items() if isinstance(v, dict)}
+
+        try:
+            empresa = Empresa.objects.get(id=data.get('empresa'), owner=request.user)
+        except (Empresa.DoesNotExist, ValueError, TypeError):
+            return Response({'error': 'Empresa no encontrada o no autorizada.'}, status=404)
+
+        # 1 query: trabajadores + contrato (OneToOne) — 1 query: liquidaciones existentes
+        empleados_qs = (
+            Empleado.objects.filter(empresa=empresa, activo=True)
+            .select_related('contrato_activo')
+            .order_by('ficha_numero', 'apellido_paterno')
+        )
+        empleados_ids = data.get('empleados')
+        if empleados_ids:
+            if not isinstance(empleados_ids, list) or not all(
+                isinstance(i, int) and not isinstance(i, bool) for i in empleados_ids
+            ):
+                return Response({'error': 'empleados debe ser una lista de ids numéricos.'}, status=400)
+            empleados_qs = empleados_qs.filter(id__in=empleados_ids)
+        empleados = list(empleados_qs)
+        if not empleados:
+            return Response({'error': 'No se encontraron trabajadores válidos.'}, status=404)
+
+        existentes = {
+            liq.empleado_id: liq
+            for liq in Liquidacion.objects.filter(empleado__in=empleados, mes=mes, anio=anio)
+        }
+
+        # Los indicadores son los mismos para todo el período: se resuelven una vez
+        try:
+            valor_uf, valor_utm = _indicadores_periodo(mes, anio)
+        except IndicadorNoDisponible as e:
+            return Response({'error': str(e)}, status=400)
+
+        # Primera pasada: normalizar datos por trabajador (las filas inválidas
+        # se omiten sin botar el resto del período).
+        pendientes, resultados = [], []
+        for emp in empleados:
+            resultado = {
+                'empleado': emp.id,
+                'rut': emp.rut,
+                'nombre': f"{emp.nombres} {emp.apellido_paterno}",
+            }
+            resultados.append(resultado)
+
+            contrato = getattr(emp, 'contrato_activo', None)
+            if contrato is None:
+                resultado.update(estado='OMITIDA', error='El trabajador no tiene un contrato activo.')
+                continue
+
+            override = overrides.get(str(emp.id), {})
+            liquidacion = existentes.get(emp.id)
+            if liquidacion is not None:
+                datos = {c: override.get(c, getattr(liquidacion, c)) for c in _CAMPOS_EDITABLES_LIQUIDACION}
+            else:
+                datos = override
+
+            try:
+                fila = leer_fila(contrato, emp, datos)
+            except (ValueError, TypeError, AttributeError) as e:
+                resultado.update(estado='OMITIDA', error=f'Datos inválidos: {e}')
+                continue
+            pendientes.append((emp, liquidacion, resultado, fila))
+
+        # Segunda pasada: todo el período se calcula de una vez sobre columnas
+        calculados = calcular_filas([p[3] for p in pendientes], valor_uf, valor_utm)
+
+        nuevas, modificadas, pdfs_viejos = [], [], []
+        for (emp, liquidacion, resultado, _), calculado in zip(pendientes, calculados):
+            if liquidacion is not None:
+                for campo, valor in calculado.items():
+                    setattr(liquidacion, campo, valor)
+                # Igual que update(): el PDF viejo ya no refleja los montos. El
+                # archivo se borra recién cuando la transacción confirma.
+                if liquidacion.archivo_pdf:
+                    pdfs_viejos.append((liquidacion.archivo_pdf.storage, liquidacion.archivo_pdf.name))
+                    liquidacion.archivo_pdf = None
+                modificadas.append(liquidacion)
+                resultado['estado'] = 'ACTUALIZADA'
+            else:
+                liquidacion = Liquidacion(empleado=emp, mes=mes, anio=anio, **calculado)
+                nuevas.append(liquidacion)
+                resultado['estado'] = 'CREADA'
+            resultado['_liquidacion'] = liquidacion
+
+        campos_update = _CAMPOS_EDITABLES_LIQUIDACION + _CAMPOS_CALCULADOS_LIQUIDACION + ['archivo_pdf']
+        try:
+            with transaction.atomic():
+                Liquidacion.objects.bulk_create(nuevas, batch_size=500)
+                Liquidacion.objects.bulk_update(modificadas, campos_update, batch_size=500)
+                # bulk_* no dispara las señales que mantienen ResumenMensual
+                resumenes.recalcular(empresa.id, anio, mes)
+                for storage, nombre in pdfs_viejos:
+                    transaction.on_commit(lambda s=storage, n=nombre: s.delete(n))
+        except IntegrityError:
+            return Response(
+                {'error': 'Otra operación creó liquidaciones para este período en paralelo. Vuelve a intentarlo.'},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        for resultado in resultados:
+            liquidacion = resultado.pop('_liquidacion', None)
+            if liquidacion is not None:
+                resultado['liquidacion'] = liquidacion.id
+                resultado['sueldo_liquido'] = liquidacion.sueldo_liquido
+
+        return Response({
+            'empresa': empresa.id,
+            'mes': mes,
+            'anio': anio,
+            'creadas': len(nuevas),
+            'actualizadas': len(modificadas),
+            'omitidas': sum(1 for r in resultados if r['estado'] == 'OMITIDA'),
+            'resultados': resultados,
+        }, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['get'])
     def generar_pdf(self, request, pk=None):
         try:
@@ -1916,16 +2032,9 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
             sueldo_seguro = int(liquidacion.sueldo_liquido or 0)
             liquido_palabras = num2words(sueldo_seguro, lang='es')
 
-            det_no_imp = liquidacion.detalle_haberes_no_imponibles
-            if not isinstance(det_no_imp, list): det_no_imp = []
-            suma_no_imponibles = sum(int(item.get('valor', 0)) for item in det_no_imp if isinstance(item, dict))
-
-            det_otros_dsctos = liquidacion.detalle_otros_descuentos
-            if not isinstance(det_otros_dsctos, list): det_otros_dsctos = []
-            suma_otros_descuentos = sum(int(item.get('valor', 0)) for item in det_otros_dsctos if isinstance(item, dict))
-            
-            total_ley = (liquidacion.afp_monto or 0) + (liquidacion.salud_monto or 0) + (liquidacion.seguro_cesantia or 0) + (liquidacion.impuesto_unico or 0)
-            total_otros_dsctos = (liquidacion.anticipo_quincena or 0) + suma_otros_descuentos
+            suma_no_imponibles = liquidacion.total_no_imponibles
+            total_ley = liquidacion.total_ley
+            total_otros_dsctos = (liquidacion.anticipo_quincena or 0) + liquidacion.total_otros_descuentos
 
             context = {
                 'liquidacion': liquidacion,
@@ -1940,19 +2049,15 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
                 'es_plan_semilla': es_plan_semilla
             }
 
-            template = get_template('liquidacion.html')
-            html = template.render(context)
-
-            response = HttpResponse(content_type='application/pdf')
             nombre_archivo = f'Liquidacion_{liquidacion.mes}_{liquidacion.anio}_{empleado.rut}.pdf'
-            response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
-
-            pisa_status = pisa.CreatePDF(html, dest=response)
-
-            if pisa_status.err:
-                print("Error interno de pisa (xhtml2pdf)")
+            try:
+                pdf_bytes = renderizar_pdf('liquidacion.html', context, nombre_archivo, documento=liquidacion)
+            except Exception:
+                logger.exception('Error interno de pisa (xhtml2pdf)')
                 return Response({'error': 'Error al generar PDF'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            
+
+            response = HttpResponse(pdf_bytes, content_type='application/pdf')
+            response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
             return response
 
         except Exception as e:
@@ -1981,7 +2086,7 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
         qs = Liquidacion.objects.filter(
             empleado__empresa__owner=request.user,
             mes=mes, anio=anio,
-        ).select_related('empleado', 'empleado__empresa')
+        )
 
         if empresa_id:
             qs = qs.filter(empleado__empresa_id=empresa_id)
@@ -1989,132 +2094,60 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
         if not qs.exists():
             return Response({'error': 'No hay liquidaciones para el período seleccionado.'}, status=404)
 
-        lineas = []
-        for liq in qs:
-            emp = liq.empleado
-            empresa = emp.empresa
-            contrato = Contrato.objects.filter(empleado=emp).first()
-
-            # ── Identificación trabajador ──────────────────────────────────
-            rut_num, rut_dv = _rut_partes(emp.rut)
-            apellido_m = emp.apellido_materno or ''
-            sexo_cod = '2' if emp.sexo == 'F' else '1'
-            fecha_nac = _fmt_fecha_previred(emp.fecha_nacimiento)
-            fecha_ing = _fmt_fecha_previred(emp.fecha_ingreso)
-            tipo_trab = '01'
-            nac_cod = '152'  # Chile
-
-            # ── Contrato ───────────────────────────────────────────────────
-            dias_trab = str(int(liq.dias_trabajados or 30))
-            tipo_ctto = _TIPO_CONTRATO_PREVIRED.get(
-                contrato.tipo_contrato if contrato else 'INDEFINIDO', '1'
-            )
-            es_indefinido = contrato.tipo_contrato == 'INDEFINIDO' if contrato else False
-            movimiento = '0'  # vigente
-            rut_emp_num, rut_emp_dv = _rut_partes(empresa.rut)
-
-            # ── AFP ────────────────────────────────────────────────────────
-            nombre_afp = (liq.afp_nombre or 'MODELO').upper()
-            cod_afp = _AFP_CODIGOS_PREVIRED.get(nombre_afp, '08')
-            renta_imp = int(liq.total_imponible or 0)
-            cotiz_afp = str(int(liq.afp_monto or 0))
-            sis = str(math.floor(renta_imp * _TASA_SIS))
-
-            # ── Salud ──────────────────────────────────────────────────────
-            sistema = (liq.salud_nombre or 'FONASA').upper()
-            if sistema == 'FONASA':
-                cod_salud = '00'
-            else:
-                cod_salud = _ISAPRE_CODIGOS_PREVIRED.get(sistema, '00')
-            cotiz_salud = str(int(liq.salud_monto or 0))
-            uf_isapre = str(float(liq.isapre_cotizacion_uf or 0))
-
-            # ── Mutual AT/EP ───────────────────────────────────────────────
-            cotiz_mutual = str(math.floor(renta_imp * _TASA_MUTUAL_AT))
-
-            # ── AFC Cesantía ───────────────────────────────────────────────
-            ind_afc = '1' if es_indefinido else '0'
-            cotiz_afc_trab = str(int(liq.seguro_cesantia or 0))
-            if es_indefinido:
-                cotiz_afc_emp = str(math.floor(renta_imp * _TASA_AFC_EMP_INDEFINIDO))
-            elif contrato and contrato.tipo_contrato == 'PLAZO_FIJO':
-                cotiz_afc_emp = str(math.floor(renta_imp * _TASA_AFC_EMP_PLAZO))
-            else:
-                cotiz_afc_emp = '0'
-            renta_imp_afc = str(renta_imp) if es_indefinido else '0'
+        meses_nombres = [
+            'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
+            'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre',
+        ]
+        nombre_archivo = f'Previred_{meses_nombres[mes - 1]}_{anio}.txt'
+        response = StreamingHttpResponse(_lineas_previred(qs), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+        return response
 
-            # ── Reforma 2025 ───────────────────────────────────────────────
-            tipo_jornada_code = _TIPO_JORNADA_PREVIRED.get(
-                contrato.tipo_jornada if contrato else 'ORDINARIA', '1'
+    @action(detail=False, methods=['get'], url_path='exportar_previred_masivo')
+    def exportar_previred_masivo(self, request):
+        """
+        Archivos Previred de varias empresas del usuario en un solo ZIP (uno
+        por empresa). ?empresas=1,2,3 limita la selección; sin él van todas.
+        """
+        if not _plan_permite(request.user, 3):
+            return Response(
+                {'error': 'La exportación Previred está disponible desde el plan Pyme. Mejora tu suscripción para acceder.'},
+                status=status.HTTP_403_FORBIDDEN,
             )
-            cotiz_expectativa = str(math.floor(renta_imp * _TASA_EXPECTATIVA_VIDA))
-
-            # ── Construir array de 105 campos (base cero) ──────────────────
-            campos = ['0'] * 105
-
-            # Trabajador / contrato (campos 1-17, índices 0-16)
-            campos[0]  = rut_num
-            campos[1]  = rut_dv
-            campos[2]  = emp.apellido_paterno
-            campos[3]  = apellido_m
-            campos[4]  = emp.nombres
-            campos[5]  = sexo_cod
-            campos[6]  = fecha_nac
-            campos[7]  = nac_cod
-            campos[8]  = tipo_trab
-            campos[9]  = fecha_ing
-            campos[10] = ''   # fecha término (activo)
-            campos[11] = ''   # causal término
-            campos[12] = dias_trab
-            campos[13] = tipo_ctto
-            campos[14] = movimiento
-            campos[15] = rut_emp_num
-            campos[16] = rut_emp_dv
-            # índices 17-23: padding → '0' (ya inicializados)
-
-            # AFP (campos 25-28, índices 24-27)
-            campos[24] = cod_afp
-            campos[25] = str(renta_imp)
-            campos[26] = cotiz_afp
-            campos[27] = sis
-            # índices 28-43: extras AFP → '0'
-
-            # Salud (campos 45-48, índices 44-47)
-            campos[44] = cod_salud
-            campos[45] = str(renta_imp)
-            campos[46] = cotiz_salud
-            campos[47] = uf_isapre
-            # índices 48-59: extras salud → '0'
-
-            # Mutual AT/EP (campos 61-63, índices 60-62)
-            campos[60] = _MUTUAL_DEFAULT
-            campos[61] = str(renta_imp)
-            campos[62] = cotiz_mutual
-            # índices 63-69: extras mutual → '0'
-
-            # AFC (campos 71-74, índices 70-73)
-            campos[70] = ind_afc
-            campos[71] = renta_imp_afc
-            campos[72] = cotiz_afc_trab
-            campos[73] = cotiz_afc_emp
-            # índices 74-84: extras AFC → '0'
-
-            # Reforma 2025 (campos 86-88, índices 85-87)
-            campos[85] = '0'               # RIMA
-            campos[86] = tipo_jornada_code # tipo jornada ley 40h
-            campos[87] = cotiz_expectativa # expectativa de vida 0.9%
-            # índices 88-104: extras → '0'
-
-            lineas.append(';'.join(campos))
+        mes_param = request.query_params.get('mes')
+        anio_param = request.query_params.get('anio')
+        empresas_param = request.query_params.get('empresas', '')
+
+        if not mes_param or not anio_param:
+            return Response({'error': 'Se requieren los parámetros mes y anio.'}, status=400)
+        try:
+            mes = int(mes_param)
+            anio = int(anio_param)
+            empresas_ids = [int(e) for e in empresas_param.split(',') if e.strip()]
+        except ValueError:
+            return Response({'error': 'Parámetros mes, anio y empresas deben ser numéricos.'}, status=400)
+        if not 1 <= mes <= 12:
+            return Response({'error': 'El mes debe estar entre 1 y 12.'}, status=400)
+
+        qs = Liquidacion.objects.filter(
+            empleado__empresa__owner=request.user,
+            mes=mes, anio=anio,
+        )
+        if empresas_ids:
+            qs = qs.filter(empleado__empresa_id__in=empresas_ids)
+
+        if not qs.exists():
+            return Response({'error': 'No hay liquidaciones para el período seleccionado.'}, status=404)
 
         meses_nombres = [
             'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
             'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre',
         ]
-        nombre_archivo = f'Previred_{meses_nombres[mes - 1]}_{anio}.txt'
-        contenido = '\n'.join(lineas)
-        response = HttpResponse(contenido, content_type='text/plain; charset=utf-8')
-        response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+        sufijo = f'{meses_nombres[mes - 1]}_{anio}'
+        response = StreamingHttpResponse(
+            _zip_en_streaming(_archivos_previred(qs, sufijo)), content_type='application/zip',
+        )
+        response['Content-Disposition'] = f'attachment; filename="Previred_{sufijo}.zip"'
         return response
 
     @action(detail=False, methods=['get'], url_path='libro_remuneraciones')
@@ -2162,68 +2195,58 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
             return f'${int(n):,}'.replace(',', '.')
 
         # ── Preparación de filas (compartido por Excel y PDF) ─────────────────
+        # Los subtotales de cada detalle ya vienen guardados en la liquidación,
+        # así que no se lee ningún JSON: solo columnas, y los totales con SUM.
         filas = []
-        totales = {k: 0 for k in [
-            'sueldo_base', 'gratificacion', 'otros_imp', 'total_imponible',
-            'no_imponibles', 'total_haberes', 'cotiz_afp', 'cotiz_salud',
-            'cesantia', 'imp_unico', 'anticipo', 'otros_desc',
+        for liq in qs.values(
+            'empleado__ficha_numero', 'empleado__rut', 'empleado__apellido_paterno',
+            'empleado__apellido_materno', 'empleado__nombres', 'empleado__cargo',
+            'dias_trabajados', 'sueldo_base', 'gratificacion', 'total_otros_imponibles',
+            'total_horas_extras', 'total_imponible', 'total_no_imponibles', 'total_haberes',
+            'afp_nombre', 'afp_monto', 'salud_nombre', 'salud_monto', 'seguro_cesantia',
+            'impuesto_unico', 'anticipo_quincena', 'total_otros_descuentos',
             'total_descuentos', 'sueldo_liquido',
-        ]}
-
-        for liq in qs:
-            emp = liq.empleado
-            det_imp = liq.detalle_haberes_imponibles or []
-            if not isinstance(det_imp, list): det_imp = []
-            det_hex = liq.detalle_horas_extras or []
-            if not isinstance(det_hex, list): det_hex = []
-            det_noi = liq.detalle_haberes_no_imponibles or []
-            if not isinstance(det_noi, list): det_noi = []
-            det_odc = liq.detalle_otros_descuentos or []
-            if not isinstance(det_odc, list): det_odc = []
-
-            otros_imp  = sum(int(d.get('valor', 0)) for d in det_imp if isinstance(d, dict))
-            otros_imp += sum(int(d.get('valor', 0)) for d in det_hex if isinstance(d, dict))
-            no_impon   = sum(int(d.get('valor', 0)) for d in det_noi if isinstance(d, dict))
-            otros_desc = sum(int(d.get('valor', 0)) for d in det_odc if isinstance(d, dict))
-
+        ).iterator(chunk_size=1000):
             filas.append({
-                'ficha':        emp.ficha_numero or '',
-                'rut':          emp.rut,
-                'nombre':       f'{emp.apellido_paterno} {emp.apellido_materno or ""} {emp.nombres}'.strip(),
-                'cargo':        emp.cargo or '',
-                'dias':         liq.dias_trabajados,
-                'sueldo_base':  int(liq.sueldo_base),
-                'gratificacion':int(liq.gratificacion),
-                'otros_imp':    otros_imp,
-                'total_imp':    int(liq.total_imponible),
-                'no_imp':       no_impon,
-                'total_hab':    int(liq.total_haberes),
-                'afp_nombre':   liq.afp_nombre or '',
-                'cotiz_afp':    int(liq.afp_monto),
-                'salud_nombre': liq.salud_nombre or '',
-                'cotiz_salud':  int(liq.salud_monto),
-                'cesantia':     int(liq.seguro_cesantia),
-                'imp_unico':    int(liq.impuesto_unico or 0),
-                'anticipo':     int(liq.anticipo_quincena or 0),
-                'otros_desc':   otros_desc,
-                'total_desc':   int(liq.total_descuentos),
-                'sueldo_liq':   int(liq.sueldo_liquido),
+                'ficha':        liq['empleado__ficha_numero'] or '',
+                'rut':          liq['empleado__rut'],
+                'nombre':       f"{liq['empleado__apellido_paterno']} {liq['empleado__apellido_materno'] or ''} {liq['empleado__nombres']}".strip(),
+                'cargo':        liq['empleado__cargo'] or '',
+                'dias':         liq['dias_trabajados'],
+                'sueldo_base':  liq['sueldo_base'],
+                'gratificacion':liq['gratificacion'],
+                'otros_imp':    liq['total_otros_imponibles'] + liq['total_horas_extras'],
+                'total_imp':    liq['total_imponible'],
+                'no_imp':       liq['total_no_imponibles'],
+                'total_hab':    liq['total_haberes'],
+                'afp_nombre':   liq['afp_nombre'] or '',
+                'cotiz_afp':    liq['afp_monto'],
+                'salud_nombre': liq['salud_nombre'] or '',
+                'cotiz_salud':  liq['salud_monto'],
+                'cesantia':     liq['seguro_cesantia'],
+                'imp_unico':    liq['impuesto_unico'] or 0,
+                'anticipo':     liq['anticipo_quincena'] or 0,
+                'otros_desc':   liq['total_otros_descuentos'],
+                'total_desc':   liq['total_descuentos'],
+                'sueldo_liq':   liq['sueldo_liquido'],
             })
 
-            totales['sueldo_base']      += int(liq.sueldo_base)
-            totales['gratificacion']    += int(liq.gratificacion)
-            totales['otros_imp']        += otros_imp
-            totales['total_imponible']  += int(liq.total_imponible)
-            totales['no_imponibles']    += no_impon
-            totales['total_haberes']    += int(liq.total_haberes)
-            totales['cotiz_afp']        += int(liq.afp_monto)
-            totales['cotiz_salud']      += int(liq.salud_monto)
-            totales['cesantia']         += int(liq.seguro_cesantia)
-            totales['imp_unico']        += int(liq.impuesto_unico or 0)
-            totales['anticipo']         += int(liq.anticipo_quincena or 0)
-            totales['otros_desc']       += otros_desc
-            totales['total_descuentos'] += int(liq.total_descuentos)
-            totales['sueldo_liquido']   += int(liq.sueldo_liquido)
+        totales = {k: v or 0 for k, v in qs.order_by().aggregate(
+            sueldo_base=Sum('sueldo_base'),
+            gratificacion=Sum('gratificacion'),
+            otros_imp=Sum(F('total_otros_imponibles') + F('total_horas_extras')),
+            total_imponible=Sum('total_imponible'),
+            no_imponibles=Sum('total_no_imponibles'),
+            total_haberes=Sum('total_haberes'),
+            cotiz_afp=Sum('afp_monto'),
+            cotiz_salud=Sum('salud_monto'),
+            cesantia=Sum('seguro_cesantia'),
+            imp_unico=Sum('impuesto_unico'),
+            anticipo=Sum('anticipo_quincena'),
+            otros_desc=Sum('total_otros_descuentos'),
+            total_descuentos=Sum('total_descuentos'),
+            sueldo_liquido=Sum('sueldo_liquido'),
+        ).items()}
 
         nombre_base = f'LibroRemuneraciones_{mes_nombre}_{anio}_{empresa.rut}'
 
@@ -2261,182 +2284,19 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
             return response
 
         # ══════════════════════════════════════════════════════════════════════
-        # RAMA EXCEL (sin cambios respecto al paso 1)
+        # RAMA EXCEL (write-only, ver libro_excel.py)
         # ══════════════════════════════════════════════════════════════════════
-
-        # ── Estilos ───────────────────────────────────────────────────────────
-        COLOR_HEADER   = '1E3A5F'
-        COLOR_TOTALES  = 'F59E0B'
-        COLOR_FILA_PAR = 'F1F5F9'
-
-        ft_titulo    = Font(name='Calibri', bold=True, size=14, color='1E3A5F')
-        ft_subtit    = Font(name='Calibri', bold=True, size=11, color='334155')
-        ft_header    = Font(name='Calibri', bold=True, size=9,  color='FFFFFF')
-        ft_dato      = Font(name='Calibri', size=9)
-        ft_total     = Font(name='Calibri', bold=True, size=9)
-        ft_total_liq = Font(name='Calibri', bold=True, size=9, color='7C3AED')
-
-        al_center = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        al_left   = Alignment(horizontal='left',   vertical='center')
-        al_right  = Alignment(horizontal='right',  vertical='center')
-
-        fill_header = PatternFill('solid', fgColor=COLOR_HEADER)
-        fill_total  = PatternFill('solid', fgColor=COLOR_TOTALES)
-        fill_par    = PatternFill('solid', fgColor=COLOR_FILA_PAR)
-
-        thin  = Side(style='thin', color='CBD5E1')
-        borde = Border(left=thin, right=thin, top=thin, bottom=thin)
-
-        FMT_CLP  = '#,##0'
-        FMT_TEXT = '@'
-
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = f'Libro {mes_nombre} {anio}'
-        ws.sheet_view.showGridLines = False
-
-        COLS = [
-            ('N°',                    5),
-            ('RUT',                  12),
-            ('Apellidos y Nombres',  28),
-            ('Cargo',                16),
-            ('Días\nTrab.',           7),
-            ('Sueldo\nBase',         12),
-            ('Gratif.',              11),
-            ('Otros Hab.\nImpon.',   12),
-            ('Total\nImponible',     13),
-            ('Hab. No\nImponibles',  13),
-            ('Total\nHaberes',       12),
-            ('AFP',                   9),
-            ('Cotiz.\nAFP',          11),
-            ('Salud',                 9),
-            ('Cotiz.\nSalud',        11),
-            ('Cesantía',             10),
-            ('Imp.\nÚnico',          10),
-            ('Anticipo',             10),
-            ('Otros\nDesc.',         10),
-            ('Total\nDescuentos',    13),
-            ('Alcance\nLíquido',     13),
-        ]
-        for i, (_, ancho) in enumerate(COLS, start=1):
-            ws.column_dimensions[get_column_letter(i)].width = ancho
-
-        N_COLS     = len(COLS)
-        ultima_col = get_column_letter(N_COLS)
-
-        ws.row_dimensions[1].height = 22
-        ws.row_dimensions[2].height = 18
-        ws.row_dimensions[3].height = 16
-
-        ws.merge_cells(f'A1:{ultima_col}1')
-        c = ws['A1']
-        c.value     = empresa.nombre_legal.upper()
-        c.font      = ft_titulo
-        c.alignment = al_center
-
-        ws.merge_cells(f'A2:{ultima_col}2')
-        c = ws['A2']
-        c.value     = 'LIBRO DE REMUNERACIONES'
-        c.font      = ft_subtit
-        c.alignment = al_center
-
-        ws.merge_cells(f'A3:{ultima_col}3')
-        c = ws['A3']
-        c.value     = f'RUT: {empresa.rut}     Período: {mes_nombre} {anio}'
-        c.font      = Font(name='Calibri', size=10, color='475569')
-        c.alignment = al_center
-
-        ws.row_dimensions[4].height = 6
-
-        ws.row_dimensions[5].height = 36
-        for col_idx, (label, _) in enumerate(COLS, start=1):
-            c = ws.cell(row=5, column=col_idx, value=label)
-            c.font      = ft_header
-            c.fill      = fill_header
-            c.alignment = al_center
-            c.border    = borde
-
-        for fila_idx, f in enumerate(filas, start=6):
-            fill_fila = fill_par if fila_idx % 2 == 0 else None
-            valores = [
-                (f['ficha'],         FMT_TEXT, al_center),
-                (f['rut'],           FMT_TEXT, al_left),
-                (f['nombre'],        FMT_TEXT, al_left),
-                (f['cargo'],         FMT_TEXT, al_left),
-                (f['dias'],          FMT_TEXT, al_center),
-                (f['sueldo_base'],   FMT_CLP,  al_right),
-                (f['gratificacion'], FMT_CLP,  al_right),
-                (f['otros_imp'],     FMT_CLP,  al_right),
-                (f['total_imp'],     FMT_CLP,  al_right),
-                (f['no_imp'],        FMT_CLP,  al_right),
-                (f['total_hab'],     FMT_CLP,  al_right),
-                (f['afp_nombre'],    FMT_TEXT, al_center),
-                (f['cotiz_afp'],     FMT_CLP,  al_right),
-                (f['salud_nombre'],  FMT_TEXT, al_center),
-                (f['cotiz_salud'],   FMT_CLP,  al_right),
-                (f['cesantia'],      FMT_CLP,  al_right),
-                (f['imp_unico'],     FMT_CLP,  al_right),
-                (f['anticipo'],      FMT_CLP,  al_right),
-                (f['otros_desc'],    FMT_CLP,  al_right),
-                (f['total_desc'],    FMT_CLP,  al_right),
-                (f['sueldo_liq'],    FMT_CLP,  al_right),
-            ]
-            ws.row_dimensions[fila_idx].height = 15
-            for col_idx, (valor, fmt, alin) in enumerate(valores, start=1):
-                c = ws.cell(row=fila_idx, column=col_idx, value=valor)
-                c.number_format = fmt
-                c.font          = ft_dato
-                c.alignment     = alin
-                c.border        = borde
-                if fill_fila:
-                    c.fill = fill_fila
-
-        fila_total = len(filas) + 6
-        ws.row_dimensions[fila_total].height = 18
-        vals_total = [
-            ('', FMT_TEXT), ('', FMT_TEXT),
-            ('TOTALES', FMT_TEXT), ('', FMT_TEXT), ('', FMT_TEXT),
-            (totales['sueldo_base'],      FMT_CLP),
-            (totales['gratificacion'],    FMT_CLP),
-            (totales['otros_imp'],        FMT_CLP),
-            (totales['total_imponible'],  FMT_CLP),
-            (totales['no_imponibles'],    FMT_CLP),
-            (totales['total_haberes'],    FMT_CLP),
-            ('', FMT_TEXT),
-            (totales['cotiz_afp'],        FMT_CLP),
-            ('', FMT_TEXT),
-            (totales['cotiz_salud'],      FMT_CLP),
-            (totales['cesantia'],         FMT_CLP),
-            (totales['imp_unico'],        FMT_CLP),
-            (totales['anticipo'],         FMT_CLP),
-            (totales['otros_desc'],       FMT_CLP),
-            (totales['total_descuentos'], FMT_CLP),
-            (totales['sueldo_liquido'],   FMT_CLP),
-        ]
-        for col_idx, (valor, fmt) in enumerate(vals_total, start=1):
-            c = ws.cell(row=fila_total, column=col_idx, value=valor)
-            c.number_format = fmt
-            c.fill      = fill_total
-            c.border    = borde
-            c.alignment = al_right if fmt == FMT_CLP else al_center
-            if col_idx == 3:
-                c.alignment = al_left
-            c.font = ft_total_liq if col_idx == N_COLS else ft_total
-
-        ws.page_setup.orientation   = 'landscape'
-        ws.page_setup.paperSize     = ws.PAPERSIZE_LETTER
-        ws.page_setup.fitToPage     = True
-        ws.page_setup.fitToWidth    = 1
-        ws.page_setup.fitToHeight   = 0
-        ws.print_title_rows         = '1:5'
-        ws.freeze_panes             = 'A6'
-
-        buf = io.BytesIO()
-        wb.save(buf)
-        buf.seek(0)
-
-        response = HttpResponse(
-            buf.read(),
+        # Se escribe a un archivo temporal en disco y se envía por partes;
+        # FileResponse lo cierra (y el sistema lo borra) al terminar.
+        archivo = tempfile.TemporaryFile()
+        try:
+            escribir_libro(archivo, empresa.nombre_legal, empresa.rut, mes_nombre, anio, filas, totales)
+        except Exception:
+            archivo.close()
+            raise
+        archivo.seek(0)
+        response = FileResponse(
+            archivo,
             content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         )
         response['Content-Disposition'] = f'attachment; filename="{nombre_base}.xlsx"'
@@ -2457,78 +2317,67 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
         except ValueError:
             return Response({'error': 'Los parámetros anio y mes deben ser numéricos.'}, status=400)
 
-        base_qs = (
-            Liquidacion.objects
-            .filter(empleado__empresa__owner=request.user, anio=anio)
-            .select_related('empleado', 'empleado__empresa', 'empleado__contrato_activo')
-        )
-        qs_periodo = base_qs.filter(mes=mes) if mes else base_qs
-
-        if not qs_periodo.exists():
-            if formato == 'json':
-                return Response({'error': 'No hay liquidaciones para el período seleccionado.'}, status=404)
-            return Response({'error': 'No hay liquidaciones para el período seleccionado.'}, status=404)
-
-        def _costo_emp(liq):
-            try:
-                tipo = liq.empleado.contrato_activo.tipo_contrato
-                tasa_afc = _TASA_AFC_EMP_INDEFINIDO if tipo == 'INDEFINIDO' else _TASA_AFC_EMP_PLAZO
-            except Exception:
-                tasa_afc = _TASA_AFC_EMP_INDEFINIDO
-            return int(liq.total_imponible * (_TASA_SIS + _TASA_MUTUAL_AT + tasa_afc))
+        base_qs = Liquidacion.objects.filter(empleado__empresa__owner=request.user, anio=anio)
 
         def clp(n):
             if not n: return '$0'
             return f'${int(n):,}'.replace(',', '.')
 
         # ── Datos compartidos ─────────────────────────────────────────────────
-        from collections import defaultdict
+        # Todo sale de ResumenMensual (una fila por empresa y mes, mantenida
+        # en resumenes.py): a lo más 12 × empresas filas para el año completo.
+        grupos = list(
+            ResumenMensual.objects.filter(owner=request.user, anio=anio)
+            .values('mes', 'empresa_id', 'empresa__nombre_legal', 'empresa__rut',
+                    'masa_salarial', 'liquido_total', 'costo_empleador', 'trabajadores')
+        )
+        grupos_periodo = [g for g in grupos if mes is None or g['mes'] == mes]
+        if not grupos_periodo:
+            return Response({'error': 'No hay liquidaciones para el período seleccionado.'}, status=404)
+
         masa_salarial = liquido_total = costo_empleador = 0
-        empleados_ids = set()
-        empresas_dict = defaultdict(lambda: {
-            'id': None, 'nombre': '', 'rut': '',
-            'trabajadores': 0, 'masa_salarial': 0,
-            'liquido_total': 0, 'costo_empleador': 0,
-        })
-        for liq in qs_periodo:
-            ce = _costo_emp(liq)
-            masa_salarial   += liq.total_haberes
-            liquido_total   += liq.sueldo_liquido
-            costo_empleador += ce
-            empleados_ids.add(liq.empleado_id)
-            eid = liq.empleado.empresa_id
-            emp = liq.empleado.empresa
-            d = empresas_dict[eid]
-            d['id']             = eid
-            d['nombre']         = emp.nombre_legal
-            d['rut']            = emp.rut
-            d['trabajadores']  += 1
-            d['masa_salarial'] += liq.total_haberes
-            d['liquido_total'] += liq.sueldo_liquido
-            d['costo_empleador'] += ce
+        empresas_dict = {}
+        for g in grupos_periodo:
+            masa_salarial   += g['masa_salarial']
+            liquido_total   += g['liquido_total']
+            costo_empleador += g['costo_empleador']
+            eid = g['empresa_id']
+            d = empresas_dict.setdefault(eid, {
+                'id': eid, 'nombre': g['empresa__nombre_legal'], 'rut': g['empresa__rut'],
+                'trabajadores': 0, 'masa_salarial': 0,
+                'liquido_total': 0, 'costo_empleador': 0,
+            })
+            # En el año son liquidaciones emitidas (un trabajador por mes)
+            d['trabajadores']    += g['trabajadores']
+            d['masa_salarial']   += g['masa_salarial']
+            d['liquido_total']   += g['liquido_total']
+            d['costo_empleador'] += g['costo_empleador']
 
         empresas_list = sorted(empresas_dict.values(), key=lambda x: x['masa_salarial'], reverse=True)
 
         MESES_CORTOS = ['Ene','Feb','Mar','Abr','May','Jun','Jul','Ago','Sep','Oct','Nov','Dic']
         MESES_LARGOS = ['Enero','Febrero','Marzo','Abril','Mayo','Junio',
                         'Julio','Agosto','Septiembre','Octubre','Noviembre','Diciembre']
-        evolucion = []
-        for m in range(1, 13):
-            qs_m = base_qs.filter(mes=m)
-            if qs_m.exists():
-                ms = sum(l.total_haberes   for l in qs_m)
-                lq = sum(l.sueldo_liquido  for l in qs_m)
-                ce = sum(_costo_emp(l)     for l in qs_m)
-                tw = qs_m.values('empleado_id').distinct().count()
-            else:
-                ms = lq = ce = tw = 0
-            evolucion.append({'mes': m, 'mes_nombre': MESES_CORTOS[m-1],
-                              'masa_salarial': ms, 'liquido_total': lq,
-                              'costo_empleador': ce, 'trabajadores': tw})
+        evolucion = [{'mes': m, 'mes_nombre': MESES_CORTOS[m-1],
+                      'masa_salarial': 0, 'liquido_total': 0,
+                      'costo_empleador': 0, 'trabajadores': 0} for m in range(1, 13)]
+        for g in grupos:
+            ev = evolucion[g['mes'] - 1]
+            ev['masa_salarial']   += g['masa_salarial']
+            ev['liquido_total']   += g['liquido_total']
+            ev['costo_empleador'] += g['costo_empleador']
+            ev['trabajadores']    += g['trabajadores']
+
+        # Un trabajador tiene una liquidación por mes, así que en un mes los
+        # trabajadores son los del resumen; en el año hay que contar distintos.
+        if mes:
+            trabajadores_periodo = evolucion[mes - 1]['trabajadores']
+        else:
+            trabajadores_periodo = base_qs.aggregate(n=Count('empleado_id', distinct=True))['n']
 
         kpis = {
             'masa_salarial':   masa_salarial,
-            'trabajadores':    len(empleados_ids),
+            'trabajadores':    trabajadores_periodo,
             'costo_empleador': costo_empleador,
             'liquido_total':   liquido_total,
         }
@@ -2717,58 +2566,33 @@ class LiquidacionViewSet(viewsets.ModelViewSet):
 # PREVIRED EXPORT
 # ==========================================
 
-_AFP_CODIGOS_PREVIRED = {
-    'CAPITAL': '03', 'CUPRUM': '04', 'HABITAT': '05',
-    'MODELO': '08', 'PLANVITAL': '06', 'PROVIDA': '07', 'UNO': '10', 'IPS': '00',
-}
-
-_ISAPRE_CODIGOS_PREVIRED = {
-    'BANMEDICA': '01', 'COLMENA': '02', 'CRUZ_BLANCA': '03',
-    'ESENCIAL': '04', 'VIDA_TRES': '05', 'SAN_LORENZO': '06',
-    'NUEVA_MASVIDA': '07', 'CONSALUD': '08',
-}
-
-_TIPO_CONTRATO_PREVIRED = {
-    'INDEFINIDO': '1', 'PLAZO_FIJO': '2', 'OBRA_FAENA': '3',
-}
-
-_TIPO_JORNADA_PREVIRED = {
-    'ORDINARIA': '1', 'TURNOS': '1', 'BISMANAL': '1',
-    'ART_22': '2', 'PARCIAL': '2', 'OTRO': '1',
-}
-
-_MUTUAL_DEFAULT = '01'  # ISL por defecto
-_TASA_MUTUAL_AT = 0.0093  # tasa base AT/EP empleador
-_TASA_AFC_EMP_INDEFINIDO = 0.024
-_TASA_AFC_EMP_PLAZO = 0.030
-_TASA_SIS = 0.0149
-_TASA_EXPECTATIVA_VIDA = 0.009  # Reforma 2025
-
-
-def _rut_partes(rut_str: str):
-    """Devuelve (numero_str, dv_str) desde un RUT como '12.345.678-9'."""
-    limpio = (rut_str or '').replace('.', '').replace(' ', '').upper()
-    if '-' in limpio:
-        num, dv = limpio.rsplit('-', 1)
-    elif len(limpio) > 1:
-        num, dv = limpio[:-1], limpio[-1]
-    else:
-        return '0', '0'
-    return num.lstrip('0') or '0', dv
+def _lineas_previred(qs):
+    """
+    Genera el archivo Previred de a una línea (con su salto de línea), para
+    enviarlo con StreamingHttpResponse. Una sola consulta con solo las
+    columnas que usa previred.linea, leída por partes.
+    """
+    for i, fila in enumerate(qs.values(*previred.CAMPOS).iterator(chunk_size=500)):
+        yield ('\n' if i else '') + previred.linea(fila)
 
 
-def _fmt_fecha_previred(f) -> str:
-    """Convierte fecha a DDMMAAAA o cadena vacía."""
-    if not f:
-        return ''
-    try:
-        if isinstance(f, str):
-            d = datetime.date.fromisoformat(f)
-        else:
-            d = f
-        return d.strftime('%d%m%Y')
-    except Exception:
-        return ''
+def _archivos_previred(qs, sufijo):
+    """
+    Genera (nombre_archivo, bytes) con un archivo Previred por empresa, a
+    partir de una sola consulta ordenada por empresa. En memoria queda a lo
+    más una empresa a la vez.
+    """
+    filas = (
+        qs.order_by('empleado__empresa_id', 'id')
+        .values('empleado__empresa_id', 'empleado__empresa__nombre_legal', *previred.CAMPOS)
+        .iterator(chunk_size=2_000)
+    )
+    for _, grupo in itertools.groupby(filas, key=lambda f: f['empleado__empresa_id']):
+        grupo = list(grupo)
+        rut_num, rut_dv = previred.rut_partes(grupo[0]['empleado__empresa__rut'])
+        nombre = re.sub(r'[^\w]+', '_', grupo[0]['empleado__empresa__nombre_legal'] or '').strip('_')
+        contenido = '\n'.join(previred.lineas(grupo)).encode('utf-8')
+        yield f"Previred_{rut_num}-{rut_dv}_{nombre}_{sufijo}.txt", contenido
 
 
 # ==========================================
@@ -2815,7 +2639,7 @@ def _calcular_finiquito(empleado, fecha_termino, dias_trabajados_ultimo_mes, cau
 
     salud_nombre = (empleado.sistema_salud or 'FONASA').upper()
     if salud_nombre == 'ISAPRE' and empleado.plan_isapre_uf and float(empleado.plan_isapre_uf) > 0:
-        salud_monto = max(math.floor(float(empleado.plan_isapre_uf) * obtener_uf()),
+        salud_monto = max(math.floor(float(empleado.plan_isapre_uf) * obtener_uf(fecha_termino)),
                           math.floor(sueldo_proporcional * 0.07))
     else:
         salud_monto = math.floor(sueldo_proporcional * 0.07)
@@ -2875,7 +2699,10 @@ class FiniquitoViewSet(viewsets.ModelViewSet):
         dias = int(data.get('dias_trabajados_ultimo_mes', 30))
         causal = str(data.get('causal_articulo', ''))
 
-        montos = _calcular_finiquito(empleado, fecha_termino, dias, causal)
+        try:
+            montos = _calcular_finiquito(empleado, fecha_termino, dias, causal)
+        except IndicadorNoDisponible as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         # Los montos pueden ser sobreescritos si el usuario los envía explícitamente
         for campo in montos:
@@ -3033,13 +2860,12 @@ class FiniquitoViewSet(viewsets.ModelViewSet):
 </body>
 </html>"""
 
-            buffer = io.BytesIO()
-            pisa_status = pisa.CreatePDF(html, dest=buffer)
-            if pisa_status.err:
+            try:
+                pdf_bytes = pdf_desde_html(html, f'Finiquito_{empleado.rut}', documento=finiquito)
+            except Exception:
                 return Response({'error': 'Error al generar el PDF.'}, status=500)
 
-            buffer.seek(0)
-            response = HttpResponse(buffer.read(), content_type='application/pdf')
+            response = HttpResponse(pdf_bytes, content_type='application/pdf')
             response['Content-Disposition'] = (
                 f'attachment; filename="finiquito_{empleado.rut}_{finiquito.fecha_termino}.pdf"'
             )
@@ -3126,28 +2952,104 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
             return Response({'error': 'Error al subir el documento al almacenamiento.'}, status=500)
 
         try:
-            solicitud = SolicitudFirma.objects.create(
-                empleado=empleado,
-                empresa=empresa,
-                tipo_documento=tipo_doc,
-                contrato=contrato_obj,
-                documento_legal=doc_legal_obj,
-                liquidacion=liquidacion_obj,
-                vacacion=vacacion_obj,
-                finiquito=finiquito_obj,
-                email_firmante=email_trabajador,
-                b2_key_temporal=key,
-            )
+            with transaction.atomic():
+                solicitud = SolicitudFirma.objects.create(
+                    empleado=empleado,
+                    empresa=empresa,
+                    tipo_documento=tipo_doc,
+                    contrato=contrato_obj,
+                    documento_legal=doc_legal_obj,
+                    liquidacion=liquidacion_obj,
+                    vacacion=vacacion_obj,
+                    finiquito=finiquito_obj,
+                    email_firmante=email_trabajador,
+                    b2_key_temporal=key,
+                )
+                self._enviar_email_firma(solicitud, empleado, empresa)
         except Exception as e:
             b2_client.eliminar_documento(key)
             return Response({'error': f'Error al registrar la solicitud: {e}'}, status=500)
 
+        return Response(SolicitudFirmaSerializer(solicitud).data, status=201)
+
+    MAX_SOLICITUDES_MASIVAS = 500
+    MAX_TRABAJOS_ACTIVOS = 3
+
+    @action(detail=False, methods=['post'])
+    def solicitar_masivo(self, request):
+        """
+        Envía a firma muchos documentos de una empresa en segundo plano.
+        Body: {empresa_id, items: [{empleado_id, tipo_documento, contrato_id?,
+        documento_legal_id?, anexo_contrato_id?, liquidacion_id?, vacacion_id?,
+        finiquito_id?}]}. Responde 202 con el trabajo; su estado y el de cada
+        documento se consultan en GET solicitar_masivo/<id>/.
+        """
         try:
-            self._enviar_email_firma(solicitud, empleado, empresa)
-        except Exception:
-            pass
+            empresa = Empresa.objects.get(id=request.data.get('empresa_id'), owner=request.user)
+        except (Empresa.DoesNotExist, ValueError, TypeError):
+            return Response({'error': 'Empresa no encontrada o no autorizada.'}, status=404)
+        if not empresa.firma_imagen:
+            return Response(
+                {'error': 'La empresa no tiene firma del empleador configurada. Configúrela en el Lobby de Empresas.'},
+                status=400
+            )
 
-        return Response(SolicitudFirmaSerializer(solicitud).data, status=201)
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'Debes indicar al menos un documento en items.'}, status=400)
+        if len(items) > self.MAX_SOLICITUDES_MASIVAS:
+            return Response(
+                {'error': f'Máximo {self.MAX_SOLICITUDES_MASIVAS} documentos por envío masivo.'}, status=400,
+            )
+
+        tipos_validos = {t[0] for t in SolicitudFirma.TIPOS_DOCUMENTO}
+        ids_empleados = set(
+            Empleado.objects.filter(empresa=empresa).values_list('id', flat=True)
+        )
+        normalizados, errores = [], []
+        for indice, item in enumerate(items):
+            if not isinstance(item, dict):
+                errores.append({'indice': indice, 'error': 'Formato inválido.'})
+                continue
+            if item.get('tipo_documento') not in tipos_validos:
+                errores.append({'indice': indice, 'error': 'Tipo de documento inválido.'})
+                continue
+            try:
+                empleado_id = int(item.get('empleado_id'))
+            except (TypeError, ValueError):
+                empleado_id = None
+            if empleado_id not in ids_empleados:
+                errores.append({'indice': indice, 'error': 'Trabajador no encontrado.'})
+                continue
+            normalizado = {'empleado_id': empleado_id, 'tipo_documento': item['tipo_documento']}
+            for campo in _IDS_DOCUMENTO_FIRMA:
+                if item.get(campo) not in (None, ''):
+                    normalizado[campo] = item[campo]
+            normalizado.update({'estado': 'PENDIENTE', 'error': '', 'solicitud_id': None})
+            normalizados.append(normalizado)
+        if errores:
+            return Response({'error': 'Hay documentos inválidos.', 'detalle': errores}, status=400)
+
+        activos = FirmaMasivaJob.objects.filter(owner=request.user, estado__in=['PENDIENTE', 'PROCESANDO']).count()
+        if activos >= self.MAX_TRABAJOS_ACTIVOS:
+            return Response(
+                {'error': f'Ya tienes {activos} envíos masivos en curso. Espera a que terminen.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+
+        job = FirmaMasivaJob.objects.create(
+            owner=request.user, empresa=empresa, items=normalizados, total=len(normalizados),
+        )
+        return Response(FirmaMasivaJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'solicitar_masivo/(?P<job_id>[0-9a-f-]{36})')
+    def estado_masivo(self, request, job_id=None):
+        """Estado y resultado por documento de un envío masivo."""
+        try:
+            job = FirmaMasivaJob.objects.get(id=uuid_mod.UUID(job_id), owner=request.user)
+        except (FirmaMasivaJob.DoesNotExist, ValueError):
+            return Response({'error': 'Envío masivo no encontrado.'}, status=404)
+        return Response(FirmaMasivaJobSerializer(job).data)
 
     @action(detail=True, methods=['patch'])
     def cancelar(self, request, pk=None):
@@ -3163,10 +3065,7 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
         solicitud = self.get_object()
         if solicitud.estado != 'PENDIENTE':
             return Response({'error': 'Solo se puede reenviar una solicitud pendiente.'}, status=400)
-        try:
-            self._enviar_email_firma(solicitud, solicitud.empleado, solicitud.empresa)
-        except Exception as e:
-            return Response({'error': f'Error al reenviar el email: {str(e)}'}, status=500)
+        self._enviar_email_firma(solicitud, solicitud.empleado, solicitud.empresa)
         return Response({'mensaje': 'Email de firma reenviado correctamente.'})
 
     @action(detail=True, methods=['post'])
@@ -3194,6 +3093,20 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
                            contrato_id, doc_legal_id, anexo_id,
                            liquidacion_id, vacacion_id, finiquito_id, es_plan_semilla):
         """Genera el PDF a firmar y retorna (pdf_bytes, contrato, doc_legal, liquidacion, vacacion, finiquito)."""
+        html, nombre_doc, *documentos = self._html_firma(
+            empleado, empresa, tipo_doc, contrato_id, doc_legal_id, anexo_id,
+            liquidacion_id, vacacion_id, finiquito_id, es_plan_semilla,
+        )
+        return (_html_a_pdf_bytes(html, nombre_doc), *documentos)
+
+    def _html_firma(self, empleado, empresa, tipo_doc,
+                    contrato_id, doc_legal_id, anexo_id,
+                    liquidacion_id, vacacion_id, finiquito_id, es_plan_semilla):
+        """
+        Arma el HTML del documento a firmar, sin convertirlo (la solicitud
+        masiva convierte en el pool de procesos). Retorna
+        (html, nombre_doc, contrato, doc_legal, liquidacion, vacacion, finiquito).
+        """
         ciudad = str(
             getattr(empresa, 'ciudad', '') or getattr(empresa, 'comuna', '') or 'Santiago'
         ).strip().title()
@@ -3206,7 +3119,7 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
                 raise Exception('El trabajador no tiene contrato registrado.')
             ctx = _ctx_contrato(contrato, es_plan_semilla)
             html = render_to_string('contrato_trabajo.html', ctx)
-            return _html_a_pdf_bytes(html, f'Contrato_{empleado.rut}'), contrato, None, None, None, None
+            return html, f'Contrato_{empleado.rut}', contrato, None, None, None, None
 
         if tipo_doc == 'ANEXO_40H':
             try:
@@ -3216,7 +3129,7 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
                 raise Exception('El trabajador no tiene contrato registrado.')
             ctx = _ctx_contrato(contrato, es_plan_semilla)
             html = render_to_string('anexo_40h.html', ctx)
-            return _html_a_pdf_bytes(html, f'Anexo40h_{empleado.rut}'), contrato, None, None, None, None
+            return html, f'Anexo40h_{empleado.rut}', contrato, None, None, None, None
 
         if tipo_doc in ('AMONESTACION', 'CONSTANCIA'):
             if doc_legal_id:
@@ -3236,7 +3149,7 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
                    'fecha_actual': fecha_es, 'ciudad': ciudad,
                    'es_plan_semilla': es_plan_semilla}
             html = render_to_string('documento_legal.html', ctx)
-            return _html_a_pdf_bytes(html, f'{doc.tipo}_{empleado.rut}'), None, doc, None, None, None
+            return html, f'{doc.tipo}_{empleado.rut}', None, doc, None, None, None
 
         if tipo_doc == 'DESPIDO':
             if doc_legal_id:
@@ -3250,8 +3163,9 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
                 ).order_by('-fecha_emision').first()
                 if not doc:
                     raise Exception('No se encontró carta de despido.')
-            pdf_bytes = self._pdf_para_documento_legal(doc, es_plan_semilla)
-            return pdf_bytes, None, doc, None, None, None
+            trabajo = EmpleadoViewSet()._pdf_para_documento_legal(doc, es_plan_semilla, diferido=True)
+            return (render_to_string(trabajo.template_name, trabajo.context), trabajo.nombre_doc,
+                    None, doc, None, None, None)
 
         if tipo_doc == 'ANEXO_CONTRATO':
             if not anexo_id:
@@ -3267,7 +3181,7 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
                    'empresa': empresa, 'fecha_actual': fecha_es, 'ciudad': ciudad,
                    'es_plan_semilla': es_plan_semilla}
             html = render_to_string('anexo_contrato.html', ctx)
-            return _html_a_pdf_bytes(html, f'AnexoContrato_{empleado.rut}'), contrato, None, None, None, None
+            return html, f'AnexoContrato_{empleado.rut}', contrato, None, None, None, None
 
         if tipo_doc == 'LIQUIDACION':
             if not liquidacion_id:
@@ -3281,15 +3195,9 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
             mes_nombre = meses[liq.mes - 1]
             sueldo_seguro = int(liq.sueldo_liquido or 0)
             liquido_palabras = num2words(sueldo_seguro, lang='es')
-            det_no_imp = liq.detalle_haberes_no_imponibles
-            if not isinstance(det_no_imp, list): det_no_imp = []
-            suma_no_imponibles = sum(int(i.get('valor', 0)) for i in det_no_imp if isinstance(i, dict))
-            det_otros = liq.detalle_otros_descuentos
-            if not isinstance(det_otros, list): det_otros = []
-            suma_otros_descuentos = sum(int(i.get('valor', 0)) for i in det_otros if isinstance(i, dict))
-            total_ley = ((liq.afp_monto or 0) + (liq.salud_monto or 0) +
-                         (liq.seguro_cesantia or 0) + (liq.impuesto_unico or 0))
-            total_otros_dsctos = (liq.anticipo_quincena or 0) + suma_otros_descuentos
+            suma_no_imponibles = liq.total_no_imponibles
+            total_ley = liq.total_ley
+            total_otros_dsctos = (liq.anticipo_quincena or 0) + liq.total_otros_descuentos
             ctx = {
                 'liquidacion': liq, 'empleado': empleado, 'empresa': empresa,
                 'contrato': contrato_liq,
@@ -3301,7 +3209,7 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
                 'es_plan_semilla': es_plan_semilla,
             }
             html = render_to_string('liquidacion.html', ctx)
-            return _html_a_pdf_bytes(html, f'Liquidacion_{liq.mes}_{liq.anio}_{empleado.rut}'), None, None, liq, None, None
+            return html, f'Liquidacion_{liq.mes}_{liq.anio}_{empleado.rut}', None, None, liq, None, None
 
         if tipo_doc == 'VACACION':
             if not vacacion_id:
@@ -3323,7 +3231,7 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
                 'es_plan_semilla': es_plan_semilla,
             }
             html = render_to_string('comprobante_vacaciones.html', ctx)
-            return _html_a_pdf_bytes(html, f'Vacacion_{empleado.rut}'), None, None, None, vac, None
+            return html, f'Vacacion_{empleado.rut}', None, None, None, vac, None
 
         if tipo_doc == 'FINIQUITO':
             if not finiquito_id:
@@ -3419,11 +3327,18 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
   Generado por Jornada40 · {_fmt_fin(fin.fecha_emision)}.</p>
 </body>
 </html>"""
-            return _html_a_pdf_bytes(html, f'Finiquito_{empleado.rut}'), None, None, None, None, fin
+            return html, f'Finiquito_{empleado.rut}', None, None, None, None, fin
 
         raise Exception(f'Tipo de documento no soportado: {tipo_doc}')
 
     def _enviar_email_firma(self, solicitud, empleado, empresa):
+        """Encola el email con el enlace de firma (lo envía procesar_trabajos)."""
+        correo = self._email_firma(solicitud, empleado, empresa)
+        correo.save()
+        return correo
+
+    def _email_firma(self, solicitud, empleado, empresa):
+        """EmailOutbox (sin guardar) con el enlace de firma."""
         tipo_labels = {
             'CONTRATO':       'Contrato Laboral',
             'ANEXO_40H':      'Anexo Ley 40 Horas',
@@ -3483,14 +3398,117 @@ class SolicitudFirmaViewSet(viewsets.GenericViewSet):
   </div>
 </body>
 </html>"""
-        msg = EmailMultiAlternatives(
-            subject=f"Firma requerida: {tipo_label} — {empresa.nombre_legal}",
-            body=texto_plano,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[solicitud.email_firmante],
+        return correos.nuevo(
+            f"Firma requerida: {tipo_label} — {empresa.nombre_legal}",
+            texto_plano, [solicitud.email_firmante], html=html_body, categoria='FIRMA_SOLICITUD',
         )
-        msg.attach_alternative(html_body, "text/html")
-        msg.send()
+
+
+# Ids opcionales de un item de solicitar_masivo, en el orden de _html_firma
+_IDS_DOCUMENTO_FIRMA = (
+    'contrato_id', 'documento_legal_id', 'anexo_contrato_id',
+    'liquidacion_id', 'vacacion_id', 'finiquito_id',
+)
+# Documentos por bloque del envío masivo (al menos 2 por worker del pool de PDF)
+TAMANO_BLOQUE_FIRMA_MASIVA = 20
+
+
+def procesar_firma_masiva_job(job):
+    """
+    Procesa un FirmaMasivaJob reclamado por el worker (core/trabajos.py), por
+    bloques: arma el HTML de cada documento, convierte los PDF en el pool de
+    procesos, los sube a B2 en paralelo con el cliente compartido y crea las
+    solicitudes y sus emails con bulk_create. Cada bloque se confirma junto
+    con el resultado de sus items, así que un reintento retoma donde quedó.
+    """
+    from .pdf_pool import cantidad_workers, convertir_htmls
+
+    vista = SolicitudFirmaViewSet()
+    es_plan_semilla = _es_plan_semilla(job.owner)
+    items = job.items
+    pendientes = [i for i, item in enumerate(items) if item.get('estado') == 'PENDIENTE']
+    empleados = Empleado.objects.filter(empresa=job.empresa).in_bulk(
+        {items[i]['empleado_id'] for i in pendientes}
+    )
+    tamano_bloque = max(TAMANO_BLOQUE_FIRMA_MASIVA, cantidad_workers() * 2)
+    procesados = job.total - len(pendientes)
+
+    for inicio in range(0, len(pendientes), tamano_bloque):
+        bloque = pendientes[inicio:inicio + tamano_bloque]
+
+        # 1. HTML de cada documento (consulta la BD: en este proceso)
+        preparados = []   # (indice, empleado, html, nombre_doc, documentos)
+        for i in bloque:
+            item = items[i]
+            empleado = empleados.get(item['empleado_id'])
+            try:
+                if empleado is None:
+                    raise Exception('Trabajador no encontrado.')
+                if not empleado.email:
+                    raise Exception('El trabajador no tiene email registrado.')
+                html, nombre_doc, *documentos = vista._html_firma(
+                    empleado, job.empresa, item['tipo_documento'],
+                    *(item.get(campo) for campo in _IDS_DOCUMENTO_FIRMA), es_plan_semilla,
+                )
+            except Exception as e:
+                item.update(estado='ERROR', error=str(e)[:500])
+                continue
+            preparados.append((i, empleado, html, nombre_doc, documentos))
+
+        # 2. PDF en paralelo
+        pdfs = convertir_htmls([(html, nombre) for _, _, html, nombre, _ in preparados])
+
+        # 3. Subida concurrente a B2
+        subidas = []   # (indice, empleado, documentos, key, pdf)
+        for (i, empleado, _, _, documentos), pdf in zip(preparados, pdfs):
+            if isinstance(pdf, Exception):
+                items[i].update(estado='ERROR', error=str(pdf)[:500])
+                continue
+            key = b2_client.key_pendiente(job.empresa_id, str(uuid_mod.uuid4()))
+            subidas.append((i, empleado, documentos, key, pdf))
+        hilos = max(1, min(getattr(settings, 'B2_MAX_POOL_CONNECTIONS', 10), len(subidas)))
+        with ThreadPoolExecutor(max_workers=hilos) as executor:
+            futuros = [executor.submit(b2_client.subir_documento, pdf, key) for _, _, _, key, pdf in subidas]
+        subidos = []
+        for futuro, (i, empleado, documentos, key, _) in zip(futuros, subidas):
+            if futuro.exception() is not None:
+                items[i].update(estado='ERROR', error='Error al subir el documento al almacenamiento.')
+                continue
+            subidos.append((i, empleado, documentos, key))
+
+        # 4. Solicitudes, emails y avance del trabajo en una sola transacción
+        expira_en = timezone.now() + timezone.timedelta(days=7)
+        solicitudes = [
+            SolicitudFirma(
+                empleado=empleado, empresa=job.empresa, tipo_documento=items[i]['tipo_documento'],
+                contrato=contrato, documento_legal=doc_legal, liquidacion=liquidacion,
+                vacacion=vacacion, finiquito=finiquito,
+                email_firmante=empleado.email, b2_key_temporal=key, expira_en=expira_en,
+            )
+            for i, empleado, (contrato, doc_legal, liquidacion, vacacion, finiquito), key in subidos
+        ]
+        procesados += len(bloque)
+        try:
+            with transaction.atomic():
+                SolicitudFirma.objects.bulk_create(solicitudes)
+                correos.encolar_lote([
+                    vista._email_firma(solicitud, solicitud.empleado, job.empresa) for solicitud in solicitudes
+                ])
+                for (i, _, _, _), solicitud in zip(subidos, solicitudes):
+                    items[i].update(estado='ENVIADO', error='', solicitud_id=solicitud.id)
+                FirmaMasivaJob.objects.filter(pk=job.pk).update(
+                    items=items, procesados=procesados, actualizado_en=timezone.now(),
+                )
+        except Exception:
+            for _, _, _, key in subidos:
+                b2_client.eliminar_documento(key)
+            raise
+        job.procesados = procesados
+
+    job.items = items
+    job.estado = 'COMPLETADO'
+    job.terminado_en = timezone.now()
+    job.save(update_fields=['items', 'estado', 'terminado_en', 'actualizado_en'])
 
 
 # Endpoint para listar los planes activos en la BD
@@ -3817,18 +3835,14 @@ def firma_publica_solicitar_otp(request, token):
     # Generar código de 6 dígitos
     codigo = ''.join(random.choices(string.digits, k=6))
 
-    otp = OTPFirma.objects.create(
-        solicitud=solicitud,
-        codigo=codigo,
-        email_destino=solicitud.email_firmante,
-    )
-
-    # Enviar email con el código
-    try:
+    # El código y su email se guardan juntos; el worker envía el email
+    with transaction.atomic():
+        otp = OTPFirma.objects.create(
+            solicitud=solicitud,
+            codigo=codigo,
+            email_destino=solicitud.email_firmante,
+        )
         _enviar_email_otp(otp, solicitud)
-    except Exception as e:
-        otp.delete()
-        return Response({'error': f'No se pudo enviar el código por email: {str(e)}'}, status=500)
 
     return Response({
         'enviado': True,
@@ -3953,14 +3967,11 @@ def _enviar_email_otp(otp: OTPFirma, solicitud: SolicitudFirma):
 </body>
 </html>"""
 
-    msg = EmailMultiAlternatives(
-        subject=f"Tu código de verificación — {empresa_nombre}",
-        body=texto_plano,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[otp.email_destino],
+    # Vence en 10 minutos: no espera turno en el worker
+    correos.enviar_al_confirmar(
+        f"Tu código de verificación — {empresa_nombre}",
+        texto_plano, [otp.email_destino], html=html_body, categoria='OTP',
     )
-    msg.attach_alternative(html_body, "text/html")
-    msg.send()
 
 
 # ==========================================
@@ -3977,9 +3988,11 @@ def _enviar_emails_firma_completada(
     solicitud: SolicitudFirma,
     empleado,
     empresa,
-    pdf_firmado_bytes: bytes,
 ):
-    """Envía confirmación de firma al trabajador y notificación al empleador."""
+    """
+    Encola la confirmación de firma al trabajador y la notificación al
+    empleador, con el PDF firmado (solicitud.b2_key_firmado) adjunto.
+    """
     tipo_labels = {
         'CONTRATO': 'Contrato Laboral', 'ANEXO_40H': 'Anexo Ley 40 Horas',
         'AMONESTACION': 'Carta de Amonestación', 'DESPIDO': 'Carta de Despido',
@@ -4032,15 +4045,12 @@ def _enviar_emails_firma_completada(
 </body>
 </html>"""
 
-    msg_trabajador = EmailMultiAlternatives(
-        subject=f"Documento firmado: {tipo_label} — {empresa.nombre_legal}",
-        body=texto_trabajador,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[solicitud.email_firmante],
+    adjuntos = [{'nombre': nombre_pdf, 'b2_key': solicitud.b2_key_firmado, 'content_type': 'application/pdf'}]
+    correos.encolar(
+        f"Documento firmado: {tipo_label} — {empresa.nombre_legal}",
+        texto_trabajador, [solicitud.email_firmante], html=html_trabajador,
+        adjuntos=adjuntos, categoria='FIRMA_COMPLETADA',
     )
-    msg_trabajador.attach_alternative(html_trabajador, "text/html")
-    msg_trabajador.attach(nombre_pdf, pdf_firmado_bytes, 'application/pdf')
-    msg_trabajador.send()
 
     # ── Email al empleador ───────────────────────────────────────────────────
     email_empleador = empresa.owner.email
@@ -4083,28 +4093,23 @@ def _enviar_emails_firma_completada(
 </body>
 </html>"""
 
-    msg_empleador = EmailMultiAlternatives(
-        subject=f"Firma recibida: {nombre_trabajador} firmó «{tipo_label}»",
-        body=texto_empleador,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[email_empleador],
+    correos.encolar(
+        f"Firma recibida: {nombre_trabajador} firmó «{tipo_label}»",
+        texto_empleador, [email_empleador], html=html_empleador,
+        adjuntos=adjuntos, categoria='FIRMA_COMPLETADA',
     )
-    msg_empleador.attach_alternative(html_empleador, "text/html")
-    msg_empleador.attach(nombre_pdf, pdf_firmado_bytes, 'application/pdf')
-    msg_empleador.send()
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def firma_publica_firmar(request, token):
     """
-    Procesa la firma del trabajador:
+    Registra la firma del trabajador y deja el resto en cola:
     1. Valida sesion_token y datos de entrada
-    2. Descarga PDF original de B2
-    3. Genera PDF firmado con página de certificado (pdf_firma.py)
-    4. Sube PDF firmado a B2 y elimina el temporal
-    5. Marca SolicitudFirma como FIRMADO
-    6. Envía emails de confirmación con el PDF adjunto
+    2. Marca la solicitud PROCESANDO y guarda la imagen de firma, fecha e IP
+    3. Encola un FirmaJob; procesar_trabajos genera el PDF con certificado,
+       lo sube a B2 y encola los emails (procesar_firma_job)
+    La página pública consulta firma_publica_estado hasta ver FIRMADO.
     """
     sesion_token    = str(request.data.get('sesion_token',    '')).strip()
     firma_trabajador = str(request.data.get('firma_trabajador', '')).strip()
@@ -4120,9 +4125,7 @@ def firma_publica_firmar(request, token):
 
     try:
         with transaction.atomic():
-            solicitud = SolicitudFirma.objects.select_related(
-                'empleado', 'empresa', 'empresa__owner'
-            ).select_for_update().get(token=token)
+            solicitud = SolicitudFirma.objects.select_for_update().get(token=token)
 
             # ── Validaciones de estado ──────────────────────────────────────
             if solicitud.estado != 'PENDIENTE':
@@ -4151,92 +4154,129 @@ def firma_publica_firmar(request, token):
 
             # Reclamamos la solicitud de inmediato para que ninguna petición
             # concurrente (doble clic, doble tap) pueda pasar este chequeo.
+            firmado_en = timezone.now()
             solicitud.estado = 'PROCESANDO'
-            solicitud.save(update_fields=['estado', 'actualizado_en'])
+            solicitud.firma_trabajador_imagen = firma_trabajador
+            solicitud.save(update_fields=['estado', 'firma_trabajador_imagen', 'actualizado_en'])
+
+            # Un reintento tras un fallo definitivo reutiliza el mismo trabajo
+            FirmaJob.objects.update_or_create(solicitud=solicitud, defaults={
+                'estado': 'PENDIENTE', 'intentos': 0, 'error': '',
+                'firmado_en': firmado_en, 'ip_firmante': _ip_desde_request(request) or None,
+                'iniciado_en': None, 'terminado_en': None,
+            })
     except SolicitudFirma.DoesNotExist:
         return Response({'error': 'Solicitud de firma no encontrada.'}, status=404)
 
-    # ── Descargar PDF original de B2 ────────────────────────────────────────
-    try:
-        pdf_original_bytes = b2_client.descargar_documento(solicitud.b2_key_temporal)
-    except Exception as exc:
-        solicitud.estado = 'PENDIENTE'
-        solicitud.save(update_fields=['estado', 'actualizado_en'])
-        return Response({'error': f'Error al obtener el documento: {exc}'}, status=500)
+    return Response({'estado': 'PROCESANDO', 'firmado_en': firmado_en.isoformat()}, status=202)
 
-    # ── Generar PDF firmado con certificado ─────────────────────────────────
-    empleado = solicitud.empleado
-    empresa  = solicitud.empresa
-    tipo_labels = {
-        'CONTRATO': 'Contrato Laboral', 'ANEXO_40H': 'Anexo Ley 40 Horas',
-        'AMONESTACION': 'Carta de Amonestación', 'DESPIDO': 'Carta de Despido',
-        'CONSTANCIA': 'Constancia Laboral', 'ANEXO_CONTRATO': 'Anexo de Contrato',
-        'LIQUIDACION': 'Liquidación de Sueldo', 'VACACION': 'Comprobante de Vacaciones',
-        'FINIQUITO': 'Finiquito de Término',
-    }
-    firmado_en  = timezone.now()
-    ip_firmante = _ip_desde_request(request)
 
-    try:
-        from .pdf_firma import agregar_certificado_firma
-        pdf_firmado_bytes = agregar_certificado_firma(
-            pdf_original_bytes    = pdf_original_bytes,
-            tipo_documento_label  = tipo_labels.get(solicitud.tipo_documento, solicitud.tipo_documento),
-            empresa_nombre        = empresa.nombre_legal,
-            empresa_rut           = empresa.rut,
-            firmante_nombre       = empresa.firma_firmante_nombre or empresa.representante_legal or '',
-            firmante_cargo        = empresa.firma_firmante_cargo or 'Representante Legal',
-            firma_empleador_b64   = empresa.firma_imagen or '',
-            trabajador_nombre     = f"{empleado.nombres} {empleado.apellido_paterno}",
-            trabajador_rut        = empleado.rut,
-            firma_trabajador_b64  = firma_trabajador,
-            token                 = str(solicitud.token),
-            firmado_en            = firmado_en,
-            ip_firmante           = ip_firmante,
-            email_firmante        = solicitud.email_firmante,
+def procesar_firma_job(job):
+    """
+    Completa una firma encolada por firma_publica_firmar (lo llama el worker
+    de core/trabajos.py). Se puede repetir sin efectos duplicados: el key del
+    PDF firmado depende solo del token y la fecha de firma, el paso a FIRMADO
+    es condicional y el temporal se borra recién después de ese paso.
+    """
+    solicitud = SolicitudFirma.objects.select_related('empleado', 'empresa', 'empresa__owner').get(
+        pk=job.solicitud_id,
+    )
+    if solicitud.estado != 'PROCESANDO':
+        # Ya firmada por un intento anterior, o cancelada/expirada mientras tanto
+        job.estado = 'COMPLETADO' if solicitud.estado == 'FIRMADO' else 'ERROR'
+        if job.estado == 'ERROR':
+            job.error = f'La solicitud quedó en estado {solicitud.get_estado_display()}.'
+        job.terminado_en = timezone.now()
+        job.save(update_fields=['estado', 'error', 'terminado_en', 'actualizado_en'])
+        return
+
+    key_firmado = _generar_y_subir_firmado(solicitud, job)
+
+    # ── Actualizar SolicitudFirma y encolar los emails, juntos ──────────────
+    with transaction.atomic():
+        actualizadas = SolicitudFirma.objects.filter(pk=solicitud.pk, estado='PROCESANDO').update(
+            estado='FIRMADO',
+            firmado_en=job.firmado_en,
+            ip_firmante=job.ip_firmante,
+            b2_key_firmado=key_firmado,
+            sesion_token_trabajador=None,   # invalidar sesión
+            actualizado_en=timezone.now(),
         )
-    except Exception as exc:
-        solicitud.estado = 'PENDIENTE'
-        solicitud.save(update_fields=['estado', 'actualizado_en'])
-        return Response({'error': f'Error al generar el documento firmado: {exc}'}, status=500)
+        if actualizadas:
+            solicitud.refresh_from_db()
+            _enviar_emails_firma_completada(solicitud, solicitud.empleado, solicitud.empresa)
+    if actualizadas:
+        # Eliminar PDF temporal (no crítico)
+        b2_client.eliminar_documento(solicitud.b2_key_temporal)
+
+    job.estado = 'COMPLETADO'
+    job.terminado_en = timezone.now()
+    job.save(update_fields=['estado', 'terminado_en', 'actualizado_en'])
+
 
-    # ── Subir PDF firmado a B2 ──────────────────────────────────────────────
+def firma_job_fallido(job):
+    """
+    El FirmaJob quedó en ERROR (sin más reintentos o colgado demasiadas
+    veces): la solicitud vuelve a PENDIENTE para que el trabajador pueda
+    firmar de nuevo, en vez de quedar PROCESANDO para siempre.
+    """
+    SolicitudFirma.objects.filter(pk=job.solicitud_id, estado='PROCESANDO').update(
+        estado='PENDIENTE', actualizado_en=timezone.now(),
+    )
+
+
+def _generar_y_subir_firmado(solicitud, job):
+    """Descarga el original, agrega el certificado y sube el PDF firmado a B2."""
+    from .pdf_firma import agregar_certificado_firma
+
+    empleado = solicitud.empleado
+    empresa  = solicitud.empresa
+    pdf_original_bytes = b2_client.descargar_documento(solicitud.b2_key_temporal)
+    pdf_firmado_bytes = agregar_certificado_firma(
+        pdf_original_bytes    = pdf_original_bytes,
+        tipo_documento_label  = _TIPO_LABELS_PUBLICO.get(solicitud.tipo_documento, solicitud.tipo_documento),
+        empresa_nombre        = empresa.nombre_legal,
+        empresa_rut           = empresa.rut,
+        firmante_nombre       = empresa.firma_firmante_nombre or empresa.representante_legal or '',
+        firmante_cargo        = empresa.firma_firmante_cargo or 'Representante Legal',
+        firma_empleador_b64   = empresa.firma_imagen or '',
+        trabajador_nombre     = f"{empleado.nombres} {empleado.apellido_paterno}",
+        trabajador_rut        = empleado.rut,
+        firma_trabajador_b64  = solicitud.firma_trabajador_imagen,
+        token                 = str(solicitud.token),
+        firmado_en            = job.firmado_en,
+        ip_firmante           = job.ip_firmante or '',
+        email_firmante        = solicitud.email_firmante,
+    )
     key_firmado = b2_client.key_firmado(
         empresa_id=empresa.id,
         uuid=str(solicitud.token),
-        year=firmado_en.year,
-        month=firmado_en.month,
+        year=job.firmado_en.year,
+        month=job.firmado_en.month,
     )
-    try:
-        b2_client.subir_documento(pdf_firmado_bytes, key_firmado)
-    except Exception as exc:
-        solicitud.estado = 'PENDIENTE'
-        solicitud.save(update_fields=['estado', 'actualizado_en'])
-        return Response({'error': f'Error al guardar el documento firmado: {exc}'}, status=500)
-
-    # Eliminar PDF temporal (no crítico)
-    b2_client.eliminar_documento(solicitud.b2_key_temporal)
-
-    # ── Actualizar SolicitudFirma ───────────────────────────────────────────
-    solicitud.estado                 = 'FIRMADO'
-    solicitud.firmado_en             = firmado_en
-    solicitud.ip_firmante            = ip_firmante or None
-    solicitud.firma_trabajador_imagen = firma_trabajador
-    solicitud.b2_key_firmado         = key_firmado
-    solicitud.sesion_token_trabajador = None   # invalidar sesión
-    solicitud.save(update_fields=[
-        'estado', 'firmado_en', 'ip_firmante',
-        'firma_trabajador_imagen', 'b2_key_firmado',
-        'sesion_token_trabajador', 'actualizado_en',
-    ])
-
-    # ── Emails de confirmación (no críticos) ────────────────────────────────
-    try:
-        _enviar_emails_firma_completada(solicitud, empleado, empresa, pdf_firmado_bytes)
-    except Exception:
-        pass
+    b2_client.subir_documento(pdf_firmado_bytes, key_firmado)
+    return key_firmado
+
 
-    return Response({'firmado': True, 'firmado_en': firmado_en.isoformat()})
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def firma_publica_estado(request, token):
+    """
+    Estado liviano de una solicitud (una consulta) para que la página pública
+    sepa cuándo terminó de procesarse la firma.
+    """
+    fila = SolicitudFirma.objects.filter(token=token).values(
+        'estado', 'firmado_en', 'firma_job__estado', 'firma_job__error',
+    ).first()
+    if fila is None:
+        return Response({'error': 'Solicitud de firma no encontrada.'}, status=404)
+    respuesta = {
+        'estado': fila['estado'],
+        'firmado_en': fila['firmado_en'].isoformat() if fila['firmado_en'] else None,
+    }
+    if fila['estado'] == 'PENDIENTE' and fila['firma_job__estado'] == 'ERROR':
+        respuesta['error'] = 'No se pudo completar la firma. Intenta firmar nuevamente.'
+    return Response(respuesta)
 
 
 # ============================================================
@@ -4256,6 +4296,9 @@ _TIPO_LABELS_PUBLICO = {
 }
 
 
+_RANGO_SIMPLE = re.compile(r'^bytes=(\d+-\d*|-\d+)$')
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def firma_publica_documento(request, token):
@@ -4263,7 +4306,15 @@ def firma_publica_documento(request, token):
     Retorna el PDF del documento para que el trabajador lo revise antes de firmar.
     Solo requiere el token — ver el documento no constituye firma ni compromiso.
     Si la solicitud ya fue firmada, retorna el PDF firmado con certificado.
+
+    ?modo=redirect responde 302 a una URL presignada de B2 y ?modo=url la
+    entrega en JSON: el PDF baja directo del bucket sin pasar por el worker.
+    Sin modo, el PDF se reenvía desde B2 por trozos, respetando Range.
     """
+    modo = request.query_params.get('modo', 'proxy')
+    if modo not in ('proxy', 'redirect', 'url'):
+        return Response({'error': "modo debe ser 'proxy', 'redirect' o 'url'."}, status=400)
+
     try:
         solicitud = SolicitudFirma.objects.select_related('empleado').get(token=token)
     except SolicitudFirma.DoesNotExist:
@@ -4280,18 +4331,51 @@ def firma_publica_documento(request, token):
     else:
         return HttpResponse(status=404)
 
-    try:
-        pdf_bytes = b2_client.descargar_documento(b2_key)
-    except Exception as exc:
-        return Response({'error': f'Error al obtener el documento: {exc}'}, status=500)
-
     tipo_label = _TIPO_LABELS_PUBLICO.get(solicitud.tipo_documento, solicitud.tipo_documento)
     apellido   = solicitud.empleado.apellido_paterno.replace(' ', '_')
     filename   = f"{tipo_label.replace(' ', '_')}_{apellido}.pdf"
 
-    response = HttpResponse(pdf_bytes, content_type='application/pdf')
+    if modo != 'proxy':
+        try:
+            url, vence_en = b2_client.url_presignada_vigente(
+                b2_key, ttl_segundos=settings.FIRMA_DOCUMENTO_URL_TTL, nombre_archivo=filename,
+            )
+        except RuntimeError as exc:
+            return Response({'error': str(exc)}, status=503)
+        except Exception as exc:
+            return Response({'error': f'Error al obtener el documento: {exc}'}, status=500)
+        if modo == 'redirect':
+            response = HttpResponseRedirect(url)
+            response['Cache-Control'] = 'no-store'
+            return response
+        return Response({
+            'url': url,
+            'expira_en': datetime.datetime.fromtimestamp(vence_en, tz=datetime.timezone.utc).isoformat(),
+        })
+
+    # El PDF pasa por trozos, sin quedar entero en memoria. Los visores de
+    # PDF del navegador piden rangos; solo se reenvía un rango simple (con
+    # varios se responde el archivo completo, como permite el estándar).
+    rango = request.headers.get('Range')
+    if rango and not _RANGO_SIMPLE.match(rango):
+        rango = None
+    try:
+        documento = b2_client.abrir_documento(b2_key, rango=rango)
+    except ClientError as exc:
+        if exc.response.get('Error', {}).get('Code') == 'InvalidRange':
+            return HttpResponse(status=416)
+        return Response({'error': f'Error al obtener el documento: {exc}'}, status=500)
+    except Exception as exc:
+        return Response({'error': f'Error al obtener el documento: {exc}'}, status=500)
+
+    response = StreamingHttpResponse(
+        documento['trozos'], content_type='application/pdf', status=206 if documento['rango'] else 200,
+    )
     response['Content-Disposition'] = f'inline; filename="{filename}"'
-    response['Content-Length']      = len(pdf_bytes)
+    response['Content-Length']      = documento['largo']
+    response['Accept-Ranges']       = 'bytes'
+    if documento['rango']:
+        response['Content-Range'] = documento['rango']
     return response
 
 
@@ -4335,19 +4419,15 @@ def firma_publica_rechazar(request, token):
             solicitud.estado = 'RECHAZADO'
             solicitud.motivo_rechazo = motivo
             solicitud.save(update_fields=['estado', 'motivo_rechazo', 'actualizado_en'])
+            _notificar_rechazo_empleador(solicitud, motivo)
     except SolicitudFirma.DoesNotExist:
         return Response({'error': 'Solicitud no encontrada.'}, status=404)
 
-    try:
-        _notificar_rechazo_empleador(solicitud, motivo)
-    except Exception:
-        pass  # el rechazo ya fue registrado; el email es no-crítico
-
     return Response({'rechazado': True})
 
 
 def _notificar_rechazo_empleador(solicitud: SolicitudFirma, motivo: str):
-    """Envía un email al empleador informando que el trabajador rechazó el documento."""
+    """Encola un email al empleador informando que el trabajador rechazó el documento."""
     tipo_label      = _TIPO_LABELS_PUBLICO.get(solicitud.tipo_documento, solicitud.tipo_documento)
     empleado        = solicitud.empleado
     empresa         = solicitud.empresa
@@ -4402,11 +4482,7 @@ def _notificar_rechazo_empleador(solicitud: SolicitudFirma, motivo: str):
 </body>
 </html>"""
 
-    msg = EmailMultiAlternatives(
-        subject=f"Documento rechazado: {nombre_trabajador} rechazó «{tipo_label}»",
-        body=texto_plano,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[email_empleador],
-    )
-    msg.attach_alternative(html_body, "text/html")
-    msg.send()
\ No newline at end of file
+    correos.encolar(
+        f"Documento rechazado: {nombre_trabajador} rechazó «{tipo_label}»",
+        texto_plano, [email_empleador], html=html_body, categoria='RECHAZO',
+    )
\ No newline at end of file
@@ -144,6 +144,7 @@ export default function FirmaPublica() {
       setInfo(data);
 
       if (data.estado === 'FIRMADO')   { setStep('firmado_ok');           return; }
+      if (data.estado === 'PROCESANDO') { setStep('firmado_ok');          return; }
       if (data.estado === 'EXPIRADO')  { setStep('terminal_expirado');    return; }
       if (data.estado === 'CANCELADO') { setStep('terminal_cancelado');   return; }
       if (data.estado === 'RECHAZADO') { setStep('rechazado_ok');         return; }
@@ -220,7 +221,7 @@ export default function FirmaPublica() {
   // ── Ver PDF del documento ─────────────────────────────────────────────────
   const abrirPDF = () => {
     const baseURL = import.meta.env.VITE_API_URL || '/api';
-    window.open(`${baseURL}/firma-publica/${token}/documento/`, '_blank');
+    window.open(`${baseURL}/firma-publica/${token}/documento/?modo=redirect`, '_blank');
   };
 
   // ── Firmar documento ───────────────────────────────────────────────────────
@@ -233,6 +234,21 @@ export default function FirmaPublica() {
         sesion_token: sesionToken,
         firma_trabajador: firmaDataUrl,
       });
+      // La firma se procesa en segundo plano: consultar el estado hasta que termine
+      for (let intento = 0; intento < 60; intento++) {
+        await new Promise(resolve => setTimeout(resolve, 1500));
+        const { data } = await client.get(`/firma-publica/${token}/estado/`);
+        if (data.estado === 'FIRMADO') {
+          sessionStorage.removeItem(`firma_sesion_${token}`);
+          setStep('firmado_ok');
+          return;
+        }
+        if (data.estado !== 'PROCESANDO') {
+          setFirmaError(data.error ?? 'No se pudo completar la firma. Intenta nuevamente.');
+          return;
+        }
+      }
+      // Sigue en cola: la firma ya quedó registrada y el email llegará al terminar
       sessionStorage.removeItem(`firma_sesion_${token}`);
       setStep('firmado_ok');
     } catch (err) {